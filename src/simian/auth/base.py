@@ -36,6 +36,7 @@ warnings.filterwarnings(
 import array  # (Mute warnings before cause) pylint: disable=g-bad-import-order,g-import-not-at-top
 import base64
 import datetime
+import hashlib
 import logging
 import os
 import struct
@@ -43,6 +44,7 @@ import struct
 
 from simian.auth import tlslite_bridge
 from simian.auth import x509
+from simian.mac.common import lru
 
 # Message separator
 MSG_SEP = ' '
@@ -55,6 +57,10 @@ AGE_DEFAULT_SECONDS = 6 * 60 * 60
 AGE_APPLESUS_TOKEN_SECONDS = 14 * 24 * 60 * 60
 # Minimum value for Cn (client nonce) value
 MIN_VALUE_CN = 2**100
+# Number of parsed CA/server certs and keys cached per process
+PARSED_PEM_CACHE_SIZE = 20
+# Number of verified client certs cached per process
+VERIFIED_CERT_CACHE_SIZE = 1000
 
 # Level values supplied to DoMunkiAuth() and used in session data
 LEVEL_APPLESUS = -5
@@ -566,6 +572,12 @@ class Auth1(AuthBase):
   """
   TOKEN = 'Auth1Token'
 
+  # Process-wide caches, shared by all instances.  Parsed certs and keys are
+  # keyed by PEM; verified client certs by the digests of the client cert and
+  # CA cert, and the required issuer.
+  _parsed_pem_cache = lru.LruCache(max_size=PARSED_PEM_CACHE_SIZE)
+  _verified_cert_cache = lru.LruCache(max_size=VERIFIED_CERT_CACHE_SIZE)
+
   def __init__(self, *args, **kwargs):
     super(Auth1, self).__init__(*args, **kwargs)
     self._key = None
@@ -678,13 +690,22 @@ class Auth1(AuthBase):
       # tlslite 0.3.8 array.array
       return sig_bytes.tostring()
 
+  @classmethod
+  def ClearCaches(cls):
+    """Clears the process-wide parsed PEM and verified client cert caches."""
+    cls._parsed_pem_cache.Clear()
+    cls._verified_cert_cache.Clear()
+
   def LoadSelfKey(self, keystr):
     """Load a key and keep it as this instance's key.
 
     Args:
       keystr: str, bytes of key in PEM format
     """
-    key = self._LoadKey(keystr)
+    key = self._parsed_pem_cache.Get(('key', keystr))
+    if key is None:
+      key = self._LoadKey(keystr)
+      self._parsed_pem_cache.Set(('key', keystr), key)
     self._key = key
 
   def LoadOtherCert(self, certstr):
@@ -715,7 +736,10 @@ class Auth1(AuthBase):
     Returns:
       True or False
     """
-    ca_cert = self.LoadOtherCert(self._ca_pem)
+    ca_cert = self._parsed_pem_cache.Get(('cert', self._ca_pem))
+    if ca_cert is None:
+      ca_cert = self.LoadOtherCert(self._ca_pem)
+      self._parsed_pem_cache.Set(('cert', self._ca_pem), ca_cert)
     try:
       return cert.IsSignedBy(ca_cert)
     except (x509.Error, AssertionError), e:
@@ -790,6 +814,16 @@ class Auth1(AuthBase):
 
     return True
 
+  def _SessionGetToken(self, token):
+    """Return the session for a token.
+
+    Args:
+      token: str, token string from SessionCreateAuthToken
+    Returns:
+      session object, or None if the token is unknown or expired
+    """
+    return self._session.GetToken(token)
+
   def GetSessionIfAuthOK(self, token, require_level=None):
     """Check if auth is OK for a given token.
 
@@ -802,7 +836,7 @@ class Auth1(AuthBase):
     Raises:
       AuthSessionError: auth token is unknown, state is not OK, or level not OK.
     """
-    session = self._session.GetToken(token)
+    session = self._SessionGetToken(token)
 
     if not session:
       raise AuthSessionError('GetSessionIfAuthOK: session is None')
@@ -826,7 +860,7 @@ class Auth1(AuthBase):
       uuid str OR
       None if token does not exist
     """
-    session = self._session.GetToken(token)
+    session = self._SessionGetToken(token)
     return getattr(session, 'uuid', None)
 
   def SessionCreateAuthToken(self, uuid, level=LEVEL_BASE):
@@ -942,33 +976,49 @@ class Auth1(AuthBase):
         except TypeError, e:
           raise _Error('Invalid c or s parameter b64 format(%s)', str(e))
 
-        # load X509 client cert 'c' into object
-        try:
-          client_cert = self.LoadOtherCert(c)
-        except ValueError, e:
-          raise _Error('Invalid cert supplied %s' % str(e))
-
-        # sanity check
-        if not client_cert.GetPublicKey():
-          raise _Error('Malformed X509 cert with no public key')
-
-        client_cert.SetRequiredIssuer(self._required_issuer)
-        try:
-          client_cert.CheckAll()
-        except x509.Error, e:
-          raise _Error('X509 certificate error: %s' % str(e))
-
-        # obtain uuid from cert
-        uuid = client_cert.GetSubject()
-        log_prefix = uuid
-
-        # client_cert is loaded
-        #logging.debug('%s Client cert loaded', log_prefix)
-        #logging.debug('%s Message = %s', log_prefix, m)
-
-        # verify that the client cert is legitimate
-        if not self.VerifyCertSignedByCA(client_cert):
-          raise _Error('Client cert is not signed by the required CA')
+        # reuse client cert 'c' if it was already loaded and verified.
+        cert_cache_key = (
+            hashlib.sha256(c).digest(),
+            hashlib.sha256(self._ca_pem).digest(), self._required_issuer)
+        cached_cert = self._verified_cert_cache.Get(cert_cache_key)
+        if cached_cert is not None:
+          client_cert, uuid = cached_cert
+          log_prefix = uuid
+          # the validity window is the only check that changes over time.
+          try:
+            client_cert.CheckValidity()
+          except x509.Error, e:
+            raise _Error('X509 certificate error: %s' % str(e))
+        else:
+          # load X509 client cert 'c' into object
+          try:
+            client_cert = self.LoadOtherCert(c)
+          except ValueError, e:
+            raise _Error('Invalid cert supplied %s' % str(e))
+
+          # sanity check
+          if not client_cert.GetPublicKey():
+            raise _Error('Malformed X509 cert with no public key')
+
+          client_cert.SetRequiredIssuer(self._required_issuer)
+          try:
+            client_cert.CheckAll()
+          except x509.Error, e:
+            raise _Error('X509 certificate error: %s' % str(e))
+
+          # obtain uuid from cert
+          uuid = client_cert.GetSubject()
+          log_prefix = uuid
+
+          # client_cert is loaded
+          #logging.debug('%s Client cert loaded', log_prefix)
+          #logging.debug('%s Message = %s', log_prefix, m)
+
+          # verify that the client cert is legitimate
+          if not self.VerifyCertSignedByCA(client_cert):
+            raise _Error('Client cert is not signed by the required CA')
+
+          self._verified_cert_cache.Set(cert_cache_key, (client_cert, uuid))
 
         # verify that the message was signed by the client cert
         if not self.VerifyDataSignedWithCert(m, s, client_cert):
@@ -25,10 +25,16 @@ Classes:
 Functions:
 
   DoMunkiAuth:                  Check Munki client auth credentials.
+  LogoutSession:                Log out of a session.
 """
 
+import base64
+import collections
 import Cookie
 import datetime
+import hashlib
+import hmac
+import json
 import logging
 import os
 import time
@@ -47,6 +53,7 @@ from simian import auth
 from simian.auth import base
 from simian.auth import util
 from simian.mac import models
+from simian.mac.common import lru
 
 
 # Level values supplied to DoMunkiAuth() and used in session data
@@ -62,7 +69,18 @@ ALL_LEVELS = [LEVEL_APPLESUS, LEVEL_BASE, LEVEL_ADMIN, LEVEL_UPLOADPKG]
 
 # Deadline in seconds for datastore RPC operations
 DATASTORE_RPC_DEADLINE = 5
+# Prefix of stateless auth tokens, which are signed instead of stored
+STATELESS_TOKEN_PREFIX = 's1.'
+# Seconds the stateless token secret is cached per instance
+STATELESS_TOKEN_SECRET_CACHE_SECS = 60
+# Memcache key prefix, followed by level and uuid, for the issue time of the
+# latest logged out stateless token of a client and level
+REVOKED_TOKEN_MEMCACHE_PREFIX = 'a1rb_'
 
+# Instance-local cache of the stateless token secret, so that verifying a
+# stateless token needs no settings lookup.
+_stateless_token_secret_cache = lru.LruCache(
+    max_size=1, ttl=STATELESS_TOKEN_SECRET_CACHE_SECS)
 
 
 class Error(Exception):
@@ -177,12 +195,34 @@ class Auth1ServerDatastoreSession(base.Auth1ServerSession):
 
 
 class Auth1ServerDatastoreMemcacheSession(Auth1ServerDatastoreSession):
-  """AuthSession data container which uses memcache as a frontend."""
+  """AuthSession data container which uses memcache as a frontend.
+
+  Sessions whose ids start with one of MEMCACHE_ONLY_PREFIXES are kept only in
+  memcache, and only written to datastore when memcache is unavailable.
+  """
+
+  MEMCACHE_ONLY_PREFIXES = ()
+
+  # Instance-wide counts of memcache-only session adds, collisions with an
+  # existing session, and fallbacks to datastore.
+  _memcache_only_stats = collections.Counter()
 
   def __init__(self):
     super(Auth1ServerDatastoreMemcacheSession, self).__init__()
     self.prefix = 'a1sd_'
     self.ttl = 2 * 60
+    self.memcache_only_ttl = base.AGE_CN_SECONDS
+
+  @classmethod
+  def GetMemcacheOnlyStats(cls):
+    """Returns a dict with adds, collisions and fallbacks counts."""
+    stats = dict.fromkeys(['adds', 'collisions', 'fallbacks'], 0)
+    stats.update(cls._memcache_only_stats)
+    return stats
+
+  def _IsMemcacheOnly(self, sid):
+    """Returns True if the session with id sid is kept only in memcache."""
+    return sid.startswith(self.MEMCACHE_ONLY_PREFIXES)
 
   def _CallSuperWithDefer(self, method_name, *args, **kwargs):
     """Call a superclass method and defer if a datastore error occurs.
@@ -226,18 +266,75 @@ class Auth1ServerDatastoreMemcacheSession(Auth1ServerDatastoreSession):
     Args:
       session: db.Model, session instance
     """
+    sid = session.key().name()
+    if self._IsMemcacheOnly(sid):
+      self._PutMemcacheOnly(sid, session)
+      return
     memcache.set(
-        '%s%s' % (self.prefix, session.key().name()),
+        '%s%s' % (self.prefix, sid),
         value=session, time=self.ttl)
     self._CallSuperWithDefer('_Put', session)
 
+  def _PutMemcacheOnly(self, sid, session):
+    """Add a new session to memcache, falling back to datastore.
+
+    An existing session is never replaced, so that a pending session cannot
+    be overwritten by a replayed or colliding request.
+
+    Args:
+      sid: str, session id
+      session: db.Model, session instance
+    """
+    key = '%s%s' % (self.prefix, sid)
+    if memcache.add(key, value=session, time=self.memcache_only_ttl):
+      self._memcache_only_stats['adds'] += 1
+    elif memcache.get(key) is not None:
+      logging.warning('Session %s already exists, not replacing it', sid)
+      self._memcache_only_stats['collisions'] += 1
+    else:
+      logging.warning('Memcache unavailable, putting session %s', sid)
+      self._memcache_only_stats['fallbacks'] += 1
+      self._CallSuperWithDefer('_Put', session)
+
+  def Claim(self, sid):
+    """Atomically delete a session, so that only one caller can use it.
+
+    Args:
+      sid: str, session id
+    Returns:
+      True if this caller deleted the session, False if it did not exist.
+    """
+    if memcache.delete('%s%s' % (self.prefix, sid)) == (
+        memcache.DELETE_SUCCESSFUL):
+      return True
+    # the session may have been put to datastore if memcache was unavailable.
+    return db.run_in_transaction(self._ClaimFromDatastore, sid)
+
+  def _ClaimFromDatastore(self, sid):
+    """Delete a session from datastore, within a transaction.
+
+    Args:
+      sid: str, session id
+    Returns:
+      True if the session existed and was deleted.
+    """
+    m = self.model.get_by_key_name(sid)
+    if not m:
+      return False
+    m.delete()
+    return True
+
   def DeleteById(self, sid):
     """Delete session data for a session id.
 
     Args:
       sid: str, session id
     """
-    memcache.delete('%s%s' % (self.prefix, sid))
+    result = memcache.delete('%s%s' % (self.prefix, sid))
+    if self._IsMemcacheOnly(sid):
+      if result != memcache.DELETE_NETWORK_FAILURE:
+        return
+      self._memcache_only_stats['fallbacks'] += 1
     # slightly defer with countdown so that back to back _Put(cn, sn)
     # and DeleteById(cn) are more likely to run in the right order.    best
     # effort, the session cleaner cron will destroy anything leftover later
@@ -250,21 +347,25 @@ class Auth1ServerDatastoreMemcacheSession(Auth1ServerDatastoreSession):
     Args:
       session: db.Model, session instance
     """
-    memcache.delete('%s%s' % (self.prefix, session.key().name()))
+    sid = session.key().name()
+    memcache.delete('%s%s' % (self.prefix, sid))
+    if self._IsMemcacheOnly(sid) and not session.is_saved():
+      return
     self._CallSuperWithDefer('Delete', session)
 
 
 class AuthSessionSimianServer(Auth1ServerDatastoreMemcacheSession):
   """AuthSession data container that uses the Simian AuthSession model."""
 
+  # Cn/Sn pairs live only for the seconds between auth steps 1 and 2.
+  MEMCACHE_ONLY_PREFIXES = (base.Auth1ServerSession.SESSION_TYPE_PREFIX_CN,)
+
   @staticmethod
   def GetModelClass():
     return models.AuthSession
 
-  def IsExpired(self, session, now=None):
-    """check whether session is expired."""
-    if now is None:
-      now = self._Now()
+  def _GetMaxAge(self, session):
+    """Returns the datetime.timedelta a session is valid for, or None."""
     ek = session.key().name()
     age = None
     if ek.startswith(self.SESSION_TYPE_PREFIX_TOKEN):
@@ -274,12 +375,163 @@ class AuthSessionSimianServer(Auth1ServerDatastoreMemcacheSession):
 
     if session.level == LEVEL_APPLESUS:
       age = datetime.timedelta(seconds=base.AGE_APPLESUS_TOKEN_SECONDS)
+    return age
+
+  def IsExpired(self, session, now=None):
+    """check whether session is expired."""
+    if now is None:
+      now = self._Now()
+    age = self._GetMaxAge(session)
 
     if not session.mtime or not age:
       return True
 
     return now - session.mtime > age
 
+  def GetExpiresAt(self, session):
+    """Returns the datetime.datetime a session expires at, or None if unknown.
+
+    Args:
+      session: db.Model, session instance
+    """
+    age = self._GetMaxAge(session)
+    if session.mtime and age:
+      return session.mtime + age
+
+  def _Put(self, session):
+    """Put a session instance into storage, setting its expiry time.
+
+    Args:
+      session: db.Model, session instance
+    """
+    expires_at = self.GetExpiresAt(session)
+    if expires_at:
+      session.expires_at = expires_at
+    super(AuthSessionSimianServer, self)._Put(session)
+
+
+def _GetStatelessTokenSecret():
+  """Returns the secret to sign stateless tokens with.
+
+  Returns:
+    str secret, or None if stateless tokens are not enabled.
+  """
+  secret = _stateless_token_secret_cache.Get('secret', default=False)
+  if secret is False:
+    secret = None
+    if models.Settings.GetItem('stateless_auth_tokens')[0]:
+      secret = models.Settings.GetItem('auth_token_secret')[0]
+      if secret:
+        secret = str(secret)  # hmac secrets cannot be unicode.
+      else:
+        logging.warning('Stateless auth tokens enabled without a secret.')
+    _stateless_token_secret_cache.Set('secret', secret)
+  return secret
+
+
+def _SignStatelessToken(secret, payload):
+  """Returns the str HMAC-SHA256 digest of a stateless token payload."""
+  return hmac.new(secret, payload, hashlib.sha256).digest()
+
+
+def CreateStatelessToken(secret, uuid, level, now=None):
+  """Create a stateless token.
+
+  The token carries its own session data and a signature over it, so it can
+  be verified without a session lookup.
+
+  Args:
+    secret: str, secret to sign the token with.
+    uuid: str, uuid for client which is receiving token.
+    level: int, level for session.
+    now: int, optional, current epoch seconds.
+  Returns:
+    str, token
+  """
+  if now is None:
+    now = int(time.time())
+  if level == LEVEL_APPLESUS:
+    age = base.AGE_APPLESUS_TOKEN_SECONDS
+  else:
+    age = base.AGE_TOKEN_SECONDS
+  token_id = base64.urlsafe_b64encode(os.urandom(12))
+  payload = base64.urlsafe_b64encode(
+      json.dumps([token_id, uuid, level, now, now + age]))
+  signature = base64.urlsafe_b64encode(_SignStatelessToken(secret, payload))
+  return '%s%s.%s' % (STATELESS_TOKEN_PREFIX, payload, signature)
+
+
+def ParseStatelessToken(secret, token, now=None):
+  """Verify a stateless token and return its session data.
+
+  Args:
+    secret: str, secret the token was signed with.
+    token: str, token from CreateStatelessToken.
+    now: int, optional, current epoch seconds.
+  Returns:
+    base.AuthSessionData, or None if the token is invalid or expired.
+  """
+  if now is None:
+    now = int(time.time())
+  try:
+    payload, signature = str(token)[len(STATELESS_TOKEN_PREFIX):].split('.', 1)
+    signature = base64.urlsafe_b64decode(signature)
+  except (ValueError, TypeError, UnicodeError):
+    return
+  if not hmac.compare_digest(
+      signature, _SignStatelessToken(secret, payload)):
+    logging.warning('Stateless token has an invalid signature.')
+    return
+  try:
+    token_id, uuid, level, issued, expires = json.loads(
+        base64.urlsafe_b64decode(payload))
+  except (ValueError, TypeError):
+    return
+  if now >= expires:
+    return
+  return base.AuthSessionData(
+      sid=token, token_id=token_id, state=base.AuthState.OK, uuid=uuid,
+      level=level, mtime=datetime.datetime.utcfromtimestamp(issued),
+      issued=issued, expires=expires)
+
+
+def IsStatelessToken(token):
+  """Returns True if token is a stateless token."""
+  return bool(token) and token.startswith(STATELESS_TOKEN_PREFIX)
+
+
+def _GetRevokedTokenMemcacheKey(session):
+  """Returns the memcache key of revoked tokens of a session's client."""
+  return '%s%s_%s' % (
+      REVOKED_TOKEN_MEMCACHE_PREFIX, session.level, session.uuid)
+
+
+def RevokeStatelessSession(session):
+  """Revoke a stateless token session until the token expires.
+
+  All tokens of the same client and level issued no later than the token are
+  revoked with it, so a revocation is one memcache value per client and
+  level, and checking it needs no Datastore RPC.  If memcache evicts it, the
+  revoked tokens are valid again until they expire.
+
+  Args:
+    session: base.AuthSessionData, from ParseStatelessToken.
+  """
+  ttl = session.expires - int(time.time())
+  if ttl <= 0:
+    return
+  memcache_key = _GetRevokedTokenMemcacheKey(session)
+  revoked_before = memcache.get(memcache_key)
+  if revoked_before is None or revoked_before < session.issued:
+    # tokens of a level have one age, so this outlives those it revokes.
+    memcache.set(memcache_key, session.issued, time=ttl)
+
+
+def IsStatelessSessionRevoked(session):
+  """Returns True if a stateless token session has been revoked."""
+  revoked_before = memcache.get(_GetRevokedTokenMemcacheKey(session))
+  return revoked_before is not None and session.issued <= revoked_before
+
 
 class AuthSimianServer(base.Auth1):
   """Auth1 server which uses AuthSessionSimian for session storage."""
@@ -312,6 +564,67 @@ class AuthSimianServer(base.Auth1):
   def GetSessionClass(self):
     return AuthSessionSimianServer
 
+  def SessionVerifyKnownCnSn(self, cn, sn):
+    """Verify that a Cn, Sn pair is known, and claim it.
+
+    Claiming the pair means a replayed message cannot use it concurrently.
+
+    Args:
+      cn: str, client nonce
+      sn: str, server nonce
+    Returns:
+      bool, True if the pair is known and was claimed by this call
+    """
+    if not super(AuthSimianServer, self).SessionVerifyKnownCnSn(cn, sn):
+      return False
+    return self._session.Claim(
+        '%s%s' % (self._session.SESSION_TYPE_PREFIX_CN, cn))
+
+  def _SessionGetToken(self, token):
+    """Return the session for a token.
+
+    Args:
+      token: str, token string from SessionCreateAuthToken
+    Returns:
+      session object, or None if the token is unknown, expired or revoked
+    """
+    if not IsStatelessToken(token):
+      return super(AuthSimianServer, self)._SessionGetToken(token)
+    secret = _GetStatelessTokenSecret()
+    if not secret:
+      return
+    session = ParseStatelessToken(secret, token)
+    if session and not IsStatelessSessionRevoked(session):
+      return session
+
+  def SessionCreateAuthToken(self, uuid, level=LEVEL_BASE):
+    """Create an auth token, stateless if enabled in settings.
+
+    Args:
+      uuid: str, uuid for client which is receiving token
+      level: int, optional, default LEVEL_BASE, level for session
+    Returns:
+      str, token
+    """
+    secret = _GetStatelessTokenSecret()
+    if not secret:
+      return super(AuthSimianServer, self).SessionCreateAuthToken(
+          uuid, level=level)
+    if self._auth_state == base.AuthState.OK:
+      return CreateStatelessToken(secret, uuid, level)
+
+  def SessionDelToken(self, token):
+    """Delete a token from session data, or revoke it if stateless.
+
+    Args:
+      token: str, token string from SessionCreateAuthToken
+    """
+    if not IsStatelessToken(token):
+      return super(AuthSimianServer, self).SessionDelToken(token)
+    session = self._SessionGetToken(token)
+    if session:
+      RevokeStatelessSession(session)
+
 
 def DoMunkiAuth(fake_noauth=None, require_level=None):
   """Do Munki auth.
@@ -377,8 +690,12 @@ def LogoutSession(session):
   """Logs out of a given session.
 
   Args:
-    session: db.Model, session instance
+    session: db.Model, session instance, or base.AuthSessionData for a
+        stateless token session.
   """
+  if getattr(session, 'token_id', None):
+    RevokeStatelessSession(session)
+    return
   a = AuthSessionSimianServer()
   try:
     a.Delete(session)
@@ -21,21 +21,29 @@
 
 
 
+import cStringIO
 import datetime
+import gzip
+import hashlib
 import httplib
+import json
 import logging
 import mimetools
 import os
 import platform
+import Queue
+import re
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import urllib
 import urlparse
 import warnings
 
 from M2Crypto import SSL
+from M2Crypto import threading as m2_threading
 from M2Crypto.SSL import Checker
 
 
@@ -58,6 +66,17 @@ else:
 
 
 DEFAULT_HTTP_ATTEMPTS = 4
+# Seconds an idle keep-alive connection is kept for reuse.
+CONNECTION_POOL_IDLE_SECS = 30
+# Maximum number of idle keep-alive connections kept per host.
+CONNECTION_POOL_MAX_IDLE = 4
+# Default number of concurrent package downloads from one host.
+DOWNLOAD_MAX_CONNECTIONS_PER_HOST = 4
+# Bounds of the adaptive response body read size.
+DOWNLOAD_READ_MIN = 64 * 1024
+DOWNLOAD_READ_MAX = 1024 * 1024
+# Seconds one response body read should take; the read size adapts to it.
+DOWNLOAD_READ_TARGET_SECS = 0.5
 DEFAULT_RETRY_HTTP_STATUS_CODES = frozenset([500, 502, 503, 504])
 SERVER_HOSTNAME = settings.SERVER_HOSTNAME
 SERVER_PORT = settings.SERVER_PORT
@@ -74,6 +93,10 @@ URL_UPLOADPKG = '/uploadpkg'
 _SSL_VERSION = 'sslv23'
 _CIPHER_LIST = None
 
+# Guards the one time initialization of OpenSSL locking for threads.
+_m2_threading_lock = threading.Lock()
+_m2_threading_initialized = False
+
 
 class Error(Exception):
   """Base class."""
@@ -290,6 +313,50 @@ class MultiBodyConnection:  # pylint: disable=g-old-style-class,no-init
     self._ProgressCallback(bytes_sent, content_length)
 
 
+def _GetBodyPositions(body):
+  """Returns the read positions of file-like items in a request body.
+
+  Args:
+    body: str or dict or file or list, body to send with request.
+  Returns:
+    list of (file-like object, int position) tuples.
+  """
+  if type(body) is not list:
+    body = [body]
+  return [(b, b.tell()) for b in body if hasattr(b, 'tell')]
+
+
+def _AdaptReadSize(read_len, bytes_read, secs):
+  """Returns the size of the next response body read.
+
+  Reads grow while the connection fills them quickly, so fast downloads
+  make few large reads, and shrink on slow connections so progress is
+  still reported regularly.
+
+  Args:
+    read_len: int, size of the last read.
+    bytes_read: int, bytes the last read returned.
+    secs: float, seconds the last read took.
+  Returns:
+    int, size of the next read, within DOWNLOAD_READ_MIN..DOWNLOAD_READ_MAX.
+  """
+  if bytes_read >= read_len and secs < DOWNLOAD_READ_TARGET_SECS / 2:
+    return min(read_len * 2, DOWNLOAD_READ_MAX)
+  elif secs > DOWNLOAD_READ_TARGET_SECS * 2:
+    return max(read_len / 2, DOWNLOAD_READ_MIN)
+  return read_len
+
+
+def _SetBodyPositions(positions):
+  """Rewinds file-like items in a request body to resend it.
+
+  Args:
+    positions: list, from _GetBodyPositions().
+  """
+  for b, position in positions:
+    b.seek(position, SEEK_SET)
+
+
 class HTTPMultiBodyConnection(MultiBodyConnection, httplib.HTTPConnection):
   """HTTP multi-body connection implemented over HTTP."""
   _is_https = False
@@ -404,6 +471,330 @@ class HTTPSMultiBodyConnection(MultiBodyConnection, httplib.HTTPSConnection):
     # _tunnel_* options here, see original HTTPConnection.connect().
 
 
+class ConnectionPool(object):
+  """Thread-safe pool of idle HTTP/1.1 keep-alive connections, per host."""
+
+  def __init__(
+      self, idle_secs=CONNECTION_POOL_IDLE_SECS,
+      max_idle=CONNECTION_POOL_MAX_IDLE):
+    """Initializer.
+
+    Args:
+      idle_secs: int, seconds an idle connection is kept for reuse.
+      max_idle: int, maximum number of idle connections kept per host.
+    """
+    self._idle_secs = idle_secs
+    self._max_idle = max_idle
+    self._idle = {}
+    self._lock = threading.Lock()
+    self.opened = 0
+    self.reused = 0
+    self.retried = 0
+
+  def Get(self, key, connect):
+    """Returns an idle connection for key, or a new one.
+
+    Args:
+      key: hashable, identifies the host and connection settings.
+      connect: func, returns a new connection.
+    Returns:
+      (connection, bool True if the connection was reused)
+    """
+    now = time.time()
+    with self._lock:
+      idle = self._idle.get(key, [])
+      while idle:
+        conn, last_used = idle.pop()
+        if now - last_used <= self._idle_secs:
+          self.reused += 1
+          return conn, True
+        conn.close()
+    return self.Open(connect), False
+
+  def Open(self, connect):
+    """Returns a new connection, counting it.
+
+    Args:
+      connect: func, returns a new connection.
+    Returns:
+      connection
+    """
+    conn = connect()
+    with self._lock:
+      self.opened += 1
+    return conn
+
+  def Put(self, key, conn):
+    """Returns a connection to the pool for reuse.
+
+    Args:
+      key: hashable, identifies the host and connection settings.
+      conn: HTTP{,S}Connection, with its last response fully read.
+    """
+    with self._lock:
+      idle = self._idle.setdefault(key, [])
+      if len(idle) < self._max_idle:
+        idle.append((conn, time.time()))
+        return
+    conn.close()
+
+  def CountRetry(self):
+    """Counts a request retried after a pooled connection went stale."""
+    with self._lock:
+      self.retried += 1
+
+  def Clear(self):
+    """Closes all idle connections."""
+    with self._lock:
+      idle, self._idle = self._idle, {}
+    for conns in idle.itervalues():
+      for conn, _ in conns:
+        conn.close()
+
+  def GetStats(self):
+    """Returns a dict of connection pool statistics."""
+    with self._lock:
+      return {
+          'opened': self.opened,
+          'reused': self.reused,
+          'retried': self.retried,
+          'idle': sum(len(conns) for conns in self._idle.itervalues()),
+      }
+
+
+# Keep-alive connections shared by all HttpsClient instances.
+_connection_pool = ConnectionPool()
+
+
+class BandwidthLimiter(object):
+  """Thread-safe token bucket limiting the bytes per second of transfers."""
+
+  def __init__(self, bytes_per_sec, burst_secs=1):
+    """Initializer.
+
+    Args:
+      bytes_per_sec: int, bytes per second allowed across all transfers.
+      burst_secs: int, seconds of unused allowance which may be saved up.
+    """
+    self.bytes_per_sec = float(bytes_per_sec)
+    self._capacity = self.bytes_per_sec * burst_secs
+    self._tokens = self._capacity
+    self._last = time.time()
+    self._lock = threading.Lock()
+
+  def Consume(self, num_bytes):
+    """Accounts for transferred bytes, sleeping to keep to the limit.
+
+    Args:
+      num_bytes: int, bytes transferred.
+    """
+    with self._lock:
+      now = time.time()
+      self._tokens = min(
+          self._capacity,
+          self._tokens + (now - self._last) * self.bytes_per_sec)
+      self._last = now
+      # callers reserve their bytes in turn and wait off any deficit, so
+      # concurrent transfers share the limit.
+      self._tokens -= num_bytes
+      wait = -self._tokens / self.bytes_per_sec
+    if wait > 0:
+      time.sleep(wait)
+
+
+class PartialDownload(object):
+  """File-like output for a download which can be resumed.
+
+  The body is written to FILENAME.partial, and the ETag it belongs to to
+  FILENAME.partial.etag, so that an interrupted download can be resumed by a
+  later request with a Range header.
+  """
+
+  PARTIAL_SUFFIX = '.partial'
+  ETAG_SUFFIX = '.etag'
+  CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+  READ_SIZE = 1024 * 1024
+
+  def __init__(self, filename):
+    """Initializer.
+
+    Args:
+      filename: str, filename to write the completed download to.
+    """
+    self.filename = filename
+    self.partial_filename = filename + self.PARTIAL_SUFFIX
+    self.etag_filename = self.partial_filename + self.ETAG_SUFFIX
+    self._file = None
+    self._written = 0
+    self._expected_size = None
+    self._size = 0
+    self._sha256 = None
+    self._progress_callback = None
+    self._bandwidth_limiter = None
+
+  def SetProgressCallback(self, fn):
+    """Set function to callback to with download progress.
+
+    Args:
+      fn: function which will receive (bytes received, bytes total to
+          receive) arguments; bytes total is None if unknown.
+    Raises:
+      Error: if non callable item is passed as fn
+    """
+    if not callable(fn):
+      raise Error('SetProgressCallback argument fn must be callable')
+    self._progress_callback = fn
+
+  def SetBandwidthLimiter(self, limiter):
+    """Set a BandwidthLimiter to throttle writes of the body through."""
+    self._bandwidth_limiter = limiter
+
+  def _HashPartial(self):
+    """Returns a sha256 hash object updated with the partial download."""
+    h = hashlib.sha256()
+    with open(self.partial_filename, 'rb') as f:
+      buf = f.read(self.READ_SIZE)
+      while buf:
+        h.update(buf)
+        buf = f.read(self.READ_SIZE)
+    return h
+
+  def _GetEtag(self):
+    """Returns the ETag of the partial download, or None."""
+    try:
+      with open(self.etag_filename, 'r') as f:
+        return f.read().strip() or None
+    except IOError:
+      return None
+
+  def _GetPartialSize(self):
+    """Returns the size in bytes of the partial download."""
+    try:
+      return os.path.getsize(self.partial_filename)
+    except OSError:
+      return 0
+
+  def Discard(self):
+    """Deletes the partial download."""
+    self.close()
+    for filename in (self.partial_filename, self.etag_filename):
+      try:
+        os.unlink(filename)
+      except OSError:
+        pass
+
+  def GetResumeHeaders(self):
+    """Returns request headers to resume the download.
+
+    Returns:
+      dict, with Range and If-Range headers if a partial download with an
+      ETag exists, otherwise empty.
+    """
+    etag = self._GetEtag()
+    size = self._GetPartialSize()
+    if not etag or not size:
+      return {}
+    return {'Range': 'bytes=%d-' % size, 'If-Range': '"%s"' % etag}
+
+  def BeginResponse(self, status, headers):
+    """Opens the partial file to write a response body to.
+
+    Called once the response status and headers are known, before the
+    body is written.
+
+    Args:
+      status: int, response status.
+      headers: dict, response headers with lowercase names.
+    """
+    self.close()
+    self._written = 0
+    self._expected_size = None
+    self._size = 0
+    self._sha256 = None
+    if status == httplib.PARTIAL_CONTENT:
+      content_range = headers.get('content-range', '')
+      m = self.CONTENT_RANGE_RE.match(content_range)
+      if m and int(m.group(1)) == self._GetPartialSize():
+        logging.info(
+            'Resuming download of %s at byte %s', self.filename, m.group(1))
+        if m.group(3) != '*':
+          self._expected_size = int(m.group(3))
+        # hash what was received so far once, then hash the rest as it
+        # streams in.
+        self._sha256 = self._HashPartial()
+        self._size = int(m.group(1))
+        self._file = open(self.partial_filename, 'ab')
+      else:
+        # the range does not continue the partial download; start over.
+        logging.warning(
+            'Unexpected Content-Range for %s: %s', self.filename,
+            content_range)
+        self.Discard()
+    elif status == httplib.OK:
+      self.Discard()
+      if headers.get('content-length', '').isdigit():
+        self._expected_size = int(headers['content-length'])
+      self._file = open(self.partial_filename, 'wb')
+      self._sha256 = hashlib.sha256()
+      etag = headers.get('etag', '').strip('"')
+      if etag:
+        with open(self.etag_filename, 'w') as f:
+          f.write(etag)
+    elif status == httplib.REQUESTED_RANGE_NOT_SATISFIABLE:
+      self.Discard()
+
+  def write(self, data):  # pylint: disable=g-bad-name
+    """Writes response body data; data of error responses is dropped."""
+    if self._file is not None:
+      if self._bandwidth_limiter is not None:
+        self._bandwidth_limiter.Consume(len(data))
+      self._file.write(data)
+      self._sha256.update(data)
+      self._size += len(data)
+      if self._progress_callback is not None:
+        self._progress_callback(self._size, self._expected_size)
+    self._written += len(data)
+
+  def tell(self):  # pylint: disable=g-bad-name
+    """Returns the number of body bytes written for the current response."""
+    return self._written
+
+  def close(self):  # pylint: disable=g-bad-name
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+  def Finish(self):
+    """Verifies the completed download and moves it to filename.
+
+    Returns:
+      True if the download was moved to filename, False if it is incomplete
+      and can be resumed, or if it did not match its SHA-256 ETag and was
+      discarded.
+    """
+    self.close()
+    if not os.path.exists(self.partial_filename):
+      return False
+    size = self._GetPartialSize()
+    if self._expected_size is not None and size < self._expected_size:
+      logging.warning(
+          'Download of %s ended at byte %d of %d', self.filename, size,
+          self._expected_size)
+      return False
+    etag = self._GetEtag()
+    if etag:
+      h = self._sha256
+      if h is None or self._size != size:
+        h = self._HashPartial()
+      if h.hexdigest() != etag:
+        logging.warning(
+            'SHA-256 of %s does not match %s, discarding download',
+            self.filename, etag)
+        self.Discard()
+        return False
+    os.rename(self.partial_filename, self.filename)
+    self.Discard()
+    return True
 
 
 class HttpsClient(object):
@@ -549,6 +940,41 @@ class HttpsClient(object):
       raise SimianClientError('_Connect() httplib.socket.error: %s' % str(e))
     return conn
 
+  def _GetPoolKey(self):
+    """Returns the connection pool key for this client's connections."""
+    if self.proxy_hostname:
+      return (self.proxy_hostname, self.proxy_port, self.proxy_use_https,
+              self._ca_cert_chain)
+    return (self.hostname, self.port, self.use_https, self._ca_cert_chain)
+
+  def _GetConnection(self):
+    """Return a pooled keep-alive connection, or a new one.
+
+    Returns:
+      (HTTP{,S}Connection object, bool True if it was reused)
+    """
+    conn, reused = _connection_pool.Get(self._GetPoolKey(), self._Connect)
+    if reused:
+      if self._progress_callback is not None:
+        conn.SetProgressCallback(self._progress_callback)
+      elif hasattr(conn, '_progress_callback'):
+        del conn._progress_callback
+    return conn, reused
+
+  def _ReleaseConnection(self, conn):
+    """Return a connection to the pool, if the server kept it open.
+
+    Args:
+      conn: HTTP{,S}Connection, with its last response fully read.
+    """
+    # httplib closes the connection when the response says it will close.
+    if getattr(conn, 'sock', None) is not None:
+      _connection_pool.Put(self._GetPoolKey(), conn)
+
+  def GetConnectionStats(self):
+    """Returns a dict of opened, reused, retried and idle connection counts."""
+    return _connection_pool.GetStats()
+
   def _GetResponse(self, conn, output_file=None):
     """Obtain a response from the connection and interpret it.
 
@@ -564,14 +990,20 @@ class HttpsClient(object):
     reason = response.reason
     body_len = 0
 
-    read_len = 8192   # some arbitrary block size
+    if isinstance(output_file, PartialDownload):
+      output_file.BeginResponse(status, dict(headers))
+
+    read_len = DOWNLOAD_READ_MIN
 
     if output_file:
-      buf = response.read(read_len)
-      while buf:
+      while True:
+        read_start = time.time()
+        buf = response.read(read_len)
+        if not buf:
+          break
+        read_len = _AdaptReadSize(read_len, len(buf), time.time() - read_start)
         body_len += len(buf)
         output_file.write(buf)
-        buf = response.read(read_len)
       body = None
     else:
       body = response.read()
@@ -624,15 +1056,32 @@ class HttpsClient(object):
       suffix = self.use_https * 's'
       logging.debug('Connecting to http%s://%s:%s',
                     suffix, self.hostname, self.port)
-      conn = self._Connect()
+      conn, reused = self._GetConnection()
       # if proxy is in use, request the full URL including host.
       if self.proxy_hostname:
         url = 'http%s://%s%s' % (self.use_https * 's', self.netloc, url)
-      logging.debug('Requesting %s %s', method, url)
-      self._Request(method, conn, url, body=body, headers=headers)
-      logging.debug('Waiting for response')
-      response = self._GetResponse(conn, output_file=output_file)
+      body_positions = _GetBodyPositions(body)
+      output_position = output_file.tell() if output_file else None
+      try:
+        logging.debug('Requesting %s %s', method, url)
+        self._Request(method, conn, url, body=body, headers=headers)
+        logging.debug('Waiting for response')
+        response = self._GetResponse(conn, output_file=output_file)
+      except (httplib.BadStatusLine, httplib.socket.error, SSL.SSLError), e:
+        conn.close()
+        if not reused or (
+            output_file and output_file.tell() != output_position):
+          raise
+        # the server closed the idle connection before it received this
+        # request; resend it once on a new connection.
+        logging.debug('Pooled connection went stale (%s), reconnecting', e)
+        _connection_pool.CountRetry()
+        _SetBodyPositions(body_positions)
+        conn = _connection_pool.Open(self._Connect)
+        self._Request(method, conn, url, body=body, headers=headers)
+        response = self._GetResponse(conn, output_file=output_file)
       logging.debug('Response status %d', response.status)
+      self._ReleaseConnection(conn)
       return response
     except httplib.HTTPException, e:
       raise HTTPError(str(e))
@@ -769,6 +1218,88 @@ class HttpsClient(object):
     return response
 
 
+def ParseFacterOutput(lines):
+  """Parses facter output lines like "key => value" into a dict.
+
+  Args:
+    lines: iterable of str lines of facter output.
+  Returns:
+    dict, facts
+  """
+  facts = {}
+  for line in lines:
+    try:
+      (key, unused_sep, value) = line.split(' ', 2)
+      facts[key] = value.strip()
+    except ValueError:
+      logging.info('Ignoring invalid facter output line: %s', line)
+  return facts
+
+
+def IsFacterCacheTrusted(st):
+  """Returns True if a facter cache file can be trusted by this process.
+
+  Args:
+    st: os.stat() result of the facter cache file.
+  Returns:
+    bool, False if the file was written by a user who is not trusted.
+  """
+  # if we are root, and the writer of the cache was not root, OR
+  # if we are not root, the cache was not written by root, and
+  # the cache was not written by ourselves
+  euid = os.geteuid()
+  if (euid == 0 and st.st_uid != 0) or (
+      euid != 0 and st.st_uid != 0 and euid != st.st_uid):
+    return False
+  return True
+
+
+def ReadFacterCache(path, max_age=None, not_before=None, open_fn=open):
+  """Reads facts from a facter cache file.
+
+  Args:
+    path: str, path of the facter cache file.
+    max_age: int, optional, seconds after its mtime the cache is stale.
+    not_before: float, optional, timestamp the cache mtime must not be
+        older than, e.g. the mtime of the facter command.
+    open_fn: func, optional, supply an open() function
+  Returns:
+    dict, facter contents, or None if the cache does not exist, is not
+    trusted, is stale, or cannot be read.
+  """
+  try:
+    st = os.stat(path)
+  except OSError, e:
+    logging.info('ReadFacterCache: OSError from os.stat(): %s', str(e))
+    return None
+
+  if not IsFacterCacheTrusted(st):
+    # don't trust this file.  be paranoid.
+    logging.info('ReadFacterCache: Untrusted facter cache, ignoring')
+    return None
+  logging.debug(
+      'ReadFacterCache: facter cache mtime is %s',
+      datetime.datetime.fromtimestamp(st.st_mtime))
+  if max_age is not None and time.time() - st.st_mtime > max_age:
+    logging.debug('ReadFacterCache: facter cache is older than %ds', max_age)
+    return None
+  if not_before is not None and st.st_mtime < not_before:
+    logging.debug('ReadFacterCache: facter cache predates %s', not_before)
+    return None
+
+  try:
+    f = open_fn(path, 'r')
+    try:
+      facter = ParseFacterOutput(f.read().splitlines())
+    finally:
+      f.close()
+  except (EOFError, IOError), e:
+    logging.warning('ReadFacterCache: error %s', str(e))
+    return None
+  logging.debug('ReadFacterCache: read %d entities', len(facter))
+  return facter
+
+
 class HttpsAuthClient(HttpsClient):
   """Https client with support for authentication."""
 
@@ -927,47 +1458,7 @@ class HttpsAuthClient(HttpsClient):
       logging.info('GetFacter: facter cache file does not exist.')
       return {}
 
-    facter = {}
-    use_facter_cache = False
-    try:
-      st = os.stat(self.facter_cache_path)
-      # if we are root, and the writer of the cache was not root, OR
-      # if we are not root, the cache was not written by root, and
-      # the cache was not written by ourselves
-      if (os.geteuid() == 0 and st.st_uid != 0) or (
-          os.geteuid() != 0 and st.st_uid != 0 and os.geteuid() != st.st_uid):
-        # don't trust this file.  be paranoid.
-        logging.info('GetFacter: Untrusted facter cache, ignoring')
-        use_facter_cache = False
-      else:
-        use_facter_cache = True
-        cache_mtime = datetime.datetime.fromtimestamp(st.st_mtime)
-        logging.debug('GetFacter: facter cache mtime is %s', cache_mtime)
-    except OSError, e:
-      logging.info('GetFacter: OSError from os.stat(): %s', str(e))
-      use_facter_cache = False
-
-    if use_facter_cache:
-      try:
-        logging.debug('GetFacter: reading recent facter cache')
-        f = open_fn(self.facter_cache_path, 'r')
-        facter = {}
-        line = f.readline()
-        while line:
-          try:
-            (key, unused_sep, value) = line.split(' ', 2)
-            value = value.strip()
-            facter[key] = value
-          except ValueError:
-            logging.info('GetFacter: ignoring facter cache line: %s', line)
-          line = f.readline()
-        f.close()
-        logging.debug('GetFacter: read %d entities', len(facter))
-      except (EOFError, IOError), e:
-        logging.warning('GetFacter: error %s', str(e))
-        facter = {}
-
-    return facter
+    return ReadFacterCache(self.facter_cache_path, open_fn=open_fn) or {}
 
   def _GetPuppetSslDetails(self, cert_fname=None, interactive_user=False):
     """Get Puppet SSL details.
@@ -1328,13 +1819,14 @@ class SimianClient(HttpsAuthClient):
 
     Args:
       name: str, package name
-      output_filename: str, optional, filename to write response body to
+      output_filename: str, optional, filename to write response body to;
+          the download is resumed if it was interrupted before.
     Returns:
       See _SimianRequest
     """
-    return self._SimianRequest(
-        'GET', '/pkgs/%s' % urllib.quote(name),
-        output_filename=output_filename)
+    if output_filename:
+      return self.DownloadPackage(name, output_filename=output_filename)
+    return self._SimianRequest('GET', '/pkgs/%s' % urllib.quote(name))
 
   def GetPackageInfo(self, filename, get_hash=False):
     """Get package info.
@@ -1364,21 +1856,59 @@ class SimianClient(HttpsAuthClient):
     else:
       return response.body
 
-  def DownloadPackage(self, filename):
-    """Downloads a package.
+  def DownloadPackage(
+      self, filename, output_filename=None,
+      attempt_times=DEFAULT_HTTP_ATTEMPTS, progress_callback=None,
+      bandwidth_limiter=None):
+    """Downloads a package, resuming an earlier interrupted download.
 
-    Writes the package with the same filename into the current directory.
+    The download is kept in output_filename.partial until it completes and
+    matches the SHA-256 package ETag, so an interrupted download continues
+    from where it stopped on the next attempt or the next run.
 
     Args:
       filename: str filename of the package to download.
+      output_filename: str, optional, filename to write the package to;
+          defaults to filename in the current directory.
+      attempt_times: int, default 4, how many times to attempt the download.
+      progress_callback: function, optional, receives (bytes received, bytes
+          total to receive) as the package downloads.
+      bandwidth_limiter: BandwidthLimiter, optional, to throttle through.
     Returns:
       None
     Raises:
       SimianServerError: if the Simian server returned an error (status != 200)
     """
-    return self._SimianRequest(
-        'GET', '/pkgs/%s' % urllib.quote(filename),
-        output_filename=filename)
+    if output_filename is None:
+      output_filename = filename
+    url = '/pkgs/%s' % urllib.quote(filename)
+    download = PartialDownload(output_filename)
+    if progress_callback is not None:
+      download.SetProgressCallback(progress_callback)
+    if bandwidth_limiter is not None:
+      download.SetBandwidthLimiter(bandwidth_limiter)
+
+    for n in xrange(attempt_times):
+      time.sleep(n * 5)
+      try:
+        response = self._DoRequestResponse(
+            'GET', url, headers=download.GetResumeHeaders(),
+            output_file=download)
+      except HTTPError, e:
+        logging.warning('HTTPError downloading %s: %s', filename, e)
+        continue
+      finally:
+        download.close()
+
+      if response.status in [httplib.OK, httplib.PARTIAL_CONTENT]:
+        if download.Finish():
+          return
+      elif (response.status != httplib.REQUESTED_RANGE_NOT_SATISFIABLE and
+            response.status not in DEFAULT_RETRY_HTTP_STATUS_CODES):
+        raise SimianServerError(
+            response.status, response.reason, response.body)
+
+    raise SimianServerError('Download of %s failed' % filename)
 
   def GetPackageMetadata(
       self, install_types=None, catalogs=None, filename=None):
@@ -1421,6 +1951,30 @@ class SimianClient(HttpsAuthClient):
       body = '%s&_feedback=1' % (body)
     return self._SimianRequest('POST', '/reports', str(body))
 
+  def PostJsonReport(self, report_type, data, compress=True):
+    """Post a JSON report to the server.
+
+    Args:
+      report_type: str, like 'install_reports'
+      data: JSON serializable object, the report.
+      compress: bool, default True, gzip encode the report.
+    Returns:
+      str body from response
+    Raises:
+      SimianServerError: if the Simian server returned an error (status != 200)
+    """
+    body = json.dumps(data)
+    headers = {'Content-Type': 'application/json'}
+    if compress:
+      buf = cStringIO.StringIO()
+      gzip_file = gzip.GzipFile(fileobj=buf, mode='wb')
+      gzip_file.write(body)
+      gzip_file.close()
+      body = buf.getvalue()
+      headers['Content-Encoding'] = 'gzip'
+    url = '/reports?_report_type=%s' % urllib.quote(report_type)
+    return self._SimianRequest('POST', url, body, headers=headers)
+
   def PostReportBody(self, body, feedback=False):
     """Post a pre-encoded report to the server.
 
@@ -1498,3 +2052,118 @@ class SimianAuthClient(SimianClient):
       return True
     except SimianServerError:
       return False
+
+
+def _InitM2CryptoThreading():
+  """Initializes OpenSSL locking, which SSL use from several threads needs."""
+  global _m2_threading_initialized
+  with _m2_threading_lock:
+    if not _m2_threading_initialized:
+      m2_threading.init()
+      _m2_threading_initialized = True
+
+
+class DownloadManager(object):
+  """Downloads several packages concurrently through a SimianClient.
+
+  Packages are fetched by up to max_connections_per_host threads, which
+  share the client's keep-alive connections to the Simian server, and
+  optionally share one bandwidth limit.
+  """
+
+  def __init__(
+      self, simian_client,
+      max_connections_per_host=DOWNLOAD_MAX_CONNECTIONS_PER_HOST,
+      max_bytes_per_sec=None, attempt_times=DEFAULT_HTTP_ATTEMPTS):
+    """Initializer.
+
+    Args:
+      simian_client: SimianClient, authenticated client to download with.
+      max_connections_per_host: int, maximum concurrent downloads.
+      max_bytes_per_sec: int, optional, bandwidth cap across all downloads.
+      attempt_times: int, how many times to attempt each download.
+    """
+    if max_connections_per_host < 1:
+      raise Error('max_connections_per_host must be at least 1')
+    self._client = simian_client
+    self._max_connections = max_connections_per_host
+    self._attempt_times = attempt_times
+    self._bandwidth_limiter = None
+    if max_bytes_per_sec:
+      self._bandwidth_limiter = BandwidthLimiter(max_bytes_per_sec)
+    self._progress_callback = None
+
+  def SetProgressCallback(self, fn):
+    """Set function to callback to with download progress.
+
+    Args:
+      fn: function which will receive (filename, bytes received, bytes total
+          to receive) arguments; bytes total is None if unknown.
+    Raises:
+      Error: if non callable item is passed as fn
+    """
+    if not callable(fn):
+      raise Error('SetProgressCallback argument fn must be callable')
+    self._progress_callback = fn
+
+  def _GetProgressCallback(self, filename):
+    """Returns a per file progress callback for DownloadPackage, or None."""
+    if self._progress_callback is None:
+      return None
+    fn = self._progress_callback
+    return lambda bytes_received, bytes_total: fn(
+        filename, bytes_received, bytes_total)
+
+  def _DownloadWorker(self, queue, errors):
+    """Downloads packages from queue until it is empty.
+
+    Args:
+      queue: Queue.Queue of (filename, output_filename) tuples.
+      errors: dict, to set filename keys to the exception of failed downloads.
+    """
+    while True:
+      try:
+        filename, output_filename = queue.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        self._client.DownloadPackage(
+            filename, output_filename, attempt_times=self._attempt_times,
+            progress_callback=self._GetProgressCallback(filename),
+            bandwidth_limiter=self._bandwidth_limiter)
+      except (Error, EnvironmentError), e:
+        logging.warning('Download of %s failed: %s', filename, e)
+        errors[filename] = e
+      except Exception, e:  # pylint: disable=broad-except
+        # an unexpected error must not end the worker, leaving the rest of
+        # the queue undownloaded and unreported.
+        logging.exception('Download of %s failed unexpectedly', filename)
+        errors[filename] = e
+
+  def Download(self, packages):
+    """Downloads packages concurrently.
+
+    Args:
+      packages: list of str package filenames, or of (filename,
+          output_filename) tuples.
+    Returns:
+      dict of filename keys and exception values for failed downloads; empty
+      if all packages downloaded.
+    """
+    queue = Queue.Queue()
+    for package in packages:
+      if isinstance(package, basestring):
+        package = (package, package)
+      queue.put(package)
+
+    errors = {}
+    threads = []
+    _InitM2CryptoThreading()
+    for _ in xrange(min(self._max_connections, queue.qsize())):
+      t = threading.Thread(target=self._DownloadWorker, args=(queue, errors))
+      t.daemon = True
+      t.start()
+      threads.append(t)
+    for t in threads:
+      t.join()
+    return errors
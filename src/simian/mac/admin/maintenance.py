@@ -54,15 +54,8 @@ INSTALL_LOG_MAX_FETCH = 2000
 
 
 def RebuildInstallCounts():
-  """Rebuilds "install_counts" dictionary from all InstallLog entities."""
-  lock = models.KeyValueCache.get_by_key_name('pkgs_list_cron_lock')
-  if lock:
-    lock.delete()
-  cursor_obj = models.KeyValueCache.get_by_key_name('pkgs_list_cursor')
-  if cursor_obj:
-    cursor_obj.delete()
-  models.ReportsCache.SetInstallCounts({})
-  deferred.defer(reports_cache._GenerateInstallCounts)
+  """Rebuilds install count shards from all InstallLog entities."""
+  reports_cache.RebuildInstallCounts()
 
 
 def UpdateInstallLogSchema(cursor=None, num_updated=0):
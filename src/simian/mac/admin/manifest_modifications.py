@@ -152,6 +152,7 @@ class ManifestModifications(admin.AdminHandler):
     """Deletes a manifest modifications."""
     key_str = self.request.get('key')
     db.delete(db.Key(key_str))
+    models.ManifestModificationIndex.Invalidate()
     data = {'deleted': True, 'key': key_str}
     self.response.headers['Content-Type'] = 'application/json'
     self.response.out.write(json.dumps(data))
@@ -58,16 +58,16 @@ class Package(admin.AdminHandler):
           'error.html', {'message': 'PackageInfo not found: %s' % filename})
       return
 
+    summary = p.GetPlistSummary()
     p.name = p.plist['name']
-    p.display_name = p.plist.get('display_name', '')
-    p.unattended = p.plist.get('unattended_install')
-    p.unattended_uninstall = p.plist.get('unattended_uninstall')
-    p.version = p.plist['version']
-    force_install_after_date = p.plist.get('force_install_after_date', None)
+    p.display_name = summary['display_name'] or ''
+    p.unattended = summary['unattended_install']
+    p.version = summary['version'] or ''
+    force_install_after_date = summary['force_install_after_date']
     if force_install_after_date:
-      p.force_install_after_date = datetime.datetime.strftime(
+      p.force_install_date_str = datetime.datetime.strftime(
           force_install_after_date, '%Y-%m-%d')
-      p.force_install_after_date_time = datetime.datetime.strftime(
+      p.force_install_time_str = datetime.datetime.strftime(
           force_install_after_date, '%H:%M')
 
     if self.request.referrer and self.request.referrer.endswith('proposals'):
@@ -207,14 +207,15 @@ class ReleaseReport(admin.AdminHandler):
     """Generates list of items with report parameters."""
     item_dict = {}
     p = models.PackageInfo.get_by_key_name(filename)
+    summary = p.GetPlistSummary()
 
-    if p.plist.get('display_name', None):
-      item_dict['package_name'] = p.plist.get('display_name', '')
+    if summary['display_name']:
+      item_dict['package_name'] = summary['display_name']
     else:
-      item_dict['package_name'] = p.plist.get('name', '')
+      item_dict['package_name'] = p.name or ''
 
-    minimum_os_version = p.plist.get('minimum_os_version', None)
-    maximum_os_version = p.plist.get('maximum_os_version', None)
+    minimum_os_version = summary['minimum_os_version']
+    maximum_os_version = summary['maximum_os_version']
     item_dict['osx_version_string'] = self.InstallOsTextGenerator(
         minimum_os_version, maximum_os_version)
     install_types = set(p.install_types)
@@ -231,21 +232,21 @@ class ReleaseReport(admin.AdminHandler):
     else:
       item_dict['managed_update'] = False
 
-    item_dict['is_unattended'] = p.plist.get('unattended_install', False)
-    item_dict['is_unattended_uninstall'] = p.plist.get(
-        'unattended_uninstall', False)
+    item_dict['is_unattended'] = bool(summary['unattended_install'])
+    item_dict['is_unattended_uninstall'] = bool(
+        summary['unattended_uninstall'])
 
-    if p.plist.get('force_install_after_date', None):
-      force_date_raw = p.plist.get('force_install_after_date', None)
+    if summary['force_install_after_date']:
+      force_date_raw = summary['force_install_after_date']
       item_dict['forced_on_date'] = force_date_raw.strftime('%B %d')
       item_dict['is_forced_install'] = True
     else:
       item_dict['is_forced_install'] = False
 
-    if p.plist.get('RestartAction', None) == 'RequireRestart':
+    if summary['RestartAction'] == 'RequireRestart':
       item_dict['restart_required'] = True
     else:
       item_dict['restart_required'] = False
 
-    item_dict['version'] = p.plist['version']
+    item_dict['version'] = summary['version']
     return item_dict
@@ -16,8 +16,12 @@
 #
 """Admin UI summary generating module."""
 
+import bisect
+import collections
 import copy
 import datetime
+import itertools
+import operator
 import urllib
 
 from  distutils import version as distutils_version
@@ -183,75 +187,131 @@ def PrepareComputerSummaryForTemplate(s):
     return {}
 
 
-def GetComputerSummary(computers, initial_summary=None):
-  """Generates a summary overview of all computers in a given query.
+class ComputerSummary(object):
+  """Mergeable partial aggregate of Computer stats for summary reports.
 
-  Args:
-    computers: list of Computer objects to generate a summary of.
-    initial_summary: optional, dict, initial value for summary.
-  Returns:
-    dict, stats summary data.
+  Only the properties a summary needs are read from each batch of computers,
+  into columns which are then counted in bulk.  Active window counts are kept
+  per bucket, where bucket i holds computers active within ACTIVE_DAY_COUNTS[i]
+  days but not ACTIVE_DAY_COUNTS[i + 1] days, and are summed on ToDict().
   """
-  if not initial_summary:
-    summary = {
-        'active': {},
-        'all_pkgs_installed': {},
+
+  def __init__(self, now=None):
+    """Initializer.
+
+    Args:
+      now: datetime, optional, time active windows end at; defaults to utcnow.
+    """
+    if now is None:
+      now = datetime.datetime.utcnow()
+    # thresholds ascend, as ACTIVE_DAY_COUNTS descend.
+    self._thresholds = [
+        now - datetime.timedelta(days=days) for days in ACTIVE_DAY_COUNTS]
+    buckets = len(ACTIVE_DAY_COUNTS)
+    self.active = [0] * buckets
+    self.all_pkgs_installed = [0] * buckets
+    self.all_apple_updates_installed = [0] * buckets
+    self.tracks = dict((track, [0] * buckets) for track in common.TRACKS)
+    self.conns_on_corp = 0
+    self.conns_off_corp = 0
+    self.os_versions = collections.Counter()
+    self.client_versions = collections.Counter()
+    self.sites_histogram = collections.Counter()
+
+  def _GetBucket(self, preflight_datetime):
+    """Returns the active window bucket of a preflight datetime, or -1."""
+    if preflight_datetime is None:
+      return -1
+    return bisect.bisect_left(self._thresholds, preflight_datetime) - 1
+
+  def AddComputers(self, computers):
+    """Adds a batch of computers to the summary.
+
+    Args:
+      computers: list of Computer entities.
+    """
+    # copy property values to new str, so computer object isn't kept in
+    # memory for the sake of dict key storage.
+    self.os_versions.update(str(c.os_version) for c in computers)
+    self.client_versions.update(str(c.client_version) for c in computers)
+    self.sites_histogram.update(str(c.site) for c in computers)
+    self.conns_on_corp += sum(c.connections_on_corp or 0 for c in computers)
+    self.conns_off_corp += sum(c.connections_off_corp or 0 for c in computers)
+
+    buckets = [self._GetBucket(c.preflight_datetime) for c in computers]
+    for c, bucket in itertools.izip(computers, buckets):
+      if bucket < 0:
+        continue
+      self.active[bucket] += 1
+      if c.track not in self.tracks:
+        self.tracks[c.track] = [0] * len(ACTIVE_DAY_COUNTS)
+      self.tracks[c.track][bucket] += 1
+      if c.all_pkgs_installed:
+        self.all_pkgs_installed[bucket] += 1
+      if getattr(c, 'all_apple_updates_installed', False):
+        self.all_apple_updates_installed[bucket] += 1
+
+  def Merge(self, other):
+    """Adds the counts of another ComputerSummary to this one.
+
+    Args:
+      other: ComputerSummary, with the same active window end time.
+    """
+    for name in (
+        'active', 'all_pkgs_installed', 'all_apple_updates_installed'):
+      setattr(self, name, map(operator.add, getattr(self, name),
+                              getattr(other, name)))
+    for track, counts in other.tracks.iteritems():
+      self.tracks[track] = map(
+          operator.add, self.tracks.get(track, [0] * len(counts)), counts)
+    self.conns_on_corp += other.conns_on_corp
+    self.conns_off_corp += other.conns_off_corp
+    self.os_versions.update(other.os_versions)
+    self.client_versions.update(other.client_versions)
+    self.sites_histogram.update(other.sites_histogram)
+
+  def _GetWindowCounts(self, buckets):
+    """Returns dict of ACTIVE_DAY_COUNTS keys and cumulative bucket counts."""
+    counts = {}
+    total = 0
+    for i in reversed(xrange(len(ACTIVE_DAY_COUNTS))):
+      total += buckets[i]
+      counts[ACTIVE_DAY_COUNTS[i]] = total
+    return counts
+
+  def ToDict(self):
+    """Returns the summary as a dict, for PrepareComputerSummaryForTemplate."""
+    return {
+        'active': self._GetWindowCounts(self.active),
+        'all_pkgs_installed': self._GetWindowCounts(self.all_pkgs_installed),
         'all_pkgs_installed_percent': {},
-        'all_apple_updates_installed': {},
+        'all_apple_updates_installed': self._GetWindowCounts(
+            self.all_apple_updates_installed),
         'all_apple_updates_installed_percent': {},
-        'conns_on_corp': 0,
-        'conns_off_corp': 0,
+        'conns_on_corp': self.conns_on_corp,
+        'conns_off_corp': self.conns_off_corp,
         'conns_on_corp_percent': None,
         'conns_off_corp_percent': None,
-        'tracks': {},
-        'os_versions': {},
-        'client_versions': {},
-        'sites_histogram': {},
+        'tracks': dict(
+            (track, self._GetWindowCounts(counts))
+            for track, counts in self.tracks.iteritems()),
+        'os_versions': dict(self.os_versions),
+        'client_versions': dict(self.client_versions),
+        'sites_histogram': dict(self.sites_histogram),
     }
-    # initialize active counts dictionaries.
-    for days in ACTIVE_DAY_COUNTS:
-      summary['active'][days] = 0
-      summary['all_pkgs_installed'][days] = 0
-      summary['all_apple_updates_installed'][days] = 0
-      for track in common.TRACKS:
-        summary['tracks'][track] = {}
-        summary['tracks'][track][days] = 0
-  else:
-    summary = copy.deepcopy(initial_summary)
 
-  # even though Tasks can now run up to 10 minutes, Datastore queries are
-  # still limited to 30 seconds (2010-10-27). Treating a QuerySet as an
-  # iterator also trips this restriction, so fetch 500 at a time.
-  for c in computers:
-    # copy property values to new str, so computer object isn't kept in
-    # memory for the sake of dict key storage.
-    os_version = str(c.os_version)
-    client_version = str(c.client_version)
-    site = str(c.site)
-
-    summary['conns_on_corp'] += c.connections_on_corp
-    summary['conns_off_corp'] += c.connections_off_corp
-    summary['os_versions'][os_version] = summary['os_versions'].get(
-        os_version, 0) + 1
-    summary['client_versions'][client_version] = (
-        summary['client_versions'].get(client_version, 0) + 1)
-
-    for days in ACTIVE_DAY_COUNTS:
-      if IsWithinPastXHours(c.preflight_datetime, days * 24):
-        summary['active'][days] += 1
-        track_count = summary['tracks'][c.track].get(days, 0)
-        summary['tracks'][c.track][days] = track_count + 1
-        if c.all_pkgs_installed:
-          summary['all_pkgs_installed'][days] += 1
-        if getattr(c, 'all_apple_updates_installed', False):
-          summary['all_apple_updates_installed'][days] += 1
-      else:
-        break
 
-    summary['sites_histogram'][site] = (
-        summary['sites_histogram'].get(site, 0) + 1)
+def GetComputerSummary(computers):
+  """Generates a summary overview of all computers in a given query.
 
-  return summary
+  Args:
+    computers: list of Computer objects to generate a summary of.
+  Returns:
+    dict, stats summary data.
+  """
+  summary = ComputerSummary()
+  summary.AddComputers(computers)
+  return summary.ToDict()
 
 
 def GetPercentage(number, total):
@@ -283,12 +343,3 @@ def DictToList(d, sort=True, reverse=True, by_value=False, version=False):
   if reverse:
     l.reverse()
   return l
-
-
-def IsWithinPastXHours(datetime_val, hours=24):
-  """Returns True if datetime is within past X hours, False otherwise."""
-  hours_delta = datetime.timedelta(hours=hours)
-  utcnow = datetime.datetime.utcnow()
-  if utcnow - datetime_val < hours_delta:
-    return True
-  return False
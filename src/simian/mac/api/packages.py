@@ -14,7 +14,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-"""API handler for package info."""
+"""API handler for package info.
+
+GET /api/packages?key=<API_INFO_KEY> returns a JSON dict of filename to
+package dict, from the precomputed models.PackageInfoExport.  Responses carry
+an ETag, and a matching If-None-Match request header yields 304 Not Modified.
+
+With since=<ISO datetime>, only changes are returned, as a JSON dict with
+packages (changed packages), deleted (filenames), complete (True if packages
+holds all packages) and mtime (to pass as the next since).
+"""
 
 import httplib
 import json
@@ -23,21 +32,13 @@ import webapp2
 
 from simian import settings
 from simian.mac import models
+from simian.mac.common import compress
+from simian.mac.common import util
+from simian.mac.munki import handlers
 
 API_INFO_KEY = settings.API_INFO_KEY
 
 
-PKGINFO_PLIST_KEYS_AND_DEFAULTS = (
-    ('display_name', None),
-    ('autoremove', False),
-    ('forced_install', False),
-    ('unattended_install', False),
-    ('unattended_uninstall', False),
-    ('uninstallable', True),
-    ('version', None)
-)
-
-
 class PackageInfo(webapp2.RequestHandler):
 
   def get(self):
@@ -51,21 +52,41 @@ class PackageInfo(webapp2.RequestHandler):
       self.response.set_status(httplib.UNAUTHORIZED)
       return
 
-    output = {}
+    since = self.request.get('since')
+    if since:
+      try:
+        since = util.Datetime.fromisoformat(since)
+      except ValueError:
+        self.response.set_status(httplib.BAD_REQUEST)
+        self.response.out.write('Invalid since: %s' % since)
+        return
 
-    for package in models.PackageInfo.all():
-      output[package.filename] = {
-          'name': package.name,
-          'catalogs': package.catalogs,
-          'created': package.created.isoformat(),
-          'install_types': package.install_types,
-          'manifests': package.manifests,
-          'munki_name': package.munki_name,
-          'mtime': package.mtime.isoformat(),
-      }
+    export = models.PackageInfoExport.Get()
 
-      for key, default in PKGINFO_PLIST_KEYS_AND_DEFAULTS:
-        output[package.filename][key] = package.plist.get(key, default)
+    self.response.headers['ETag'] = handlers.QuoteETag(export.etag)
+    if_none_match = self.request.headers.get('If-None-Match', '')
+    if if_none_match and handlers.IsETagMatch(export.etag, if_none_match):
+      self.response.set_status(httplib.NOT_MODIFIED)
+      return
+
+    try:
+      if since:
+        changes = export.GetChanges(since)
+      else:
+        export_gzip = export.GetGzip()
+    except models.PackageInfoExportError as e:
+      logging.error('%s', e)
+      self.response.set_status(httplib.SERVICE_UNAVAILABLE)
+      return
 
     self.response.headers['Content-Type'] = 'application/json'
-    self.response.out.write(json.dumps(output))
+    if since:
+      self.response.out.write(json.dumps(changes))
+      return
+
+    self.response.headers['Vary'] = 'Accept-Encoding'
+    if handlers.IsGzipAccepted(self.request.headers.get('Accept-Encoding', '')):
+      self.response.headers['Content-Encoding'] = 'gzip'
+      self.response.out.write(export_gzip)
+    else:
+      self.response.out.write(compress.Gunzip(export_gzip))
@@ -31,8 +31,10 @@ import signal
 import struct
 import subprocess
 import tempfile
+import threading
 import time
 
+from simian.client import client as simian_client
 from simian.mac.client import version
 
 # Place all ObjC-dependent imports in this try/except block.
@@ -53,6 +55,14 @@ except ImportError:
 
 
 FACTER_CMD = '/usr/local/bin/simianfacter'
+FACTER_TIMEOUT = 300
+FACTER_CACHE_PATH = simian_client.HttpsAuthClient.FACTER_CACHE_OSX_PATH
+# Seconds facter output is cached for before facter is executed again.
+FACTER_CACHE_TTL = 4 * 60 * 60
+ON_CORP_CMD_CONFIG = '/etc/simian/on_corp_cmd'
+ON_CORP_CMD_TIMEOUT = 60
+# Seconds any other GetClientIdentifier() probe may take.
+PROBE_TIMEOUT = 30
 DATETIME_STR_FORMAT = '%Y-%m-%d %H:%M:%S'
 DELIMITER = '|'
 APPLE_SUS_PLIST = '/Library/Preferences/com.apple.SoftwareUpdate.plist'
@@ -66,6 +76,8 @@ DEFAULT_ADDITIONAL_HTTP_HEADERS_KEY = 'AdditionalHttpHeaders'
 AUTH1_TOKEN = None
 HUNG_MSU_TIMEOUT = datetime.timedelta(hours=2)
 MUNKI_CLIENT_ID_HEADER_KEY = 'X-munki-client-id'
+# Version of the JSON body of install_reports reports.
+INSTALL_REPORTS_VERSION = 1
 
 
 DEBUG = False
@@ -318,26 +330,59 @@ def GetUserSettings():
   return {}
 
 
-def GetFacterFacts():
+def _WriteFacterCache(output):
+  """Atomically writes facter output to FACTER_CACHE_PATH.
+
+  Args:
+    output: str, facter output.
+  """
+  if os.geteuid() != 0:
+    return  # as root only trusts a cache written by root.
+  tmp_path = None
+  try:
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(FACTER_CACHE_PATH), prefix='.facter.cache.')
+    try:
+      os.write(fd, output)
+    finally:
+      os.close(fd)
+    os.chmod(tmp_path, 0644)
+    os.rename(tmp_path, FACTER_CACHE_PATH)
+  except OSError as e:
+    logging.warning('Error writing facter cache: %s', str(e))
+    if tmp_path and os.path.exists(tmp_path):
+      os.unlink(tmp_path)
+
+
+def GetFacterFacts(use_cache=True):
   """Return facter contents.
 
+  As facter is slow, its output is cached in FACTER_CACHE_PATH, and reused
+  until it is FACTER_CACHE_TTL seconds old or FACTER_CMD changes.
+
+  Args:
+    use_cache: bool, default True, use cached facter output if fresh.
   Returns:
     dict, facter contents
   """
+  if use_cache:
+    try:
+      cmd_mtime = os.path.getmtime(FACTER_CMD)
+    except OSError:
+      cmd_mtime = None
+    facts = simian_client.ReadFacterCache(
+        FACTER_CACHE_PATH, max_age=FACTER_CACHE_TTL, not_before=cmd_mtime)
+    if facts:
+      return facts
+
   return_code, stdout, unused_stderr = Exec(
-      FACTER_CMD, timeout=300, waitfor=0.5)
+      FACTER_CMD, timeout=FACTER_TIMEOUT, waitfor=0.5)
   if return_code != 0:
     return {}
 
-  # Iterate over the facter output and create a dictionary of the contents.
-  facts = {}
-  for line in stdout.splitlines():
-    try:
-      key, unused_sep, value = line.split(' ', 2)
-      value = value.strip()
-      facts[key] = value
-    except ValueError:
-      logging.warning('Ignoring invalid facter output line: %s', line)
+  facts = simian_client.ParseFacterOutput(stdout.splitlines())
+  if facts:
+    _WriteFacterCache(stdout)
   return facts
 
 
@@ -393,6 +438,102 @@ def GetDiskFree(path=None):
   return st.f_frsize * st.f_bavail  # f_bavail matches df(1) output
 
 
+def _GetUptimeOrError():
+  """Returns the system uptime, or an error str."""
+  try:
+    return GetSystemUptime()
+  except Error as e:
+    return 'ERROR: %s' % str(e)
+
+
+def _GetDiskFreeOrError(path=None):
+  """Returns the bytes of free space of path, or an error str."""
+  try:
+    return GetDiskFree(path)
+  except Error as e:
+    return 'ERROR: %s' % str(e)
+
+
+def _GetOnCorp():
+  """Returns str '1' if on the corp network, '0' if not, or None if unknown."""
+  on_corp_cmd = ''
+  if os.path.isfile(ON_CORP_CMD_CONFIG):
+    try:
+      f = open(ON_CORP_CMD_CONFIG, 'r')
+      on_corp_cmd = f.read()
+      on_corp_cmd = on_corp_cmd.strip()
+      f.close()
+    except IOError as e:
+      logging.exception(
+          'Error reading %s: %s', ON_CORP_CMD_CONFIG, str(e))
+  if not on_corp_cmd:
+    return None
+  try:
+    on_corp, unused_stdout, unused_stderr = Exec(
+        on_corp_cmd, timeout=ON_CORP_CMD_TIMEOUT, waitfor=0.5)
+    # exit=0 means on corp, so reverse.
+    return '%d' % (not on_corp)
+  except OSError as e:
+    # in this case, we don't know if on corp or not so don't log either.
+    logging.exception('OSError calling on_corp_cmd: %s', str(e))
+    return None
+
+
+class _Probe(threading.Thread):
+  """Thread running one probe function and timing it."""
+
+  def __init__(self, name, fn):
+    super(_Probe, self).__init__(name='probe-%s' % name)
+    self.daemon = True
+    self.probe_name = name
+    self.result = None
+    self.secs = None
+    self._fn = fn
+
+  def run(self):
+    start = time.time()
+    try:
+      self.result = self._fn()
+    except Exception:  # pylint: disable=broad-except
+      logging.exception('Probe %s failed', self.probe_name)
+    finally:
+      self.secs = time.time() - start
+
+
+def RunProbes(probes):
+  """Runs independent probe functions concurrently, each with a deadline.
+
+  Args:
+    probes: list of (str name, function, int timeout seconds) tuples; the
+        functions are called without arguments.
+  Returns:
+    tuple of dicts, (results, timings), with probe name keys and the return
+    value and seconds taken as values.  A probe which failed or did not
+    return before its deadline has a None result, and is abandoned.
+  """
+  start = time.time()
+  threads = []
+  for name, fn, timeout in probes:
+    t = _Probe(name, fn)
+    t.start()
+    threads.append((t, start + timeout))
+
+  results = {}
+  timings = {}
+  for t, deadline in sorted(threads, key=lambda x: x[1]):
+    t.join(max(0, deadline - time.time()))
+    if t.is_alive():
+      logging.warning(
+          'Probe %s did not finish within %ds', t.probe_name,
+          deadline - start)
+      results[t.probe_name] = None
+      timings[t.probe_name] = time.time() - start
+    else:
+      results[t.probe_name] = t.result
+      timings[t.probe_name] = t.secs
+  return results, timings
+
+
 def GetClientIdentifier(runtype=None):
   """Assembles the client identifier based on information collected by facter.
 
@@ -401,8 +542,24 @@ def GetClientIdentifier(runtype=None):
   Returns:
     dict client identifier.
   """
-  facts = GetFacterFacts()
-
+  # run the slow probes concurrently; the fallbacks below are cheap.
+  probes, timings = RunProbes([
+      ('facter', GetFacterFacts, FACTER_TIMEOUT),
+      ('on_corp', _GetOnCorp, ON_CORP_CMD_TIMEOUT),
+      # LastNotifiedDate comes as local time from FoundationPlist,
+      # so convert to epoc timestamp then to UTC datetime.
+      ('last_notified', lambda: GetPlistDateValue(
+          'LastNotifiedDate', str_format=DATETIME_STR_FORMAT), PROBE_TIMEOUT),
+      ('uptime', _GetUptimeOrError, PROBE_TIMEOUT),
+      ('root_disk_free', _GetDiskFreeOrError, PROBE_TIMEOUT),
+  ])
+  facts = probes['facter'] or {}
+  on_corp = probes['on_corp']
+  last_notified_datetime_str = probes['last_notified']
+  uptime = probes['uptime']
+  root_disk_free = probes['root_disk_free']
+
+  fallbacks_start = time.time()
   uuid = (facts.get('certname', None) or
           facts.get('uuid', None) or _GetMachineInfoPlistValue('MachineUUID') or
           _GetHardwareUUID())
@@ -432,58 +589,19 @@ def GetClientIdentifier(runtype=None):
   mgmt_enabled = facts.get(
       'client_management_enabled', 'true').lower() == 'true'
 
-  # Determine if the computer is on the corp network or not.
-  on_corp = None
-  on_corp_cmd = ''
-  on_corp_cmd_config = '/etc/simian/on_corp_cmd'
-  if not on_corp_cmd and os.path.isfile(on_corp_cmd_config):
-    try:
-      f = open(on_corp_cmd_config, 'r')
-      on_corp_cmd = f.read()
-      on_corp_cmd = on_corp_cmd.strip()
-      f.close()
-    except IOError as e:
-      logging.exception(
-          'Error reading %s: %s', on_corp_cmd_config, str(e))
-  if on_corp_cmd:
-    try:
-      on_corp, unused_stdout, unused_stderr = Exec(
-          on_corp_cmd, timeout=60, waitfor=0.5)
-      # exit=0 means on corp, so reverse.
-      on_corp = '%d' % (not on_corp)
-    except OSError as e:
-      # in this case, we don't know if on corp or not so don't log either.
-      logging.exception('OSError calling on_corp_cmd: %s', str(e))
-      on_corp = None
-
-  # LastNotifiedDate comes as local time from FoundationPlist,
-  # so convert to epoc timestamp then to UTC datetime.
-  last_notified_datetime_str = GetPlistDateValue(
-      'LastNotifiedDate', str_format=DATETIME_STR_FORMAT)
-
-  # get uptime
-  try:
-    uptime = GetSystemUptime()
-  except Error as e:
-    uptime = 'ERROR: %s' % str(e)
-
-  # get free space
-  try:
-    root_disk_free = GetDiskFree()
-  except Error as e:
-    root_disk_free = 'ERROR: %s' % str(e)
-
   # get user disk free
   user_disk_free = None
   if owner:
-    try:
-      # TODO(user): this may not be FileVault compatible, at least before
-      # the user is logged in; investigate.
-      user_dir_path = '/Users/%s/' % owner
-      if os.path.isdir(user_dir_path):
-        user_disk_free = GetDiskFree(user_dir_path)
-    except Error as e:
-      user_disk_free = 'ERROR: %s' % str(e)
+    # TODO(user): this may not be FileVault compatible, at least before
+    # the user is logged in; investigate.
+    user_dir_path = '/Users/%s/' % owner
+    if os.path.isdir(user_dir_path):
+      user_disk_free = _GetDiskFreeOrError(user_dir_path)
+  timings['fallbacks'] = time.time() - fallbacks_start
+
+  logging.info('GetClientIdentifier probe timings: %s', ', '.join(
+      '%s=%.2fs' % (name, secs) for name, secs in sorted(
+          timings.items(), key=lambda x: x[1], reverse=True)))
 
   client_id = {
       'uuid': uuid,
@@ -598,7 +716,7 @@ def Flatten(o):
   """
   if o is None or not OBJC_OK:
     pass
-  elif type(o, Foundation.NSCFDictionary):
+  elif isinstance(o, Foundation.NSCFDictionary):
     n = {}
     for k, v in o.iteritems():
       n[Flatten(k)] = Flatten(v)
@@ -663,6 +781,35 @@ def GetRemainingPackagesToInstall():
   return pkgs_to_install, apple_updates_to_install
 
 
+def _GetInstallReportResults(install_report):
+  """Returns the installs, removals and problems of a ManagedInstallReport.
+
+  Args:
+    install_report: plist object for ManagedInstallsReport.plist.
+  Returns:
+    tuple of lists, (installs, removals, problem_installs); installs are
+    dicts with any 'time' as an epoc timestamp, the others unicode strs.
+  """
+  installs = []
+  for install in install_report.get('InstallResults', []):  # incl. updates.
+    install = dict((k, Flatten(v)) for k, v in install.items())
+    # If 'time' exists, convert it to an epoc timestamp.
+    install_time = install.get('time', None)
+    if hasattr(install_time, 'timeIntervalSince1970'):
+      install['time'] = install_time.timeIntervalSince1970()
+    installs.append(install)
+
+  removals = [unicode(r) for r in install_report.get('RemovalResults', [])]
+
+  problem_installs = []
+  for p in install_report.get('ProblemInstalls', []):
+    if hasattr(p, 'keys'):
+      p = u'%s: %s' % (p.get('name', ''), p.get('note', ''))
+    problem_installs.append(unicode(p))
+
+  return installs, removals, problem_installs
+
+
 def _UploadManagedInstallReport(client, on_corp, install_report):
   """Reports any installs, updates, uninstalls back to Simian server.
 
@@ -674,54 +821,70 @@ def _UploadManagedInstallReport(client, on_corp, install_report):
   if not install_report:
     return
 
-  installs = install_report.get('InstallResults', [])  # includes updates.
-  removals = install_report.get('RemovalResults', [])
-  problem_installs = install_report.get('ProblemInstalls', [])
-
-  # encode all strings to utf-8 for unicode character support.
-  for item_list in [removals]:
-    for i in xrange(len(item_list)):
-      item_list[i] = unicode(item_list[i]).encode('utf-8')
-
-  # convert dict problems to strings, and encode as utf-8.
-  for i in xrange(len(problem_installs)):
-    # TODO(user): send dict to server so details can be stored separately:
-    #    problem_installs[i] = DictToStr(problem_installs[i])
-    p = problem_installs[i]
-    if hasattr(p, 'keys'):
-      p = u'%s: %s' % (p.get('name', ''), p.get('note', ''))
-    problem_installs[i] = p.encode('utf-8')
-
-  for i in xrange(len(installs)):
-    # If 'time' exists, convert it to an epoc timestamp.
-    install_time = installs[i].get('time', None)
-    if hasattr(install_time, 'timeIntervalSince1970'):
-      installs[i]['time'] = install_time.timeIntervalSince1970()
-    # TODO(user): convert DictToStr to JSON, here and on the server, in
-    #     //mac/munki/handlers/reports.py:_LogInstalls
-    installs[i] = DictToStr(installs[i])
+  installs, removals, problem_installs = _GetInstallReportResults(
+      install_report)
 
   if installs or removals or problem_installs:
+    # encode all strings to utf-8 for unicode character support.
     data = {
         'on_corp': on_corp,
-        'installs': installs,
-        'removals': removals,
-        'problem_installs': problem_installs,
+        'installs': [DictToStr(i) for i in installs],
+        'removals': [r.encode('utf-8') for r in removals],
+        'problem_installs': [p.encode('utf-8') for p in problem_installs],
     }
     client.PostReport('install_report', data)
 
 
+def _UploadInstallReports(client, on_corp, install_reports):
+  """Reports the results of several install reports in one JSON request.
+
+  Args:
+    client: SimianAuthClient.
+    on_corp: str, on_corp status from GetClientIdentifier.
+    install_reports: list of plist objects for ManagedInstallsReport.plist.
+  Returns:
+    True if the reports were uploaded or had nothing to report, False if
+    the server does not support install_reports.
+  """
+  reports = []
+  for install_report in install_reports:
+    if not install_report:
+      continue
+    installs, removals, problem_installs = _GetInstallReportResults(
+        install_report)
+    if installs or removals or problem_installs:
+      reports.append({
+          'installs': installs,
+          'removals': removals,
+          'problem_installs': problem_installs,
+      })
+  if not reports:
+    return True
+
+  response = client.PostJsonReport('install_reports', {
+      'version': INSTALL_REPORTS_VERSION,
+      'on_corp': on_corp,
+      'reports': reports,
+  })
+  # servers predating install_reports log it as unknown, responding empty.
+  return bool(response)
+
+
 def UploadAllManagedInstallReports(client, on_corp):
   """Uploads any installs, updates, uninstalls back to Simian server.
 
+  All reports are uploaded in one install_reports request, falling back to
+  one install_report request per report for older servers.
+
   Args:
     client: A SimianAuthClient.
     on_corp: str, on_corp status from GetClientIdentifier.
   """
   # Report installs from the ManagedInstallsReport archives.
+  archives = []
   archives_dir = os.path.join(munkicommon.pref('ManagedInstallDir'), 'Archives')
   if os.path.isdir(archives_dir):
-    for fname in os.listdir(archives_dir):
+    for fname in sorted(os.listdir(archives_dir)):
       if not fname.startswith('ManagedInstallReport-'):
         continue
       install_report_path = os.path.join(archives_dir, fname)
@@ -729,27 +892,39 @@ def UploadAllManagedInstallReports(client, on_corp):
         continue
       install_report, _ = GetManagedInstallReport(
           install_report_path=install_report_path)
-      try:
-        _UploadManagedInstallReport(client, on_corp, install_report)
-        try:
-          os.unlink(install_report_path)
-        except (IOError, OSError):
-          logging.warning(
-              'Failed to delete ManagedInstallsReport.plist: %s',
-              install_report_path)
-      except ServerRequestError:
-        logging.exception('Error uploading ManagedInstallReport installs.')
+      archives.append((install_report_path, install_report))
 
   # Report installs from the current ManagedInstallsReport.plist.
   install_report, install_report_path = GetManagedInstallReport()
+
+  try:
+    uploaded = _UploadInstallReports(
+        client, on_corp, [r for _, r in archives] + [install_report])
+  except (ServerRequestError, simian_client.SimianServerError):
+    logging.exception('Error uploading ManagedInstallReport installs.')
+    return
+
+  for archive_path, archive_report in archives:
+    try:
+      if not uploaded:
+        _UploadManagedInstallReport(client, on_corp, archive_report)
+      try:
+        os.unlink(archive_path)
+      except (IOError, OSError):
+        logging.warning(
+            'Failed to delete ManagedInstallsReport.plist: %s', archive_path)
+    except (ServerRequestError, simian_client.SimianServerError):
+      logging.exception('Error uploading ManagedInstallReport installs.')
+
   try:
-    _UploadManagedInstallReport(client, on_corp, install_report)
+    if not uploaded:
+      _UploadManagedInstallReport(client, on_corp, install_report)
     # Clear reportable information now that is has been published.
     install_report['InstallResults'] = []
     install_report['RemovalResults'] = []
     install_report['ProblemInstalls'] = []
     fpl.writePlist(install_report, install_report_path)
-  except ServerRequestError:
+  except (ServerRequestError, simian_client.SimianServerError):
     logging.exception('Error uploading ManagedInstallReport installs.')
 
 
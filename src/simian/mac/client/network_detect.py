@@ -17,10 +17,12 @@
 """Simian network backoff detection module."""
 
 
+import collections
 import logging
 import platform
 import re
 import socket
+import threading
 import urlparse
 import requests
 
@@ -38,6 +40,10 @@ IFCONFIG = '/sbin/ifconfig'
 
 IOS_WAP_DEFAULT_GATEWAY_IP = '172.20.10.1'
 IOS_WAP_NETWORK_GATEWAY_SUBNET = '172.20.10/28'
+IOS_WAP_PORT = 62078
+
+# Seconds a NetworkSnapshot waits for a gateway probe.
+PROBE_TIMEOUT = 5
 
 INTERFACE_ANDROID_WAP = 'android_wap'
 INTERFACE_WWAN = 'wwan'
@@ -59,17 +65,14 @@ def _GetPlatform():
   return platform_str
 
 
-def GetAllInterfaceNames():
-  """Get network interfaces info for this host.
-
-  Note that this list may include all types of interfaces
-  that are not normally interesting to this script, e.g. fw0.
+def _GetInterfaces(this_platform):
+  """Get network interfaces and their ifconfig output for this host.
 
+  Args:
+    this_platform: str, like constants LINUX or DARWIN.
   Returns:
-    list, e.g. ['en0', 'en1', 'fw0', 'eth0']
+    OrderedDict of str interface name keys and str ifconfig output values.
   """
-  this_platform = _GetPlatform()
-
   # Note slight difference in regex.
   # BSD ifconfig writes "interface_name:\s+"
   # while Linux writes "interface_name\s+"
@@ -78,35 +81,37 @@ def GetAllInterfaceNames():
   elif this_platform == DARWIN:
     intf_header = re.compile(r'^([a-z]+(?:[0-9]+)?):\s+')
 
-  return_code, stdout, stderr = flight_common.Exec('/sbin/ifconfig')
+  return_code, stdout, stderr = flight_common.Exec(IFCONFIG)
+  interfaces = collections.OrderedDict()
   if return_code != 0 or stderr:
-    return []
-
-  interfaces = []
+    return interfaces
 
+  lines = None
   if stdout:
     for l in stdout.splitlines():  # pylint: disable=maybe-no-member
       m = intf_header.search(str(l))
       if m:
-        interfaces.append(m.group(1))
+        lines = interfaces.setdefault(m.group(1), [])
+      if lines is not None:
+        lines.append(l)
 
+  for name, lines in interfaces.iteritems():
+    interfaces[name] = '\n'.join(lines)
   return interfaces
 
 
-def GetInterfaceNames(interface_type):
-  """Get the network interface names for an interface type.
+def _FilterInterfaceNames(all_interfaces, interface_type, this_platform):
+  """Returns the interface names for an interface type.
 
   Args:
+    all_interfaces: list of str interface names.
     interface_type: str, like INTERFACE_* constant
+    this_platform: str, like constants LINUX or DARWIN.
   Returns:
     list of str, like ['ppp0'] or ['en0', 'en1']
   Raises:
     ValueError: if interface_type is unknown
-    PlatformError: if platform is not implemented
   """
-  this_platform = _GetPlatform()
-  all_interfaces = GetAllInterfaceNames()
-
   if interface_type == INTERFACE_WWAN:
     return [x for x in all_interfaces if x.startswith('ppp')
             or x.startswith('bnep')]
@@ -124,23 +129,15 @@ def GetInterfaceNames(interface_type):
     raise ValueError(interface_type)
 
 
-def GetNetworkGateway(network):
-  """Get the gateway for a network.
-
-  Uses "netstat -nr" on Darwin and "ip route" on Linux to read the routing
-  table.
+def _GetRoutes(this_platform):
+  """Returns the str routing table of this host, or None if unknown.
 
-  It searches for a route with destination exactly matching the network
-  parameter!
+  Uses "netstat -nr" on Darwin and "ip route" on Linux.
 
   Args:
-    network: str, likely in CIDR format or default gateway,
-        e.g. "1.2.3/24" or "0.0.0.0"
-  Returns:
-    a string like "1.2.3.4" or "link#1" or "01:02:03:04:05:06" or
-    "dev wlan0", depending on the type of route and platform.
+    this_platform: str, like constants LINUX or DARWIN.
   """
-  route = ROUTE.get(_GetPlatform(), None)
+  route = ROUTE.get(this_platform, None)
   logging.debug('Route: %s', str(route))
   if not route:
     return
@@ -153,10 +150,30 @@ def GetNetworkGateway(network):
   if return_code != 0 or stderr or not stdout:
     return
 
+  return str(stdout)
+
+
+def _FindNetworkGateway(routes, network):
+  """Finds the gateway for a network in a routing table.
+
+  It searches for a route with destination exactly matching the network
+  parameter!
+
+  Args:
+    routes: str, routing table from _GetRoutes(), or None.
+    network: str, likely in CIDR format or default gateway,
+        e.g. "1.2.3/24" or "0.0.0.0"
+  Returns:
+    a string like "1.2.3.4" or "link#1" or "01:02:03:04:05:06" or
+    "dev wlan0", depending on the type of route and platform, or None.
+  """
+  if not routes:
+    return
+
   gateway_pattern = (
       r'^%s\s+(via[\s\t])?'
       r'([\d\.]+|[0-9a-f:]+|link#\d+|dev [a-z\d]+)[\s\t]+' % network)
-  gateway = re.search(gateway_pattern, str(stdout), re.MULTILINE)
+  gateway = re.search(gateway_pattern, routes, re.MULTILINE)
 
   if gateway:
     return gateway.group(2)
@@ -164,21 +181,62 @@ def GetNetworkGateway(network):
   return
 
 
+def GetAllInterfaceNames():
+  """Get network interfaces info for this host.
+
+  Note that this list may include all types of interfaces
+  that are not normally interesting to this script, e.g. fw0.
+
+  Returns:
+    list, e.g. ['en0', 'en1', 'fw0', 'eth0']
+  """
+  return _GetInterfaces(_GetPlatform()).keys()
+
+
+def GetInterfaceNames(interface_type):
+  """Get the network interface names for an interface type.
+
+  Args:
+    interface_type: str, like INTERFACE_* constant
+  Returns:
+    list of str, like ['ppp0'] or ['en0', 'en1']
+  Raises:
+    ValueError: if interface_type is unknown
+    PlatformError: if platform is not implemented
+  """
+  return _FilterInterfaceNames(
+      GetAllInterfaceNames(), interface_type, _GetPlatform())
+
+
+def GetNetworkGateway(network):
+  """Get the gateway for a network.
+
+  Uses "netstat -nr" on Darwin and "ip route" on Linux to read the routing
+  table.
+
+  It searches for a route with destination exactly matching the network
+  parameter!
+
+  Args:
+    network: str, likely in CIDR format or default gateway,
+        e.g. "1.2.3/24" or "0.0.0.0"
+  Returns:
+    a string like "1.2.3.4" or "link#1" or "01:02:03:04:05:06" or
+    "dev wlan0", depending on the type of route and platform.
+  """
+  return _FindNetworkGateway(_GetRoutes(_GetPlatform()), network)
+
+
 def GetDefaultGateway():
   """Gets the default gateway.
 
   Returns:
     a string like "192.168.0.1" or None if default gateway is unknown.
   """
-  if _GetPlatform() in [DARWIN, LINUX]:
-    default = 'default'
-  else:
-    logging.error('Unknown platform %s', _GetPlatform())
-
-  return GetNetworkGateway(default)
+  return GetNetworkGateway('default')
 
 
-def GetHttpResource(host, path='/', port=80, redir=False):
+def GetHttpResource(host, path='/', port=80, redir=False, timeout=None):
   """Gets HTTP resource.
 
   Args:
@@ -186,6 +244,7 @@ def GetHttpResource(host, path='/', port=80, redir=False):
     path: optional, str, like "/path", default "/".
     port: optional, int, default 80.
     redir: optional, bool, whether to follow redirects.
+    timeout: optional, float, seconds to wait for the server.
   Returns:
     (int response code, str response body)
     (int -1, str error from http exception)
@@ -197,7 +256,7 @@ def GetHttpResource(host, path='/', port=80, redir=False):
   url = 'http://%s%s' % (host, port_str)
   url = urlparse.urljoin(url, path)
   try:
-    response = requests.get(url, allow_redirects=redir)
+    response = requests.get(url, allow_redirects=redir, timeout=timeout)
     code = response.status_code
     body = response.text
     return code, body
@@ -205,35 +264,6 @@ def GetHttpResource(host, path='/', port=80, redir=False):
     return -1, str(e)
 
 
-def IsOnWwan():
-  """"Checks WWAN device connection status.
-
-  Note: this may produce false-positives, and may not catch all WWAN
-    devices.  Several Sprint and Verizon devices were tested, all of which
-    create ppp0 upon connection.  However, L2TP VPN also creates ppp0
-    (Google no longer uses this as of Q2-2010 in favor of SSLVPN).  A
-    stronger check is probably needed at some point.
-
-    As of 2011-12-6 OpenVPN interface is tun0 on Linux and Darwin.
-
-  Returns:
-    Boolean. True if WWAN device is active, False otherwise.
-  """
-  wwan_ifaces = GetInterfaceNames(INTERFACE_WWAN)
-  for wwan_iface in wwan_ifaces:
-    try:
-      return_code, unused_out, unused_err = flight_common.Exec(
-          [IFCONFIG, wwan_iface])
-    except OSError:
-      return_code = None
-
-    # ifconfig exits with 1 if interface doesn't exist.
-    if return_code == 0:
-      return True
-
-  return False
-
-
 def GetNetworkName():
   """Return network name (SSID for WLANs) a device is connected to.
 
@@ -271,126 +301,252 @@ def GetNetworkName():
       return out.strip() or None
 
 
-def IsOnBackoffWLAN():
-  """Returns True if on a Backoff WLAN, such as gogoinflight WiFi."""
-  return GetNetworkName() in BACKOFF_WLANS
+def _IsDnsmasq(ip):
+  """Returns True if the DNS server at ip reveals itself as dnsmasq."""
+  # Request needs to be explicitly top level, as Linux uses
+  # ndots:2 which would turn VERSION.BIND (without trailing dot) into
+  # VERSION.BIND.foo.example.com in some cases.
+  cmd = [HOST, '-W', str(PROBE_TIMEOUT), '-c', 'CHAOS', '-t', 'txt',
+         'VERSION.BIND.', ip]
+  try:
+    return_code, stdout, unused_err = flight_common.Exec(cmd)
+  except OSError:
+    return_code = None
+  if return_code != 0:
+    return False
+  return re.search(
+      r'VERSION\.BIND descriptive text "dnsmasq-.*"', stdout) is not None
 
 
-def IsOnAndroidWap():
-  """Checks if Android WiFi or Bluetooth tethering is connected.
+def _IsIosWapPortOpen(ip):
+  """Returns True if the iOS WAP TCP port is open at ip."""
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  sock.settimeout(PROBE_TIMEOUT)
+  try:
+    return sock.connect_ex((ip, IOS_WAP_PORT)) == 0
+  except socket.error:
+    return False
+  finally:
+    sock.close()
 
-  Returns:
-    Boolean. True if Android tethering is connected, False otherwise.
+
+def _IsMifi(ip):
+  """Returns True if the HTTP server at ip looks like a MiFi-like device."""
+  if ip.startswith('192.168.1.'):  # Verizon and Sprint devices
+    http_status, body = GetHttpResource(
+        ip, redir=True, timeout=PROBE_TIMEOUT)
+    # MiFi-like devices usually run a http interface. It returns a long http
+    # response with various easily found "MiFi" or "Jetpack" strings in it
+    # when loaded. No http auth challenge is issued.
+    return bool(
+        http_status == 200 and body and ('MiFi' in body or 'Jetpack' in body))
+  elif ip == '192.168.8.1':  # common Huawei gateway
+    http_status, _ = GetHttpResource(ip, redir=False, timeout=PROBE_TIMEOUT)
+    return http_status == 307
+  return False
+
+
+class NetworkSnapshot(object):
+  """Network state of this host, collected once for all IsOn* checks.
+
+  Interfaces and routes are read with one ifconfig and one route command.
+  The SSID lookup, and the probes of the default gateway which its address
+  calls for, run concurrently in the background from initialization, and
+  the IsOn* checks wait at most PROBE_TIMEOUT seconds for them.
   """
-  # ifconfig output looks a little bit different on Darwin vs Linux.
-  #
-  # Darwin:
-  # inet 169.254.135.20 netmask 0xffff0000 broadcast 169.254.255.255
-  # Linux:
-  # inet addr:172.26.113.45  Bcast:172.26.115.255  Mask:255.255.252.0
-  android_wap_match_regex = re.compile(
-      r'inet[\w\s]*[\s:]+192\.168\.(42|43|44)\.\d{1,3}\s+'
-      r'.*(?:netmask\s+0xffffff00\s+|Mask:255\.255\.255\.0)')
-
-  ifaces = GetInterfaceNames(INTERFACE_ANDROID_WAP)
-
-  for wifi_iface in ifaces:
-    # Android tethering uses very specific subnets*, as well as dnsmasq which
-    # reveals itself via the TXT VERSION.BIND record.
-    # * 192.168.42.0/24 for wired, 192.168.43.0/24 for WiFi, and
-    #   192.168.44.0/24 for Bluetooth.
-    try:
-      return_code, stdout, stderr = flight_common.Exec([IFCONFIG, wifi_iface])
-    except OSError:
-      return_code = None
-
-    if return_code != 0 or stderr:  # interface was likely not found.
-      continue
-
-    android_wap_match = android_wap_match_regex.search(stdout)
-
-    # Look for an interface on 192.168.4[2-4].0/24.
-    if android_wap_match is not None:
-      # If the default gateway is not through a likely Android WAN interface,
-      # tethering may be active but is not likely to be used.
-      default_gateway = GetDefaultGateway()
-      logging.debug('Default gateway: %s', str(default_gateway))
-      default_gateway_prefix = '192.168.%s.' % android_wap_match.group(1)
-      if not default_gateway.startswith(default_gateway_prefix):
-        return False
-
-      # IP, netmask, gateway look like Android WAP, so check dnsmasq.
-
-      # Request needs to be explicitly top level, as Linux uses
-      # ndots:2 which would turn VERSION.BIND (without trailing dot) into
-      # VERSION.BIND.foo.example.com in some cases.
-      cmd = [HOST, '-W', '5', '-c', 'CHAOS', '-t', 'txt', 'VERSION.BIND.',
-             default_gateway]
+
+  def __init__(self):
+    self.platform = _GetPlatform()
+    self.interfaces = _GetInterfaces(self.platform)
+    self.routes = _GetRoutes(self.platform)
+    self.default_gateway = self.GetNetworkGateway('default')
+    self._probes = {}
+    self._probe_results = {}
+
+    self._StartProbe('ssid', GetNetworkName)
+    ip = self.default_gateway
+    if ip and re.match(r'^192\.168\.4[234]\.', ip):
+      self._StartProbe('dnsmasq', _IsDnsmasq, ip)
+    if (ip == IOS_WAP_DEFAULT_GATEWAY_IP and
+        self.GetNetworkGateway(IOS_WAP_NETWORK_GATEWAY_SUBNET)):
+      self._StartProbe('ios_wap_port', _IsIosWapPortOpen, ip)
+    if ip and (ip.startswith('192.168.1.') or ip == '192.168.8.1'):
+      self._StartProbe('mifi', _IsMifi, ip)
+
+  def _StartProbe(self, name, fn, *args):
+    """Starts running fn(*args) in a background thread."""
+    def _Run():
       try:
-        return_code, stdout, unused_err = flight_common.Exec(cmd)
-      except OSError:
-        return_code = None
-      if return_code != 0:
-        continue
-      dnsmasq_match = re.search(
-          r'VERSION\.BIND descriptive text "dnsmasq-.*"', stdout)
-      if dnsmasq_match is not None:
-        # IP, netmask and dnsmasq all match Android WAP tethering.
-        return True
+        self._probe_results[name] = fn(*args)
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('Network probe %s failed', name)
+    t = threading.Thread(target=_Run, name='network-probe-%s' % name)
+    t.daemon = True
+    t.start()
+    self._probes[name] = t
+
+  def _GetProbeResult(self, name, timeout=PROBE_TIMEOUT):
+    """Returns the result of a probe, or None if not started or not done."""
+    t = self._probes.get(name)
+    if t is None:
+      return
+    t.join(timeout)
+    if t.is_alive():
+      logging.warning('Network probe %s timed out', name)
+    return self._probe_results.get(name)
+
+  def GetInterfaceNames(self, interface_type):
+    """Get the network interface names for an interface type.
+
+    Args:
+      interface_type: str, like INTERFACE_* constant
+    Returns:
+      list of str, like ['ppp0'] or ['en0', 'en1']
+    """
+    return _FilterInterfaceNames(
+        self.interfaces.keys(), interface_type, self.platform)
+
+  def GetNetworkGateway(self, network):
+    """Get the gateway for a network; see GetNetworkGateway()."""
+    return _FindNetworkGateway(self.routes, network)
+
+  def GetNetworkName(self):
+    """Return network name (SSID for WLANs), or None if unknown."""
+    return self._GetProbeResult('ssid')
+
+  def IsOnWwan(self):
+    """"Checks WWAN device connection status.
+
+    Note: this may produce false-positives, and may not catch all WWAN
+      devices.  Several Sprint and Verizon devices were tested, all of which
+      create ppp0 upon connection.  However, L2TP VPN also creates ppp0
+      (Google no longer uses this as of Q2-2010 in favor of SSLVPN).  A
+      stronger check is probably needed at some point.
+
+      As of 2011-12-6 OpenVPN interface is tun0 on Linux and Darwin.
+
+    Returns:
+      Boolean. True if WWAN device is active, False otherwise.
+    """
+    # ifconfig lists only interfaces which exist.
+    return bool(self.GetInterfaceNames(INTERFACE_WWAN))
+
+  def IsOnBackoffWLAN(self):
+    """Returns True if on a Backoff WLAN, such as gogoinflight WiFi."""
+    return self.GetNetworkName() in BACKOFF_WLANS
+
+  def IsOnAndroidWap(self):
+    """Checks if Android WiFi or Bluetooth tethering is connected.
+
+    Returns:
+      Boolean. True if Android tethering is connected, False otherwise.
+    """
+    # ifconfig output looks a little bit different on Darwin vs Linux.
+    #
+    # Darwin:
+    # inet 169.254.135.20 netmask 0xffff0000 broadcast 169.254.255.255
+    # Linux:
+    # inet addr:172.26.113.45  Bcast:172.26.115.255  Mask:255.255.252.0
+    android_wap_match_regex = re.compile(
+        r'inet[\w\s]*[\s:]+192\.168\.(42|43|44)\.\d{1,3}\s+'
+        r'.*(?:netmask\s+0xffffff00\s+|Mask:255\.255\.255\.0)')
+
+    for wifi_iface in self.GetInterfaceNames(INTERFACE_ANDROID_WAP):
+      # Android tethering uses very specific subnets*, as well as dnsmasq
+      # which reveals itself via the TXT VERSION.BIND record.
+      # * 192.168.42.0/24 for wired, 192.168.43.0/24 for WiFi, and
+      #   192.168.44.0/24 for Bluetooth.
+      android_wap_match = android_wap_match_regex.search(
+          self.interfaces[wifi_iface])
+
+      # Look for an interface on 192.168.4[2-4].0/24.
+      if android_wap_match is not None:
+        # If the default gateway is not through a likely Android WAN
+        # interface, tethering may be active but is not likely to be used.
+        logging.debug('Default gateway: %s', str(self.default_gateway))
+        default_gateway_prefix = '192.168.%s.' % android_wap_match.group(1)
+        if not (self.default_gateway or '').startswith(
+            default_gateway_prefix):
+          return False
+
+        # IP, netmask, gateway look like Android WAP, so check dnsmasq.
+        if self._GetProbeResult('dnsmasq'):
+          # IP, netmask and dnsmasq all match Android WAP tethering.
+          return True
 
-  return False
+    return False
 
+  def IsOnIosWap(self):
+    """Checks if the wireless connection is to an iOS WAP tether.
 
-def IsOnIosWap():
-  """Checks if the wireless connection is to an iOS WAP tether.
+    Returns:
+      Boolean. True if iOS WAP is connected, False otherwise.
+    """
+    # iOS WAP looks like a 172.20.10/28 network. Gateway is
+    # 172.20.10.1 with TCP port 62078 open; the probe is only started then.
+    return bool(self._GetProbeResult('ios_wap_port'))
+
+  def IsOnMifi(self):
+    """Checks if the wireless connection is to a MiFi-like device.
+
+    These devices are available from Verizon, Sprint, others, and usually
+    offer some kind of web access portal that says MiFi or Jetpack as a text
+    string.
+
+    Returns:
+      Bool, True if the connection is a likely MiFi-like device, False if not.
+    """
+    return bool(self._GetProbeResult('mifi'))
+
+
+def IsOnWwan(snapshot=None):
+  """Checks WWAN device connection status; see NetworkSnapshot.IsOnWwan().
 
+  Args:
+    snapshot: NetworkSnapshot, optional, network state to check.
   Returns:
-    Boolean. True if iOS WAP is connected, False otherwise.
+    Boolean. True if WWAN device is active, False otherwise.
   """
-  # iOS WAP looks like a 172.20.10/28 network. Gateway is
-  # 172.20.10.1 with TCP port 62078 open.
-  gateway = GetNetworkGateway(IOS_WAP_NETWORK_GATEWAY_SUBNET)
-  if not gateway:
-    return False
+  return (snapshot or NetworkSnapshot()).IsOnWwan()
 
-  ip = GetDefaultGateway()
-  if not ip:
-    return False
 
-  if ip != IOS_WAP_DEFAULT_GATEWAY_IP:
-    return False
+def IsOnBackoffWLAN(snapshot=None):
+  """Returns True if on a Backoff WLAN, such as gogoinflight WiFi.
 
-  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-  result = sock.connect_ex((ip, 62078))
-  if result == 0:
-    return True
+  Args:
+    snapshot: NetworkSnapshot, optional, network state to check.
+  """
+  return (snapshot or NetworkSnapshot()).IsOnBackoffWLAN()
 
-  return False
 
+def IsOnAndroidWap(snapshot=None):
+  """Checks if Android WiFi or Bluetooth tethering is connected.
+
+  Args:
+    snapshot: NetworkSnapshot, optional, network state to check.
+  Returns:
+    Boolean. True if Android tethering is connected, False otherwise.
+  """
+  return (snapshot or NetworkSnapshot()).IsOnAndroidWap()
 
-def IsOnMifi():
-  """Checks if the wireless connection is to a MiFi-like device.
 
-  These devices are available from Verizon, Sprint, others, and usually
-  offer some kind of web access portal that says MiFi or Jetpack as a text
-  string.
+def IsOnIosWap(snapshot=None):
+  """Checks if the wireless connection is to an iOS WAP tether.
 
+  Args:
+    snapshot: NetworkSnapshot, optional, network state to check.
   Returns:
-    Bool, True if the connection is a likely MiFi-like device, False if not.
+    Boolean. True if iOS WAP is connected, False otherwise.
   """
-  ip = GetDefaultGateway()
-  if not ip:
-    return False
+  return (snapshot or NetworkSnapshot()).IsOnIosWap()
 
-  if ip.startswith('192.168.1.'):  # Verizon and Sprint devices
-    http_status, body = GetHttpResource(ip, redir=True)
-    # MiFi-like devices usually run a http interface. It returns a long http
-    # response with various easily found "MiFi" or "Jetpack" strings in it
-    # when loaded. No http auth challenge is issued.
-    if http_status == 200 and body and ('MiFi' in body or 'Jetpack' in body):
-      return True
-  elif ip == '192.168.8.1':  # common Huawei gateway
-    http_status, _ = GetHttpResource(ip, redir=False)
-    return http_status == 307
 
-  return False
+def IsOnMifi(snapshot=None):
+  """Checks if the wireless connection is to a MiFi-like device.
+
+  Args:
+    snapshot: NetworkSnapshot, optional, network state to check.
+  Returns:
+    Bool, True if the connection is a likely MiFi-like device, False if not.
+  """
+  return (snapshot or NetworkSnapshot()).IsOnMifi()
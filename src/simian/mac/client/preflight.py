@@ -356,15 +356,16 @@ def RunPreflight(runtype, server_url=None):
   # If the munki exec is an auto run (launchd), exit if on WWAN or Android WAP.
   client_exit = None
   if runtype == 'auto':
-    if network_detect.IsOnWwan():
+    network = network_detect.NetworkSnapshot()
+    if network.IsOnWwan():
       client_exit = 'WWAN device ppp0 is active'
-    elif network_detect.IsOnAndroidWap():
+    elif network.IsOnAndroidWap():
       client_exit = 'Android WAP tether is active'
-    elif network_detect.IsOnIosWap():
+    elif network.IsOnIosWap():
       client_exit = 'iOS WAP tether is active'
-    elif network_detect.IsOnMifi():
+    elif network.IsOnMifi():
       client_exit = 'MiFi tether is active'
-    elif network_detect.IsOnBackoffWLAN():
+    elif network.IsOnBackoffWLAN():
       client_exit = 'Backoff WLAN SSID detected'
 
   # get a client auth token/cookie from the server, and post connection data.
@@ -16,6 +16,8 @@
 #
 """Module for a container class of zlib-encoded text."""
 
+import cStringIO
+import gzip
 import hashlib
 import zlib
 
@@ -26,6 +28,39 @@ INTERNAL_ENCODING = 'utf-8'
 COMPRESSION_THRESHOLD = 665600  # 650K
 
 
+def Gzip(data):
+  """Returns gzip encoded data, suitable for Content-Encoding: gzip.
+
+  The gzip header carries no timestamp, so equal data always encodes to equal
+  bytes.
+
+  Args:
+    data: str, data to compress.
+  Returns:
+    str of gzip encoded data.
+  """
+  buf = cStringIO.StringIO()
+  gzip_file = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+  gzip_file.write(data)
+  gzip_file.close()
+  return buf.getvalue()
+
+
+def Gunzip(data):
+  """Returns data decoded from gzip encoding, as produced by Gzip().
+
+  Args:
+    data: str, gzip encoded data.
+  Returns:
+    str of decoded data.
+  """
+  gzip_file = gzip.GzipFile(fileobj=cStringIO.StringIO(data), mode='rb')
+  try:
+    return gzip_file.read()
+  finally:
+    gzip_file.close()
+
+
 class CompressedText(object):
   """Container for compressed text.
 
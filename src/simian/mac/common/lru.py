@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Size-bounded, instance-local LRU cache."""
+
+import collections
+import threading
+import time
+
+
+class LruCache(object):
+  """Thread-safe LRU cache with optional per-item expiry.
+
+  Items are evicted in least recently used order once max_size is reached,
+  and are treated as missing once their ttl has passed.
+  """
+
+  def __init__(self, max_size=1000, ttl=None):
+    """Initializer.
+
+    Args:
+      max_size: int, maximum number of items to hold.
+      ttl: int, optional, default seconds an item is valid for; None for no
+          expiry.
+    """
+    self._max_size = max_size
+    self._ttl = ttl
+    self._items = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def Get(self, key, default=None):
+    """Returns the cached value for key, or default if missing or expired.
+
+    Args:
+      key: hashable, cache key.
+      default: any, value to return on a miss.
+    Returns:
+      cached value or default.
+    """
+    with self._lock:
+      item = self._items.pop(key, None)
+      if item is None:
+        self.misses += 1
+        return default
+      value, expires = item
+      if expires is not None and expires < time.time():
+        self.misses += 1
+        return default
+      self._items[key] = item  # reinsert as most recently used.
+      self.hits += 1
+      return value
+
+  def Set(self, key, value, ttl=None):
+    """Caches a value.
+
+    Args:
+      key: hashable, cache key.
+      value: any, value to cache.
+      ttl: int, optional, seconds the value is valid for; defaults to the
+          ttl given on init.
+    """
+    if ttl is None:
+      ttl = self._ttl
+    expires = time.time() + ttl if ttl is not None else None
+    with self._lock:
+      self._items.pop(key, None)
+      self._items[key] = (value, expires)
+      while len(self._items) > self._max_size:
+        self._items.popitem(last=False)
+
+  def Delete(self, key):
+    """Removes a key from the cache, if present."""
+    with self._lock:
+      self._items.pop(key, None)
+
+  def Clear(self):
+    """Removes all items from the cache and resets hit/miss counters."""
+    with self._lock:
+      self._items.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def GetStats(self):
+    """Returns a dict of cache statistics."""
+    with self._lock:
+      return {
+          'hits': self.hits,
+          'misses': self.misses,
+          'size': len(self._items),
+          'max_size': self._max_size,
+      }
+
+  def __len__(self):
+    return len(self._items)
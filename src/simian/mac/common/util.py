@@ -84,6 +84,21 @@ class Datetime(object):
       raise EpochFutureValueError(msg)
     return dt
 
+  @classmethod
+  def fromisoformat(cls, value):
+    """Converts a str ISO 8601 datetime, as datetime.isoformat() returns.
+
+    Args:
+      value: str, like 2016-01-02T03:04:05 or 2016-01-02T03:04:05.123456.
+    Returns:
+      datetime.
+    Raises:
+      ValueError: value is invalid.
+    """
+    if '.' in value:
+      return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+
 
 def Serialize(obj):
   """Return a binary serialized version of object.
@@ -36,6 +36,11 @@ app = webapp2.WSGIApplication([
 
     # Maintenance
     ('/cron/maintenance/authsession_cleanup', maintenance.AuthSessionCleanup),
+    ('/cron/maintenance/backfill_pkginfo_summaries',
+     maintenance.BackfillPackageInfoSummaries),
+    ('/cron/maintenance/flush_client_connections',
+     maintenance.FlushClientConnections),
+    ('/cron/maintenance/flush_reports', maintenance.FlushReports),
     ('/cron/maintenance/mark_computers_inactive',
      maintenance.MarkComputersInactive),
     ('/cron/maintenance/verify_packages', maintenance.VerifyPackages),
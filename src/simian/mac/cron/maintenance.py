@@ -21,6 +21,7 @@ Classes:
 """
 
 import datetime
+import json
 import logging
 import time
 import uuid
@@ -28,6 +29,7 @@ import uuid
 import webapp2
 
 from google.appengine.ext import blobstore
+from google.appengine.ext import db
 from google.appengine.ext import deferred
 
 from simian.mac.common import datastore_locks
@@ -38,48 +40,285 @@ from simian.mac import common
 from simian.mac import models
 from simian.mac.common import gae_util
 from simian.mac.common import mail
+from simian.mac.munki import common as munki_common
+from simian.mac.munki.handlers import reports
+
+
+# Seconds a single cron run spends flushing queued client connections.
+FLUSH_CLIENT_CONNECTIONS_MAX_SECS = 45
+# Seconds a single cron run spends ingesting queued client reports.
+FLUSH_REPORTS_MAX_SECS = 45
+# Number of expires_at ranges that expired auth sessions are purged in,
+# in parallel.
+AUTH_SESSION_PURGE_RANGES = 8
+# Number of auth session keys fetched per query.
+AUTH_SESSION_PURGE_PAGE_SIZE = 5000
+# Number of auth session keys deleted per datastore RPC.
+AUTH_SESSION_PURGE_BATCH_SIZE = 500
+# Seconds a single task spends purging auth sessions before continuing in
+# a new task.
+AUTH_SESSION_PURGE_MAX_SECS = 60
+# Number of auth sessions backfilled with expires_at per task.
+AUTH_SESSION_EXPIRES_AT_BACKFILL_BATCH_SIZE = 500
+# Number of auth sessions given expires_at per cross-group transaction; the
+# datastore allows at most 25 entity groups per transaction.
+AUTH_SESSION_EXPIRES_AT_BACKFILL_TXN_SIZE = 25
+# KeyValueCache key set once all auth sessions have expires_at.
+AUTH_SESSION_EXPIRES_AT_BACKFILL_KEY = 'auth_session_expires_at_backfilled'
+# KeyValueCache key of the query cursor of the running backfill, set by each
+# of its tasks.
+AUTH_SESSION_EXPIRES_AT_BACKFILL_CURSOR_KEY = (
+    'auth_session_expires_at_backfill_cursor')
+# Seconds without progress after which the running backfill is presumed
+# lost, and resumed from its cursor.
+AUTH_SESSION_EXPIRES_AT_BACKFILL_STALE_SECS = 6 * 60 * 60
+# Number of PackageInfo entities backfilled with plist summaries per task.
+PKGINFO_SUMMARY_BACKFILL_BATCH_SIZE = 100
 
 
 class AuthSessionCleanup(webapp2.RequestHandler):
   """Class to invoke auth session cleanup routines when called."""
 
   @classmethod
-  def _DeferRemoveExpiredAuthSessions(
-      cls, prefix, level, min_age_seconds, cursor=None):
-    deferred_name = '%s_auth_session_cleanup_%s' % (prefix, str(uuid.uuid1()))
+  def _GetPurgeRanges(cls, now):
+    """Splits expires_at of all expired sessions into ranges to purge.
+
+    Args:
+      now: datetime.datetime, current time.
+    Returns:
+      list of (start, end) datetime.datetime tuples; start is inclusive and
+      None for the first range, end is exclusive.
+    """
+    oldest = models.AuthSession.all(projection=('expires_at',)).filter(
+        'expires_at >', datetime.datetime.utcfromtimestamp(0)).order(
+            'expires_at').get()
+    if not oldest or oldest.expires_at >= now:
+      return []
+    span = (now - oldest.expires_at) / AUTH_SESSION_PURGE_RANGES
+    starts = [oldest.expires_at + span * i
+              for i in xrange(1, AUTH_SESSION_PURGE_RANGES)]
+    return zip([None] + starts, starts + [now])
+
+  @classmethod
+  def _DeferPurgeAuthSessions(cls, prop_name, start, end, **kwargs):
+    deferred_name = '%s_auth_session_cleanup_%s' % (
+        prop_name.replace('_', ''), str(uuid.uuid1()))
     deferred.defer(
-        cls._RemoveExpiredAuthSessions, prefix, level, min_age_seconds,
-        cursor, _name=deferred_name)
+        cls._PurgeAuthSessions, prop_name, start, end, _name=deferred_name,
+        **kwargs)
 
   @classmethod
-  def _RemoveExpiredAuthSessions(cls, prefix, level, min_age_seconds, cursor):
-    """Expire all session data."""
-    asd = gaeserver.AuthSessionSimianServer()
+  def _PurgeAuthSessions(
+      cls, prop_name, start, end, cursor=None, purged=0, elapsed=0.0):
+    """Deletes all sessions with prop_name in a range, by key.
+
+    Args:
+      prop_name: str, 'expires_at', or 'mtime' for sessions stored without
+          expires_at.
+      start: datetime.datetime, inclusive start of the range, or None.
+      end: datetime.datetime, exclusive end of the range.
+      cursor: str, optional, query cursor to continue from.
+      purged: int, optional, sessions purged so far in this range.
+      elapsed: float, optional, seconds spent so far in this range.
+    """
+    task_start = time.time()
+    query = models.AuthSession.all(keys_only=True)
+    if start is not None:
+      query.filter('%s >=' % prop_name, start)
+    query.filter('%s <' % prop_name, end)
+
+    while time.time() - task_start < AUTH_SESSION_PURGE_MAX_SECS:
+      query.with_cursor(cursor)
+      keys = query.fetch(AUTH_SESSION_PURGE_PAGE_SIZE)
+      gae_util.BatchDatastoreOp(
+          db.delete, keys, batch_size=AUTH_SESSION_PURGE_BATCH_SIZE)
+      purged += len(keys)
+      cursor = query.cursor()
+      if len(keys) < AUTH_SESSION_PURGE_PAGE_SIZE:
+        elapsed += time.time() - task_start
+        logging.info(
+            'Purged %d auth sessions with %s in [%s, %s) in %.1fs (%.0f/s)',
+            purged, prop_name, start, end, elapsed,
+            purged / elapsed if elapsed else 0)
+        return
+
+    cls._DeferPurgeAuthSessions(
+        prop_name, start, end, cursor=cursor, purged=purged,
+        elapsed=elapsed + time.time() - task_start)
+
+  def get(self):
+    """Handle GET"""
+    now = datetime.datetime.utcnow()
+    for start, end in self._GetPurgeRanges(now):
+      self._DeferPurgeAuthSessions('expires_at', start, end)
+
+    # sessions stored before expires_at was set are given one, or purged if
+    # already expired, once, by a single chain of backfill tasks.
+    backfilled, _ = models.KeyValueCache.GetItem(
+        AUTH_SESSION_EXPIRES_AT_BACKFILL_KEY)
+    if not backfilled:
+      cursor, mtime = models.KeyValueCache.GetItem(
+          AUTH_SESSION_EXPIRES_AT_BACKFILL_CURSOR_KEY)
+      if mtime is None or now - mtime > datetime.timedelta(
+          seconds=AUTH_SESSION_EXPIRES_AT_BACKFILL_STALE_SECS):
+        _DeferBackfillAuthSessionExpiresAt(cursor or None)
+
+    # sessions still without expires_at, having no known age, are expired at
+    # the latest after the longest session age.
+    self._DeferPurgeAuthSessions(
+        'mtime', None, now - datetime.timedelta(
+            seconds=auth_base.AGE_APPLESUS_TOKEN_SECONDS))
+
+
+def _DeferBackfillAuthSessionExpiresAt(cursor):
+  """Defers the next backfill task, recording its cursor as progress.
+
+  Args:
+    cursor: str query cursor to resume backfilling from, or None.
+  """
+  models.KeyValueCache.SetItem(
+      AUTH_SESSION_EXPIRES_AT_BACKFILL_CURSOR_KEY, cursor or '')
+  deferred.defer(_BackfillAuthSessionExpiresAt, cursor=cursor)
+
+
+def _BackfillAuthSessionExpiresAt(cursor=None):
+  """Sets expires_at of sessions stored without it, continuing in new tasks.
+
+  Sessions which have already expired, by the age of their type and level,
+  are deleted instead.  Sessions of no known age are left without expires_at,
+  for the mtime purge of AuthSessionCleanup.
+
+  Args:
+    cursor: str, optional, query cursor to resume backfilling from.
+  """
+  query = models.AuthSession.all()
+  if cursor:
+    query.with_cursor(cursor)
+  sessions = query.fetch(AUTH_SESSION_EXPIRES_AT_BACKFILL_BATCH_SIZE)
+  if not sessions:
+    models.KeyValueCache.SetItem(AUTH_SESSION_EXPIRES_AT_BACKFILL_KEY, '1')
+    logging.info('Complete! AuthSession expires_at backfilled.')
+    return
+
+  session_server = gaeserver.AuthSessionSimianServer()
+  now = datetime.datetime.utcnow()
+  to_update = []
+  to_delete = []
+  for session in sessions:
+    if session.expires_at:
+      continue
+    expires_at = session_server.GetExpiresAt(session)
+    if expires_at is None:
+      continue
+    elif expires_at > now:
+      to_update.append((session.key(), expires_at))
+    else:
+      to_delete.append(session.key())
+
+  # Update within transactions so concurrent session updates aren't lost.
+  xg = db.create_transaction_options(xg=True)
+  gae_util.BatchDatastoreOp(
+      lambda batch: db.run_in_transaction_options(
+          xg, _SetAuthSessionExpiresAt, batch),
+      to_update, batch_size=AUTH_SESSION_EXPIRES_AT_BACKFILL_TXN_SIZE)
+  db.delete(to_delete)
+  _DeferBackfillAuthSessionExpiresAt(query.cursor())
 
-    query = asd.All(level=level, min_age_seconds=min_age_seconds, cursor=cursor)
-    sessions = query.fetch(settings.ENTITIES_PER_DEFERRED_TASK)
 
-    if not sessions:
+def _SetAuthSessionExpiresAt(expires_ats):
+  """Sets expires_at of sessions still stored without it, in a transaction.
+
+  Args:
+    expires_ats: list of (db.Key of an AuthSession, datetime.datetime the
+        session expires at) tuples.
+  """
+  sessions = db.get([key for key, _ in expires_ats])
+  to_put = []
+  for session, (_, expires_at) in zip(sessions, expires_ats):
+    if session and not session.expires_at:
+      session.expires_at = expires_at
+      to_put.append(session)
+  db.put(to_put)
+
+
+class BackfillPackageInfoSummaries(webapp2.RequestHandler):
+  """Class to backfill PackageInfo plist summary properties.
+
+  New and updated PackageInfo entities get summaries on put(), and completion
+  is recorded per PLIST_SUMMARY_VERSION, so this only runs once per version.
+  """
+
+  def get(self):
+    """Handle GET."""
+    if models.PackageInfo.IsPlistSummaryBackfilled():
       return
+    deferred.defer(_BackfillPackageInfoSummaries)
+
+
+def _UpdatePackageInfoSummary(key):
+  """Updates the plist summary of a single PackageInfo, in a transaction.
+
+  Args:
+    key: db.Key of the PackageInfo to update.
+  """
+  p = models.PackageInfo.get(key)
+  if p and p.UpdatePlistSummary():
+    # db.put() skips PackageInfo.put(), leaving mtime and the plist untouched.
+    db.put(p)
+
 
-    # expire all certs that are over min expiration age.
-    for session in sessions:
-      if asd.IsExpired(session):
-        session.delete()
+def _BackfillPackageInfoSummaries(cursor=None):
+  """Backfills PackageInfo plist summaries, continuing in new tasks.
 
-    cls._DeferRemoveExpiredAuthSessions(
-        prefix, level, min_age_seconds, cursor=query.cursor())
+  Args:
+    cursor: str, optional, query cursor to resume backfilling from.
+  """
+  query = models.PackageInfo.all()
+  if cursor:
+    query.with_cursor(cursor)
+  pkginfos = query.fetch(PKGINFO_SUMMARY_BACKFILL_BATCH_SIZE)
+  if not pkginfos:
+    models.PackageInfo.SetPlistSummaryBackfilled()
+    logging.info('Complete! PackageInfo plist summaries backfilled.')
+    return
+
+  for p in pkginfos:
+    if p.plist_summary_version != models.PLIST_SUMMARY_VERSION:
+      # Update within a transaction so concurrent pkginfo edits aren't lost.
+      db.run_in_transaction(_UpdatePackageInfoSummary, p.key())
+  deferred.defer(_BackfillPackageInfoSummaries, cursor=query.cursor())
+
+
+class FlushClientConnections(webapp2.RequestHandler):
+  """Class to log client connections queued for batched writes."""
 
   def get(self):
-    """Handle GET"""
-    for lvl in gaeserver.ALL_LEVELS:
-      if lvl != gaeserver.LEVEL_APPLESUS:
-        self._DeferRemoveExpiredAuthSessions(
-            'token', lvl, auth_base.AGE_CN_SECONDS)
-
-    self._DeferRemoveExpiredAuthSessions(
-        'applesus', gaeserver.LEVEL_APPLESUS,
-        auth_base.AGE_APPLESUS_TOKEN_SECONDS)
+    """Handle GET."""
+    # Always drain, so connections queued before write-behind was disabled
+    # are still logged.
+    start = time.time()
+    while True:
+      stats = munki_common.FlushClientConnections()
+      if (stats['connections'] < munki_common.CLIENT_CONNECTION_FLUSH_MAX_TASKS
+          or time.time() - start > FLUSH_CLIENT_CONNECTIONS_MAX_SECS):
+        break
+
+
+class FlushReports(webapp2.RequestHandler):
+  """Class to ingest client reports queued for batched writes."""
+
+  def get(self):
+    """Handle GET."""
+    # Always drain, so reports queued before write-behind was disabled are
+    # still ingested.
+    start = time.time()
+    while True:
+      stats = reports.FlushReports()
+      if (stats['reports'] < reports.REPORT_FLUSH_MAX_TASKS
+          or time.time() - start > FLUSH_REPORTS_MAX_SECS):
+        break
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(json.dumps(stats))
 
 
 class MarkComputersInactive(webapp2.RequestHandler):
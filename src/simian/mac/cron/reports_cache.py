@@ -27,7 +27,6 @@ import time
 import webapp2
 
 from google.appengine.api import taskqueue
-from google.appengine.ext import db
 from google.appengine.ext import deferred
 
 from simian.mac.common import datastore_locks
@@ -37,6 +36,8 @@ from simian.mac.admin import summary as summary_module
 
 TRENDING_INSTALLS_LIMIT = 5
 RUNTIME_MAX_SECS = 30
+# KeyValueCache key holding when install count shards were last backfilled.
+INSTALL_COUNTS_BACKFILL_KEY = 'install_counts_backfill_since'
 
 
 class ReportsCache(webapp2.RequestHandler):
@@ -71,7 +72,7 @@ class ReportsCache(webapp2.RequestHandler):
         kwargs = {}
       _GenerateTrendingInstallsCache(**kwargs)
     elif name == 'pendingcounts':
-      self._GeneratePendingCounts()
+      _GeneratePendingCounts()
     elif name == 'msu_user_summary':
       if arg:
         try:
@@ -208,88 +209,59 @@ class ReportsCache(webapp2.RequestHandler):
 
     lock.Release()
 
-  def _GeneratePendingCounts(self):
-    """Generates a dictionary of all install names and their pending count."""
-    d = {}
-    for munki_name in [p.munki_name for p in models.PackageInfo.all()]:
-      d[munki_name] = models.Computer.AllActive(keys_only=True).filter(
-          'pkgs_to_install =', munki_name).count(999999)
-    models.ReportsCache.SetPendingCounts(d)
 
+def _GeneratePendingCounts(cursor=None, counts=None):
+  """Generates a dictionary of all install names and their pending count.
 
-def _GenerateInstallCounts():
-  """Generates a dictionary of all installs names and the count of each."""
-
-  # Obtain a lock.
-  lock_name = 'pkgs_list_cron_lock'
-  lock = datastore_locks.DatastoreLock(lock_name)
-  try:
-    lock.Acquire(timeout=600, max_acquire_attempts=1)
-  except datastore_locks.AcquireLockError:
-    logging.warning('GenerateInstallCounts: lock found; exiting.')
-    return
+  Active computers are read once, in batches of deferred tasks, counting each
+  package in their pkgs_to_install.
 
-  # Get a list of all packages that have previously been pushed.
-  pkgs, unused_dt = models.ReportsCache.GetInstallCounts()
-
-  # Generate a query of all InstallLog entites that haven't been read yet.
-  query = models.InstallLog.all().order('server_datetime')
-  cursor_obj = models.KeyValueCache.get_by_key_name('pkgs_list_cursor')
-  if cursor_obj:
-    query.with_cursor(cursor_obj.text_value)
-
-  # Loop over new InstallLog entries.
-  try:
-    installs = query.fetch(1000)
-  except db.Error:
-    installs = None
-  if not installs:
-    models.ReportsCache.SetInstallCounts(pkgs)
-    lock.Release()
+  Args:
+    cursor: str, optional, Computer query cursor to resume counting from.
+    counts: dict, optional, pending counts so far, keyed by munki_name.
+  """
+  if counts is None:
+    counts = dict.fromkeys(
+        (p.munki_name
+         for p in models.PackageInfo.all(projection=['munki_name'])), 0)
+
+  query = models.Computer.AllActive().with_cursor(cursor)
+  computers = query.fetch(summary_module.DEFAULT_COMPUTER_FETCH_LIMIT)
+  if computers:
+    for c in computers:
+      for munki_name in set(c.pkgs_to_install):
+        if munki_name in counts:
+          counts[munki_name] += 1
+    deferred.defer(_GeneratePendingCounts, query.cursor(), counts)
     return
+  models.ReportsCache.SetPendingCounts(counts)
 
-  for install in installs:
-    pkg_name = install.package
-    if pkg_name not in pkgs:
-      pkgs[pkg_name] = {
-          'install_count': 0,
-          'install_fail_count': 0,
-          'applesus': install.applesus,
-      }
-    if install.IsSuccess():
-      pkgs[pkg_name]['install_count'] = (
-          pkgs[pkg_name].setdefault('install_count', 0) + 1)
-      # (re)calculate avg_duration_seconds for this package.
-      if 'duration_seconds_avg' not in pkgs[pkg_name]:
-        pkgs[pkg_name]['duration_count'] = 0
-        pkgs[pkg_name]['duration_total_seconds'] = 0
-        pkgs[pkg_name]['duration_seconds_avg'] = None
-      # only proceed if entity has "duration_seconds" property != None.
-      if getattr(install, 'duration_seconds', None) is not None:
-        pkgs[pkg_name]['duration_count'] += 1
-        pkgs[pkg_name]['duration_total_seconds'] += (
-            install.duration_seconds)
-        pkgs[pkg_name]['duration_seconds_avg'] = int(
-            pkgs[pkg_name]['duration_total_seconds'] /
-            pkgs[pkg_name]['duration_count'])
-    else:
-      pkgs[pkg_name]['install_fail_count'] = (
-          pkgs[pkg_name].setdefault('install_fail_count', 0) + 1)
 
-  # Update any changed packages.
-  models.ReportsCache.SetInstallCounts(pkgs)
+def _GenerateInstallCounts():
+  """Backfills install count shards from InstallLog entities, if not yet done.
 
-  if not cursor_obj:
-    cursor_obj = models.KeyValueCache(key_name='pkgs_list_cursor')
+  Installs logged after the backfill starts are counted as they're reported,
+  so this only runs once.
+  """
+  since, unused_mtime = models.KeyValueCache.GetItem(
+      INSTALL_COUNTS_BACKFILL_KEY)
+  if since:
+    return
+  RebuildInstallCounts()
 
-  cursor_txt = str(query.cursor())
-  cursor_obj.text_value = cursor_txt
-  cursor_obj.put()
 
-  # Delete the lock.
-  lock.Release()
+def RebuildInstallCounts():
+  """Recounts install count shards from all InstallLog entities.
 
-  deferred.defer(_GenerateInstallCounts)
+  Shards are counted into a new generation, which replaces the current counts
+  once complete.
+  """
+  models.KeyValueCache.SetItem(
+      INSTALL_COUNTS_BACKFILL_KEY, str(datetime.datetime.utcnow()))
+  generation = models.InstallCountShard.StartRebuild()
+  deferred.defer(
+      models.InstallCountShard.Backfill, generation,
+      _countdown=models.InstallCountShard.BACKFILL_SINCE_SLACK_SECS)
 
 
 def _GenerateTrendingInstallsCacheDeferCallback(
@@ -377,13 +349,14 @@ def IsTimeDelta(dt1, dt2, seconds=None, minutes=None, hours=None, days=None):
 
 
 def _GenerateComputersSummaryCache(cursor=None, summary=None):
+  if summary is None:
+    summary = summary_module.ComputerSummary()
   query = models.Computer.AllActive().with_cursor(cursor)
 
   computers = query.fetch(summary_module.DEFAULT_COMPUTER_FETCH_LIMIT)
   if computers:
-    summary = summary_module.GetComputerSummary(
-        computers, initial_summary=summary)
+    summary.AddComputers(computers)
     deferred.defer(_GenerateComputersSummaryCache, query.cursor(), summary)
     return
   models.ReportsCache.SetStatsSummary(
-      summary_module.PrepareComputerSummaryForTemplate(summary))
+      summary_module.PrepareComputerSummaryForTemplate(summary.ToDict()))
@@ -19,14 +19,22 @@
 import datetime
 import difflib
 import gc
+import hashlib
 import logging
+import random
 import re
+import time
+import uuid
 
 from google.appengine.api import memcache
 from google.appengine.ext import db
+from google.appengine.ext import deferred
+from google.appengine.runtime import apiproxy_errors
 
+from simian.mac.common import compress
 from simian.mac.common import ipcalc
 from simian.mac.common import gae_util
+from simian.mac.common import lru
 from simian.mac.common import util
 from simian.mac.models import properties
 from simian.mac.munki import plist as plist_lib
@@ -44,11 +52,94 @@ class InvalidArgumentsError(Error):
 COMPUTER_ACTIVE_DAYS = 30
 # Default memcache seconds for memcache-backed datastore entities
 MEMCACHE_SECS = 300
+# Maximum bytes of stored content plus its gzip variant in a single entity;
+# Datastore entities are limited to 1MB.
+GZIP_VARIANT_MAX_BYTES = 900 * 1024
+# Maximum number of entities/values held in the instance-local cache.
+LOCAL_CACHE_MAX_SIZE = 500
+
+# Instance-local cache of decoded entities and property values, in front of
+# memcache for models with MEMCACHE_WRAP_LOCAL_CACHE enabled.  Keys include a
+# per entity generation stored in memcache, so that invalidating on one
+# instance invalidates all instances.
+_local_cache = lru.LruCache(max_size=LOCAL_CACHE_MAX_SIZE)
+
+# Maximum characters of plist XML whose LazyPlist is kept in the
+# instance-local cache; larger plists, like catalogs, are not cached.
+LAZY_PLIST_CACHE_MAX_CHARS = 256 * 1024
+
+# Instance-local cache of LazyPlist views of stored plists, keyed by entity
+# key and mtime.
+_lazy_plist_cache = lru.LruCache(max_size=LOCAL_CACHE_MAX_SIZE)
+
+
+def _GetMemcacheGeneration(memcache_key):
+  """Returns the int generation counter stored at memcache_key.
+
+  If the counter is not set it is seeded with the current time, in
+  microseconds, so that a memcache eviction can never recycle a generation
+  which is still cached by a running instance.
+
+  Args:
+    memcache_key: str, memcache key of the generation counter.
+  Returns:
+    int generation, or 0 if memcache is unavailable.
+  """
+  generation = memcache.get(memcache_key)
+  if generation is None:
+    memcache.add(memcache_key, int(time.time() * 1000000))
+    generation = memcache.get(memcache_key) or 0
+  return generation
+
+
+def _IncrementMemcacheGeneration(memcache_key):
+  """Increments the generation counter stored at memcache_key."""
+  memcache.incr(memcache_key, initial_value=int(time.time() * 1000000))
+
+
+def GetGzipVariant(content, stored_size=None):
+  """Returns a gzip variant and strong ETag of content served to clients.
+
+  Args:
+    content: str, utf-8 content as served to clients.
+    stored_size: int, optional, bytes the content takes in its entity;
+        defaults to len(content).
+  Returns:
+    tuple of (str gzip encoded content, or None if the entity would grow too
+    large, str ETag).
+  """
+  etag = hashlib.sha256(content).hexdigest()
+  gzip_content = compress.Gzip(content)
+  if stored_size is None:
+    stored_size = len(content)
+  if stored_size + len(gzip_content) > GZIP_VARIANT_MAX_BYTES:
+    gzip_content = None
+  return gzip_content, etag
 
 
 class BaseModel(db.Model):
   """Abstract base model with useful generic methods."""
 
+  # If True, MemcacheWrappedGet() results are also kept decoded in the
+  # instance-local cache.  Only enable this for models whose cached entities
+  # are not modified in place by callers.
+  MEMCACHE_WRAP_LOCAL_CACHE = False
+
+  @classmethod
+  def _InvalidateLocalCache(cls, key_name):
+    """Invalidates locally cached copies of an entity on all instances.
+
+    Args:
+      key_name: str key name of the entity to invalidate.
+    """
+    if cls.MEMCACHE_WRAP_LOCAL_CACHE:
+      _IncrementMemcacheGeneration('mwggen_%s_%s' % (cls.kind(), key_name))
+
+  @classmethod
+  def GetLocalCacheStats(cls):
+    """Returns a dict with hits, misses, size and max_size of the local cache."""
+    return _local_cache.GetStats()
+
   @classmethod
   def DeleteMemcacheWrap(cls, key_name, prop_name=None):
     """Deletes a cached entity or property from memcache.
@@ -62,6 +153,7 @@ class BaseModel(db.Model):
     else:
       memcache_key = 'mwg_%s_%s' % (cls.kind(), key_name)
     memcache.delete(memcache_key)
+    cls._InvalidateLocalCache(key_name)
 
   @classmethod
   def ResetMemcacheWrap(
@@ -103,6 +195,15 @@ class BaseModel(db.Model):
     else:
       memcache_key = 'mwg_%s_%s' % (cls.kind(), key_name)
 
+    local_key = None
+    if cls.MEMCACHE_WRAP_LOCAL_CACHE and not retry:
+      generation = _GetMemcacheGeneration(
+          'mwggen_%s_%s' % (cls.kind(), key_name))
+      local_key = (memcache_key, generation)
+      output = _local_cache.Get(local_key)
+      if output is not None:
+        return output
+
     cached = memcache.get(memcache_key)
 
     if cached is None:
@@ -155,6 +256,8 @@ class BaseModel(db.Model):
           else:
             return cls.get_by_key_name(key_name)
 
+    if local_key is not None:
+      _local_cache.Set(local_key, output, ttl=memcache_secs)
     return output
 
   @classmethod
@@ -216,6 +319,7 @@ class BaseModel(db.Model):
     entity_protobuf = db.model_to_protobuf(entity).SerializeToString()
     memcache.set(memcache_key, value, memcache_secs)
     memcache.set(memcache_entity_key, entity_protobuf, memcache_secs)
+    cls._InvalidateLocalCache(key_name)
 
   @classmethod
   def MemcacheWrappedDelete(cls, key_name=None, entity=None):
@@ -245,6 +349,7 @@ class BaseModel(db.Model):
       entity.delete()
     memcache_key = 'mwg_%s_%s' % (cls.kind(), key_name)
     memcache.delete(memcache_key)
+    cls._InvalidateLocalCache(key_name)
 
 
 class BasePlistModel(BaseModel):
@@ -294,9 +399,63 @@ class BasePlistModel(BaseModel):
     else:
       self._plist_obj = plist
       self._plist = db.Text(self._plist_obj.GetXml())
+    if hasattr(self, '_plist_lazy'):
+      del self._plist_lazy
 
   plist = property(_GetPlist, _SetPlist)
 
+  def _GetPlistLazy(self):
+    """Returns a read-only view of the plist, parsing values on demand.
+
+    Views of stored plists are cached per entity mtime in the instance-local
+    cache.  If the plist was already parsed, it is returned instead, as it may
+    have been changed.
+
+    Returns:
+      plist_lib.LazyPlist, or the PLIST_LIB_CLASS instance self.plist returns.
+    """
+    if hasattr(self, '_plist_obj') or not self._plist:
+      return self.plist
+    if hasattr(self, '_plist_lazy'):
+      return self._plist_lazy
+
+    cache_key = None
+    mtime = getattr(self, 'mtime', None)
+    if (mtime and self.is_saved()
+        and len(self._plist) <= LAZY_PLIST_CACHE_MAX_CHARS):
+      cache_key = (self.key(), mtime)
+      lazy = _lazy_plist_cache.Get(cache_key)
+      # the plist may have been put without updating mtime.
+      if lazy is not None and lazy.plist_xml == self._plist:
+        self._plist_lazy = lazy
+        return lazy
+
+    try:
+      self._plist_lazy = plist_lib.LazyPlist(self._plist)
+    except plist_lib.PlistError, e:
+      logging.exception('Error parsing self._plist: %s', str(e))
+      return None
+    if cache_key:
+      _lazy_plist_cache.Set(cache_key, self._plist_lazy)
+    return self._plist_lazy
+
+  plist_lazy = property(_GetPlistLazy)
+
+  def SetPlistXml(self, plist_xml):
+    """Sets the _plist property without parsing it.
+
+    Args:
+      plist_xml: str or unicode XML plist, already in the form GetXml() would
+          produce; it is stored as is.
+    """
+    if type(plist_xml) is unicode:
+      self._plist = db.Text(plist_xml)
+    else:
+      self._plist = db.Text(plist_xml, encoding='utf-8')
+    for attr in ('_plist_obj', '_plist_lazy'):
+      if hasattr(self, attr):
+        delattr(self, attr)
+
   def _GetPlistXml(self):
     """Returns the str plist."""
     return self._plist
@@ -312,10 +471,17 @@ class BasePlistModel(BaseModel):
     Returns:
       return value from superclass put()
     """
-    if self.plist:
-      self._plist = self.plist.GetXml()
+    # Only a parsed plist can have been modified, so only serialize that.
+    # It is always serialized, as in-place edits of nested values are not
+    # tracked by the plist's changed flag.
+    if getattr(self, '_plist_obj', None):
+      self._plist = self._plist_obj.GetXml()
+    self._UpdatePlistVariants()
     return super(BasePlistModel, self).put(*args, **kwargs)
 
+  def _UpdatePlistVariants(self):
+    """Updates properties derived from the plist XML; called by put()."""
+
 
 class Computer(db.Model):
   """Computer model."""
@@ -413,16 +579,20 @@ class Computer(db.Model):
       query.with_cursor(cursor)
     return count
 
+  def UpdateActive(self):
+    """Sets active according to preflight_datetime."""
+    now = datetime.datetime.utcnow()
+    earliest_active_date = now - datetime.timedelta(days=COMPUTER_ACTIVE_DAYS)
+    if self.preflight_datetime:
+      if self.preflight_datetime > earliest_active_date:
+        self.active = True
+      else:
+        self.active = False
+
   def put(self, update_active=True):
     """Forcefully set active according to preflight_datetime."""
     if update_active:
-      now = datetime.datetime.utcnow()
-      earliest_active_date = now - datetime.timedelta(days=COMPUTER_ACTIVE_DAYS)
-      if self.preflight_datetime:
-        if self.preflight_datetime > earliest_active_date:
-          self.active = True
-        else:
-          self.active = False
+      self.UpdateActive()
     super(Computer, self).put()
 
 
@@ -618,6 +788,8 @@ class AdminAppleSUSProductLog(AdminLogBase):
 class KeyValueCache(BaseModel):
   """Model for a generic key value pair storage."""
 
+  MEMCACHE_WRAP_LOCAL_CACHE = True
+
   text_value = db.TextProperty()
   blob_value = db.BlobProperty()
   mtime = db.DateTimeProperty(auto_now=True)
@@ -716,7 +888,6 @@ class ReportsCache(KeyValueCache):
   """Model for various reports data caching."""
 
   _SUMMARY_KEY = 'summary'
-  _INSTALL_COUNTS_KEY = 'install_counts'
   _TRENDING_INSTALLS_KEY = 'trending_installs_%d_hours'
   _PENDING_COUNTS_KEY = 'pending_counts'
   _MSU_USER_SUMMARY_KEY = 'msu_user_summary'
@@ -741,17 +912,8 @@ class ReportsCache(KeyValueCache):
 
   @classmethod
   def GetInstallCounts(cls):
-    """Returns tuple (install counts dict, datetime) from Datastore."""
-    return cls.GetSerializedItem(cls._INSTALL_COUNTS_KEY)
-
-  @classmethod
-  def SetInstallCounts(cls, d):
-    """Sets a the install counts dictionary to Datastore.
-
-    Args:
-      d: dict of summary data.
-    """
-    return cls.SetSerializedItem(cls._INSTALL_COUNTS_KEY, d)
+    """Returns tuple (install counts dict, datetime) from InstallCountShard."""
+    return InstallCountShard.GetInstallCounts()
 
   @classmethod
   def GetTrendingInstalls(cls, since_hours):
@@ -824,6 +986,310 @@ class ReportsCache(KeyValueCache):
     entity.delete()
 
 
+class InstallCountBackfill(BaseModel):
+  """Progress of a rebuild of install count shards from InstallLog entities.
+
+  key_name is "gen_<generation>".  The shards a rebuild counts into are
+  children of this entity, so each batch is counted, and its cursor recorded,
+  in a single transaction.
+  """
+
+  # InstallLog entities logged before this time are counted.
+  since = db.DateTimeProperty()
+  # query cursor of the next batch to count; None for the first batch.
+  cursor = db.TextProperty()
+  done = db.BooleanProperty(default=False)
+  mtime = db.DateTimeProperty(auto_now=True)
+
+
+class InstallCountShard(BaseModel):
+  """Sharded install counters of a package, incremented as installs are logged.
+
+  key_name is "<generation>_<package>_<shard number>"; increments pick a
+  random shard, so installs of one package can be counted concurrently.
+  Shards of generation 0, from before generations, omit the generation.
+
+  Counts are read from the active generation.  A rebuild counts all InstallLog
+  entities into a new generation, while installs logged since it started are
+  counted into both, and then makes the new generation active.
+  """
+
+  NUM_SHARDS = 20
+  COUNTERS = [
+      'install_count', 'install_fail_count', 'duration_count',
+      'duration_total_seconds']
+  # Number of ids of applied increments kept per shard, so that retrying an
+  # increment which did commit does not count it again.
+  INCREMENT_IDS_KEPT = 50
+  # Number of InstallLog entities counted per rebuild transaction.
+  BACKFILL_BATCH_SIZE = 400
+  # A rebuild counts InstallLog entities logged up to this long after it
+  # starts, and starts counting once they are logged, so that installs
+  # incremented by requests which read the generations before the rebuild
+  # started are not missed.
+  BACKFILL_SINCE_SLACK_SECS = 60
+  _MEMCACHE_KEY = 'install_count_shards'
+  _MEMCACHE_SECS = 60
+  # KeyValueCache key of the serialized generations dict; see GetGenerations.
+  _GENERATIONS_KEY = 'install_count_generations'
+
+  package = db.StringProperty()
+  applesus = db.BooleanProperty(default=False)
+  install_count = db.IntegerProperty(default=0)
+  install_fail_count = db.IntegerProperty(default=0)
+  # number of successful installs with a known duration, and their total.
+  duration_count = db.IntegerProperty(default=0)
+  duration_total_seconds = db.IntegerProperty(default=0)
+  generation = db.IntegerProperty(default=0)
+  increment_ids = db.StringListProperty(indexed=False)
+  mtime = db.DateTimeProperty(auto_now=True)
+
+  @classmethod
+  def GetGenerations(cls):
+    """Returns the shard generations.
+
+    Returns:
+      dict with keys active, int generation counts are read from; building,
+      int generation being rebuilt, or None; and since, str ISO datetime
+      before which the rebuild counts InstallLog entities, or None.
+    """
+    value, _ = KeyValueCache.GetItem(cls._GENERATIONS_KEY)
+    if not value:
+      return {'active': 0, 'building': None, 'since': None}
+    return util.Deserialize(value)
+
+  @classmethod
+  def _SetGenerations(cls, generations):
+    KeyValueCache.SetItem(cls._GENERATIONS_KEY, util.Serialize(generations))
+
+  @classmethod
+  def GetDeltas(cls, installs):
+    """Returns counter increments for installs.
+
+    Args:
+      installs: list of InstallLog entities.
+    Returns:
+      dict of package name keys and dict values of applesus and COUNTERS.
+    """
+    deltas = {}
+    for install in installs:
+      delta = deltas.get(install.package)
+      if delta is None:
+        delta = dict.fromkeys(cls.COUNTERS, 0)
+        delta['applesus'] = install.applesus
+        deltas[install.package] = delta
+      if install.IsSuccess():
+        delta['install_count'] += 1
+        if getattr(install, 'duration_seconds', None) is not None:
+          delta['duration_count'] += 1
+          delta['duration_total_seconds'] += install.duration_seconds
+      else:
+        delta['install_fail_count'] += 1
+    return deltas
+
+  @classmethod
+  def _AddDelta(cls, shard, delta):
+    shard.applesus = delta['applesus']
+    for counter in cls.COUNTERS:
+      setattr(shard, counter, getattr(shard, counter) + delta[counter])
+
+  @classmethod
+  def _Increment(cls, key_name, package, generation, delta, increment_id):
+    """Adds delta to a shard unless already added; run in a transaction."""
+    shard = cls.get_by_key_name(key_name)
+    if shard is None:
+      shard = cls(key_name=key_name, package=package, generation=generation)
+    elif increment_id in shard.increment_ids:
+      return
+    cls._AddDelta(shard, delta)
+    shard.increment_ids = (
+        shard.increment_ids + [increment_id])[-cls.INCREMENT_IDS_KEPT:]
+    shard.put()
+
+  @classmethod
+  def ApplyIncrements(cls, increments):
+    """Applies shard increments, deferring increments that fail.
+
+    Args:
+      increments: list of (key_name, package, generation, delta, increment_id)
+          tuples; failed increments are retried with the same shard and id.
+    """
+    failed = []
+    for increment in increments:
+      try:
+        db.run_in_transaction(cls._Increment, *increment)
+      except (db.Error, apiproxy_errors.Error) as e:
+        logging.warning(
+            'InstallCountShard increment error %s: %s',
+            e.__class__.__name__, str(e))
+        failed.append(increment)
+    if failed:
+      deferred.defer(cls.ApplyIncrements, failed, _countdown=60)
+
+  @classmethod
+  def IncrementCounts(cls, deltas, generation=None):
+    """Increments package counters, deferring increments that fail.
+
+    Args:
+      deltas: dict, as returned by GetDeltas().
+      generation: int, optional, generation to increment; default active.
+    """
+    if generation is None:
+      generation = cls.GetGenerations()['active']
+    increments = []
+    for package, delta in deltas.iteritems():
+      shard = random.randrange(cls.NUM_SHARDS)
+      if generation:
+        key_name = '%d_%s_%d' % (generation, package, shard)
+      else:
+        key_name = '%s_%d' % (package, shard)
+      increments.append(
+          (key_name, package, generation, delta, uuid.uuid4().hex))
+    cls.ApplyIncrements(increments)
+
+  @classmethod
+  def IncrementInstalls(cls, installs):
+    """Increments package counters for installs.
+
+    Args:
+      installs: list of InstallLog entities.
+    """
+    generations = cls.GetGenerations()
+    cls.IncrementCounts(cls.GetDeltas(installs), generations['active'])
+    if generations['building'] is not None:
+      # Installs logged before since are counted by the rebuild itself.
+      since = util.Datetime.fromisoformat(generations['since'])
+      installs = [i for i in installs if i.server_datetime >= since]
+      if installs:
+        cls.IncrementCounts(cls.GetDeltas(installs), generations['building'])
+
+  @classmethod
+  def GetInstallCounts(cls):
+    """Returns tuple (install counts dict, datetime) summed over all shards.
+
+    Sums are cached in memcache for _MEMCACHE_SECS.
+    """
+    cached = memcache.get(cls._MEMCACHE_KEY)
+    if cached is not None:
+      return cached
+
+    active = cls.GetGenerations()['active']
+    counts = {}
+    mtime = None
+    for shard in gae_util.QueryIterator(cls.all()):
+      if shard.generation != active:
+        continue
+      d = counts.get(shard.package)
+      if d is None:
+        d = dict.fromkeys(cls.COUNTERS, 0)
+        d['applesus'] = shard.applesus
+        counts[shard.package] = d
+      for counter in cls.COUNTERS:
+        d[counter] += getattr(shard, counter) or 0
+      if mtime is None or shard.mtime > mtime:
+        mtime = shard.mtime
+    for d in counts.itervalues():
+      d['duration_seconds_avg'] = None
+      if d['duration_count']:
+        d['duration_seconds_avg'] = int(
+            d['duration_total_seconds'] / d['duration_count'])
+
+    memcache.set(cls._MEMCACHE_KEY, (counts, mtime), cls._MEMCACHE_SECS)
+    return counts, mtime
+
+  @classmethod
+  def StartRebuild(cls):
+    """Starts recounting all InstallLog entities into a new generation.
+
+    Counts are read from the active generation until the rebuild completes.
+
+    Returns:
+      int generation being rebuilt; pass it to Backfill(), no sooner than
+      BACKFILL_SINCE_SLACK_SECS from now, to count it.
+    """
+    generations = cls.GetGenerations()
+    generation = max(generations['active'], generations['building'] or 0) + 1
+    since = datetime.datetime.utcnow() + datetime.timedelta(
+        seconds=cls.BACKFILL_SINCE_SLACK_SECS)
+    InstallCountBackfill(key_name='gen_%d' % generation, since=since).put()
+    generations['building'] = generation
+    generations['since'] = since.isoformat()
+    cls._SetGenerations(generations)
+    return generation
+
+  @classmethod
+  def Backfill(cls, generation):
+    """Counts the next batch of InstallLog entities of a rebuild.
+
+    Each batch is counted, its cursor recorded and the next batch queued in
+    one transaction, so a retried task counts nothing twice.  Once all are
+    counted, the generation is made active.
+
+    Args:
+      generation: int, generation returned by StartRebuild().
+    """
+    backfill = InstallCountBackfill.get_by_key_name('gen_%d' % generation)
+    if not backfill or backfill.done:
+      return
+    query = InstallLog.all().filter(
+        'server_datetime <', backfill.since).order('server_datetime')
+    if backfill.cursor:
+      query.with_cursor(backfill.cursor)
+    installs = query.fetch(cls.BACKFILL_BATCH_SIZE)
+    if not installs:
+      cls._ActivateGeneration(generation)
+      return
+    db.run_in_transaction(
+        cls._CountBackfillBatch, backfill.key(), generation, backfill.cursor,
+        query.cursor(), cls.GetDeltas(installs))
+
+  @classmethod
+  def _CountBackfillBatch(cls, backfill_key, generation, cursor, next_cursor,
+                          deltas):
+    """Counts a batch of a rebuild unless already counted; run in a txn."""
+    backfill = db.get(backfill_key)
+    if backfill.done or backfill.cursor != cursor:
+      return  # counted by an earlier attempt, which queued the next batch.
+    packages = deltas.keys()
+    shards = db.get([
+        db.Key.from_path(cls.kind(), package, parent=backfill_key)
+        for package in packages])
+    to_put = [backfill]
+    for package, shard in zip(packages, shards):
+      if shard is None:
+        shard = cls(key_name=package, parent=backfill_key, package=package,
+                    generation=generation)
+      cls._AddDelta(shard, deltas[package])
+      to_put.append(shard)
+    backfill.cursor = next_cursor
+    db.put(to_put)
+    deferred.defer(cls.Backfill, generation, _transactional=True)
+
+  @classmethod
+  def _ActivateGeneration(cls, generation):
+    """Makes a fully counted generation active and deletes the previous one."""
+    generations = cls.GetGenerations()
+    backfill = InstallCountBackfill.get_by_key_name('gen_%d' % generation)
+    backfill.done = True
+    backfill.put()
+    if generations['building'] != generation:
+      # Superseded by a newer rebuild.
+      deferred.defer(cls.DeleteGeneration, generation)
+      return
+    previous = generations['active']
+    cls._SetGenerations({'active': generation, 'building': None, 'since': None})
+    memcache.delete(cls._MEMCACHE_KEY)
+    deferred.defer(cls.DeleteGeneration, previous)
+
+  @classmethod
+  def DeleteGeneration(cls, generation):
+    """Deletes all shards of a generation."""
+    keys = [
+        shard.key() for shard in gae_util.QueryIterator(cls.all())
+        if shard.generation == generation]
+    gae_util.BatchDatastoreOp(db.delete, keys, batch_size=500)
+
+
 # Munki ########################################################################
 
 
@@ -835,6 +1301,8 @@ class AuthSession(db.Model):
 
   data = db.StringProperty()
   mtime = db.DateTimeProperty()
+  # time after which the session is expired and may be purged.
+  expires_at = db.DateTimeProperty()
   state = db.StringProperty()
   uuid = db.StringProperty()
   level = db.IntegerProperty(default=0)
@@ -853,6 +1321,24 @@ class AppleSUSCatalog(BaseCompressedMunkiModel):
   """Apple Software Update Service Catalog."""
 
   last_modified_header = db.StringProperty()
+  # gzip encoded plist and strong ETag of plist, set on put().
+  plist_gzip = db.BlobProperty()
+  plist_etag = db.StringProperty()
+
+  def put(self, *args, **kwargs):
+    """Put to Datastore, generating the gzip variant and ETag of the plist.
+
+    Args:
+      args: list, optional, args to superclass put()
+      kwargs: dict, optional, keyword args to superclass put()
+    Returns:
+      return value from superclass put()
+    """
+    # self._plist holds the plist as stored, zlib compressed if large enough.
+    gzip_plist, self.plist_etag = GetGzipVariant(
+        self.plist or '', stored_size=len(self._plist or ''))
+    self.plist_gzip = gzip_plist and db.Blob(gzip_plist)
+    return super(AppleSUSCatalog, self).put(*args, **kwargs)
 
 
 class AppleSUSProduct(BaseModel):
@@ -940,13 +1426,17 @@ class Tag(BaseModel):
   def put(self, *args, **kwargs):
     """Ensure tags memcache entries are purged when a new one is created."""
     memcache.delete(self.ALL_TAGS_MEMCACHE_KEY)
-    return super(Tag, self).put(*args, **kwargs)
+    ret = super(Tag, self).put(*args, **kwargs)
+    ManifestModificationIndex.Invalidate()
+    return ret
 
   def delete(self, *args, **kwargs):
     """Ensure tags memcache entries are purged when one is delete."""
     # TODO(user): extend BaseModel so such memcache cleanup is reusable.
     memcache.delete(self.ALL_TAGS_MEMCACHE_KEY)
-    return super(Tag, self).delete(*args, **kwargs)
+    ret = super(Tag, self).delete(*args, **kwargs)
+    ManifestModificationIndex.Invalidate()
+    return ret
 
   @classmethod
   def GetAllTagNames(cls):
@@ -981,12 +1471,16 @@ class Group(BaseModel):
   def put(self, *args, **kwargs):
     """Ensure groups memcache entries are purged when a new one is created."""
     memcache.delete(self.ALL_GROUPS_MEMCACHE_KEY)
-    return super(Group, self).put(*args, **kwargs)
+    ret = super(Group, self).put(*args, **kwargs)
+    ManifestModificationIndex.Invalidate()
+    return ret
 
   def delete(self, *args, **kwargs):
     """Ensure groups memcache entries are purged when one is delete."""
     memcache.delete(self.ALL_GROUPS_MEMCACHE_KEY)
-    return super(Group, self).delete(*args, **kwargs)
+    ret = super(Group, self).delete(*args, **kwargs)
+    ManifestModificationIndex.Invalidate()
+    return ret
 
   @classmethod
   def GetAllGroupNames(cls):
@@ -1017,6 +1511,18 @@ class BaseManifestModification(BaseModel):
   mtime = db.DateTimeProperty(auto_now_add=True)
   user = db.UserProperty()
 
+  def put(self, *args, **kwargs):
+    """Ensure the manifest modification index is rebuilt after a put."""
+    ret = super(BaseManifestModification, self).put(*args, **kwargs)
+    ManifestModificationIndex.Invalidate()
+    return ret
+
+  def delete(self, *args, **kwargs):
+    """Ensure the manifest modification index is rebuilt after a delete."""
+    ret = super(BaseManifestModification, self).delete(*args, **kwargs)
+    ManifestModificationIndex.Invalidate()
+    return ret
+
   def Serialize(self):
     """Returns a serialized string representation of the entity instance."""
     d = {}
@@ -1074,6 +1580,9 @@ class BaseManifestModification(BaseModel):
   def ResetModMemcache(cls, mod_type, target):
     """Clear the memcache associated with this modification type.
 
+    This also invalidates the ManifestModificationIndex, as batch db.put()
+    calls bypass BaseManifestModification.put().
+
     Args:
       mod_type: str, modification type like 'site', 'owner', etc.
       target: str, modification target value, like 'foouser', or 'foouuid'.
@@ -1085,6 +1594,7 @@ class BaseManifestModification(BaseModel):
       raise ValueError
 
     model.DeleteMemcacheWrappedGetAllFilter((('%s =' % mod_type, target),))
+    ManifestModificationIndex.Invalidate()
 
 
 class SiteManifestModification(BaseManifestModification):
@@ -1145,12 +1655,192 @@ MANIFEST_MOD_MODELS = {
 }
 
 
+class ManifestModificationIndex(object):
+  """Precompiled index of enabled manifest modifications for a single track.
+
+  GenerateDynamicManifest used to issue a memcache lookup per mod type, tag
+  and group on every manifest request.  Instead, all enabled modifications
+  applying to a track are bucketed by mod type and target once, along with
+  the tag and group memberships referenced by tag/group mods, so that every
+  mod applying to a client resolves with dict lookups.
+
+  Indexes are versioned by a generation counter held in memcache, which is
+  incremented by Invalidate() whenever a modification, Tag or Group changes.
+  Built indexes are stored in memcache and in an instance-local cache.
+  """
+
+  # Memcache key of the index generation counter.
+  GENERATION_MEMCACHE_KEY = 'manifest_mod_index_generation'
+  # Memcache key of a built index, formatted with track and generation.
+  INDEX_MEMCACHE_KEY = 'manifest_mod_index_%s_%s'
+  # Order in which manifest modification types are applied to a manifest.
+  MOD_TYPES = ('site', 'os_version', 'owner', 'uuid', 'tag', 'group')
+
+  # Instance-local cache of track: ManifestModificationIndex.
+  _local_cache = {}
+
+  def __init__(self, track, generation, data):
+    """Initializer.
+
+    Args:
+      track: str, track (manifest name) the index was built for.
+      generation: int, index generation the index was built for.
+      data: dict, index data as returned by _BuildData().
+    """
+    self.track = track
+    self.generation = generation
+    self.mods = data['mods']
+    self.computer_tags = data['computer_tags']
+    self.user_groups = data['user_groups']
+    self.ctime = datetime.datetime.utcnow()
+
+  @classmethod
+  def GetGeneration(cls):
+    """Returns the current int index generation, initializing it if unset."""
+    return _GetMemcacheGeneration(cls.GENERATION_MEMCACHE_KEY)
+
+  @classmethod
+  def Invalidate(cls):
+    """Increments the index generation, forcing all indexes to be rebuilt."""
+    _IncrementMemcacheGeneration(cls.GENERATION_MEMCACHE_KEY)
+
+  @classmethod
+  def _BuildData(cls, tracks):
+    """Builds index data for the given tracks from Datastore.
+
+    Args:
+      tracks: list of str tracks to build index data for.
+    Returns:
+      dict of track: dict index data, with keys:
+        mods: dict of mod type: dict of target: list of
+            (str value, list install_types) tuples.
+        computer_tags: dict of uuid: list of tag names with mods.
+        user_groups: dict of owner: list of group names with mods.
+    """
+    out = {}
+    for track in tracks:
+      out[track] = {
+          'mods': dict((mod_type, {}) for mod_type in cls.MOD_TYPES),
+          'computer_tags': {},
+          'user_groups': {},
+      }
+
+    for mod_type in cls.MOD_TYPES:
+      model = MANIFEST_MOD_MODELS[mod_type]
+      query = model.all().filter('enabled =', True)
+      for mod in gae_util.QueryIterator(query):
+        mod_tuple = (mod.value, list(mod.install_types))
+        for track in tracks:
+          # if mod.manifests is empty or None, mod is made to any manifest.
+          if mod.manifests and track not in mod.manifests:
+            continue
+          out[track]['mods'][mod_type].setdefault(
+              mod.target, []).append(mod_tuple)
+
+    # Resolve memberships of the tags and groups that are targeted by mods,
+    # in key name order to match the order Datastore returns them in.
+    tag_names = set()
+    group_names = set()
+    for track in tracks:
+      tag_names.update(out[track]['mods']['tag'])
+      group_names.update(out[track]['mods']['group'])
+
+    tag_names = sorted(tag_names)
+    for tag_name, tag in zip(tag_names, Tag.get_by_key_name(tag_names)):
+      if not tag:
+        continue
+      for key in tag.keys:
+        for track in tracks:
+          if tag_name in out[track]['mods']['tag']:
+            out[track]['computer_tags'].setdefault(
+                key.name(), []).append(tag_name)
+
+    group_names = sorted(group_names)
+    for group_name, group in zip(
+        group_names, Group.get_by_key_name(group_names)):
+      if not group:
+        continue
+      for user in group.users:
+        for track in tracks:
+          if group_name in out[track]['mods']['group']:
+            out[track]['user_groups'].setdefault(user, []).append(group_name)
+
+    return out
+
+  @classmethod
+  def Get(cls, track, tracks=()):
+    """Returns the current ManifestModificationIndex for a track.
+
+    Args:
+      track: str, track (manifest name) to return the index for.
+      tracks: list, optional, other tracks to build indexes for at the same
+          time if the index for track must be rebuilt.
+    Returns:
+      ManifestModificationIndex instance.
+    """
+    generation = cls.GetGeneration()
+    max_age = datetime.timedelta(seconds=MEMCACHE_SECS)
+
+    index = cls._local_cache.get(track)
+    if (index and index.generation == generation and
+        datetime.datetime.utcnow() - index.ctime < max_age):
+      return index
+
+    data = memcache.get(cls.INDEX_MEMCACHE_KEY % (track, generation))
+    if data is not None:
+      index = cls(track, generation, data)
+      cls._local_cache[track] = index
+      return index
+
+    tracks = set(tracks)
+    tracks.add(track)
+    built = cls._BuildData(sorted(tracks))
+    to_cache = {}
+    for t, data in built.iteritems():
+      to_cache[cls.INDEX_MEMCACHE_KEY % (t, generation)] = data
+      cls._local_cache[t] = cls(t, generation, data)
+    try:
+      failed = memcache.set_multi(to_cache, time=MEMCACHE_SECS)
+      if failed:
+        logging.warning(
+            'ManifestModificationIndex: failure to memcache.set %s', failed)
+    except ValueError, e:
+      logging.warning(
+          'ManifestModificationIndex: failure to memcache.set: %s', str(e))
+
+    return cls._local_cache[track]
+
+  def GetModifications(self, client_id):
+    """Returns all modifications applying to a client, in application order.
+
+    Args:
+      client_id: dict client_id parsed by common.ParseClientId.
+    Returns:
+      list of (str value, list install_types) tuples.
+    """
+    mods = []
+    for mod_type in ('site', 'os_version', 'owner', 'uuid'):
+      mods.extend(self.mods[mod_type].get(client_id[mod_type], []))
+
+    if client_id['uuid']:  # not set if viewing a base manifest.
+      for tag in self.computer_tags.get(client_id['uuid'], []):
+        mods.extend(self.mods['tag'].get(tag, []))
+
+    if client_id['owner']:
+      for group in self.user_groups.get(client_id['owner'], []):
+        mods.extend(self.mods['group'].get(group, []))
+
+    return mods
+
+
 class PackageAlias(BaseModel):
   """Maps an alias to a Munki package name.
 
   Note: PackageAlias key_name should be the alias name.
   """
 
+  MEMCACHE_WRAP_LOCAL_CACHE = True
+
   munki_pkg_name = db.StringProperty()
   enabled = db.BooleanProperty(default=True)
 
@@ -17,11 +17,16 @@
 """App Engine Models related to Munki."""
 
 import datetime
+import hashlib
+import json
 import logging
 import os
 import re
+import time
 import urllib
 
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.api import users
 from google.appengine.ext import blobstore
 from google.appengine.ext import db
@@ -29,15 +34,54 @@ from google.appengine.ext import deferred
 
 from simian.mac.common import datastore_locks
 from simian.mac import common
+from simian.mac.common import compress
 from simian.mac.common import gae_util
 from simian.mac.common import mail as mail_tool
 from simian.mac.models import base
-from simian.mac.models import constants
 from simian.mac.models import settings
 from simian.mac.munki import plist as plist_lib
 
 
 PACKAGE_LOCK_PREFIX = 'pkgsinfo_'
+# Serialized catalog XML of a single pkginfo plist, by plist digest.
+CATALOG_FRAGMENT_MEMCACHE_KEY = 'catalog_fragment_%s'
+CATALOG_FRAGMENT_MEMCACHE_SECS = 7 * 24 * 60 * 60
+# Bump when PLIST_SUMMARY_PROPERTIES changes, so existing entities are
+# backfilled again; see PackageInfo.UpdatePlistSummary().
+PLIST_SUMMARY_VERSION = 1
+# KeyValueCache key holding the last PLIST_SUMMARY_VERSION backfilled, by kind.
+PLIST_SUMMARY_BACKFILL_KEY = '%s_plist_summary_version'
+
+# Key name of the PackageInfoExport entity, and name of its update lock.
+PACKAGE_INFO_EXPORT_KEY = 'packages'
+PACKAGE_INFO_EXPORT_LOCK = 'package_info_export_lock'
+# Pull queue of key names of PackageInfo entities to re-export.
+PACKAGE_INFO_EXPORT_QUEUE = 'package-info-export'
+# Seconds PackageInfo changes are batched for before the export is updated.
+PACKAGE_INFO_EXPORT_DELAY_SECS = 10
+# Seconds queued changes are leased for, and max changes, per update.
+PACKAGE_INFO_EXPORT_LEASE_SECS = 60
+PACKAGE_INFO_EXPORT_MAX_TASKS = 1000
+# Days deleted packages are reported to delta requests for.
+PACKAGE_INFO_EXPORT_DELETED_DAYS = 30
+# Seconds before since that delta requests also include changes from, as a
+# package put just before an update may only be exported by the next one.
+PACKAGE_INFO_EXPORT_SINCE_SLACK_SECS = 300
+# Bytes of the gzip encoded export stored per entity; the rest is stored in
+# PackageInfoExportChunk entities.
+PACKAGE_INFO_EXPORT_CHUNK_BYTES = 900 * 1024
+# Seconds the chunks of a replaced export are kept for requests reading it.
+PACKAGE_INFO_EXPORT_CHUNK_EXPIRY_SECS = 600
+# tuple of (pkginfo plist key, default) pairs exported for each package.
+PACKAGE_INFO_EXPORT_PLIST_KEYS_AND_DEFAULTS = (
+    ('display_name', None),
+    ('autoremove', False),
+    ('forced_install', False),
+    ('unattended_install', False),
+    ('unattended_uninstall', False),
+    ('uninstallable', True),
+    ('version', None)
+)
 
 
 class MunkiError(base.Error):
@@ -68,6 +112,10 @@ class PackageInfoNotFoundError(PackageInfoUpdateError):
   """Requested PackageInfo not found."""
 
 
+class PackageInfoExportError(MunkiError):
+  """A PackageInfoExport chunk is missing."""
+
+
 class PackageInfoNotSafeError(PackageInfoUpdateError):
   """It's not safe to edit this PackageInfo."""
 
@@ -95,23 +143,79 @@ class Catalog(BaseMunkiModel):
   """
 
   package_names = db.StringListProperty()
+  # gzip encoded plist XML and strong ETag of plist XML, set on put().
+  plist_gzip = db.BlobProperty()
+  plist_etag = db.StringProperty()
 
   PLIST_LIB_CLASS = plist_lib.MunkiPlist
+  # Catalogs are multi-MB, so are not kept in the instance-local cache.
+  MEMCACHE_WRAP_LOCAL_CACHE = False
+
+  def _UpdatePlistVariants(self):
+    """Generates the gzip variant and ETag of the plist XML."""
+    gzip_plist, self.plist_etag = base.GetGzipVariant(
+        (self.plist_xml or u'').encode('utf-8'))
+    self.plist_gzip = gzip_plist and db.Blob(gzip_plist)
 
   @classmethod
-  def Generate(cls, name, delay=0):
+  def _GetCatalogFragments(cls, package_infos, full=False):
+    """Returns catalog XML fragments for PackageInfo entities.
+
+    A fragment only depends on the stored pkginfo plist, so fragments are
+    cached in memcache by plist digest and only new or changed pkginfo
+    plists are parsed and serialized.
+
+    Args:
+      package_infos: list of PackageInfo entities.
+      full: bool, default False, True to serialize every plist, ignoring
+          cached fragments.
+    Returns:
+      list of str XML fragments, in package_infos order.
+    Raises:
+      plist_lib.Error: a pkginfo plist could not be serialized.
+    """
+    memcache_keys = []
+    for p in package_infos:
+      digest = hashlib.sha1((p.plist_xml or u'').encode('utf-8')).hexdigest()
+      memcache_keys.append(CATALOG_FRAGMENT_MEMCACHE_KEY % digest)
+
+    cached = {}
+    if not full and memcache_keys:
+      cached = memcache.get_multi(memcache_keys)
+
+    fragments = []
+    new_fragments = {}
+    for p, memcache_key in zip(package_infos, memcache_keys):
+      fragment = cached.get(memcache_key)
+      if fragment is None:
+        fragment = p.plist.GetXmlContent(indent_num=2)
+        new_fragments[memcache_key] = fragment
+      fragments.append(fragment)
+
+    if new_fragments:
+      memcache.set_multi(new_fragments, time=CATALOG_FRAGMENT_MEMCACHE_SECS)
+    logging.debug(
+        'Catalog fragments: %d cached, %d serialized.',
+        len(fragments) - len(new_fragments), len(new_fragments))
+    return fragments
+
+  @classmethod
+  def Generate(cls, name, delay=0, full=False):
     """Generates a Catalog plist and entity from matching PackageInfo entities.
 
     Args:
       name: str, catalog name. all PackageInfo entities with this name in the
           "catalogs" property will be included in the generated catalog.
       delay: int, if > 0, Generate call is deferred this many seconds.
+      full: bool, default False, True to serialize every pkginfo plist rather
+          than reusing cached fragments of unchanged ones.
     """
     if delay:
       now = datetime.datetime.utcnow()
       now_str = '%s-%d' % (now.strftime('%Y-%m-%d-%H-%M-%S'), now.microsecond)
       deferred_name = 'create-catalog-%s-%s' % (name, now_str)
-      deferred.defer(cls.Generate, name, _name=deferred_name, _countdown=delay)
+      deferred.defer(
+          cls.Generate, name, full=full, _name=deferred_name, _countdown=delay)
       return
 
     lock_name = 'catalog_lock_%s' % name
@@ -121,7 +225,7 @@ class Catalog(BaseMunkiModel):
     except datastore_locks.AcquireLockError:
       # If catalog creation for this name is already in progress then delay.
       logging.debug('Catalog creation for %s is locked. Delaying....', name)
-      cls.Generate(name, delay=10)
+      cls.Generate(name, delay=10, full=full)
       return
 
     package_names = []
@@ -132,21 +236,25 @@ class Catalog(BaseMunkiModel):
       # new catalog has updated average install durations,
       # download daily.
       mtimes = [midnight]
-      pkgsinfo_dicts = []
       package_infos = PackageInfo.all().filter('catalogs =', name).fetch(None)
       if not package_infos:
         logging.warning('No PackageInfo entities with catalog: %s', name)
       for p in package_infos:
         package_names.append(p.name)
-        pkgsinfo_dicts.append(p.plist.GetXmlContent(indent_num=1))
         mtimes.append(p.mtime)
+      pkgsinfo_dicts = cls._GetCatalogFragments(package_infos, full=full)
 
-      catalog = constants.CATALOG_PLIST_XML % '\n'.join(pkgsinfo_dicts)
+      # Splice the fragments into the catalog exactly as plist_lib would
+      # serialize it, so the catalog need not be parsed and serialized again.
+      catalog = ''.join(
+          [plist_lib.PLIST_HEAD, '  <array>'] +
+          ['\n' + fragment for fragment in pkgsinfo_dicts] +
+          ['\n  </array>', plist_lib.PLIST_FOOT])
 
       c = cls.get_or_insert(name)
       c.package_names = package_names
       c.name = name
-      c.plist = catalog
+      c.SetPlistXml(catalog)
 
       c.mtime = max(mtimes)
       c.put(avoid_mtime_update=True)
@@ -169,6 +277,7 @@ class Manifest(BaseMunkiModel):
   """
 
   PLIST_LIB_CLASS = plist_lib.MunkiManifestPlist
+  MEMCACHE_WRAP_LOCAL_CACHE = True
 
   enabled = db.BooleanProperty(default=True)
 
@@ -267,6 +376,44 @@ class PackageInfo(BaseMunkiModel):
   # this package into manifests.
   manifest_mod_access = db.StringListProperty()
 
+  # Denormalized copies of frequently read pkginfo plist keys, so readers can
+  # use them, or projection queries, without parsing the plist.
+  # These properties are automatically updated on put(); values of the wrong
+  # type, or too long to index, are stored as None.
+  display_name = db.StringProperty()
+  version = db.StringProperty()
+  minimum_os_version = db.StringProperty()
+  maximum_os_version = db.StringProperty()
+  installer_item_size = db.IntegerProperty()
+  unattended_install = db.BooleanProperty()
+  unattended_uninstall = db.BooleanProperty()
+  uninstallable = db.BooleanProperty()
+  autoremove = db.BooleanProperty()
+  forced_install = db.BooleanProperty()
+  force_install_after_date = db.DateTimeProperty()
+  restart_action = db.StringProperty()
+  # PLIST_SUMMARY_VERSION the above properties were last updated with.
+  plist_summary_version = db.IntegerProperty()
+
+  # True to queue changes for PackageInfoExport on put() and delete().
+  EXPORTED = True
+
+  # tuple of (pkginfo plist key, property name) pairs summarized on put().
+  PLIST_SUMMARY_PROPERTIES = (
+      ('display_name', 'display_name'),
+      ('version', 'version'),
+      ('minimum_os_version', 'minimum_os_version'),
+      ('maximum_os_version', 'maximum_os_version'),
+      ('installer_item_size', 'installer_item_size'),
+      ('unattended_install', 'unattended_install'),
+      ('unattended_uninstall', 'unattended_uninstall'),
+      ('uninstallable', 'uninstallable'),
+      ('autoremove', 'autoremove'),
+      ('forced_install', 'forced_install'),
+      ('force_install_after_date', 'force_install_after_date'),
+      ('RestartAction', 'restart_action'),
+  )
+
   def _GetDescription(self):
     """Returns only admin portion of the desc, omitting avg duration text."""
     desc = self.plist.get('description', None)
@@ -335,6 +482,81 @@ class PackageInfo(BaseMunkiModel):
   def manifest_matrix(self):
     return common.util.MakeTrackMatrix(self.manifests, self.proposal.manifests)
 
+  @classmethod
+  def IsPlistSummaryBackfilled(cls):
+    """Returns True if all entities have current plist summary properties.
+
+    Until then, projection queries on the summary properties omit entities
+    which have not been backfilled.
+    """
+    version, _ = base.KeyValueCache.GetItem(
+        PLIST_SUMMARY_BACKFILL_KEY % cls.kind())
+    return version == str(PLIST_SUMMARY_VERSION)
+
+  @classmethod
+  def SetPlistSummaryBackfilled(cls):
+    """Records that all entities have current plist summary properties."""
+    base.KeyValueCache.SetItem(
+        PLIST_SUMMARY_BACKFILL_KEY % cls.kind(), str(PLIST_SUMMARY_VERSION))
+
+  def UpdatePlistSummary(self):
+    """Updates the plist summary properties from the plist.
+
+    Returns:
+      True if any summary property changed, False otherwise.
+    """
+    plist = self.plist_lazy
+    properties = self.properties()
+    values = {'plist_summary_version': PLIST_SUMMARY_VERSION}
+    for key, name in self.PLIST_SUMMARY_PROPERTIES:
+      value = None
+      if plist:
+        try:
+          value = plist.get(key)
+        except plist_lib.PlistNotParsedError:
+          pass
+      try:
+        values[name] = properties[name].validate(value)
+      except db.BadValueError:
+        values[name] = None
+
+    changed = False
+    for name, value in values.iteritems():
+      if getattr(self, name) != value:
+        setattr(self, name, value)
+        changed = True
+    return changed
+
+  def GetPlistSummary(self):
+    """Returns the summarized pkginfo plist keys and values.
+
+    The summary properties are used if current, otherwise the plist is read.
+
+    Returns:
+      dict of pkginfo plist key to value, or None if the key is not set.
+    """
+    if self.plist_summary_version != PLIST_SUMMARY_VERSION:
+      self.UpdatePlistSummary()
+    return dict(
+        (key, getattr(self, name))
+        for key, name in self.PLIST_SUMMARY_PROPERTIES)
+
+  def GetExportDict(self):
+    """Returns a dict of the package, as exported by PackageInfoExport."""
+    d = {
+        'name': self.name,
+        'catalogs': self.catalogs,
+        'created': self.created.isoformat(),
+        'install_types': self.install_types,
+        'manifests': self.manifests,
+        'munki_name': self.munki_name,
+        'mtime': self.mtime.isoformat(),
+    }
+    summary = self.GetPlistSummary()
+    for key, default in PACKAGE_INFO_EXPORT_PLIST_KEYS_AND_DEFAULTS:
+      d[key] = default if summary[key] is None else summary[key]
+    return d
+
   def IsSafeToModify(self):
     """Returns True if the pkginfo is modifiable, False otherwise."""
     if self.approval_required:
@@ -354,7 +576,7 @@ class PackageInfo(BaseMunkiModel):
       self.Update(catalogs=[], manifests=[])
 
   def put(self, *args, **kwargs):
-    """Put to Datastore, generating and setting the "munki_name" property.
+    """Put to Datastore, updating "munki_name" and the plist summary.
 
     Args:
       *args: list, optional, args to superclass put()
@@ -376,7 +598,11 @@ class PackageInfo(BaseMunkiModel):
       self.munki_name = self.plist.GetMunkiName()
     except plist_lib.PlistNotParsedError:
       self.munki_name = None
-    return super(PackageInfo, self).put(*args, **kwargs)
+    self.UpdatePlistSummary()
+    ret = super(PackageInfo, self).put(*args, **kwargs)
+    if self.EXPORTED:
+      PackageInfoExport.QueueUpdate(self.key().name())
+    return ret
 
   def delete(self, *args, **kwargs):
     """Deletes a PackageInfo and cleans up associated data in other models.
@@ -390,7 +616,10 @@ class PackageInfo(BaseMunkiModel):
     Returns:
       return value from superlass delete()
     """
+    key_name = self.key().name()
     ret = super(PackageInfo, self).delete(*args, **kwargs)
+    if self.EXPORTED:
+      PackageInfoExport.QueueUpdate(key_name)
     for catalog in self.catalogs:
       Catalog.Generate(catalog, delay=1)
     if self.blobstore_key:
@@ -691,6 +920,8 @@ class PackageInfoProposal(PackageInfo):
   # status of proposal. One of 'proposed', 'approved', 'rejected'.
   status = db.StringProperty()
 
+  EXPORTED = False
+
   # properties that will get copied between PackageInfo and PackageInfoProposal
   # objects
   COMMON_PROPERTIES = ['catalogs', 'manifests', 'install_types', 'plist',
@@ -908,6 +1139,278 @@ class PackageInfoProposal(PackageInfo):
     return body
 
 
+class PackageInfoExportChunk(base.BaseModel):
+  """A chunk of a gzip encoded PackageInfoExport too large for one entity.
+
+  key_name is "<export mtime>_<chunk number>", numbered from 1; chunk 0 is the
+  export's own export_gzip.
+  """
+
+  data = db.BlobProperty()
+
+  @classmethod
+  def GetKeyNames(cls, mtime, chunk_count):
+    """Returns the key names of the chunks of an export."""
+    return ['%s_%d' % (mtime.isoformat(), i) for i in xrange(1, chunk_count)]
+
+  @classmethod
+  def DeleteChunks(cls, mtime, chunk_count):
+    """Deletes the chunks of a replaced export."""
+    db.delete([
+        db.Key.from_path(cls.kind(), key_name)
+        for key_name in cls.GetKeyNames(mtime, chunk_count)])
+
+
+class PackageInfoExport(base.BaseModel):
+  """Precomputed JSON export of all PackageInfo entities, for /api/packages.
+
+  The export is a dict of filename to PackageInfo.GetExportDict(), stored
+  gzip encoded, in PackageInfoExportChunk entities too if it is large.
+  PackageInfo put() and delete() queue the changed package with QueueUpdate(),
+  and a deferred Update() then re-exports only the queued packages, so pkginfo
+  plists are not read on every request.
+  """
+
+  MEMCACHE_WRAP_LOCAL_CACHE = True
+
+  # first chunk of the gzip encoded JSON export, and strong ETag of the JSON.
+  export_gzip = db.BlobProperty()
+  etag = db.StringProperty()
+  # number of chunks of the gzip encoded export, including export_gzip.
+  chunk_count = db.IntegerProperty(default=1)
+  # datetime the export was last updated.
+  mtime = db.DateTimeProperty()
+  # JSON dict of filename to str ISO datetime deleted, of packages deleted in
+  # the last PACKAGE_INFO_EXPORT_DELETED_DAYS.
+  deleted_json = db.TextProperty()
+
+  def GetGzip(self):
+    """Returns the gzip encoded JSON export.
+
+    Raises:
+      PackageInfoExportError: a chunk of the export is missing.
+    """
+    chunks = getattr(self, '_chunks', None)
+    if chunks is None:
+      chunks = [self.export_gzip or '']
+      if self.chunk_count > 1:
+        entities = PackageInfoExportChunk.get_by_key_name(
+            PackageInfoExportChunk.GetKeyNames(self.mtime, self.chunk_count))
+        if None in entities:
+          raise PackageInfoExportError(
+              'PackageInfoExport of %s is missing chunks.' % self.mtime)
+        chunks.extend(e.data for e in entities)
+    return ''.join(chunks)
+
+  def GetPackages(self):
+    """Returns the export, a dict of filename to package dict."""
+    if not self.etag:
+      return {}
+    return json.loads(compress.Gunzip(self.GetGzip()))
+
+  def GetDeleted(self):
+    """Returns a dict of filename to str ISO datetime of deleted packages."""
+    if not self.deleted_json:
+      return {}
+    return json.loads(self.deleted_json)
+
+  def GetChanges(self, since):
+    """Returns packages changed or deleted since a datetime.
+
+    Args:
+      since: datetime, return changes since this time; changes during the
+          PACKAGE_INFO_EXPORT_SINCE_SLACK_SECS before it are returned too.
+    Returns:
+      dict with keys:
+        packages: dict of filename to package dict, of changed packages.
+        deleted: list of filenames of deleted packages.
+        complete: bool, True if since predates the deleted packages known,
+            so packages holds all packages and should replace the client's.
+        mtime: str ISO datetime of the export, to pass as the next since.
+    """
+    now = datetime.datetime.utcnow()
+    complete = since < now - datetime.timedelta(
+        days=PACKAGE_INFO_EXPORT_DELETED_DAYS)
+    since -= datetime.timedelta(seconds=PACKAGE_INFO_EXPORT_SINCE_SLACK_SECS)
+
+    packages = self.GetPackages()
+    deleted = []
+    if not complete:
+      packages = dict(
+          (filename, d) for filename, d in packages.iteritems()
+          if common.util.Datetime.fromisoformat(d['mtime']) > since)
+      deleted = sorted(
+          filename for filename, dt in self.GetDeleted().iteritems()
+          if common.util.Datetime.fromisoformat(dt) > since)
+    return {
+        'packages': packages,
+        'deleted': deleted,
+        'complete': complete,
+        'mtime': self.mtime.isoformat(),
+    }
+
+  def _SetPackages(self, packages, deleted, now):
+    """Sets the export, split into chunks if it is too large for one entity.
+
+    Args:
+      packages: dict of filename to package dict.
+      deleted: dict of filename to str ISO datetime of deleted packages.
+      now: datetime of the update.
+    """
+    expired = (now - datetime.timedelta(
+        days=PACKAGE_INFO_EXPORT_DELETED_DAYS)).isoformat()
+    self.deleted_json = db.Text(json.dumps(dict(
+        (filename, dt) for filename, dt in deleted.iteritems()
+        if dt > expired)))
+    content = json.dumps(packages)
+    self.etag = hashlib.sha256(content).hexdigest()
+    gzip_content = compress.Gzip(content)
+    first = max(0, PACKAGE_INFO_EXPORT_CHUNK_BYTES - len(self.deleted_json))
+    self._chunks = [gzip_content[:first]] + [
+        gzip_content[i:i + PACKAGE_INFO_EXPORT_CHUNK_BYTES] for i in xrange(
+            first, len(gzip_content), PACKAGE_INFO_EXPORT_CHUNK_BYTES)]
+    self.export_gzip = db.Blob(self._chunks[0])
+    self.chunk_count = len(self._chunks)
+    self.mtime = now
+
+  def _Store(self):
+    """Puts the export, after any chunks it was split into."""
+    if self.chunk_count > 1:
+      key_names = PackageInfoExportChunk.GetKeyNames(
+          self.mtime, self.chunk_count)
+      db.put([
+          PackageInfoExportChunk(key_name=key_name, data=db.Blob(chunk))
+          for key_name, chunk in zip(key_names, self._chunks[1:])])
+    self.put()
+
+  @classmethod
+  def Build(cls, export=None):
+    """Returns an export of all packages.
+
+    Args:
+      export: PackageInfoExport, optional, existing export to update; packages
+          it holds which no longer exist are recorded as deleted.
+    Returns:
+      PackageInfoExport, not yet stored.
+    """
+    if export is None:
+      export = cls(key_name=PACKAGE_INFO_EXPORT_KEY)
+    now = datetime.datetime.utcnow()
+    packages = {}
+    for p in gae_util.QueryIterator(PackageInfo.all()):
+      packages[p.filename] = p.GetExportDict()
+    deleted = export.GetDeleted()
+    for filename in set(export.GetPackages()) - set(packages):
+      deleted[filename] = now.isoformat()
+    for filename in packages:
+      deleted.pop(filename, None)
+    export._SetPackages(packages, deleted, now)
+    return export
+
+  @classmethod
+  def Get(cls):
+    """Returns the current export, building it if none exists yet.
+
+    Returns:
+      PackageInfoExport; it may not be stored, if it was just built while
+      another update is in progress.
+    """
+    export = cls.MemcacheWrappedGet(PACKAGE_INFO_EXPORT_KEY)
+    if export and export.etag:
+      return export
+    return cls.Update(rebuild=True)
+
+  @classmethod
+  def QueueUpdate(cls, key_name):
+    """Queues a changed package to be re-exported by a deferred Update().
+
+    Args:
+      key_name: str, key name of the PackageInfo that changed or was deleted.
+    """
+    try:
+      taskqueue.Queue(PACKAGE_INFO_EXPORT_QUEUE).add(
+          taskqueue.Task(payload=key_name, method='PULL'))
+    except taskqueue.Error as e:
+      logging.warning(
+          'Failed to queue PackageInfoExport update for %s: %s', key_name, e)
+      return
+
+    # Changes within each PACKAGE_INFO_EXPORT_DELAY_SECS share one update,
+    # which runs once the period ends.
+    now = time.time()
+    period = int(now) // PACKAGE_INFO_EXPORT_DELAY_SECS
+    try:
+      deferred.defer(
+          cls.Update, _name='package-info-export-%d' % period,
+          _countdown=(period + 1) * PACKAGE_INFO_EXPORT_DELAY_SECS - now + 1)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+      pass
+
+  @classmethod
+  def Update(cls, rebuild=False):
+    """Re-exports queued packages into the export.
+
+    Args:
+      rebuild: bool, default False, True to export all packages, as is done
+          anyway if no export is stored.
+    Returns:
+      PackageInfoExport, or None if another update is in progress and
+      rebuild is False.
+    """
+    lock = datastore_locks.DatastoreLock(PACKAGE_INFO_EXPORT_LOCK)
+    try:
+      lock.Acquire(timeout=600, max_acquire_attempts=2)
+    except datastore_locks.AcquireLockError:
+      if rebuild:
+        return cls.Build()
+      # Queued changes are left for the update in progress, or the next one.
+      logging.debug('PackageInfoExport update is locked. Delaying....')
+      deferred.defer(cls.Update, _countdown=PACKAGE_INFO_EXPORT_DELAY_SECS)
+      return
+
+    try:
+      queue = taskqueue.Queue(PACKAGE_INFO_EXPORT_QUEUE)
+      tasks = queue.lease_tasks(
+          PACKAGE_INFO_EXPORT_LEASE_SECS, PACKAGE_INFO_EXPORT_MAX_TASKS)
+      export = cls.get_by_key_name(PACKAGE_INFO_EXPORT_KEY)
+      replaced = None
+      if export and export.etag:
+        replaced = (export.mtime, export.chunk_count)
+
+      if rebuild or not replaced:
+        export = cls.Build(export)
+      elif tasks:
+        now = datetime.datetime.utcnow()
+        packages = export.GetPackages()
+        deleted = export.GetDeleted()
+        key_names = sorted(set(task.payload for task in tasks))
+        for key_name, p in zip(
+            key_names, PackageInfo.get_by_key_name(key_names)):
+          if p:
+            packages[p.filename] = p.GetExportDict()
+            deleted.pop(p.filename, None)
+          elif key_name in packages:
+            del packages[key_name]
+            deleted[key_name] = now.isoformat()
+        export._SetPackages(packages, deleted, now)
+      else:
+        return export
+
+      export._Store()
+      cls.DeleteMemcacheWrap(PACKAGE_INFO_EXPORT_KEY)
+      if replaced and replaced[1] > 1:
+        deferred.defer(
+            PackageInfoExportChunk.DeleteChunks, *replaced,
+            _countdown=PACKAGE_INFO_EXPORT_CHUNK_EXPIRY_SECS)
+      if tasks:
+        queue.delete_tasks(tasks)
+      if len(tasks) == PACKAGE_INFO_EXPORT_MAX_TASKS:
+        deferred.defer(cls.Update)
+      return export
+    finally:
+      lock.Release()
+
+
 def GetLockForPackage(filename):
   lock_name = PACKAGE_LOCK_PREFIX + filename
   lock = datastore_locks.DatastoreLock(lock_name)
@@ -62,6 +62,21 @@ SETTINGS = {
         'comment': 'If enabled, data is displayed in Summary and Host reports.',
         'default': False,
     },
+    'client_connection_write_behind': {
+        'type': 'bool',
+        'title': 'Batch Client Connection Logging',
+        'comment': ('Client connections are queued and logged in batches by '
+                    'cron, instead of on each preflight/postflight.'),
+        'default': False,
+    },
+    'report_write_behind': {
+        'type': 'bool',
+        'title': 'Batch Client Report Ingestion',
+        'comment': ('Install reports, MSU logs and broken client reports are '
+                    'queued and ingested in batches by cron, instead of on '
+                    'each request.'),
+        'default': False,
+    },
     'list_of_categories': {
         'type': 'string',
         'title': 'Categories',
@@ -128,6 +143,18 @@ SETTINGS = {
         'type': 'random_str',
         'title': 'XSRF secret',
     },
+    'auth_token_secret': {
+        'type': 'random_str',
+        'title': 'Auth Token Secret',
+    },
+    'stateless_auth_tokens': {
+        'type': 'bool',
+        'title': 'Stateless Auth Tokens',
+        'comment': ('Issue signed auth tokens which are verified without a '
+                    'session lookup. Regenerating the Auth Token Secret '
+                    'invalidates all of them.'),
+        'default': False,
+    },
     'server_private_key_pem': {
         'type': 'pem',
         'suffix': True,
@@ -18,15 +18,21 @@
 
 import base64
 import datetime
+import hashlib
+import json
 import logging
 
 from google.appengine import runtime
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
 from google.appengine.ext import deferred
 from google.appengine.runtime import apiproxy_errors
 
 from simian.mac import common
 from simian.mac import models
+from simian.mac.common import gae_util
+from simian.mac.common import lru
 from simian.mac.common import util
 from simian.mac.munki import plist as plist_module
 
@@ -52,6 +58,18 @@ FLASH_PLUGIN_NAME = 'flashplugin'
 FLASH_PLUGIN_DEBUG_NAME = 'flash_player_debug'
 # Apple Software Update pkgs_to_install text format.
 APPLESUS_PKGS_TO_INSTALL_FORMAT = 'AppleSUS: %s'
+# Rendered manifest XML, by fingerprint; see GetManifestFingerprint().
+RENDERED_MANIFEST_MEMCACHE_KEY = 'rendered_manifest_%s'
+RENDERED_MANIFEST_MEMCACHE_SECS = 300
+RENDERED_MANIFEST_LOCAL_CACHE_SIZE = 100
+# Pull queue of client connections logged by FlushClientConnections(), used
+# when the client_connection_write_behind setting is enabled.
+CLIENT_CONNECTION_QUEUE = 'client-connections'
+CLIENT_CONNECTION_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+CLIENT_CONNECTION_LEASE_SECS = 300
+CLIENT_CONNECTION_FLUSH_MAX_TASKS = 1000
+# Number of Computers fetched and put per datastore batch.
+CLIENT_CONNECTION_FLUSH_BATCH_SIZE = 100
 # Serial numbers for which first connection de-duplication should be skipped.
 DUPE_SERIAL_NUMBER_EXCEPTIONS = [
     'SystemSerialNumb', 'System Serial#', 'Not Available', None]
@@ -73,6 +91,13 @@ class ManifestDisabledError(Error):
   """Disable manifest was requested."""
 
 
+# Rendered manifest XML is immutable for a given fingerprint, so it is safe
+# to hold on each instance without any invalidation.
+_rendered_manifest_cache = lru.LruCache(
+    max_size=RENDERED_MANIFEST_LOCAL_CACHE_SIZE,
+    ttl=RENDERED_MANIFEST_MEMCACHE_SECS)
+
+
 def _SaveFirstConnection(client_id, computer_key):
   """Function to save first connection of a given client.
 
@@ -101,6 +126,115 @@ def _SaveFirstConnection(client_id, computer_key):
         dupe.put(update_active=False)
 
 
+def _UpdateComputerConnection(
+    c, event, client_id, pkgs_to_install, apple_updates_to_install,
+    ip_address, report_feedback, cert_fingerprint, now):
+  """Updates a Computer entity with a client connection, without putting it.
+
+  Args:
+    c: models.Computer entity to update.
+    event: str name of the event that prompted a client connection log.
+    client_id: dict client id.
+    pkgs_to_install: list of string packages remaining to install.
+    apple_updates_to_install: list of string Apple updates remaining to
+        install.
+    ip_address: str IP address of the connection.
+    report_feedback: dict ReportFeedback commands sent to the client.
+    cert_fingerprint: str Client certificate fingerprint.
+    now: datetime of the connection, in UTC.
+  """
+  c.uuid = client_id['uuid']
+  c.hostname = client_id['hostname']
+  c.serial = client_id['serial']
+  c.owner = client_id['owner']
+  c.track = client_id['track']
+  c.site = client_id['site']
+  c.config_track = client_id['config_track']
+  c.client_version = client_id['client_version']
+  c.os_version = client_id['os_version']
+  c.uptime = client_id['uptime']
+  c.root_disk_free = client_id['root_disk_free']
+  c.user_disk_free = client_id['user_disk_free']
+  c.runtype = client_id['runtype']
+  c.ip_address = ip_address
+  c.cert_fingerprint = cert_fingerprint
+
+  last_notified_datetime = client_id['last_notified_datetime']
+  if last_notified_datetime:  # might be None
+    try:
+      last_notified_datetime = datetime.datetime.strptime(
+          last_notified_datetime, '%Y-%m-%d %H:%M:%S')  # timestamp is UTC.
+      c.last_notified_datetime = last_notified_datetime
+    except ValueError:  # non-standard datetime sent.
+      logging.warning(
+          'Non-standard last_notified_datetime: %s', last_notified_datetime)
+
+  # Update event specific (preflight vs postflight) report values.
+  if event == 'preflight':
+    c.preflight_datetime = now
+    if client_id['on_corp'] == True:
+      c.last_on_corp_preflight_datetime = now
+
+    # Increment the number of preflight connections since the last successful
+    # postflight, but only if the current connection is not going to exit due
+    # to report feedback (WWAN, GoGo InFlight, etc.)
+    if not report_feedback or not report_feedback.get('exit'):
+      if c.preflight_count_since_postflight is not None:
+        c.preflight_count_since_postflight += 1
+      else:
+        c.preflight_count_since_postflight = 1
+
+  elif event == 'postflight':
+    c.preflight_count_since_postflight = 0
+    c.postflight_datetime = now
+
+    # Update pkgs_to_install.
+    if pkgs_to_install:
+      c.pkgs_to_install = pkgs_to_install
+      c.all_pkgs_installed = False
+    else:
+      c.pkgs_to_install = []
+      c.all_pkgs_installed = True
+    # Update all_apple_updates_installed and add Apple updates to
+    # pkgs_to_install. It's important that this code block comes after
+    # all_pkgs_installed is updated above, to ensure that all_pkgs_installed
+    # is only considers Munki updates, ignoring Apple updates added below.
+    # NOTE: if there are any pending Munki updates then we simply assume
+    # there are also pending Apple Updates, even though we cannot be sure
+    # due to the fact that Munki only checks for Apple Updates if all regular
+    # updates are installed
+    if not pkgs_to_install and not apple_updates_to_install:
+      c.all_apple_updates_installed = True
+    else:
+      c.all_apple_updates_installed = False
+      # For now, let's store Munki and Apple Update pending installs together,
+      # using APPLESUS_PKGS_TO_INSTALL_FORMAT to format the text as desired.
+      for update in apple_updates_to_install:
+        c.pkgs_to_install.append(APPLESUS_PKGS_TO_INSTALL_FORMAT % update)
+
+    # Keep the last CONNECTION_DATETIMES_LIMIT connection datetimes.
+    if len(c.connection_datetimes) == CONNECTION_DATETIMES_LIMIT:
+      c.connection_datetimes.pop(0)
+    c.connection_datetimes.append(now)
+
+    # Increase on_corp/off_corp count appropriately.
+    if client_id['on_corp'] == True:
+      c.connections_on_corp = (c.connections_on_corp or 0) + 1
+    elif client_id['on_corp'] == False:
+      c.connections_off_corp = (c.connections_off_corp or 0) + 1
+
+    # Keep the last CONNECTION_DATES_LIMIT connection dates
+    # (with time = 00:00:00)
+    # Use newly created datetime.time object to set time to 00:00:00
+    now_date = datetime.datetime.combine(now, datetime.time())
+    if now_date not in c.connection_dates:
+      if len(c.connection_dates) == CONNECTION_DATES_LIMIT:
+        c.connection_dates.pop(0)
+      c.connection_dates.append(now_date)
+  else:
+    logging.warning('Unknown event value: %s', event)
+
+
 def LogClientConnection(
     event, client_id, user_settings=None, pkgs_to_install=None,
     apple_updates_to_install=None, ip_address=None, report_feedback=None,
@@ -136,6 +270,17 @@ def LogClientConnection(
     logging.warning('LogClientConnection: uuid is unknown, skipping log')
     return
 
+  if IsClientConnectionWriteBehindEnabled():
+    try:
+      _QueueClientConnection(
+          event, client_id, pkgs_to_install, apple_updates_to_install,
+          ip_address, report_feedback, cert_fingerprint)
+      return
+    except (taskqueue.Error, apiproxy_errors.Error) as e:
+      logging.warning(
+          'LogClientConnection queue error %s: %s; writing directly',
+          e.__class__.__name__, str(e))
+
   def __UpdateComputerEntity(
       event, _client_id, _user_settings, _pkgs_to_install,
       _apple_updates_to_install, _ip_address, _report_feedback, c=None,
@@ -148,97 +293,9 @@ def LogClientConnection(
     if c is None:  # First time this client has connected.
       c = models.Computer(key_name=_client_id['uuid'])
       is_new_client = True
-    c.uuid = _client_id['uuid']
-    c.hostname = _client_id['hostname']
-    c.serial= _client_id['serial']
-    c.owner = _client_id['owner']
-    c.track = _client_id['track']
-    c.site = _client_id['site']
-    c.config_track = _client_id['config_track']
-    c.client_version = _client_id['client_version']
-    c.os_version = _client_id['os_version']
-    c.uptime = _client_id['uptime']
-    c.root_disk_free = _client_id['root_disk_free']
-    c.user_disk_free = _client_id['user_disk_free']
-    c.runtype = _client_id['runtype']
-    c.ip_address = _ip_address
-    c.cert_fingerprint = cert_fingerprint
-
-    last_notified_datetime = _client_id['last_notified_datetime']
-    if last_notified_datetime:  # might be None
-      try:
-        last_notified_datetime = datetime.datetime.strptime(
-            last_notified_datetime, '%Y-%m-%d %H:%M:%S')  # timestamp is UTC.
-        c.last_notified_datetime = last_notified_datetime
-      except ValueError:  # non-standard datetime sent.
-        logging.warning(
-            'Non-standard last_notified_datetime: %s', last_notified_datetime)
-
-    # Update event specific (preflight vs postflight) report values.
-    if event == 'preflight':
-      c.preflight_datetime = now
-      if _client_id['on_corp'] == True:
-        c.last_on_corp_preflight_datetime = now
-
-      # Increment the number of preflight connections since the last successful
-      # postflight, but only if the current connection is not going to exit due
-      # to report feedback (WWAN, GoGo InFlight, etc.)
-      if not _report_feedback or not _report_feedback.get('exit'):
-        if c.preflight_count_since_postflight is not None:
-          c.preflight_count_since_postflight += 1
-        else:
-          c.preflight_count_since_postflight = 1
-
-    elif event == 'postflight':
-      c.preflight_count_since_postflight = 0
-      c.postflight_datetime = now
-
-      # Update pkgs_to_install.
-      if _pkgs_to_install:
-        c.pkgs_to_install = _pkgs_to_install
-        c.all_pkgs_installed = False
-      else:
-        c.pkgs_to_install = []
-        c.all_pkgs_installed = True
-      # Update all_apple_updates_installed and add Apple updates to
-      # pkgs_to_install. It's important that this code block comes after
-      # all_pkgs_installed is updated above, to ensure that all_pkgs_installed
-      # is only considers Munki updates, ignoring Apple updates added below.
-      # NOTE: if there are any pending Munki updates then we simply assume
-      # there are also pending Apple Updates, even though we cannot be sure
-      # due to the fact that Munki only checks for Apple Updates if all regular
-      # updates are installed
-      if not pkgs_to_install and not _apple_updates_to_install:
-        c.all_apple_updates_installed = True
-      else:
-        c.all_apple_updates_installed = False
-        # For now, let's store Munki and Apple Update pending installs together,
-        # using APPLESUS_PKGS_TO_INSTALL_FORMAT to format the text as desired.
-        for update in _apple_updates_to_install:
-          c.pkgs_to_install.append(APPLESUS_PKGS_TO_INSTALL_FORMAT % update)
-
-      # Keep the last CONNECTION_DATETIMES_LIMIT connection datetimes.
-      if len(c.connection_datetimes) == CONNECTION_DATETIMES_LIMIT:
-        c.connection_datetimes.pop(0)
-      c.connection_datetimes.append(now)
-
-      # Increase on_corp/off_corp count appropriately.
-      if _client_id['on_corp'] == True:
-        c.connections_on_corp = (c.connections_on_corp or 0) + 1
-      elif _client_id['on_corp'] == False:
-        c.connections_off_corp = (c.connections_off_corp or 0) + 1
-
-      # Keep the last CONNECTION_DATES_LIMIT connection dates
-      # (with time = 00:00:00)
-      # Use newly created datetime.time object to set time to 00:00:00
-      now_date = datetime.datetime.combine(now, datetime.time())
-      if now_date not in c.connection_dates:
-        if len(c.connection_dates) == CONNECTION_DATES_LIMIT:
-          c.connection_dates.pop(0)
-        c.connection_dates.append(now_date)
-    else:
-      logging.warning('Unknown event value: %s', event)
-
+    _UpdateComputerConnection(
+        c, event, _client_id, _pkgs_to_install, _apple_updates_to_install,
+        _ip_address, _report_feedback, cert_fingerprint, now)
     c.put()
     if is_new_client:  # Queue welcome email to be sent.
       deferred.defer(
@@ -260,6 +317,158 @@ def LogClientConnection(
         delay=DATASTORE_NOWRITE_DELAY)
 
 
+def IsClientConnectionWriteBehindEnabled():
+  """Returns True if client connections are queued for write-behind."""
+  enabled, _ = models.Settings.GetItem('client_connection_write_behind')
+  return bool(enabled)
+
+
+def _QueueClientConnection(
+    event, client_id, pkgs_to_install, apple_updates_to_install, ip_address,
+    report_feedback, cert_fingerprint):
+  """Queues a client connection for FlushClientConnections() to log.
+
+  Args:
+    event: str name of the event that prompted a client connection log.
+    client_id: dict client id.
+    pkgs_to_install: list of string packages remaining to install.
+    apple_updates_to_install: list of string Apple updates remaining to
+        install.
+    ip_address: str IP address of the connection.
+    report_feedback: dict ReportFeedback commands sent to the client.
+    cert_fingerprint: str Client certificate fingerprint.
+  Raises:
+    taskqueue.Error: the connection could not be queued.
+  """
+  payload = {
+      'event': event,
+      'client_id': client_id,
+      'pkgs_to_install': pkgs_to_install,
+      'apple_updates_to_install': apple_updates_to_install,
+      'ip_address': ip_address,
+      # only the exit command affects the logged connection.
+      'report_feedback': {'exit': bool(
+          report_feedback and report_feedback.get('exit'))},
+      'cert_fingerprint': cert_fingerprint,
+      'now': datetime.datetime.utcnow().strftime(
+          CLIENT_CONNECTION_DATETIME_FORMAT),
+  }
+  taskqueue.Queue(CLIENT_CONNECTION_QUEUE).add(taskqueue.Task(
+      payload=json.dumps(payload), method='PULL', tag=client_id['uuid']))
+
+
+def _IsClientConnectionApplied(c, connection):
+  """Returns True if a queued connection is already logged on a Computer.
+
+  Connections are logged in order, so one no newer than the last logged
+  connection of its event was logged by an earlier flush whose tasks were not
+  deleted.
+
+  Args:
+    c: models.Computer entity.
+    connection: dict queued connection, with a datetime now.
+  """
+  if connection['event'] == 'preflight':
+    last = c.preflight_datetime
+  elif connection['event'] == 'postflight':
+    last = c.postflight_datetime
+  else:
+    return False
+  return last is not None and connection['now'] <= last
+
+
+def FlushClientConnections(max_tasks=CLIENT_CONNECTION_FLUSH_MAX_TASKS):
+  """Logs client connections queued by LogClientConnection().
+
+  Connections are grouped by uuid, so each Computer is fetched and put once
+  per flush no matter how many times it connected.  Computers are fetched and
+  put in batches of CLIENT_CONNECTION_FLUSH_BATCH_SIZE, and the tasks of a
+  batch deleted as soon as it is put; tasks of a failed batch are leased
+  again after CLIENT_CONNECTION_LEASE_SECS, and connections a Computer
+  already logged are skipped, so logging them again is idempotent.
+
+  Args:
+    max_tasks: int, maximum number of queued connections to log.
+  Returns:
+    dict of flush statistics: connections, computers, lag_seconds (age of
+    the oldest connection logged) and backlog (connections left queued).
+  """
+  queue = taskqueue.Queue(CLIENT_CONNECTION_QUEUE)
+  tasks = queue.lease_tasks(CLIENT_CONNECTION_LEASE_SECS, max_tasks)
+
+  connections = {}
+  tasks_by_uuid = {}
+  oldest = None
+  for task in tasks:
+    connection = json.loads(task.payload)
+    connection['now'] = datetime.datetime.strptime(
+        connection['now'], CLIENT_CONNECTION_DATETIME_FORMAT)
+    uuid = connection['client_id']['uuid']
+    connections.setdefault(uuid, []).append(connection)
+    tasks_by_uuid.setdefault(uuid, []).append(task)
+    if oldest is None or connection['now'] < oldest:
+      oldest = connection['now']
+
+  updated = []
+
+  def __UpdateComputers(uuids):
+    """Logs the queued connections of a batch of Computers."""
+    try:
+      to_put = []
+      new_clients = []
+      for uuid, c in zip(uuids, models.Computer.get_by_key_name(uuids)):
+        is_new_client = c is None
+        if is_new_client:  # First time this client has connected.
+          c = models.Computer(key_name=uuid)
+          new_clients.append((uuid, c))
+        changed = False
+        for connection in sorted(connections[uuid], key=lambda x: x['now']):
+          if is_new_client or not _IsClientConnectionApplied(c, connection):
+            _UpdateComputerConnection(
+                c, connection['event'], connection['client_id'],
+                connection['pkgs_to_install'],
+                connection['apple_updates_to_install'],
+                connection['ip_address'], connection['report_feedback'],
+                connection['cert_fingerprint'], connection['now'])
+            changed = True
+        if changed:
+          c.UpdateActive()  # as Computer.put() does, which db.put() skips.
+          to_put.append(c)
+      db.put(to_put)
+      for uuid, c in new_clients:  # Queue welcome email to be sent.
+        deferred.defer(
+            _SaveFirstConnection, client_id=connections[uuid][0]['client_id'],
+            computer_key=c.key(), _countdown=300, _queue='first')
+      queue.delete_tasks([t for uuid in uuids for t in tasks_by_uuid[uuid]])
+      updated.extend(uuids)
+    except (db.Error, apiproxy_errors.Error, taskqueue.Error) as e:
+      logging.warning(
+          'FlushClientConnections put() error %s: %s',
+          e.__class__.__name__, str(e))
+
+  try:
+    gae_util.BatchDatastoreOp(
+        __UpdateComputers, connections.keys(),
+        batch_size=CLIENT_CONNECTION_FLUSH_BATCH_SIZE)
+  except runtime.DeadlineExceededError:
+    logging.warning('FlushClientConnections deadline exceeded.')
+
+  stats = {
+      'connections': len(tasks),
+      'computers': len(updated),
+      'lag_seconds': 0,
+      'backlog': queue.fetch_statistics().tasks,
+  }
+  if oldest:
+    stats['lag_seconds'] = (
+        datetime.datetime.utcnow() - oldest).total_seconds()
+  logging.info(
+      'FlushClientConnections: logged %(connections)d connections for '
+      '%(computers)d computers; lag %(lag_seconds).1fs, backlog %(backlog)d.',
+      stats)
+  return stats
+
+
 def WriteClientLog(model, uuid, **kwargs):
   """Writes a ClientLog entry.
 
@@ -300,6 +509,22 @@ def WriteBrokenClient(uuid, reason, details):
     reason: str, short description of broken state the client is reporting.
     details: str, details or debugging output of the broken report.
   """
+  uuid = common.SanitizeUUID(uuid)
+  bc = models.ComputerClientBroken.get_or_insert(uuid)
+  UpdateBrokenClient(bc, uuid, reason, details, datetime.datetime.utcnow())
+  bc.put()
+
+
+def UpdateBrokenClient(bc, uuid, reason, details, now):
+  """Updates a ComputerClientBroken entity with a broken client report.
+
+  Args:
+    bc: models.ComputerClientBroken entity, to update but not put.
+    uuid: str, sanitized uuid of client.
+    reason: str, short description of broken state the client is reporting.
+    details: str, details or debugging output of the broken report.
+    now: datetime, when the client reported it was broken.
+  """
   # If the details string contains facter output, parse it.
   facts = {}
   lines = details.splitlines()
@@ -311,10 +536,7 @@ def WriteBrokenClient(uuid, reason, details):
     value = value.strip()
     facts[key] = value
 
-  # Update the existing, or create a new ComputerClientBroken entity.
-  uuid = common.SanitizeUUID(uuid)
-  bc = models.ComputerClientBroken.get_or_insert(uuid)
-  bc.broken_datetimes.append(datetime.datetime.utcnow())
+  bc.broken_datetimes.append(now)
   bc.reason = reason
   bc.details = details
   bc.fixed = False  # Previously fixed computers will show up again.
@@ -322,7 +544,6 @@ def WriteBrokenClient(uuid, reason, details):
   bc.owner = facts.get('primary_user', '')
   bc.serial = facts.get('sp_serial_number', '')
   bc.uuid = uuid
-  bc.put()
 
 
 def WriteComputerMSULog(uuid, details):
@@ -338,6 +559,20 @@ def WriteComputerMSULog(uuid, details):
       'desc': str, 'additional descriptive text',
     }
   """
+  c = NewComputerMSULog(uuid, details)
+  if c is not None:
+    c.put()
+
+
+def NewComputerMSULog(uuid, details):
+  """Returns a ComputerMSULog entity for log details from MSU GUI.
+
+  Args:
+    uuid: str, computer uuid
+    details: dict, like WriteComputerMSULog() details.
+  Returns:
+    models.ComputerMSULog entity to put, or None if it is not newer.
+  """
   uuid = common.SanitizeUUID(uuid)
   key = '%s_%s_%s' % (uuid, details['source'], details['event'])
   c = models.ComputerMSULog(key_name=key)
@@ -358,7 +593,7 @@ def WriteComputerMSULog(uuid, details):
     mtime = datetime.datetime.utcnow()
   if c.mtime is None or mtime > c.mtime:
     c.mtime = mtime
-    c.put()
+    return c
 
 
 def GetBoolValueFromString(s):
@@ -507,22 +742,87 @@ def SetPanicModeNoPackages(enabled):
   SetPanicMode(PANIC_MODE_NO_PACKAGES, enabled)
 
 
-def GetComputerManifest(uuid=None, client_id=None, packagemap=False):
-  """For a computer uuid or client_id, return the current manifest.
+def GetManifestFingerprint(manifest, client_id, user_settings=None):
+  """Returns a fingerprint of all inputs to a client's dynamic manifest.
+
+  Clients with equal fingerprints receive byte-identical manifests from
+  GenerateDynamicManifest().  Rather than hashing raw client attributes, the
+  modifications resolved for the client are used; two clients on different
+  sites, or with different tags, share a fingerprint when neither attribute
+  selects any modification.
+
+  Args:
+    manifest: models.Manifest entity, manifest to start with.
+    client_id: dict client_id parsed by common.ParseClientId.
+    user_settings: dict UserSettings as defined in Simian client.
+  Returns:
+    str hex digest.
+  """
+  mod_index = models.ManifestModificationIndex.Get(
+      client_id['track'], tracks=common.TRACKS)
+
+  if manifest.mtime:
+    manifest_version = manifest.mtime.isoformat()
+  else:
+    manifest_version = hashlib.sha1(
+        (manifest.plist_xml or '').encode('utf-8')).hexdigest()
+
+  flash_developer = False
+  block_packages = []
+  if user_settings:
+    flash_developer = bool(user_settings.get('FlashDeveloper', False))
+    block_packages = sorted(user_settings.get('BlockPackages', []))
+
+  fingerprint_input = (
+      client_id['track'], manifest_version, mod_index.generation,
+      mod_index.GetModifications(client_id), flash_developer, block_packages)
+  return hashlib.sha1(repr(fingerprint_input)).hexdigest()
+
+
+def GetRenderedManifest(manifest, client_id, user_settings=None):
+  """Returns dynamic manifest XML for a client, rendered at most once.
+
+  Rendered XML is cached on the instance and in memcache by fingerprint, so
+  clients with equal fingerprints share a single serialized manifest.
+
+  Args:
+    manifest: models.Manifest entity, manifest to start with.
+    client_id: dict client_id parsed by common.ParseClientId.
+    user_settings: dict UserSettings as defined in Simian client.
+  Returns:
+    tuple of (str XML manifest, str fingerprint).
+  """
+  fingerprint = GetManifestFingerprint(
+      manifest, client_id, user_settings=user_settings)
+
+  plist_xml = _rendered_manifest_cache.Get(fingerprint)
+  if plist_xml is not None:
+    return plist_xml, fingerprint
+
+  memcache_key = RENDERED_MANIFEST_MEMCACHE_KEY % fingerprint
+  plist_xml = memcache.get(memcache_key)
+  if plist_xml is None:
+    plist_xml = GenerateDynamicManifest(
+        manifest.plist, client_id, user_settings=user_settings)
+    if not plist_xml:
+      return plist_xml, fingerprint
+    try:
+      memcache.set(memcache_key, plist_xml, RENDERED_MANIFEST_MEMCACHE_SECS)
+    except ValueError:
+      pass  # value too large for memcache; keep it locally only.
+
+  _rendered_manifest_cache.Set(fingerprint, plist_xml)
+  return plist_xml, fingerprint
+
+
+def GetComputerManifestAndFingerprint(uuid=None, client_id=None):
+  """For a computer uuid or client_id, return the current manifest XML.
 
   Args:
     uuid: str, computer uuid    OR
     client_id: dict, client_id
-    packagemap: bool, default False, whether to return packagemap or not
   Returns:
-    if packagemap, dict = {
-        'plist': plist.MunkiManifestPlist instance,
-        'packagemap': {   # if packagemap == True
-            'Firefox': 'Firefox-3.x.x.x.dmg',
-        },
-    }
-
-    if not packagemap, str, manifest plist
+    tuple of (str manifest plist, str fingerprint usable as an ETag).
   Raises:
     ValueError: error in type of arguments supplied to this method
     ComputerNotFoundError: computer cannot be found for uuid
@@ -562,31 +862,58 @@ def GetComputerManifest(uuid=None, client_id=None, packagemap=False):
         'user_disk_free': None,
     }
 
-  # Step 1: Obtain a manifest for this uuid.
-  manifest_plist_xml = None
+  manifest_name = client_id['track']
 
   if IsPanicModeNoPackages():
     manifest_plist_xml = '%s%s' % (
         plist_module.PLIST_HEAD, plist_module.PLIST_FOOT)
+    fingerprint = hashlib.sha1(manifest_plist_xml).hexdigest()
   else:
-    manifest_name = client_id['track']
     m = models.Manifest.MemcacheWrappedGet(manifest_name)
     if not m:
       raise ManifestNotFoundError(manifest_name)
     elif not m.enabled:
       raise ManifestDisabledError(manifest_name)
 
-    manifest_plist_xml = GenerateDynamicManifest(
-        m.plist, client_id, user_settings=user_settings)
+    manifest_plist_xml, fingerprint = GetRenderedManifest(
+        m, client_id, user_settings=user_settings)
 
   if not manifest_plist_xml:
     raise ManifestNotFoundError(manifest_name)
 
-  # Step 1: Return now with xml if packagemap not requested.
+  return manifest_plist_xml, fingerprint
+
+
+def GetComputerManifest(uuid=None, client_id=None, packagemap=False):
+  """For a computer uuid or client_id, return the current manifest.
+
+  Args:
+    uuid: str, computer uuid    OR
+    client_id: dict, client_id
+    packagemap: bool, default False, whether to return packagemap or not
+  Returns:
+    if packagemap, dict = {
+        'plist': plist.MunkiManifestPlist instance,
+        'packagemap': {   # if packagemap == True
+            'Firefox': 'Firefox-3.x.x.x.dmg',
+        },
+    }
+
+    if not packagemap, str, manifest plist
+  Raises:
+    ValueError: error in type of arguments supplied to this method
+    ComputerNotFoundError: computer cannot be found for uuid
+    ManifestNotFoundError: manifest requested is invalid (not found)
+    ManifestDisabledError: manifest requested is disabled
+  """
+  manifest_plist_xml, _ = GetComputerManifestAndFingerprint(
+      uuid=uuid, client_id=client_id)
+
+  # Return now with xml if packagemap not requested.
   if not packagemap:
     return manifest_plist_xml
 
-  # Step 2: Build lookup table from PackageName to PackageName-VersionNumber
+  # Build lookup table from PackageName to PackageName-VersionNumber
   # for packages found in catalogs used by the client.
 
   manifest_plist = plist_module.MunkiManifestPlist(manifest_plist_xml)
@@ -594,12 +921,22 @@ def GetComputerManifest(uuid=None, client_id=None, packagemap=False):
 
   packages = {}
 
-  query = models.PackageInfo.all()
-  for p in query:
-    display_name = p.plist.get('display_name', None) or p.plist.get('name')
-    display_name = display_name.strip()
-    version = p.plist.get('version', '')
-    packages[p.name] = '%s-%s' % (display_name, version)
+  if models.PackageInfo.IsPlistSummaryBackfilled():
+    # Projection queries omit entities lacking the properties, so are only
+    # complete once all summaries are backfilled.
+    query = models.PackageInfo.all(
+        projection=['name', 'display_name', 'version'])
+    for p in query:
+      display_name = (p.display_name or p.name).strip()
+      packages[p.name] = '%s-%s' % (display_name, p.version or '')
+  else:
+    query = models.PackageInfo.all()
+    for p in query:
+      pl = p.plist_lazy
+      display_name = pl.get('display_name', None) or pl.get('name')
+      display_name = display_name.strip()
+      version = pl.get('version', '')
+      packages[p.name] = '%s-%s' % (display_name, version)
 
   return {
       'plist': manifest_plist,
@@ -623,9 +960,29 @@ def _ModifyList(l, value):
     l.append(value)
 
 
+def _GetModifiablePlist(plist):
+  """Returns a parsed manifest plist which may be modified without side effects.
+
+  Manifest entities are shared through the instance-local model cache, so a
+  plist object is deep copied rather than modified in place.
+
+  Args:
+    plist: str XML or plist_module.ApplePlist object.
+  Returns:
+    plist_module.ApplePlist object.
+  """
+  if type(plist) is str:
+    plist = plist_module.MunkiManifestPlist(plist)
+    plist.Parse()
+    return plist
+  return plist.copy(deep=True)
+
+
 def GenerateDynamicManifest(plist, client_id, user_settings=None):
   """Generate a dynamic manifest based on a the various client_id fields.
 
+  The plist argument is never modified.
+
   Args:
     plist: str XML or plist_module.ApplePlist object, manifest to start with.
     client_id: dict client_id parsed by common.ParseClientId.
@@ -633,87 +990,30 @@ def GenerateDynamicManifest(plist, client_id, user_settings=None):
   Returns:
     str XML manifest with any custom modifications based on the client_id.
   """
-  # TODO(user): This function is getting out of control and needs refactoring.
   manifest = client_id['track']
 
-  site_mods = models.SiteManifestModification.MemcacheWrappedGetAllFilter(
-      (('site =', client_id['site']),))
-
-  os_version_mods = \
-      models.OSVersionManifestModification.MemcacheWrappedGetAllFilter(
-          (('os_version =', client_id['os_version']),))
-
-  owner_mods = models.OwnerManifestModification.MemcacheWrappedGetAllFilter(
-      (('owner =', client_id['owner']),))
-
-  uuid_mods = models.UuidManifestModification.MemcacheWrappedGetAllFilter(
-      (('uuid =', client_id['uuid']),))
-
-  tag_mods = []
-  if client_id['uuid']:  # not set if viewing a base manifest.
-    computer_key = models.db.Key.from_path('Computer', client_id['uuid'])
-    computer_tags = models.Tag.GetAllTagNamesForKey(computer_key)
-    if computer_tags:
-      # NOTE(user): if we feel most computers will have tags, it might make
-      #             sense to regularly fetch and cache all mods.
-      for tag in computer_tags:
-        t = (('tag_key_name =', tag),)
-        tag_mods.extend(
-            models.TagManifestModification.MemcacheWrappedGetAllFilter(t))
-
-  group_mods = []
-  if client_id['owner']:
-    owner_groups = models.Group.GetAllGroupNamesForUser(client_id['owner'])
-    if owner_groups:
-      for group in owner_groups:
-        g = (('group_key_name =', group),)
-        group_mods.extend(
-            models.GroupManifestModification.MemcacheWrappedGetAllFilter(g))
-
-  def __ApplyModifications(manifest, mod, plist):
-    """Applies a manifest modification if the manifest matches mod manifest.
-
-    NOTE(user): if mod.manifests is empty or None, mod is made to any manifest.
-    """
-    plist_xml = None
-    if type(plist) is str:
-      plist_xml = plist
-
-    if not mod.enabled:
-      return  # return it the mod is disabled
-    elif mod.manifests and manifest not in mod.manifests:
-      return  # return if the desired manifest is not in the mod manifests.
-
-    for install_type in mod.install_types:
-      plist_module.UpdateIterable(
-          plist, install_type, mod.value, default=[], op=_ModifyList)
-
-  if (site_mods or owner_mods or os_version_mods or uuid_mods or tag_mods
-      or group_mods):
-    if type(plist) is str:
-      plist = plist_module.MunkiManifestPlist(plist)
-      plist.Parse()
-    for mod in site_mods:
-      __ApplyModifications(manifest, mod, plist)
-    for mod in os_version_mods:
-      __ApplyModifications(manifest, mod, plist)
-    for mod in owner_mods:
-      __ApplyModifications(manifest, mod, plist)
-    for mod in uuid_mods:
-      __ApplyModifications(manifest, mod, plist)
-    for mod in tag_mods:
-      __ApplyModifications(manifest, mod, plist)
-    for mod in group_mods:
-      __ApplyModifications(manifest, mod, plist)
+  # All enabled mods for this manifest, bucketed by target, are resolved with
+  # in-memory lookups against the precompiled modification index.
+  mod_index = models.ManifestModificationIndex.Get(
+      manifest, tracks=common.TRACKS)
+  mods = mod_index.GetModifications(client_id)
+
+  modifiable = False
+  if mods:
+    plist = _GetModifiablePlist(plist)
+    modifiable = True
+    for value, install_types in mods:
+      for install_type in install_types:
+        plist_module.UpdateIterable(
+            plist, install_type, value, default=[], op=_ModifyList)
 
   if user_settings:
     flash_developer = user_settings.get('FlashDeveloper', False)
     block_packages = user_settings.get('BlockPackages', [])
-    # If plist is not parsed yet and modifications are required, parse it.
-    if (flash_developer or block_packages) and type(plist) is str:
-      if type(plist) is str:
-        plist = plist_module.MunkiManifestPlist(plist)
-        plist.Parse()
+    # If modifications are required and plist is not yet private, parse it.
+    if (flash_developer or block_packages) and not modifiable:
+      plist = _GetModifiablePlist(plist)
+      modifiable = True
 
     # If FlashDeveloper is True, replace the regular flash plugin with the
     # debug version in managed_updates.
@@ -83,6 +83,63 @@ def IsClientResourceExpired(resource_dt, str_header_dt):
     return True
 
 
+def QuoteETag(etag):
+  """Returns an ETag header value, quoted per RFC 7232.
+
+  Args:
+    etag: str, opaque entity tag.
+  """
+  return '"%s"' % etag
+
+
+def IsETagMatch(etag, if_none_match):
+  """Returns True if an If-None-Match header value matches an ETag.
+
+  Tags are compared weakly, as RFC 7232 requires for If-None-Match, and
+  unquoted tags sent by older clients are accepted.
+
+  Args:
+    etag: str, opaque entity tag, unquoted.
+    if_none_match: str, If-None-Match header value.
+  """
+  for client_etag in if_none_match.split(','):
+    client_etag = client_etag.strip()
+    if client_etag == '*':
+      return True
+    if client_etag.startswith('W/'):
+      client_etag = client_etag[2:]
+    if client_etag.strip('"') == etag:
+      return True
+  return False
+
+
+def IsGzipAccepted(accept_encoding):
+  """Returns True if an Accept-Encoding header value accepts gzip.
+
+  Codings with a q-value of 0, like "gzip;q=0", are not accepted.
+
+  Args:
+    accept_encoding: str, Accept-Encoding header value.
+  """
+  wildcard_q = 0
+  for coding in accept_encoding.split(','):
+    params = coding.split(';')
+    name = params[0].strip().lower()
+    q = 1.0
+    for param in params[1:]:
+      key, _, value = param.partition('=')
+      if key.strip().lower() == 'q':
+        try:
+          q = float(value)
+        except ValueError:
+          q = 0
+    if name in ('gzip', 'x-gzip'):
+      return q > 0
+    elif name == '*':
+      wildcard_q = q
+  return wildcard_q > 0
+
+
 def GetClientIdForRequest(request, session=None, client_id_str=None):
   """Returns a client_id dict for the given request.
 
@@ -132,3 +189,40 @@ class AuthenticationHandler(webapp2.RequestHandler):
       return
 
     super(AuthenticationHandler, self).handle_exception(exception, debug_mode)
+
+  def WriteCatalog(self, plist_xml, mtime, etag=None, plist_gzip=None):
+    """Writes a catalog, or 304 Not Modified if the client's copy is current.
+
+    An If-None-Match header takes precedence over If-Modified-Since, so that
+    clients holding an unchanged catalog don't download it again just because
+    its mtime moved.
+
+    Args:
+      plist_xml: str or unicode, catalog XML.
+      mtime: datetime, catalog modification time.
+      etag: str, optional, strong ETag of plist_xml.
+      plist_gzip: str, optional, gzip encoded plist_xml.
+    """
+    if_none_match = ''
+    if etag:
+      if_none_match = self.request.headers.get('If-None-Match', '')
+      self.response.headers['ETag'] = QuoteETag(etag)
+    if if_none_match:
+      resource_expired = not IsETagMatch(etag, if_none_match)
+    else:
+      header_date_str = self.request.headers.get('If-Modified-Since', '')
+      resource_expired = IsClientResourceExpired(mtime, header_date_str)
+
+    if not resource_expired:
+      self.response.set_status(httplib.NOT_MODIFIED)
+      return
+
+    self.response.headers['Last-Modified'] = mtime.strftime(HEADER_DATE_FORMAT)
+    self.response.headers['Content-Type'] = 'text/xml; charset=utf-8'
+    if plist_gzip:
+      self.response.headers['Vary'] = 'Accept-Encoding'
+      if IsGzipAccepted(self.request.headers.get('Accept-Encoding', '')):
+        self.response.headers['Content-Encoding'] = 'gzip'
+        self.response.out.write(plist_gzip)
+        return
+    self.response.out.write(plist_xml)
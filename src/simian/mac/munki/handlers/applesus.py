@@ -85,15 +85,9 @@ class AppleSUS(handlers.AuthenticationHandler):
       self.response.set_status(httplib.NOT_FOUND)
       return
 
-    header_date_str = self.request.headers.get('If-Modified-Since', '')
-    catalog_date = catalog.mtime
-    if handlers.IsClientResourceExpired(catalog_date, header_date_str):
-      self.response.headers['Last-Modified'] = catalog_date.strftime(
-          handlers.HEADER_DATE_FORMAT)
-      self.response.headers['Content-Type'] = 'text/xml; charset=utf-8'
-      self.response.out.write(catalog.plist)
-    else:
-      self.response.set_status(httplib.NOT_MODIFIED)
+    self.WriteCatalog(
+        catalog.plist, catalog.mtime, etag=catalog.plist_etag,
+        plist_gzip=catalog.plist_gzip)
 
   def _SanitazeMunkiHeader(self, munki_header):
     """Leave required fields only."""
@@ -41,13 +41,6 @@ class Catalogs(handlers.AuthenticationHandler):
       self.response.set_status(httplib.NOT_FOUND)
       return
 
-    header_date_str = self.request.headers.get('If-Modified-Since', '')
-    if not handlers.IsClientResourceExpired(catalog.mtime, header_date_str):
-      self.response.set_status(httplib.NOT_MODIFIED)
-      return
-
-    self.response.headers['Last-Modified'] = catalog.mtime.strftime(
-        handlers.HEADER_DATE_FORMAT)
-
-    self.response.headers['Content-Type'] = 'text/xml; charset=utf-8'
-    self.response.out.write(catalog.plist_xml)
+    self.WriteCatalog(
+        catalog.plist_xml, catalog.mtime, etag=catalog.plist_etag,
+        plist_gzip=catalog.plist_gzip)
@@ -41,8 +41,8 @@ class Manifests(handlers.AuthenticationHandler):
         self.request, session=session, client_id_str=client_id_str)
 
     try:
-      plist_xml = common.GetComputerManifest(
-          client_id=client_id, packagemap=False)
+      plist_xml, fingerprint = common.GetComputerManifestAndFingerprint(
+          client_id=client_id)
     except common.ManifestNotFoundError, e:
       logging.warning('Invalid manifest requested: %s', str(e))
       self.response.set_status(httplib.NOT_FOUND)
@@ -57,5 +57,14 @@ class Manifests(handlers.AuthenticationHandler):
       self.response.set_status(httplib.SERVICE_UNAVAILABLE)
       return
 
+    # The fingerprint covers every input to the rendered manifest, so clients
+    # already holding it need not download the manifest again.
+    etag = str(fingerprint)
+    self.response.headers['ETag'] = handlers.QuoteETag(etag)
+    if_none_match = self.request.headers.get('If-None-Match', '')
+    if handlers.IsETagMatch(etag, if_none_match):
+      self.response.set_status(httplib.NOT_MODIFIED)
+      return
+
     self.response.headers['Content-Type'] = 'text/xml; charset=utf-8'
     self.response.out.write(plist_xml)
@@ -46,6 +46,22 @@ class Packages(
     blobstore_handlers.BlobstoreDownloadHandler):
   """Handler for /pkgs/"""
 
+  def _IsRangeRequestValid(self, pkg):
+    """Returns True if the Range of this request should be honored.
+
+    A Range is only honored with an If-Range matching the package ETag, so
+    that a partial download of a since changed package is not resumed.
+
+    Args:
+      pkg: models.PackageInfo entity being downloaded.
+    Returns:
+      True if the Range header is to be used, False to send the whole blob.
+    """
+    if not self.request.headers.get('Range'):
+      return False
+    if_range = self.request.headers.get('If-Range', '').strip('"')
+    return bool(pkg.pkgdata_sha256) and if_range == pkg.pkgdata_sha256
+
   def get(self, filename):
     """GET
 
@@ -127,7 +143,9 @@ class Packages(
       self.response.headers['Last-Modified'] = pkg_date.strftime(
           handlers.HEADER_DATE_FORMAT)
       self.response.headers['X-Download-Size'] = str(pkg_size_bytes)
-      self.send_blob(pkg.blobstore_key)
+      self.response.headers['Accept-Ranges'] = 'bytes'
+      self.send_blob(
+          pkg.blobstore_key, use_range=self._IsRangeRequestValid(pkg))
     else:
       # Client doesn't need to do anything, current version is OK based on
       # ETag and/or last modified date.
@@ -17,11 +17,18 @@
 """Reports URL handlers."""
 
 import datetime
+import httplib
 import json
 import logging
 import os
 import re
 import urllib
+import zlib
+
+from google.appengine import runtime
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+from google.appengine.runtime import apiproxy_errors
 
 from simian.auth import gaeserver
 from simian.mac import common as main_common
@@ -43,6 +50,23 @@ INSTALL_RESULT_SUCCESSFUL = 'SUCCESSFUL'
 
 JSON_PREFIX = ')]}\',\n'
 
+# Version of the JSON body of install_reports reports.
+INSTALL_REPORTS_VERSION = 1
+GZIP_MAGIC = '\x1f\x8b'
+
+# Pull queue of reports accepted for write-behind ingestion.
+REPORT_QUEUE = 'client-reports'
+REPORT_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+REPORT_LEASE_SECS = 300
+REPORT_FLUSH_MAX_TASKS = 1000
+# Number of computers whose reports are ingested per datastore batch.
+REPORT_FLUSH_BATCH_SIZE = 100
+# Number of times a queued report is leased before it is dropped.
+REPORT_MAX_RETRIES = 5
+# Report types which may be queued for write-behind ingestion.
+QUEUED_REPORT_TYPES = frozenset([
+    'install_report', 'install_reports', 'msu_log', 'broken_client'])
+
 LEGACY_INSTALL_RESULTS_STRING_REGEX = re.compile(
     r'^Install of (.*)-(\d+.*): (%s|%s: (\-?\d+))$' % (
         INSTALL_RESULT_SUCCESSFUL, INSTALL_RESULT_FAILED))
@@ -70,6 +94,415 @@ def IsExitFeedbackIpAddress(ip_address):
       models.KeyValueCache.IpInList('client_exit_ip_blocks', ip_address))
 
 
+def DecodeInstallReports(body):
+  """Decodes the body of an install_reports report.
+
+  The body is JSON, optionally gzip encoded, like:
+    {"version": 1, "on_corp": "1", "reports": [
+        {"installs": [{"name": "Foo", "version": "1.0", "status": 0, ...}],
+         "removals": ["..."], "problem_installs": ["..."]}, ...]}
+
+  Args:
+    body: str, request body.
+  Returns:
+    dict, the decoded install reports.
+  Raises:
+    ValueError: the body is not a supported install_reports report.
+  """
+  if body.startswith(GZIP_MAGIC):
+    try:
+      body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    except zlib.error as e:
+      raise ValueError('Invalid gzip body: %s' % e)
+  install_reports = json.loads(body)
+  if (not isinstance(install_reports, dict) or
+      install_reports.get('version') != INSTALL_REPORTS_VERSION):
+    raise ValueError('Unsupported install_reports version')
+  if not isinstance(install_reports.get('reports'), list):
+    raise ValueError('install_reports has no reports list')
+  for report in install_reports['reports']:
+    if not isinstance(report, dict):
+      raise ValueError('install_reports report is not a dict')
+    for key, types in (
+        ('installs', (dict, basestring)),
+        ('removals', basestring),
+        ('problem_installs', (dict, basestring))):
+      items = report.get(key, [])
+      if (not isinstance(items, list) or
+          not all(isinstance(item, types) for item in items)):
+        raise ValueError('install_reports %s has invalid items' % key)
+  return install_reports
+
+
+def _ParseOnCorp(on_corp):
+  """Returns True for on_corp '1', False for '0', None otherwise."""
+  if on_corp == '1':
+    return True
+  elif on_corp == '0':
+    return False
+  return None
+
+
+def _GetBool(value):
+  """Returns a bool from a JSON bool or a true/false/1/0 string, or None."""
+  if isinstance(value, bool):
+    return value
+  return common.GetBoolValueFromString(value)
+
+
+def _ParseInstallString(install):
+  """Parses a str install from a legacy install_report into a dict.
+
+  Args:
+    install: str, like 'name=pkg|version=foo|...', or for old clients
+        'Install of FooPkg-1.0: SUCCESSFUL'.
+  Returns:
+    dict of install details.
+  """
+  if not install.startswith('Install of'):
+    # support for new 'name=pkg|version=foo|...' style strings.
+    return common.KeyValueStringToDict(install)
+
+  d = {
+      'applesus': 'false',
+      'duration_seconds': None,
+      'download_kbytes_per_sec': None,
+      'name': install,
+      'status': 'UNKNOWN',
+      'version': '',
+      'unattended': 'false',
+  }
+  # support for old 'Install of FooPkg-1.0: SUCCESSFUL' style strings.
+  try:
+    m = LEGACY_INSTALL_RESULTS_STRING_REGEX.search(install)
+    if not m:
+      raise ValueError
+    elif m.group(3) == INSTALL_RESULT_SUCCESSFUL:
+      d['status'] = 0
+    else:
+      d['status'] = m.group(4)
+    d['name'] = m.group(1)
+    d['version'] = m.group(2)
+  except (IndexError, AttributeError, ValueError):
+    logging.warning('Unknown install string format: %s', install)
+  return d
+
+
+def _NewInstallLog(d, uuid, computer, on_corp, key_name=None):
+  """Returns a new, unsaved InstallLog entity for an install.
+
+  Args:
+    d: dict of install details, from _ParseInstallString() or JSON.
+    uuid: str, computer uuid.
+    computer: models.Computer entity, or None.
+    on_corp: bool, or None if unknown.
+    key_name: str, optional, key name of the entity; default an id.
+  Returns:
+    models.InstallLog entity.
+  """
+  name = d.get('display_name', '') or d.get('name', '')
+  version = d.get('version', '')
+  status = str(d.get('status', ''))
+  applesus = _GetBool(d.get('applesus', '0'))
+  unattended = _GetBool(d.get('unattended', '0'))
+  try:
+    duration_seconds = int(d.get('duration_seconds', None))
+  except (TypeError, ValueError):
+    duration_seconds = None
+  try:
+    dl_kbytes_per_sec = int(d.get('download_kbytes_per_sec', None))
+    # Ignore zero KB/s download speeds, as that's how Munki reports
+    # unknown speed.
+    if dl_kbytes_per_sec == 0:
+      dl_kbytes_per_sec = None
+  except (TypeError, ValueError):
+    dl_kbytes_per_sec = None
+
+  try:
+    install_datetime = util.Datetime.utcfromtimestamp(d.get('time', None))
+  except ValueError as e:
+    logging.info('Ignoring invalid install_datetime: %s', str(e))
+    install_datetime = datetime.datetime.utcnow()
+  except util.EpochExtremeFutureValueError as e:
+    logging.info('Ignoring extreme future install_datetime: %s', str(e))
+    install_datetime = datetime.datetime.utcnow()
+  except util.EpochFutureValueError:
+    install_datetime = datetime.datetime.utcnow()
+
+  pkg = '%s-%s' % (name, version)
+  kwargs = {}
+  if key_name:
+    kwargs['key_name'] = key_name
+  entity = models.InstallLog(
+      uuid=uuid, computer=computer, package=pkg, status=status,
+      on_corp=on_corp, applesus=applesus, unattended=unattended,
+      duration_seconds=duration_seconds, mtime=install_datetime,
+      dl_kbytes_per_sec=dl_kbytes_per_sec, **kwargs)
+  entity.success = entity.IsSuccess()
+  return entity
+
+
+def _GetInstallReportEntities(
+    install_reports, uuid, computer, key_name_prefix=None):
+  """Returns new entities for the installs, removals and problems of reports.
+
+  Args:
+    install_reports: dict, decoded by DecodeInstallReports().
+    uuid: str, computer uuid.
+    computer: models.Computer entity, or None.
+    key_name_prefix: str, optional, prefix of the entities' key names, which
+        are numbered in report order, so that ingesting the same reports
+        again writes the same entities; default ids.
+  Returns:
+    tuple of lists, (InstallLog entities, ClientLog entities).
+  """
+  def __KeyNameKwargs(entities):
+    if key_name_prefix:
+      return {'key_name': '%s_%d' % (key_name_prefix, len(entities))}
+    return {}
+
+  on_corp = _ParseOnCorp(install_reports.get('on_corp'))
+  installs = []
+  client_logs = []
+  for report in install_reports['reports']:
+    for install in report.get('installs', []):
+      if isinstance(install, basestring):
+        install = _ParseInstallString(install)
+      installs.append(_NewInstallLog(
+          install, uuid, computer, on_corp, **__KeyNameKwargs(installs)))
+    for removal in report.get('removals', []):
+      client_logs.append(models.ClientLog(
+          uuid=uuid, computer=computer, action='removal', details=removal,
+          **__KeyNameKwargs(client_logs)))
+    for problem in report.get('problem_installs', []):
+      if isinstance(problem, dict):
+        problem = u'%s: %s' % (problem.get('name', ''),
+                               problem.get('note', ''))
+      client_logs.append(models.ClientLog(
+          uuid=uuid, computer=computer, action='install_problem',
+          details=problem, **__KeyNameKwargs(client_logs)))
+  return installs, client_logs
+
+
+def IsReportWriteBehindEnabled():
+  """Returns True if reports are ingested via the write-behind queue."""
+  enabled, _ = models.Settings.GetItem('report_write_behind')
+  return bool(enabled)
+
+
+def QueueReport(uuid, report_type, params):
+  """Queues a report for FlushReports() to ingest.
+
+  Args:
+    uuid: str, computer uuid.
+    report_type: str, one of QUEUED_REPORT_TYPES.
+    params: dict, report parameters; see IngestReports().
+  Raises:
+    taskqueue.Error: the report could not be queued.
+  """
+  payload = {
+      'uuid': uuid,
+      'report_type': report_type,
+      'params': params,
+      'now': datetime.datetime.utcnow().strftime(REPORT_DATETIME_FORMAT),
+  }
+  taskqueue.Queue(REPORT_QUEUE).add(taskqueue.Task(
+      payload=json.dumps(payload), method='PULL', tag=uuid))
+
+
+def ValidateQueuedReport(uuid, report_type, params):
+  """Checks that the entities of a report can be written, before queueing.
+
+  The entities are built as IngestReports() builds them, but not written, so
+  that a report with values of the wrong type or too long for their property
+  is rejected by the client's request rather than failing a FlushReports()
+  batch.
+
+  Args:
+    uuid: str, computer uuid.
+    report_type: str, one of QUEUED_REPORT_TYPES.
+    params: dict, report parameters; see IngestReports().
+  Raises:
+    ValueError: the report is invalid.
+  """
+  try:
+    if report_type == 'install_reports':
+      _GetInstallReportEntities(params, uuid, None)
+    elif report_type == 'msu_log':
+      common.NewComputerMSULog(uuid, params)
+    elif report_type == 'broken_client':
+      common.UpdateBrokenClient(
+          models.ComputerClientBroken(key_name=uuid), uuid, params['reason'],
+          params['details'], datetime.datetime.utcnow())
+  except (db.BadValueError, AttributeError, KeyError, TypeError) as e:
+    raise ValueError('%s: %s' % (e.__class__.__name__, str(e)))
+
+
+def IngestReports(reports):
+  """Writes the entities for a batch of reports.
+
+  Computers are fetched once per batch, and all InstallLog, ClientLog,
+  ComputerMSULog and ComputerClientBroken entities are put together.
+
+  InstallLog and ClientLog entities of reports with an id have key names
+  derived from it, so reports ingested again after a partial failure neither
+  duplicate them nor count their installs again.
+
+  Args:
+    reports: list of dicts with keys uuid, report_type, now (datetime),
+        optionally id (str, unique to the report) and params: for
+        install_reports, a dict from DecodeInstallReports(); for msu_log,
+        WriteComputerMSULog() details; for broken_client, a dict with reason
+        and details.
+  """
+  uuids = sorted(set(r['uuid'] for r in reports))
+  computers = dict(zip(uuids, models.Computer.get_by_key_name(uuids)))
+  broken_uuids = sorted(set(
+      r['uuid'] for r in reports if r['report_type'] == 'broken_client'))
+  broken_clients = {}
+  if broken_uuids:
+    broken_clients = dict(zip(
+        broken_uuids,
+        models.ComputerClientBroken.get_by_key_name(broken_uuids)))
+
+  installs = []
+  entities = []
+  keyed_logs = []
+  msu_logs = {}
+  for report in sorted(reports, key=lambda r: r['now']):
+    uuid = report['uuid']
+    params = report['params']
+    if report['report_type'] == 'install_reports':
+      report_installs, client_logs = _GetInstallReportEntities(
+          params, uuid, computers[uuid], key_name_prefix=report.get('id'))
+      installs.extend(report_installs)
+      entities.extend(client_logs)
+      if report.get('id'):
+        keyed_logs.extend(report_installs + client_logs)
+    elif report['report_type'] == 'msu_log':
+      msu_log = common.NewComputerMSULog(uuid, params)
+      if msu_log is not None:
+        previous = msu_logs.get(msu_log.key().name())
+        if previous is None or msu_log.mtime > previous.mtime:
+          msu_logs[msu_log.key().name()] = msu_log
+    elif report['report_type'] == 'broken_client':
+      bc = broken_clients.get(uuid)
+      if bc is None:
+        bc = models.ComputerClientBroken(key_name=uuid)
+        broken_clients[uuid] = bc
+      common.UpdateBrokenClient(
+          bc, uuid, params['reason'], params['details'], report['now'])
+    else:
+      logging.warning('Ignoring queued %s report', report['report_type'])
+
+  if keyed_logs:
+    # skip logs written by an earlier ingestion of the same reports.
+    written = set(
+        e.key() for e in db.get([e.key() for e in keyed_logs]) if e)
+    installs = [e for e in installs if not _IsWritten(e, written)]
+    entities = [e for e in entities if not _IsWritten(e, written)]
+
+  entities.extend(msu_logs.values())
+  entities.extend(broken_clients.values())
+  gae_util.BatchDatastoreOp(models.db.put, installs + entities)
+  models.InstallCountShard.IncrementInstalls(installs)
+
+
+def _IsWritten(entity, written_keys):
+  """Returns True if an entity with a key name is in a set of written keys."""
+  return entity.has_key() and entity.key() in written_keys
+
+
+def FlushReports(max_tasks=REPORT_FLUSH_MAX_TASKS):
+  """Ingests reports queued by QueueReport().
+
+  Reports are grouped by uuid, so the entities of each computer's reports
+  are written in one batch.  Tasks are deleted as soon as their batch is
+  written.  If a batch fails, its computers' reports are ingested one
+  computer at a time, so one bad report does not hold back the others; tasks
+  which still fail are leased again after REPORT_LEASE_SECS, and their
+  reports identified by task name so they are not ingested twice.  Tasks
+  leased more than REPORT_MAX_RETRIES times, or whose payload cannot be
+  decoded, are logged and dropped.
+
+  Args:
+    max_tasks: int, maximum number of queued reports to ingest.
+  Returns:
+    dict of flush statistics: reports, computers, dropped (reports dropped
+    undelivered), lag_seconds (time from receipt to ingestion of the oldest
+    report) and backlog (reports left queued).
+  """
+  queue = taskqueue.Queue(REPORT_QUEUE)
+  tasks = queue.lease_tasks(REPORT_LEASE_SECS, max_tasks)
+
+  reports_by_uuid = {}
+  tasks_by_uuid = {}
+  dropped = []
+  oldest = None
+  for task in tasks:
+    if task.retry_count > REPORT_MAX_RETRIES:
+      logging.error(
+          'FlushReports dropping report %s leased %d times: %s',
+          task.name, task.retry_count, task.payload[:1000])
+      dropped.append(task)
+      continue
+    try:
+      report = json.loads(task.payload)
+      report['now'] = datetime.datetime.strptime(
+          report['now'], REPORT_DATETIME_FORMAT)
+      uuid = report['uuid']
+    except (KeyError, TypeError, ValueError) as e:
+      logging.error(
+          'FlushReports dropping invalid report %s: %s', task.name, str(e))
+      dropped.append(task)
+      continue
+    report['id'] = task.name
+    reports_by_uuid.setdefault(uuid, []).append(report)
+    tasks_by_uuid.setdefault(uuid, []).append(task)
+    if oldest is None or report['now'] < oldest:
+      oldest = report['now']
+
+  if dropped:
+    queue.delete_tasks(dropped)
+
+  def __IngestAndDeleteTasks(uuids):
+    try:
+      IngestReports([r for uuid in uuids for r in reports_by_uuid[uuid]])
+      queue.delete_tasks([t for uuid in uuids for t in tasks_by_uuid[uuid]])
+    except Exception:  # pylint: disable=broad-except
+      if len(uuids) == 1:
+        logging.exception('FlushReports failed for %s', uuids[0])
+        return
+      logging.exception(
+          'FlushReports failed for a batch; ingesting one computer at a time')
+      for uuid in uuids:
+        __IngestAndDeleteTasks([uuid])
+
+  try:
+    gae_util.BatchDatastoreOp(
+        __IngestAndDeleteTasks, reports_by_uuid.keys(),
+        batch_size=REPORT_FLUSH_BATCH_SIZE)
+  except runtime.DeadlineExceededError as e:
+    logging.warning(
+        'FlushReports put() error %s: %s', e.__class__.__name__, str(e))
+
+  stats = {
+      'reports': len(tasks),
+      'computers': len(reports_by_uuid),
+      'dropped': len(dropped),
+      'lag_seconds': 0,
+      'backlog': queue.fetch_statistics().tasks,
+  }
+  if oldest:
+    stats['lag_seconds'] = (
+        datetime.datetime.utcnow() - oldest).total_seconds()
+  logging.info(
+      'FlushReports: ingested %(reports)d reports for %(computers)d '
+      'computers, dropped %(dropped)d; lag %(lag_seconds).1fs, '
+      'backlog %(backlog)d.', stats)
+  return stats
+
+
 class Reports(handlers.AuthenticationHandler):
   """Handler for /reports/."""
 
@@ -144,82 +577,101 @@ class Reports(handlers.AuthenticationHandler):
     if not installs:
       return
 
-    on_corp = self.request.get('on_corp')
-    if on_corp == '1':
-      on_corp = True
-    elif on_corp == '0':
-      on_corp = False
-    else:
-      on_corp = None
-
-    to_put = []
-    for install in installs:
-      if install.startswith('Install of'):
-        d = {
-            'applesus': 'false',
-            'duration_seconds': None,
-            'download_kbytes_per_sec': None,
-            'name': install,
-            'status': 'UNKNOWN',
-            'version': '',
-            'unattended': 'false',
-        }
-        # support for old 'Install of FooPkg-1.0: SUCCESSFUL' style strings.
-        try:
-          m = LEGACY_INSTALL_RESULTS_STRING_REGEX.search(install)
-          if not m:
-            raise ValueError
-          elif m.group(3) == INSTALL_RESULT_SUCCESSFUL:
-            d['status'] = 0
-          else:
-            d['status'] = m.group(4)
-          d['name'] = m.group(1)
-          d['version'] = m.group(2)
-        except (IndexError, AttributeError, ValueError):
-          logging.warning('Unknown install string format: %s', install)
-      else:
-        # support for new 'name=pkg|version=foo|...' style strings.
-        d = common.KeyValueStringToDict(install)
-
-      name = d.get('display_name', '') or d.get('name', '')
-      version = d.get('version', '')
-      status = str(d.get('status', ''))
-      applesus = common.GetBoolValueFromString(d.get('applesus', '0'))
-      unattended = common.GetBoolValueFromString(d.get('unattended', '0'))
-      try:
-        duration_seconds = int(d.get('duration_seconds', None))
-      except (TypeError, ValueError):
-        duration_seconds = None
-      try:
-        dl_kbytes_per_sec = int(d.get('download_kbytes_per_sec', None))
-        # Ignore zero KB/s download speeds, as that's how Munki reports
-        # unknown speed.
-        if dl_kbytes_per_sec == 0:
-          dl_kbytes_per_sec = None
-      except (TypeError, ValueError):
-        dl_kbytes_per_sec = None
-
-      try:
-        install_datetime = util.Datetime.utcfromtimestamp(d.get('time', None))
-      except ValueError as e:
-        logging.info('Ignoring invalid install_datetime: %s', str(e))
-        install_datetime = datetime.datetime.utcnow()
-      except util.EpochExtremeFutureValueError as e:
-        logging.info('Ignoring extreme future install_datetime: %s', str(e))
-        install_datetime = datetime.datetime.utcnow()
-      except util.EpochFutureValueError:
-        install_datetime = datetime.datetime.utcnow()
-
-      pkg = '%s-%s' % (name, version)
-      entity = models.InstallLog(
-          uuid=computer.uuid, computer=computer, package=pkg, status=status,
-          on_corp=on_corp, applesus=applesus, unattended=unattended,
-          duration_seconds=duration_seconds, mtime=install_datetime,
-          dl_kbytes_per_sec=dl_kbytes_per_sec)
-      entity.success = entity.IsSuccess()
-      to_put.append(entity)
+    on_corp = _ParseOnCorp(self.request.get('on_corp'))
+    to_put = [
+        _NewInstallLog(
+            _ParseInstallString(install), computer.uuid, computer, on_corp)
+        for install in installs]
 
     gae_util.BatchDatastoreOp(models.db.put, to_put)
+    models.InstallCountShard.IncrementInstalls(to_put)
+
+  def _LogInstallReports(self, install_reports, uuid, computer):
+    """Logs the installs, removals and problems of bulk install reports.
+
+    All InstallLog and ClientLog entities are written in one batch.
+
+    Args:
+      install_reports: dict, decoded by DecodeInstallReports().
+      uuid: str, computer uuid.
+      computer: models.Computer entity.
+    Returns:
+      dict, counts of the logged entities.
+    """
+    installs, client_logs = _GetInstallReportEntities(
+        install_reports, uuid, computer)
+    gae_util.BatchDatastoreOp(models.db.put, installs + client_logs)
+    models.InstallCountShard.IncrementInstalls(installs)
+    return {'installs': len(installs), 'client_logs': len(client_logs)}
+
+  def _GetQueuedReportParams(self, report_type):
+    """Returns the parameters of a report to queue.
+
+    install_report reports are converted to install_reports parameters.
+
+    Args:
+      report_type: str, one of QUEUED_REPORT_TYPES.
+    Returns:
+      dict, report parameters; see IngestReports().
+    Raises:
+      ValueError: the report is invalid.
+    """
+    if report_type == 'install_reports':
+      return DecodeInstallReports(self.request.body)
+    elif report_type == 'install_report':
+      return {
+          'version': INSTALL_REPORTS_VERSION,
+          'on_corp': self.request.get('on_corp'),
+          'reports': [{
+              'installs': self.request.get_all('installs'),
+              'removals': self.request.get_all('removals'),
+              'problem_installs': self.request.get_all('problem_installs'),
+          }],
+      }
+    elif report_type == 'msu_log':
+      details = {}
+      for k in ['time', 'user', 'source', 'event', 'desc']:
+        details[k] = self.request.get(k, None)
+      return details
+    elif report_type == 'broken_client':
+      return {
+          'reason': self.request.get('reason', 'objc'),
+          'details': self.request.get('details'),
+      }
+    raise ValueError('Report type %s cannot be queued' % report_type)
+
+  def _QueueReport(self, uuid, report_type):
+    """Validates and queues a report, acknowledging it immediately.
+
+    If the report cannot be queued, it is ingested directly instead.
+
+    Args:
+      uuid: str, computer uuid.
+      report_type: str, one of QUEUED_REPORT_TYPES.
+    """
+    try:
+      params = self._GetQueuedReportParams(report_type)
+      if report_type == 'install_report':
+        report_type = 'install_reports'
+      ValidateQueuedReport(uuid, report_type, params)
+    except ValueError as e:
+      logging.warning('Client %s sent invalid %s: %s', uuid, report_type, e)
+      self.response.set_status(httplib.BAD_REQUEST)
+      return
+
+    try:
+      QueueReport(uuid, report_type, params)
+    except (taskqueue.Error, apiproxy_errors.Error) as e:
+      logging.warning(
+          'Report queue error %s: %s; ingesting directly',
+          e.__class__.__name__, str(e))
+      IngestReports([{
+          'uuid': uuid, 'report_type': report_type, 'params': params,
+          'now': datetime.datetime.utcnow()}])
+
+    if report_type == 'install_reports':
+      # a non-empty response tells the client this report type is supported.
+      self.response.out.write(JSON_PREFIX + json.dumps({'queued': True}))
 
   def post(self):
     """Reports get handler.
@@ -290,6 +742,9 @@ class Reports(handlers.AuthenticationHandler):
           report_feedback=report_feedback, cert_fingerprint=cert_fingerprint)
 
 
+    elif (report_type in QUEUED_REPORT_TYPES and
+          IsReportWriteBehindEnabled()):
+      self._QueueReport(uuid, report_type)
     elif report_type == 'install_report':
       computer = models.Computer.get_by_key_name(uuid)
 
@@ -304,6 +759,17 @@ class Reports(handlers.AuthenticationHandler):
         common.WriteClientLog(
             models.ClientLog, uuid, computer=computer,
             action='install_problem', details=problem)
+    elif report_type == 'install_reports':
+      try:
+        install_reports = DecodeInstallReports(self.request.body)
+      except ValueError as e:
+        logging.warning('Client %s sent invalid install_reports: %s', uuid, e)
+        self.response.set_status(httplib.BAD_REQUEST)
+        return
+      computer = models.Computer.get_by_key_name(uuid)
+      counts = self._LogInstallReports(install_reports, uuid, computer)
+      # a non-empty response tells the client this report type is supported.
+      self.response.out.write(JSON_PREFIX + json.dumps(counts))
     elif report_type == 'broken_client':
       # Default reason of "objc" to support legacy clients, existing when objc
       # was the only broken state ever reported.
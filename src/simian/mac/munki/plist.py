@@ -26,7 +26,9 @@ OR
 """
 
 import base64
+import copy as copy_lib
 import datetime
+import re
 import struct
 import xml.parsers.expat
 import xml.sax.saxutils
@@ -63,6 +65,33 @@ INDENT_CHAR = '  '
 
 PLIST_CONTENT_TYPES = [list, dict, type(None)]
 
+# XML parser backends for ApplePlist.Parse().
+XML_PARSER_FAST = 'fast'
+XML_PARSER_LEGACY = 'legacy'
+XML_PARSERS = (XML_PARSER_FAST, XML_PARSER_LEGACY)
+DEFAULT_XML_PARSER = XML_PARSER_FAST
+
+# Elements whose first chunk of character data is their whole value, and
+# the method names of ApplePlist converting it.
+_XML_FIRST_CHUNK_ELEMENTS = {
+    'key': None,
+    'integer': None,
+    'real': None,
+    'date': '_ParseDate',
+}
+
+# Elements, as (1) start tag name, (2) '/' of an empty element tag and
+# (3) character data up to the element's end tag when it has no child
+# elements; or as (4) end tag name.  Declarations and comments are skipped.
+_XML_TOKEN_RE = re.compile(
+    r'<([A-Za-z]+)[^>]*?(/)?>(?(2)|(?:([^<]*)</\1>)?)|</([A-Za-z]+)>')
+# Markup which may hide tags from _XML_TOKEN_RE.
+_XML_UNINDEXABLE_MARKUP = ('<!--', '<![CDATA[')
+# Key text which the XML parsers would not return as is.
+_XML_UNINDEXABLE_KEY_CHARS = ('&', '\n', '\r')
+# Default of LazyPlist.get() for missing keys.
+_MISSING = object()
+
 
 class Error(Exception):
   """Base Exception."""
@@ -100,6 +129,10 @@ class BinaryPlistVersionError(BinaryPlistError):
   """The binary plist version is unsupported."""
 
 
+class _LegacyXmlParserRequired(Error):
+  """The fast XML parser does not model this document; use the legacy one."""
+
+
 class UTC(datetime.tzinfo):
   """UTC timezone."""
 
@@ -167,15 +200,25 @@ class ApplePlist(object):
     if plist is not None:
       self.LoadPlist(plist)
 
-  def copy(self):  # pylint: disable=invalid-name
-    """Return a new instance of this plist with the same values."""
+  def copy(self, deep=False):  # pylint: disable=invalid-name
+    """Return a new instance of this plist with the same values.
+
+    Args:
+      deep: bool, default False, True to also copy nested containers, so
+          the new instance can be modified without altering this one.
+    Returns:
+      new instance of this plist class.
+    """
     if not hasattr(self, '_plist'):
       raise PlistNotParsedError
 
     # pylint: disable=protected-access
     new_plist = self.__class__()
     new_plist._validation_hooks = self._validation_hooks
-    new_plist._plist = self._plist.copy()
+    if deep:
+      new_plist._plist = copy_lib.deepcopy(self._plist)
+    else:
+      new_plist._plist = self._plist.copy()
     new_plist._plist_xml = self._plist_xml
     new_plist._plist_xml_encoding = self._plist_xml_encoding
     new_plist._plist_bin = self._plist_bin
@@ -338,6 +381,112 @@ class ApplePlist(object):
     parser.CharacterDataHandler = self._CharacterDataHandler
     return parser
 
+  def _GetFastParser(self, encoding=None):
+    """Return an expat Parser instance using the fast XML handlers.
+
+    Unlike the mode-stack handlers of _GetParser(), these keep one stack of
+    open dict and array values and build each scalar value once, when its
+    element ends.  Output and exceptions are identical to _GetParser():
+    character data of key, integer, real and date elements is only read from
+    its first chunk, a key with no value is its own value, and a value
+    without a key takes any earlier unused key.  Documents with elements
+    nested in scalar or plist elements raise _LegacyXmlParserRequired.
+
+    Args:
+      encoding: str, optional, like 'utf-8'
+    Returns:
+      xml.parsers.expat.XMLParser instance
+    """
+    containers = []  # open dict and array values.
+    keys = []  # keys awaiting their values, from all dicts.
+    top = []  # the first value of the plist element.
+    text = []  # character data chunks, or the converted first chunk.
+    # [plist element started, open scalar element name or None]
+    state = [False, None]
+    converters = {'integer': int, 'real': float}
+    for name, method in _XML_FIRST_CHUNK_ELEMENTS.iteritems():
+      if method:
+        converters[name] = getattr(self, method)
+    parse_data = self._ParseData
+
+    def StartElement(name, attributes):
+      if name not in APPLE_PLIST_ELEMENTS:
+        raise MalformedPlistError('Element %s' % name)
+      if name == 'plist':
+        if state[0]:
+          raise _LegacyXmlParserRequired
+        state[0] = True
+        if 'version' in attributes:
+          self._plist_version = attributes['version']
+        return
+      if not state[0]:
+        raise MalformedPlistError()
+      if state[1] is not None:
+        raise _LegacyXmlParserRequired
+      if name == 'dict':
+        containers.append({})
+      elif name == 'array':
+        containers.append([])
+      else:
+        state[1] = name
+        del text[:]
+
+    def CharacterData(value):
+      name = state[1]
+      if name == 'string' or name == 'data':
+        text.append(value)
+      elif name in _XML_FIRST_CHUNK_ELEMENTS and not text:
+        converter = converters.get(name)
+        text.append(converter(value) if converter else value)
+
+    def EndElement(name):
+      if name == 'plist':
+        self._plist = top[0] if top else None
+        return
+
+      if state[1] is None:
+        value = containers.pop()
+      else:
+        state[1] = None
+        if name == 'string':
+          value = ''.join(text)
+        elif name == 'data':
+          value = parse_data(''.join(text)) if text else None
+        elif name == 'true':
+          value = True
+        elif name == 'false':
+          value = False
+        elif text:
+          value = text[0]
+        elif name == 'key':
+          value = ''
+        else:
+          value = None
+        if name == 'key':
+          keys.append(value)
+
+      if not containers:
+        if not top:
+          top.append(value)
+        return
+      parent = containers[-1]
+      if type(parent) is dict:
+        if not keys:
+          raise MalformedPlistError('Missing key element before value element')
+        if name == 'key':
+          parent[value] = value
+        else:
+          parent[keys.pop()] = value
+      else:
+        parent.append(value)
+
+    parser = xml.parsers.expat.ParserCreate(encoding)
+    parser.StartElementHandler = StartElement
+    parser.EndElementHandler = EndElement
+    parser.XmlDeclHandler = self._XmlDeclHandler
+    parser.CharacterDataHandler = CharacterData
+    return parser
+
   def _ParseDate(self, date_str):
     """Parse a date string.
 
@@ -909,19 +1058,47 @@ class ApplePlist(object):
       self._object_offset[offset_no] = oft
       ofs += int_size
 
-  def Parse(self):
-    """Parse a Plist."""
+  def _XmlParse(self, xml_parser):
+    """Parse a XML plist.
+
+    Args:
+      xml_parser: str, XML parser backend to use, one of XML_PARSERS.
+    Raises:
+      ValueError: xml_parser is unknown.
+    """
+    if xml_parser not in XML_PARSERS:
+      raise ValueError('Unknown XML parser %s' % xml_parser)
+
+    if xml_parser == XML_PARSER_FAST:
+      try:
+        parser = self._GetFastParser()
+        parser.Parse(self._plist_xml)
+        return
+      except _LegacyXmlParserRequired:
+        pass  # parse the whole document again below.
+      except xml.parsers.expat.ExpatError as e:
+        raise MalformedPlistError('%s\n\n%s' % (self._plist_xml, str(e)))
+
+    parser = self._GetParser()
+    try:
+      parser.Parse(self._plist_xml)
+    except xml.parsers.expat.ExpatError as e:
+      raise MalformedPlistError('%s\n\n%s' % (self._plist_xml, str(e)))
+
+  def Parse(self, xml_parser=None):
+    """Parse a Plist.
+
+    Args:
+      xml_parser: str, optional, XML parser backend to use, one of
+          XML_PARSERS; defaults to DEFAULT_XML_PARSER.
+    """
     if hasattr(self, '_plist'):
       raise PlistAlreadyParsedError
 
     if self._plist_bin:
       self._BinaryParse()
     else:
-      parser = self._GetParser()
-      try:
-        parser.Parse(self._plist_xml)
-      except xml.parsers.expat.ExpatError as e:
-        raise MalformedPlistError('%s\n\n%s' % (self._plist_xml, str(e)))
+      self._XmlParse(xml_parser or DEFAULT_XML_PARSER)
 
     if not hasattr(self, '_plist'):
       raise MalformedPlistError('Plist not parsed; invalid XML?')
@@ -1033,26 +1210,45 @@ class ApplePlist(object):
       return self._plist_xml_encoding.lower()
     return None
 
-  def GetXml(self, indent_num=0, xml_doc=True):
+  def GetXml(self, indent_num=0, xml_doc=True, out=None):
     """Returns string XML document.
 
     This function will always return a string, even if the plist is invalid,
-    empty, or unset.
+    empty, or unset, unless out is given.
 
     Args:
       indent_num: int, number of indents to start from
       xml_doc: bool, True to return a fully fledged xml document including
         xml header and footer, False to return a xml string starting from
         the plist node.
+      out: file-like object, optional, e.g. a webapp response.out; if given,
+        the XML is written to it as it is generated and None is returned.
     Returns:
-      str
+      str, or None if out is given.
+    Raises:
+      PlistError: Output of this plist not supported because of its type
+    """
+    if out is None:
+      str_xml = []
+      self._WriteXmlDocument(str_xml.append, indent_num, xml_doc)
+      return ''.join(str_xml)
+    self._WriteXmlDocument(out.write, indent_num, xml_doc)
+
+  def _WriteXmlDocument(self, write, indent_num, xml_doc):
+    """Writes the XML document to a sink; see GetXml().
+
+    Args:
+      write: callable, called with each str or unicode chunk of XML.
+      indent_num: int, number of indents to start from
+      xml_doc: bool, True to write a full xml document.
     Raises:
       PlistError: Output of this plist not supported because of its type
     """
     if not hasattr(self, '_plist'):  # no plist is parsed.
       if xml_doc and getattr(self, '_plist_xml', None):
         # A full XML document was requested and unparsed XML is set, return it.
-        return self._plist_xml
+        write(self._plist_xml)
+        return
       elif getattr(self, '_plist_xml', None):
         # Only the XML contents were requested, so parse the unparsed XML, which
         # creates the _plist property for regular use below.
@@ -1068,19 +1264,16 @@ class ApplePlist(object):
       raise PlistError(
           'Plist contents type is not supported: %s' % type(self._plist))
 
+    if xml_doc:
+      write(PLIST_HEAD)
     # workaround for empty plists, don't try to decode the None
-    # value because of how GetXmlStr() handles them.  at this GetXml()
+    # value because of how _WriteXml() handles them.  at this GetXml()
     # level we know None means NO (0) values, not ONE (1) None value.
-    if self._plist is None:
-      str_xml = ''
-    else:
+    if self._plist is not None:
       # indent +1 from <plist> node if xml_doc
-      str_xml = GetXmlStr(self._plist, indent_num=indent_num + (xml_doc * 1))
-
+      _WriteXml(self._plist, write, indent_num + (xml_doc * 1))
     if xml_doc:
-      return ''.join([PLIST_HEAD, str_xml, PLIST_FOOT])
-    else:
-      return str_xml
+      write(PLIST_FOOT)
 
   def GetXmlContent(self, indent_num=0):
     """Returns only the nodes below the plist node of the XML document.
@@ -1483,6 +1676,220 @@ class AppleSoftwareCatalogPlist(ApplePlist):
     self._changed = True
 
 
+def _IsXmlTokenComplete(m):
+  """Returns True if a _XML_TOKEN_RE start tag match is a whole element."""
+  return bool(m.group(2)) or m.group(3) is not None
+
+
+class LazyPlist(object):
+  """Read-only view of a XML plist which parses values on demand.
+
+  Keys of the top-level dict are indexed on init, and each value is parsed
+  when it is first accessed, so reading a few keys of a large plist does not
+  parse all of it.  Documents the index cannot map exactly to what Parse()
+  would return, like a top-level array or keys with entities, are parsed
+  fully instead.
+
+  Values are returned as Parse() would return them, and must not be modified.
+  Elements are only validated when their value is parsed.
+  """
+
+  def __init__(self, plist_xml):
+    """Initializer.
+
+    Args:
+      plist_xml: str or unicode XML plist; str is assumed to be utf-8.
+    """
+    self._plist_xml = plist_xml
+    self._plist = None  # fully parsed ApplePlist, if not indexed.
+    self._values = {}
+    self._index = self._IndexXml(plist_xml)
+    if self._index is None:
+      self._ParseAll()
+
+  @staticmethod
+  def _IndexXml(plist_xml):
+    """Returns a dict of top-level keys to their value's XML offsets.
+
+    Args:
+      plist_xml: str or unicode XML plist.
+    Returns:
+      dict of unicode key to (int start, int end) offsets of the value
+      element, or None if the plist cannot be indexed.
+    """
+    for markup in _XML_UNINDEXABLE_MARKUP:
+      if markup in plist_xml:
+        return None
+
+    tokens = _XML_TOKEN_RE.finditer(plist_xml)
+    m = next(tokens, None)
+    if m is None or m.group(1) != 'plist' or _IsXmlTokenComplete(m):
+      return None
+    m = next(tokens, None)
+    if m is None or m.group(1) != 'dict':
+      return None
+
+    index = {}
+    in_dict = not _IsXmlTokenComplete(m)
+    while in_dict:  # until the end of the top-level dict.
+      m = next(tokens, None)
+      if m is None:
+        return None
+      elif m.group(4) == 'dict':
+        in_dict = False
+        continue
+      key = m.group(3)
+      if m.group(1) != 'key' or key is None:
+        return None
+      for c in _XML_UNINDEXABLE_KEY_CHARS:
+        if c in key:
+          return None
+      if type(key) is not unicode:
+        key = key.decode('utf-8')
+
+      m = next(tokens, None)
+      if m is None:
+        return None
+      value_start = m.start()
+      value_end = LazyPlist._SkipValue(tokens, m)
+      if value_end is None:
+        return None
+      index[key] = (value_start, value_end)
+
+    m = next(tokens, None)
+    if m is None or m.group(4) != 'plist':
+      return None
+    if next(tokens, None) is not None:
+      return None
+    return index
+
+  @staticmethod
+  def _SkipValue(tokens, m):
+    """Skips the tokens of a value element, checking its structure.
+
+    Args:
+      tokens: iterator of _XML_TOKEN_RE matches.
+      m: _XML_TOKEN_RE match of the value element's first token.
+    Returns:
+      int offset of the end of the value element, or None if it contains
+      elements the XML parsers would not map one to one, like a key without a
+      value or an element in a string.
+    """
+    stack = []  # [open dict or array name, dict awaiting a value for its key]
+    while True:
+      name = m.group(1)
+      if name:
+        if name not in APPLE_PLIST_ELEMENTS or name == 'plist':
+          return None
+        elif not stack or stack[-1][0] == 'array':
+          if name == 'key':
+            return None
+        elif (name == 'key') == stack[-1][1]:
+          return None  # a key without a value, or a value without a key.
+        if not _IsXmlTokenComplete(m):
+          if name != 'dict' and name != 'array':
+            return None  # an element in a scalar element.
+          stack.append([name, False])
+          m = next(tokens, None)
+          if m is None:
+            return None
+          continue
+      else:
+        name = m.group(4)
+        if not stack or stack[-1] != [name, False]:
+          return None
+        stack.pop()
+
+      # an element has ended.
+      if not stack:
+        return m.end()
+      if stack[-1][0] == 'dict':
+        stack[-1][1] = name == 'key'
+      m = next(tokens, None)
+      if m is None:
+        return None
+
+  def _ParseAll(self):
+    """Parses the whole plist, for when values cannot be parsed alone."""
+    plist_xml = self._plist_xml
+    if type(plist_xml) is unicode:
+      plist_xml = plist_xml.encode('utf-8')
+    plist = ApplePlist(plist_xml)
+    plist.Parse()
+    self._plist = plist
+    self._index = None
+    self._values = {}
+
+  def _ParseValue(self, key):
+    """Parses the value of an indexed key into self._values.
+
+    The key and value are parsed as a dict of their own, which must have
+    only that key, else the whole plist is parsed.
+
+    Args:
+      key: unicode, indexed key.
+    """
+    start, end = self._index[key]
+    plist = ApplePlist()
+    plist._LoadDocument(  # pylint: disable=protected-access
+        '<plist><dict><key>%s</key>%s</dict></plist>' % (
+            key.encode('utf-8'), self._ToUtf8(self._plist_xml[start:end])))
+    plist._XmlParse(XML_PARSER_FAST)  # pylint: disable=protected-access
+    contents = plist.GetContents()
+    if type(contents) is dict and contents.keys() == [key]:
+      self._values[key] = contents[key]
+    else:
+      self._ParseAll()
+
+  def _GetPlistXml(self):
+    """Returns the XML plist this view is of."""
+    return self._plist_xml
+
+  plist_xml = property(_GetPlistXml)
+
+  @staticmethod
+  def _ToUtf8(s):
+    """Returns s encoded in utf-8, if it is unicode."""
+    if type(s) is unicode:
+      return s.encode('utf-8')
+    return s
+
+  def get(self, k, default=None):  # pylint: disable=g-bad-name
+    """Standard python dict get method."""
+    if self._plist is not None:
+      return self._plist.get(k, default)
+    if k not in self._values:
+      if k not in self._index:
+        return default
+      self._ParseValue(k)
+      if self._plist is not None:
+        return self._plist.get(k, default)
+    return self._values[k]
+
+  def __getitem__(self, k):
+    """Standard python __getitem__ method."""
+    value = self.get(k, _MISSING)
+    if value is _MISSING:
+      raise KeyError(k)
+    return value
+
+  def __contains__(self, k):
+    """Standard python __contains__ method."""
+    if self._plist is not None:
+      return k in self._plist
+    return k in self._index
+
+  def __iter__(self):
+    """Standard python __iter__ method."""
+    if self._plist is not None:
+      return iter(self._plist)
+    return iter(self._index.keys())
+
+  def keys(self):  # pylint: disable=g-bad-name
+    """Standard python dict keys method."""
+    return list(self)
+
+
 def EscapeString(s):
   """Given a string, return a XML-escaped version.
 
@@ -1491,7 +1898,103 @@ def EscapeString(s):
   Returns:
     str
   """
-  return xml.sax.saxutils.escape(s)
+  # Most plist strings contain nothing to escape; skip the three replaces.
+  if '&' in s or '<' in s or '>' in s:
+    return xml.sax.saxutils.escape(s)
+  return s
+
+
+# Indent strings by depth, grown on demand by _GetIndent().
+_INDENTS = [INDENT_CHAR * i for i in xrange(16)]
+
+
+def _GetIndent(indent_num):
+  """Returns the indent string for a nesting depth."""
+  while indent_num >= len(_INDENTS):
+    _INDENTS.append(INDENT_CHAR * len(_INDENTS))
+  return _INDENTS[indent_num]
+
+
+def _WriteDict(xml_dict, write, indent_num):
+  """Writes the XML representation of a dict; see _WriteXml()."""
+  indent = _GetIndent(indent_num)
+  child_indent = _GetIndent(indent_num + 1)
+  write(indent + '<dict>')
+  for key in sorted(xml_dict):
+    write('\n' + child_indent + '<key>' + EscapeString(key) + '</key>\n')
+    _WriteXml(xml_dict[key], write, indent_num + 1)
+  write('\n' + indent + '</dict>')
+
+
+def _WriteSequence(sequence, write, indent_num):
+  """Writes the XML representation of a list or tuple; see _WriteXml()."""
+  indent = _GetIndent(indent_num)
+  write(indent + '<array>')
+  for value in sequence:
+    write('\n')
+    _WriteXml(value, write, indent_num + 1)
+  write('\n' + indent + '</array>')
+
+
+def _WriteXml(value, write, indent_num):
+  """Writes the XML representation of a value, in one pass, to a sink.
+
+  Nested values are separated by newlines; no trailing newline is written.
+
+  Args:
+    value: any supported type: list, tuple, dict, str, unicode, int.
+    write: callable, called with each str or unicode chunk of XML.
+    indent_num: integer; how many times to indent output.
+  Raises:
+    PlistError: a plist type is not supported in output
+  """
+  indent = _GetIndent(indent_num)
+  value_type = type(value)
+  if value_type is str or value_type is unicode:
+    write(indent + '<string>' + EscapeString(value) + '</string>')
+  elif value_type is dict:
+    _WriteDict(value, write, indent_num)
+  elif value_type is list or value_type is tuple:
+    _WriteSequence(value, write, indent_num)
+  elif value_type is int:
+    write('%s<integer>%d</integer>' % (indent, value))
+  elif value_type is float:
+    write('%s<real>%f</real>' % (indent, value))
+  elif value_type is bool:
+    if value:
+      write(indent + '<true/>')
+    else:
+      write(indent + '<false/>')
+  elif value_type is datetime.datetime:
+    date_str = value.strftime(PLIST_DATE_FORMAT)
+    write(indent + '<date>' + date_str + '</date>')
+  elif value_type is type(None):
+    # NOTE(user):  This is not the defined behavior if we use plutil(1)
+    # as a reference.  plutil is unwilling to convert binary plists
+    # with null type values into XML.
+    write(indent + '<string></string>')
+  elif value.__class__ is AppleUid:
+    write('%s<dict><key>CF$UID</key><integer>%s</integer></dict>' % (
+        indent, value))
+  elif value.__class__ is AppleData:
+    write(indent + '<data>' + base64.b64encode(value) + '</data>')
+  elif issubclass(value.__class__, ApplePlist):
+    write(value.GetXmlContent(indent_num=indent_num))
+  else:
+    raise PlistError('Value type %s not supported: %s', value_type, value)
+
+
+def WriteXml(value, out, indent_num=None):
+  """Writes XML representation of a variable to a file-like object.
+
+  Args:
+    value: any supported type: list, tuple, dict, str, unicode, int.
+    out: file-like object with a write() method, e.g. a webapp response.out.
+    indent_num: optional integer; how many times to indent output.
+  Raises:
+    PlistError: a plist type is not supported in output
+  """
+  _WriteXml(value, out.write, indent_num or 0)
 
 
 def DictToXml(xml_dict, indent_num=None):
@@ -1503,19 +2006,9 @@ def DictToXml(xml_dict, indent_num=None):
   Returns:
     String XML.
   """
-  if indent_num is None:
-    indent_num = 0
-  indent = INDENT_CHAR * indent_num
-  child_indent = INDENT_CHAR * (indent_num + 1)
   str_xml = []
-  str_xml.append('%s<dict>' % indent)
-
-  for key in sorted(xml_dict):
-    value = xml_dict[key]
-    str_xml.append('%s<key>%s</key>' % (child_indent, EscapeString(key)))
-    str_xml.append(GetXmlStr(value, indent_num=indent_num + 1))
-  str_xml.append('%s</dict>' % indent)
-  return '\n'.join(str_xml)
+  _WriteDict(xml_dict, str_xml.append, indent_num or 0)
+  return ''.join(str_xml)
 
 
 def SequenceToXml(sequence, indent_num=None):
@@ -1527,15 +2020,9 @@ def SequenceToXml(sequence, indent_num=None):
   Returns:
     String XML.
   """
-  if indent_num is None:
-    indent_num = 0
-  indent = INDENT_CHAR * indent_num
   str_xml = []
-  str_xml.append('%s<array>' % indent)
-  for value in sequence:
-    str_xml.append(GetXmlStr(value, indent_num=indent_num + 1))
-  str_xml.append('%s</array>' % indent)
-  return '\n'.join(str_xml)
+  _WriteSequence(sequence, str_xml.append, indent_num or 0)
+  return ''.join(str_xml)
 
 
 def GetXmlStr(value, indent_num=None):
@@ -1549,46 +2036,9 @@ def GetXmlStr(value, indent_num=None):
   Raises:
     PlistError: a plist type is not supported in output
   """
-  # TODO(user): refactor and write unit tests.
-  if indent_num is None:
-    indent_num = 0
-  indent = INDENT_CHAR * indent_num
   str_xml = []
-  value_type = type(value)
-  if value_type is list or value_type is tuple:
-    str_xml.append(SequenceToXml(value, indent_num=indent_num))
-  elif value_type is dict:
-    str_xml.append(DictToXml(value, indent_num=indent_num))
-  elif value_type is str or value_type is unicode:
-    str_xml.append('%s<string>%s</string>' % (indent, EscapeString(value)))
-  elif value_type is int:
-    str_xml.append('%s<integer>%d</integer>' % (indent, value))
-  elif value_type is float:
-    str_xml.append('%s<real>%f</real>' % (indent, value))
-  elif value_type is bool:
-    if value:
-      str_xml.append('%s<true/>' % indent)
-    else:
-      str_xml.append('%s<false/>' % indent)
-  elif value_type is datetime.datetime:
-    date_str = value.strftime(PLIST_DATE_FORMAT)
-    str_xml.append('%s<date>%s</date>' % (indent, date_str))
-  elif value_type is type(None):
-    # NOTE(user):  This is not the defined behavior if we use plutil(1)
-    # as a reference.  plutil is unwilling to convert binary plists
-    # with null type values into XML.
-    str_xml.append('%s<string></string>' % indent)
-  elif value.__class__ is AppleUid:
-    str_xml.append(
-        '%s<dict><key>CF$UID</key><integer>%s</integer></dict>' % (
-            indent, value))
-  elif value.__class__ is AppleData:
-    str_xml.append('%s<data>%s</data>' % (indent, base64.b64encode(value)))
-  elif issubclass(value.__class__, ApplePlist):
-    str_xml.append(value.GetXmlContent(indent_num=indent_num))
-  else:
-    raise PlistError('Value type %s not supported: %s', value_type, value)
-  return '\n'.join(str_xml)
+  _WriteXml(value, str_xml.append, indent_num or 0)
+  return ''.join(str_xml)
 
 
 def UpdateIterable(o, ki, value=None, default=None, op=None):
@@ -56,6 +56,7 @@ class AuthTestingBase(mox.MoxTestBase):
   def setUp(self):
     mox.MoxTestBase.setUp(self)
     self.stubs = stubout.StubOutForTesting()
+    base.Auth1.ClearCaches()
     self.ba = self.GetTestClass()
 
   def tearDown(self):
@@ -1309,6 +1310,75 @@ class Auth1Test(AuthTestingBase):
     self.assertEqual(self.ba._auth_state, base.AuthState.OK)
     self.mox.VerifyAll()
 
+  def testInputStep2WhenCachedCert(self):
+    """Test Input() reuses a client cert verified by an earlier Input()."""
+    m = 'c cn sn'
+    s = 'b64sig'
+    c = 'cert'
+    cn = '12345'
+    sn = '12345'
+    uuid = 'subjectcn'
+    mock_client_cert = self.mox.CreateMockAnything()
+    token = 'token1234'
+
+    self.mox.StubOutWithMock(self.ba, '_SplitMessage')
+    self.mox.StubOutWithMock(self.ba, 'SessionDelCn')
+    self.mox.StubOutWithMock(base.base64, 'urlsafe_b64decode')
+    self.mox.StubOutWithMock(self.ba, 'LoadOtherCert')
+    self.mox.StubOutWithMock(self.ba, 'VerifyCertSignedByCA')
+    self.mox.StubOutWithMock(self.ba, 'VerifyDataSignedWithCert')
+    self.mox.StubOutWithMock(self.ba, 'SessionVerifyKnownCnSn')
+    self.mox.StubOutWithMock(self.ba, 'SessionCreateAuthToken')
+    self.mox.StubOutWithMock(self.ba, '_AddOutput')
+
+    # first login loads and verifies the client cert.
+    self.ba._SplitMessage(m, 3).AndReturn([c, cn, sn])
+    base.base64.urlsafe_b64decode(s).AndReturn(s)
+    base.base64.urlsafe_b64decode(c).AndReturn(c)
+    self.ba.LoadOtherCert(c).AndReturn(mock_client_cert)
+    mock_client_cert.GetPublicKey().AndReturn(True)
+    mock_client_cert.SetRequiredIssuer(self.ba._required_issuer)
+    mock_client_cert.CheckAll().AndReturn(None)
+    mock_client_cert.GetSubject().AndReturn(uuid)
+    self.ba.VerifyCertSignedByCA(mock_client_cert).AndReturn(True)
+    self.ba.VerifyDataSignedWithCert(m, s, mock_client_cert).AndReturn(True)
+    self.ba.SessionVerifyKnownCnSn(cn, sn).AndReturn(True)
+    self.ba.SessionCreateAuthToken(uuid).AndReturn(token)
+    self.ba._AddOutput(token).AndReturn(None)
+    self.ba.SessionDelCn(cn)
+    # second login only rechecks the cert validity window.
+    self.ba._SplitMessage(m, 3).AndReturn([c, cn, sn])
+    base.base64.urlsafe_b64decode(s).AndReturn(s)
+    base.base64.urlsafe_b64decode(c).AndReturn(c)
+    mock_client_cert.CheckValidity().AndReturn(None)
+    self.ba.VerifyDataSignedWithCert(m, s, mock_client_cert).AndReturn(True)
+    self.ba.SessionVerifyKnownCnSn(cn, sn).AndReturn(True)
+    self.ba.SessionCreateAuthToken(uuid).AndReturn(token)
+    self.ba._AddOutput(token).AndReturn(None)
+    self.ba.SessionDelCn(cn)
+
+    self.mox.ReplayAll()
+    self.ba.Input(m=m, s=s)
+    self.ba.Input(m=m, s=s)
+    self.assertEqual(self.ba._auth_state, base.AuthState.OK)
+    self.mox.VerifyAll()
+
+  def testVerifyCertSignedByCACachesCaCert(self):
+    """Test VerifyCertSignedByCA() parses the CA cert once."""
+    self.mox.StubOutWithMock(self.ba, 'LoadOtherCert')
+    self.ba._ca_pem = 'ca pem'
+    mock_ca_cert = self.mox.CreateMockAnything()
+    mock_cert = self.mox.CreateMockAnything()
+    self.ba.LoadOtherCert(self.ba._ca_pem).AndReturn(mock_ca_cert)
+    mock_cert.IsSignedBy(mock_ca_cert).AndReturn(True)
+    mock_cert.IsSignedBy(mock_ca_cert).AndReturn(True)
+    self.mox.ReplayAll()
+    self.assertTrue(self.ba.VerifyCertSignedByCA(mock_cert))
+    other = base.Auth1()
+    other._ca_pem = 'ca pem'
+    self.assertTrue(other.VerifyCertSignedByCA(mock_cert))
+    self.mox.VerifyAll()
+
   def testInputWhenArgumentFailures(self):
     """Test Input()."""
     self.mox.ReplayAll()
@@ -536,6 +536,86 @@ class Auth1ServerDatastoreMemcacheSessionTest(DatastoreModelTest):
     self.ams.Delete(session)
     self.mox.VerifyAll()
 
+  def testPutMemcacheOnly(self):
+    """Test _Put() with a memcache-only session."""
+    sid = 'cn_12345'
+    self.ams.MEMCACHE_ONLY_PREFIXES = ('cn_',)
+    session = self._GetMockSession(sid)
+    self._MockMemcache(
+        'add', self._Key(sid), value=session,
+        time=self.ams.memcache_only_ttl).AndReturn(True)
+
+    self.mox.ReplayAll()
+    self.ams._Put(session)
+    self.mox.VerifyAll()
+
+  def testPutMemcacheOnlyWhenExists(self):
+    """Test _Put() does not replace an existing memcache-only session."""
+    sid = 'cn_12345'
+    self.ams.MEMCACHE_ONLY_PREFIXES = ('cn_',)
+    session = self._GetMockSession(sid)
+    self._MockMemcache(
+        'add', self._Key(sid), value=session,
+        time=self.ams.memcache_only_ttl).AndReturn(False)
+    self._MockMemcache('get', self._Key(sid)).AndReturn('existing')
+
+    self.mox.ReplayAll()
+    self.ams._Put(session)
+    self.mox.VerifyAll()
+
+  def testPutMemcacheOnlyWhenMemcacheUnavailable(self):
+    """Test _Put() falls back to datastore if memcache is unavailable."""
+    sid = 'cn_12345'
+    self.ams.MEMCACHE_ONLY_PREFIXES = ('cn_',)
+    fallbacks = self.ams.GetMemcacheOnlyStats()['fallbacks']
+    session = self._GetMockSession(sid)
+    self._MockMemcache(
+        'add', self._Key(sid), value=session,
+        time=self.ams.memcache_only_ttl).AndReturn(False)
+    self._MockMemcache('get', self._Key(sid)).AndReturn(None)
+    self._MockSuper('_Put', session).AndReturn(None)
+
+    self.mox.ReplayAll()
+    self.ams._Put(session)
+    self.assertEqual(
+        fallbacks + 1, self.ams.GetMemcacheOnlyStats()['fallbacks'])
+    self.mox.VerifyAll()
+
+  def testDeleteByIdMemcacheOnly(self):
+    """Test DeleteById() with a memcache-only session."""
+    sid = 'cn_12345'
+    self.ams.MEMCACHE_ONLY_PREFIXES = ('cn_',)
+    self._MockMemcache(
+        'delete', self._Key(sid)).AndReturn(
+            gaeserver.memcache.DELETE_ITEM_MISSING)
+
+    self.mox.ReplayAll()
+    self.ams.DeleteById(sid)
+    self.mox.VerifyAll()
+
+  def testClaim(self):
+    """Test Claim()."""
+    self._MockMemcache(
+        'delete', self._Key(self.sid)).AndReturn(
+            gaeserver.memcache.DELETE_SUCCESSFUL)
+
+    self.mox.ReplayAll()
+    self.assertTrue(self.ams.Claim(self.sid))
+    self.mox.VerifyAll()
+
+  def testClaimWhenNotInMemcache(self):
+    """Test Claim() with a session not in memcache."""
+    self._MockMemcache(
+        'delete', self._Key(self.sid)).AndReturn(
+            gaeserver.memcache.DELETE_ITEM_MISSING)
+    self.mox.StubOutWithMock(gaeserver.db, 'run_in_transaction')
+    gaeserver.db.run_in_transaction(
+        self.ams._ClaimFromDatastore, self.sid).AndReturn(False)
+
+    self.mox.ReplayAll()
+    self.assertFalse(self.ams.Claim(self.sid))
+    self.mox.VerifyAll()
+
 
 class AuthSessionSimianServer(mox.MoxTestBase, test.AppengineTest):
   """Test AuthSessionSimianServer class."""
@@ -596,6 +676,20 @@ class AuthSessionSimianServer(mox.MoxTestBase, test.AppengineTest):
         self.asps.SESSION_TYPE_PREFIX_CN,
         gaeserver.base.AGE_CN_SECONDS)
 
+  def testPutSetsExpiresAt(self):
+    """Test _Put() sets expires_at from the session age."""
+    self.asps.SetToken('123', state='OK', uuid='uuid', level=0)
+    self.asps.SetToken(
+        '456', state='OK', uuid='uuid', level=gaeserver.LEVEL_APPLESUS)
+
+    for key_name, age_seconds in (
+        ('t_123', gaeserver.base.AGE_TOKEN_SECONDS),
+        ('t_456', gaeserver.base.AGE_APPLESUS_TOKEN_SECONDS)):
+      session = models.AuthSession.get_by_key_name(key_name)
+      self.assertEqual(
+          session.mtime + datetime.timedelta(seconds=age_seconds),
+          session.expires_at)
+
 
 class AuthSimianServer(mox.MoxTestBase, test.AppengineTest):
   """Test AuthSimianServer class."""
@@ -605,6 +699,7 @@ class AuthSimianServer(mox.MoxTestBase, test.AppengineTest):
 
     mox.MoxTestBase.setUp(self)
     self.stubs = stubout.StubOutForTesting()
+    gaeserver._stateless_token_secret_cache.Clear()
     self.aps = gaeserver.AuthSimianServer()
 
   def tearDown(self):
@@ -697,6 +792,77 @@ class AuthSimianServer(mox.MoxTestBase, test.AppengineTest):
 
     self.assertRaises(gaeserver.NotAuthenticated, gaeserver.DoMunkiAuth)
 
+  def testSessionVerifyKnownCnSn(self):
+    """Test a Cn/Sn pair is kept in memcache only and can be claimed once."""
+    self.aps.SessionSetCnSn('12345', '67890')
+    self.assertEqual(0, len(models.AuthSession.all().fetch(None)))
+
+    self.assertFalse(self.aps.SessionVerifyKnownCnSn('12345', '11111'))
+    self.assertTrue(self.aps.SessionVerifyKnownCnSn('12345', '67890'))
+    self.assertFalse(self.aps.SessionVerifyKnownCnSn('12345', '67890'))
+
+  def testStatelessAuthToken(self):
+    """Test stateless tokens are verified without sessions, and revoked."""
+    models.Settings.SetItem('stateless_auth_tokens', True)
+    models.Settings.SetItem('auth_token_secret', 'secret')
+
+    token = self.aps.SessionCreateUserAuthToken('long_uuid')
+    self.assertTrue(token.startswith(gaeserver.STATELESS_TOKEN_PREFIX))
+    self.assertEqual(0, len(models.AuthSession.all().fetch(None)))
+
+    os.environ['HTTP_COOKIE'] = '%s=%s' % (auth.AUTH_TOKEN_COOKIE, token)
+    session = gaeserver.DoMunkiAuth()
+    self.assertEqual('long_uuid', session.uuid)
+    self.assertEqual(gaeserver.LEVEL_BASE, session.level)
+    self.assertRaises(
+        gaeserver.NotAuthenticated, gaeserver.DoMunkiAuth,
+        require_level=gaeserver.LEVEL_ADMIN)
+
+    gaeserver.LogoutSession(session)
+    self.assertRaises(gaeserver.NotAuthenticated, gaeserver.DoMunkiAuth)
+    self.assertEqual(0, len(models.AuthSession.all().fetch(None)))
+
+    # tokens issued later, or of another level, are not revoked, and are
+    # verified with no Datastore RPC.
+    self.mox.StubOutWithMock(gaeserver.models.AuthSession, 'get_by_key_name')
+    self.mox.ReplayAll()
+    for level, issued in [
+        (gaeserver.LEVEL_BASE, session.issued + 1),
+        (gaeserver.LEVEL_APPLESUS, session.issued)]:
+      os.environ['HTTP_COOKIE'] = '%s=%s' % (
+          auth.AUTH_TOKEN_COOKIE, gaeserver.CreateStatelessToken(
+              'secret', 'long_uuid', level, now=issued))
+      self.assertEqual('long_uuid', gaeserver.DoMunkiAuth(
+          require_level=gaeserver.LEVEL_APPLESUS).uuid)
+    self.mox.VerifyAll()
+
+  def testParseStatelessToken(self):
+    """Test ParseStatelessToken() with tampered and expired tokens."""
+    token = gaeserver.CreateStatelessToken(
+        'secret', 'uuid', gaeserver.LEVEL_BASE, now=1000)
+    expires = 1000 + gaeserver.base.AGE_TOKEN_SECONDS
+
+    session = gaeserver.ParseStatelessToken('secret', token, now=1001)
+    self.assertEqual('uuid', session.uuid)
+    self.assertEqual(expires, session.expires)
+    self.assertEqual(
+        datetime.datetime.utcfromtimestamp(1000), session.mtime)
+
+    self.assertEqual(
+        None, gaeserver.ParseStatelessToken('other', token, now=1001))
+    self.assertEqual(
+        None, gaeserver.ParseStatelessToken('secret', token, now=expires))
+    payload, signature = token.split('.')[1:]
+    forged = gaeserver.CreateStatelessToken(
+        'secret', 'other_uuid', gaeserver.LEVEL_ADMIN, now=1000)
+    self.assertEqual(None, gaeserver.ParseStatelessToken(
+        'secret', '%s%s.%s' % (
+            gaeserver.STATELESS_TOKEN_PREFIX, forged.split('.')[1],
+            signature), now=1001))
+    self.assertEqual(None, gaeserver.ParseStatelessToken(
+        'secret', '%s%s' % (gaeserver.STATELESS_TOKEN_PREFIX, payload),
+        now=1001))
+
 
 def main(unused_argv):
   basetest.main()
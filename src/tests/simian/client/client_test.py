@@ -405,6 +405,68 @@ class HTTPSMultiBodyConnectionTest(basetest.TestCase):
             [mock.call.set_cipher_list(client._CIPHER_LIST)])
 
 
+class ConnectionPoolTest(basetest.TestCase):
+  """Test ConnectionPool class."""
+
+  def setUp(self):
+    super(ConnectionPoolTest, self).setUp()
+    self.pool = client.ConnectionPool(idle_secs=30, max_idle=1)
+
+  @mock.patch.object(client.time, 'time')
+  def testGetAndPut(self, mock_time):
+    """Test Get() reuses connections returned with Put()."""
+    mock_time.return_value = 100
+    conn1 = mock.Mock()
+    conn2 = mock.Mock()
+    connect = mock.Mock(side_effect=[conn1, conn2])
+
+    self.assertEqual((conn1, False), self.pool.Get('key', connect))
+    self.pool.Put('key', conn1)
+    self.assertEqual((conn1, True), self.pool.Get('key', connect))
+    self.assertEqual((conn2, False), self.pool.Get('key', connect))
+
+    # only max_idle connections are kept.
+    self.pool.Put('key', conn1)
+    self.pool.Put('key', conn2)
+    conn2.close.assert_called_once_with()
+    self.assertEqual(
+        {'opened': 2, 'reused': 1, 'retried': 0, 'idle': 1},
+        self.pool.GetStats())
+
+  @mock.patch.object(client.time, 'time')
+  def testGetWhenIdleTooLong(self, mock_time):
+    """Test Get() closes connections idle for too long."""
+    mock_time.return_value = 100
+    conn1 = mock.Mock()
+    conn2 = mock.Mock()
+    self.pool.Put('key', conn1)
+
+    mock_time.return_value = 131
+    self.assertEqual(
+        (conn2, False), self.pool.Get('key', mock.Mock(return_value=conn2)))
+    conn1.close.assert_called_once_with()
+
+
+class BandwidthLimiterTest(basetest.TestCase):
+  """Test BandwidthLimiter class."""
+
+  @mock.patch.object(client.time, 'sleep')
+  @mock.patch.object(client.time, 'time', return_value=100)
+  def testConsume(self, mock_time, mock_sleep):
+    """Test Consume() sleeps off bytes beyond the limit."""
+    limiter = client.BandwidthLimiter(1000)
+    limiter.Consume(1000)
+    self.assertFalse(mock_sleep.called)
+
+    limiter.Consume(500)
+    mock_sleep.assert_called_once_with(0.5)
+
+    mock_time.return_value = 102
+    mock_sleep.reset_mock()
+    limiter.Consume(500)
+    self.assertFalse(mock_sleep.called)
+
+
 class HttpsClientTest(basetest.TestCase):
   """Test HttpsClient class."""
 
@@ -532,6 +594,16 @@ class HttpsClientTest(basetest.TestCase):
     test_client = client.HttpsClient(self.hostname, proxy='proxyhost:123')
     self._TestConnect(test_client, 'proxyhost', 123)
 
+  def testAdaptReadSize(self):
+    """Test _AdaptReadSize()."""
+    read_min = client.DOWNLOAD_READ_MIN
+    self.assertEqual(read_min * 2, client._AdaptReadSize(read_min, read_min, 0))
+    self.assertEqual(read_min, client._AdaptReadSize(read_min, 10, 0))
+    self.assertEqual(read_min, client._AdaptReadSize(read_min * 2, 10, 5))
+    self.assertEqual(
+        client.DOWNLOAD_READ_MAX,
+        client._AdaptReadSize(client.DOWNLOAD_READ_MAX, read_min, 0.1))
+
   def testGetResponseNoFile(self):
     """Test _GetResponse() storing body directly into response obj."""
     headers = {'foo': 1}
@@ -641,6 +713,54 @@ class HttpsClientTest(basetest.TestCase):
   def testDoRequestResponse(self):
     self._TestDoRequestResponse(self.client, '/url', '/url')
 
+  def testDoRequestResponseReusesConnection(self):
+    """Test _DoRequestResponse() keeps connections alive for reuse."""
+    pool = client.ConnectionPool()
+    self.stubs.Set(client, '_connection_pool', pool)
+    conn = mock.create_autospec(httplib.HTTPConnection)
+    conn.sock = mock.Mock()
+    response = mock.Mock(status=200)
+    self.stubs.Set(self.client, '_Request', mock.Mock())
+    self.stubs.Set(
+        self.client, '_GetResponse', mock.Mock(return_value=response))
+
+    with mock.patch.object(
+        self.client, '_Connect', return_value=conn) as connect_mock:
+      self.client._DoRequestResponse('GET', '/url')
+      self.client._DoRequestResponse('GET', '/url')
+      connect_mock.assert_called_once_with()
+
+    self.assertEqual(1, pool.GetStats()['reused'])
+    self.assertEqual(1, pool.GetStats()['idle'])
+
+  def testDoRequestResponseRetriesStaleConnection(self):
+    """Test _DoRequestResponse() reconnects if a pooled connection is stale."""
+    pool = client.ConnectionPool()
+    self.stubs.Set(client, '_connection_pool', pool)
+    stale_conn = mock.create_autospec(httplib.HTTPConnection)
+    conn = mock.create_autospec(httplib.HTTPConnection)
+    conn.sock = None  # server closes the connection after this response.
+    pool.Put(self.client._GetPoolKey(), stale_conn)
+    body = mock.Mock()
+    body.tell.return_value = 5
+    response = mock.Mock(status=200)
+    request_mock = mock.Mock()
+    self.stubs.Set(self.client, '_Request', request_mock)
+    self.stubs.Set(self.client, '_GetResponse', mock.Mock(
+        side_effect=[client.httplib.BadStatusLine(''), response]))
+
+    with mock.patch.object(self.client, '_Connect', return_value=conn):
+      self.assertEqual(
+          response, self.client._DoRequestResponse('POST', '/url', body))
+
+    stale_conn.close.assert_called_once_with()
+    body.seek.assert_called_once_with(5, client.SEEK_SET)
+    request_mock.assert_has_calls([
+        mock.call('POST', stale_conn, '/url', body=body, headers=None),
+        mock.call('POST', conn, '/url', body=body, headers=None)])
+    self.assertEqual(
+        {'opened': 1, 'reused': 1, 'retried': 1, 'idle': 0}, pool.GetStats())
+
   def testDoHttpRequestResponseWithHttpProxy(self):
     """Test a https request via a http proxy."""
     test_client = client.HttpsClient(
@@ -895,6 +1015,29 @@ class HttpsAuthClientTest(basetest.TestCase):
     with mock.patch.object(client.os, 'geteuid', return_value=0):
       self.assertEqual(facter, self.client.GetFacter(open_fn=self.fake_open))
 
+  @mock.patch.object(client.time, 'time', return_value=200)
+  def testReadFacterCacheWhenStale(self, _):
+    """Test ReadFacterCache() ignores caches by age and mtime."""
+    file_path = '/x'
+    fake_file = self.fs.CreateFile(file_path, contents='foo => bar\n')
+    fake_file.st_uid = 0
+    fake_file.st_mtime = 100
+
+    with mock.patch.object(client.os, 'geteuid', return_value=0):
+      self.assertEqual(
+          {'foo': 'bar'},
+          client.ReadFacterCache(
+              file_path, max_age=150, not_before=100,
+              open_fn=self.fake_open))
+      self.assertEqual(
+          None,
+          client.ReadFacterCache(
+              file_path, max_age=50, open_fn=self.fake_open))
+      self.assertEqual(
+          None,
+          client.ReadFacterCache(
+              file_path, not_before=101, open_fn=self.fake_open))
+
   def testGetFacterWhenInsecureFileForRoot(self):
     """Test GetFacter()."""
     file_path = '/x'
@@ -1082,7 +1225,7 @@ class SimianClientTest(basetest.TestCase):
     name = 'name'
     self.GenericStubTest(
         self.client.GetPackage, [name],
-        '_SimianRequest', 'GET', '/pkgs/%s' % name, output_filename=None)
+        '_SimianRequest', 'GET', '/pkgs/%s' % name)
 
   def testGetPackageInfo(self):
     """Test GetPackageInfo()."""
@@ -1110,15 +1253,61 @@ class SimianClientTest(basetest.TestCase):
         response,
         'GET', '/pkgsinfo/%s?hash=1' % filename, full_response=True)
 
-  def testDownloadPackage(self):
-    """Test DownloadPackage()."""
+  @mock.patch.object(client.time, 'sleep')
+  @mock.patch.object(client, 'PartialDownload')
+  def testDownloadPackage(self, partial_download_mock, _):
+    """Test DownloadPackage() resumes an interrupted download."""
     filename = 'foo'
+    download = partial_download_mock.return_value
+    download.GetResumeHeaders.side_effect = [
+        {}, {'Range': 'bytes=5-', 'If-Range': '"etag"'}]
+    download.Finish.return_value = True
+    response = client.Response(status=httplib.PARTIAL_CONTENT)
 
-    self.GenericStubTest(
-        self.client.DownloadPackage,
-        [filename],
-        '_SimianRequest', 'GET',
-        '/pkgs/%s' % filename, output_filename=filename)
+    with mock.patch.object(
+        self.client, '_DoRequestResponse',
+        side_effect=[client.HTTPError, response]) as do_mock:
+      self.assertEqual(None, self.client.DownloadPackage(filename))
+
+    partial_download_mock.assert_called_once_with(filename)
+    do_mock.assert_has_calls([
+        mock.call('GET', '/pkgs/foo', headers={}, output_file=download),
+        mock.call(
+            'GET', '/pkgs/foo',
+            headers={'Range': 'bytes=5-', 'If-Range': '"etag"'},
+            output_file=download)])
+    download.Finish.assert_called_once_with()
+
+  def testPartialDownload(self):
+    """Test PartialDownload resumes and verifies a download."""
+    data = 'package data'
+    etag = client.hashlib.sha256(data).hexdigest()
+    tmpdir = client.tempfile.mkdtemp()
+    filename = client.os.path.join(tmpdir, 'foo.dmg')
+
+    download = client.PartialDownload(filename)
+    progress_callback = mock.Mock()
+    download.SetProgressCallback(progress_callback)
+    self.assertEqual({}, download.GetResumeHeaders())
+    download.BeginResponse(
+        httplib.OK, {'etag': etag, 'content-length': str(len(data))})
+    download.write(data[:5])
+    self.assertFalse(download.Finish())
+    progress_callback.assert_called_once_with(5, len(data))
+
+    self.assertEqual(
+        {'Range': 'bytes=5-', 'If-Range': '"%s"' % etag},
+        download.GetResumeHeaders())
+    download.BeginResponse(
+        httplib.PARTIAL_CONTENT,
+        {'content-range': 'bytes 5-%d/%d' % (len(data) - 1, len(data))})
+    download.write(data[5:])
+    progress_callback.assert_called_with(len(data), len(data))
+    self.assertTrue(download.Finish())
+
+    self.assertEqual(data, open(filename).read())
+    self.assertEqual([client.os.path.basename(filename)],
+                     client.os.listdir(tmpdir))
 
   def testPostReport(self):
     """Test PostReport()."""
@@ -1146,6 +1335,21 @@ class SimianClientTest(basetest.TestCase):
         self.client.PostReport, [report_type, params, True],
         '_SimianRequest', 'POST', url, body)
 
+  def testPostJsonReport(self):
+    """Test PostJsonReport()."""
+    data = {'version': 1, 'reports': []}
+
+    with mock.patch.object(self.client, '_SimianRequest') as mock_request:
+      self.client.PostJsonReport('install_reports', data)
+      mock_request.assert_called_once_with(
+          'POST', '/reports?_report_type=install_reports', mock.ANY,
+          headers={'Content-Type': 'application/json',
+                   'Content-Encoding': 'gzip'})
+
+    body = mock_request.call_args[0][2]
+    self.assertEqual(data, client.json.loads(
+        client.gzip.GzipFile(fileobj=client.cStringIO.StringIO(body)).read()))
+
   def testPostReportBody(self):
     """Test PostReportBody()."""
     url = '/reports'
@@ -1193,6 +1397,76 @@ class SimianClientTest(basetest.TestCase):
     mock_isfile.assert_called_once_with(file_path)
 
 
+class DownloadManagerTest(basetest.TestCase):
+  """Test DownloadManager class."""
+
+  def setUp(self):
+    super(DownloadManagerTest, self).setUp()
+    patcher = mock.patch.object(client.m2_threading, 'init')
+    self.mock_m2_threading_init = patcher.start()
+    self.addCleanup(patcher.stop)
+    client._m2_threading_initialized = False
+
+  def testDownload(self):
+    """Test Download() downloads packages and collects failures."""
+    simian_client = mock.create_autospec(client.SimianClient, instance=True)
+    error = client.SimianServerError(404, 'Not Found', '')
+    simian_client.DownloadPackage.side_effect = [None, error]
+    manager = client.DownloadManager(
+        simian_client, max_connections_per_host=1, max_bytes_per_sec=1000)
+
+    self.assertEqual(
+        {'bar.dmg': error},
+        manager.Download(['foo.dmg', ('bar.dmg', '/tmp/bar.dmg')]))
+
+    limiter = simian_client.DownloadPackage.call_args[1]['bandwidth_limiter']
+    self.assertEqual(1000, limiter.bytes_per_sec)
+    simian_client.DownloadPackage.assert_has_calls([
+        mock.call(
+            'foo.dmg', 'foo.dmg', attempt_times=client.DEFAULT_HTTP_ATTEMPTS,
+            progress_callback=None, bandwidth_limiter=limiter),
+        mock.call(
+            'bar.dmg', '/tmp/bar.dmg',
+            attempt_times=client.DEFAULT_HTTP_ATTEMPTS,
+            progress_callback=None, bandwidth_limiter=limiter)])
+
+  def testDownloadWhenWorkerRaisesUnexpectedError(self):
+    """Test Download() records unexpected errors and downloads the rest."""
+    simian_client = mock.create_autospec(client.SimianClient, instance=True)
+    error = ValueError('unexpected')
+    simian_client.DownloadPackage.side_effect = [error, None]
+    manager = client.DownloadManager(
+        simian_client, max_connections_per_host=1)
+
+    self.assertEqual(
+        {'foo.dmg': error}, manager.Download(['foo.dmg', 'bar.dmg']))
+
+    self.assertEqual(2, simian_client.DownloadPackage.call_count)
+
+  def testDownloadInitializesM2CryptoThreadingOnce(self):
+    """Test Download() initializes OpenSSL locking before any download."""
+    simian_client = mock.create_autospec(client.SimianClient, instance=True)
+    manager = client.DownloadManager(simian_client)
+
+    manager.Download(['foo.dmg'])
+    manager.Download(['bar.dmg'])
+
+    self.mock_m2_threading_init.assert_called_once_with()
+
+  def testDownloadProgressCallback(self):
+    """Test Download() reports progress per file."""
+    simian_client = mock.create_autospec(client.SimianClient, instance=True)
+    progress_callback = mock.Mock()
+    manager = client.DownloadManager(simian_client)
+    manager.SetProgressCallback(progress_callback)
+
+    self.assertEqual({}, manager.Download(['foo.dmg']))
+
+    fn = simian_client.DownloadPackage.call_args[1]['progress_callback']
+    fn(5, 10)
+    progress_callback.assert_called_once_with('foo.dmg', 5, 10)
+
+
 class SimianAuthClientTest(basetest.TestCase):
   """Test SimianAuthClient class."""
 
@@ -117,6 +117,20 @@ class SummaryModuleTest(basetest.TestCase):
     self.assertEqual(3, s['active'][14])
     self.assertAlmostEqual(98.0582, s['conns_off_corp_percent'], 3)
 
+  def testComputerSummaryMerge(self):
+    computers = models.Computer.all().filter('active =', True).fetch(500)
+    now = datetime.datetime.utcnow()
+    merged = summary.ComputerSummary(now=now)
+    for c in computers:
+      partial = summary.ComputerSummary(now=now)
+      partial.AddComputers([c])
+      merged.Merge(partial)
+    whole = summary.ComputerSummary(now=now)
+    whole.AddComputers(computers)
+    self.assertEqual(whole.ToDict(), merged.ToDict())
+    self.assertEqual(
+        {30: 3, 14: 3, 7: 3, 1: 2}, merged.ToDict()['active'])
+
   @mock.patch.dict(summary.settings.__dict__, {
       'ALLOW_SELF_REPORT': False, 'AUTH_DOMAIN': 'example.com'})
   @mock.patch.object(auth, 'IsGroupMember', return_value=False)
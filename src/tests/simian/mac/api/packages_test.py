@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Packages API module tests."""
+
+import datetime
+import gzip
+import httplib
+import StringIO
+
+import mock
+import webtest
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import testbed
+
+from google.apputils import app
+from google.apputils import basetest
+
+from simian.mac import models
+from simian.mac.api import packages
+from simian.mac.api import urls as gae_main
+
+
+@mock.patch.object(packages, 'API_INFO_KEY', 'apikey')
+@mock.patch.object(taskqueue, 'Queue')
+class PackagesAPITest(basetest.TestCase):
+
+  def setUp(self):
+    super(PackagesAPITest, self).setUp()
+    self.testapp = webtest.TestApp(gae_main.app)
+
+    self.testbed = testbed.Testbed()
+
+    self.testbed.activate()
+    self.testbed.setup_env(
+        overwrite=True,
+        USER_EMAIL='user@example.com',
+        USER_ID='123',
+        USER_IS_ADMIN='0',
+        DEFAULT_VERSION_HOSTNAME='example.appspot.com')
+
+    self.testbed.init_all_stubs()
+
+  def tearDown(self):
+    super(PackagesAPITest, self).tearDown()
+    self.testbed.deactivate()
+
+  def _PutPackageInfo(self, filename):
+    p = models.PackageInfo(key_name=filename, filename=filename)
+    p.plist = (
+        '<plist><dict><key>name</key><string>%s</string>'
+        '<key>version</key><string>1.0</string></dict></plist>' % filename)
+    p.put()
+    return p
+
+  def testGetUnauthorized(self, _):
+    """Tests get() without a valid key."""
+    self.testapp.get('/api/packages?key=bad', status=httplib.UNAUTHORIZED)
+
+  def testGet(self, _):
+    """Tests get()."""
+    p = self._PutPackageInfo('foo.dmg')
+
+    resp = self.testapp.get('/api/packages?key=apikey', status=httplib.OK)
+    self.assertEqual({'foo.dmg': p.GetExportDict()}, resp.json)
+    etag = resp.headers['ETag']
+    self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+
+    self.testapp.get(
+        '/api/packages?key=apikey', headers={'If-None-Match': etag},
+        status=httplib.NOT_MODIFIED)
+
+    resp = self.testapp.get(
+        '/api/packages?key=apikey', headers={'Accept-Encoding': 'gzip'},
+        status=httplib.OK)
+    self.assertEqual('gzip', resp.headers['Content-Encoding'])
+    body = gzip.GzipFile(fileobj=StringIO.StringIO(resp.body)).read()
+    self.assertTrue('foo.dmg' in body)
+
+  def testGetGzipRefused(self, _):
+    """Tests get() with a client refusing gzip with q=0."""
+    p = self._PutPackageInfo('foo.dmg')
+
+    resp = self.testapp.get(
+        '/api/packages?key=apikey', headers={'Accept-Encoding': 'gzip;q=0'},
+        status=httplib.OK)
+    self.assertFalse('Content-Encoding' in resp.headers)
+    self.assertEqual({'foo.dmg': p.GetExportDict()}, resp.json)
+
+  def testGetSince(self, _):
+    """Tests get() with since."""
+    self._PutPackageInfo('foo.dmg')
+    since = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+    resp = self.testapp.get(
+        '/api/packages?key=apikey&since=%s' % since.isoformat(),
+        status=httplib.OK)
+    self.assertEqual({}, resp.json['packages'])
+    self.assertEqual([], resp.json['deleted'])
+    self.assertFalse(resp.json['complete'])
+
+    since -= datetime.timedelta(hours=2)
+    resp = self.testapp.get(
+        '/api/packages?key=apikey&since=%s' % since.isoformat(),
+        status=httplib.OK)
+    self.assertEqual(['foo.dmg'], resp.json['packages'].keys())
+
+  def testGetSinceInvalid(self, _):
+    """Tests get() with an invalid since."""
+    self.testapp.get(
+        '/api/packages?key=apikey&since=yesterday',
+        status=httplib.BAD_REQUEST)
+
+
+def main(unused_argv):
+  basetest.main()
+
+
+if __name__ == '__main__':
+  app.run()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""flight_common module tests."""
+
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+import mock
+
+from google.apputils import basetest
+
+# Import and load mock modules before importing flight_common.
+# pylint: disable=g-bad-import-order
+# pylint: disable=g-import-not-at-top
+from tests.simian.mac.client import munkicommon_mock
+munkicommon_mock.LoadMockModules()
+
+from simian.mac.client import flight_common
+
+
+class RunProbesTest(basetest.TestCase):
+  """Test RunProbes()."""
+
+  def testRunProbes(self):
+    """Test RunProbes() returns the result and timing of each probe."""
+    results, timings = flight_common.RunProbes([
+        ('fast', lambda: 'ok', 5),
+        ('slow', lambda: time.sleep(0.05) or 'done', 5),
+    ])
+
+    self.assertEqual({'fast': 'ok', 'slow': 'done'}, results)
+    self.assertEqual(['fast', 'slow'], sorted(timings))
+    self.assertTrue(timings['slow'] >= 0.05)
+
+  def testRunProbesWhenProbeTimesOut(self):
+    """Test a probe which does not finish by its deadline yields None."""
+    done = threading.Event()
+    self.addCleanup(done.set)
+
+    with mock.patch.object(flight_common.logging, 'warning') as mock_warning:
+      results, timings = flight_common.RunProbes([
+          ('hung', lambda: done.wait(10) or 'late', 0.01),
+          ('fast', lambda: 'ok', 5),
+      ])
+
+    self.assertEqual({'hung': None, 'fast': 'ok'}, results)
+    self.assertTrue(timings['hung'] < 10)
+    mock_warning.assert_called_once_with(
+        'Probe %s did not finish within %ds', 'hung', mock.ANY)
+
+  def testRunProbesWhenProbeFails(self):
+    """Test a probe which raises yields None."""
+    with mock.patch.object(
+        flight_common.logging, 'exception') as mock_exception:
+      results, _ = flight_common.RunProbes([
+          ('broken', mock.Mock(side_effect=ValueError('broken')), 5),
+          ('fast', lambda: 'ok', 5),
+      ])
+
+    self.assertEqual({'broken': None, 'fast': 'ok'}, results)
+    mock_exception.assert_called_once_with('Probe %s failed', 'broken')
+
+
+class FacterCacheTest(basetest.TestCase):
+  """Test GetFacterFacts() and _WriteFacterCache()."""
+
+  TTL = flight_common.FACTER_CACHE_TTL
+
+  def setUp(self):
+    super(FacterCacheTest, self).setUp()
+    self.tmp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp_dir)
+    self.cache_path = os.path.join(self.tmp_dir, 'facter.cache')
+    self.cmd_path = os.path.join(self.tmp_dir, 'simianfacter')
+    self.now = time.time()
+    self._WriteFile(self.cmd_path, '', self.now - 2 * self.TTL)
+
+    for name, value in (
+        ('FACTER_CACHE_PATH', self.cache_path),
+        ('FACTER_CMD', self.cmd_path)):
+      patcher = mock.patch.object(flight_common, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    patcher = mock.patch.object(
+        flight_common, 'Exec', return_value=(0, 'hostname => new\n', ''))
+    self.mock_exec = patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def _WriteFile(self, path, contents, mtime):
+    """Writes contents to path, setting its mtime."""
+    f = open(path, 'w')
+    f.write(contents)
+    f.close()
+    os.utime(path, (mtime, mtime))
+
+  def _WriteCache(self, age):
+    """Writes a facter cache which is age seconds old."""
+    self._WriteFile(self.cache_path, 'hostname => cached\n', self.now - age)
+
+  def _GetFacterFacts(self, **kwargs):
+    """Calls GetFacterFacts() with _WriteFacterCache() mocked out."""
+    with mock.patch.object(
+        flight_common, '_WriteFacterCache') as self.mock_write_cache:
+      return flight_common.GetFacterFacts(**kwargs)
+
+  def _AssertFacterRan(self):
+    """Asserts facter ran and its output was cached."""
+    self.mock_exec.assert_called_once_with(
+        self.cmd_path, timeout=flight_common.FACTER_TIMEOUT, waitfor=0.5)
+    self.mock_write_cache.assert_called_once_with('hostname => new\n')
+
+  def testGetFacterFactsFromCache(self):
+    """Test GetFacterFacts() with a fresh cache does not run facter."""
+    self._WriteCache(60)
+
+    with mock.patch.object(
+        flight_common.simian_client, 'ReadFacterCache',
+        wraps=flight_common.simian_client.ReadFacterCache) as mock_read:
+      self.assertEqual({'hostname': 'cached'}, self._GetFacterFacts())
+
+    mock_read.assert_called_once_with(
+        self.cache_path, max_age=self.TTL,
+        not_before=os.path.getmtime(self.cmd_path))
+    self.assertFalse(self.mock_exec.called)
+    self.assertFalse(self.mock_write_cache.called)
+
+  def testGetFacterFactsWhenNoCache(self):
+    """Test GetFacterFacts() runs and caches facter without a cache."""
+    self.assertEqual({'hostname': 'new'}, self._GetFacterFacts())
+    self._AssertFacterRan()
+
+  def testGetFacterFactsWhenCacheExpired(self):
+    """Test GetFacterFacts() ignores a cache older than FACTER_CACHE_TTL."""
+    self._WriteCache(self.TTL + 60)
+
+    self.assertEqual({'hostname': 'new'}, self._GetFacterFacts())
+    self._AssertFacterRan()
+
+  def testGetFacterFactsWhenCommandChanged(self):
+    """Test GetFacterFacts() ignores a cache older than the facter command."""
+    self._WriteCache(60)
+    os.utime(self.cmd_path, (self.now, self.now))
+
+    self.assertEqual({'hostname': 'new'}, self._GetFacterFacts())
+    self._AssertFacterRan()
+
+  def testGetFacterFactsWhenCommandMissing(self):
+    """Test GetFacterFacts() uses a fresh cache if the command is missing."""
+    self._WriteCache(60)
+    os.unlink(self.cmd_path)
+
+    self.assertEqual({'hostname': 'cached'}, self._GetFacterFacts())
+    self.assertFalse(self.mock_exec.called)
+
+  def testGetFacterFactsWithoutCache(self):
+    """Test GetFacterFacts(use_cache=False) ignores a fresh cache."""
+    self._WriteCache(60)
+
+    with mock.patch.object(
+        flight_common.simian_client, 'ReadFacterCache') as mock_read:
+      self.assertEqual(
+          {'hostname': 'new'}, self._GetFacterFacts(use_cache=False))
+
+    self.assertFalse(mock_read.called)
+    self._AssertFacterRan()
+
+  def testGetFacterFactsWhenFacterFails(self):
+    """Test GetFacterFacts() when facter fails."""
+    self.mock_exec.return_value = (1, 'hostname => partial\n', 'error')
+
+    self.assertEqual({}, self._GetFacterFacts())
+    self.assertFalse(self.mock_write_cache.called)
+
+  @mock.patch.object(flight_common.os, 'geteuid', return_value=0)
+  def testWriteFacterCache(self, _):
+    """Test _WriteFacterCache() atomically replaces the cache as root."""
+    self._WriteCache(60)
+
+    with mock.patch.object(
+        flight_common.tempfile, 'mkstemp',
+        wraps=flight_common.tempfile.mkstemp) as mock_mkstemp:
+      with mock.patch.object(
+          flight_common.os, 'rename',
+          wraps=flight_common.os.rename) as mock_rename:
+        flight_common._WriteFacterCache('hostname => new\n')
+
+    mock_mkstemp.assert_called_once_with(
+        dir=self.tmp_dir, prefix='.facter.cache.')
+    mock_rename.assert_called_once_with(mock.ANY, self.cache_path)
+    tmp_path = mock_rename.call_args[0][0]
+    self.assertEqual(self.tmp_dir, os.path.dirname(tmp_path))
+    self.assertEqual('hostname => new\n', open(self.cache_path).read())
+    self.assertEqual(
+        0644, stat.S_IMODE(os.stat(self.cache_path).st_mode))
+    self.assertEqual(
+        ['facter.cache', 'simianfacter'], sorted(os.listdir(self.tmp_dir)))
+
+  @mock.patch.object(flight_common.os, 'geteuid', return_value=501)
+  def testWriteFacterCacheWhenNotRoot(self, _):
+    """Test _WriteFacterCache() does not write the cache as a user."""
+    with mock.patch.object(flight_common.tempfile, 'mkstemp') as mock_mkstemp:
+      flight_common._WriteFacterCache('hostname => new\n')
+
+    self.assertFalse(mock_mkstemp.called)
+    self.assertFalse(os.path.exists(self.cache_path))
+
+  @mock.patch.object(flight_common.os, 'geteuid', return_value=0)
+  def testWriteFacterCacheWhenRenameFails(self, _):
+    """Test _WriteFacterCache() removes its temp file if it cannot rename."""
+    self._WriteCache(60)
+
+    with mock.patch.object(
+        flight_common.os, 'rename', side_effect=OSError('denied')):
+      with mock.patch.object(flight_common.logging, 'warning') as mock_warn:
+        flight_common._WriteFacterCache('hostname => new\n')
+
+    self.assertTrue(mock_warn.called)
+    self.assertEqual('hostname => cached\n', open(self.cache_path).read())
+    self.assertEqual(
+        ['facter.cache', 'simianfacter'], sorted(os.listdir(self.tmp_dir)))
+
+
+class InstallReportsTest(basetest.TestCase):
+  """Test _UploadInstallReports() and UploadAllManagedInstallReports()."""
+
+  def setUp(self):
+    super(InstallReportsTest, self).setUp()
+    self.tmp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp_dir)
+    self.archives_dir = os.path.join(self.tmp_dir, 'Archives')
+    os.mkdir(self.archives_dir)
+    self.install_report_path = os.path.join(
+        self.tmp_dir, 'ManagedInstallReport.plist')
+    self.archive_reports = {
+        'ManagedInstallReport-1.plist': {
+            'InstallResults': [{'name': 'a', 'version': '1', 'status': 0}],
+        },
+        'ManagedInstallReport-2.plist': {'RemovalResults': ['b']},
+    }
+    for fname in self.archive_reports.keys() + ['other.plist']:
+      open(os.path.join(self.archives_dir, fname), 'w').close()
+    self.install_report = {
+        'InstallResults': [],
+        'ProblemInstalls': [{'name': 'c', 'note': 'failed'}],
+    }
+
+    # munkilib does not import here, so munkicommon and fpl are undefined.
+    patcher = mock.patch.object(flight_common, 'munkicommon', create=True)
+    patcher.start().pref.return_value = self.tmp_dir
+    self.addCleanup(patcher.stop)
+    patcher = mock.patch.object(flight_common, 'fpl', create=True)
+    self.mock_fpl = patcher.start()
+    self.addCleanup(patcher.stop)
+    patcher = mock.patch.object(
+        flight_common, 'GetManagedInstallReport',
+        side_effect=self._GetManagedInstallReport)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    patcher = mock.patch.object(flight_common.logging, 'exception')
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    self.client = mock.Mock()
+    self.client.PostJsonReport.return_value = 'OK'
+
+  def _GetManagedInstallReport(self, install_report_path=None):
+    """Returns (install report, path) of a stubbed ManagedInstallReport."""
+    if not install_report_path:
+      return self.install_report, self.install_report_path
+    return (self.archive_reports[os.path.basename(install_report_path)],
+            install_report_path)
+
+  def _GetArchives(self):
+    """Returns the sorted file names left in the Archives dir."""
+    return sorted(os.listdir(self.archives_dir))
+
+  def testUploadInstallReports(self):
+    """Test _UploadInstallReports() uploads all reports in one request."""
+    install_reports = [
+        self.archive_reports['ManagedInstallReport-1.plist'],
+        {},
+        self.archive_reports['ManagedInstallReport-2.plist'],
+        {'InstallResults': []},
+        self.install_report,
+    ]
+
+    self.assertTrue(flight_common._UploadInstallReports(
+        self.client, '1', install_reports))
+
+    self.client.PostJsonReport.assert_called_once_with('install_reports', {
+        'version': flight_common.INSTALL_REPORTS_VERSION,
+        'on_corp': '1',
+        'reports': [
+            {
+                'installs': [{'name': 'a', 'version': '1', 'status': 0}],
+                'removals': [],
+                'problem_installs': [],
+            },
+            {'installs': [], 'removals': [u'b'], 'problem_installs': []},
+            {
+                'installs': [],
+                'removals': [],
+                'problem_installs': [u'c: failed'],
+            },
+        ],
+    })
+    self.assertFalse(self.client.PostReport.called)
+
+  def testUploadInstallReportsWhenOldServer(self):
+    """Test _UploadInstallReports() when install_reports is unsupported."""
+    self.client.PostJsonReport.return_value = ''
+
+    self.assertFalse(flight_common._UploadInstallReports(
+        self.client, '1', [self.install_report]))
+
+  def testUploadInstallReportsWhenNothingToReport(self):
+    """Test _UploadInstallReports() without results makes no request."""
+    self.assertTrue(flight_common._UploadInstallReports(
+        self.client, '1', [{}, {'InstallResults': []}]))
+    self.assertFalse(self.client.PostJsonReport.called)
+
+  def testUploadAllManagedInstallReports(self):
+    """Test UploadAllManagedInstallReports() with a new server."""
+    flight_common.UploadAllManagedInstallReports(self.client, '1')
+
+    self.assertEqual(1, self.client.PostJsonReport.call_count)
+    reports = self.client.PostJsonReport.call_args[0][1]['reports']
+    self.assertEqual(
+        [[], [], [u'c: failed']],
+        sorted(r['problem_installs'] for r in reports))
+    self.assertFalse(self.client.PostReport.called)
+    self.assertEqual(['other.plist'], self._GetArchives())
+    self.mock_fpl.writePlist.assert_called_once_with(
+        {'InstallResults': [], 'RemovalResults': [], 'ProblemInstalls': []},
+        self.install_report_path)
+
+  def testUploadAllManagedInstallReportsWhenOldServer(self):
+    """Test UploadAllManagedInstallReports() uploads each report if needed."""
+    self.client.PostJsonReport.return_value = ''
+
+    with mock.patch.object(
+        flight_common, '_UploadManagedInstallReport',
+        wraps=flight_common._UploadManagedInstallReport) as mock_upload:
+      flight_common.UploadAllManagedInstallReports(self.client, '1')
+
+    self.assertEqual(1, self.client.PostJsonReport.call_count)
+    self.assertEqual([
+        mock.call(self.client, '1',
+                  self.archive_reports['ManagedInstallReport-1.plist']),
+        mock.call(self.client, '1',
+                  self.archive_reports['ManagedInstallReport-2.plist']),
+        mock.call(self.client, '1', self.install_report),
+    ], mock_upload.call_args_list)
+    self.assertEqual(3, self.client.PostReport.call_count)
+    self.assertEqual(['other.plist'], self._GetArchives())
+    self.assertTrue(self.mock_fpl.writePlist.called)
+
+  def testUploadAllManagedInstallReportsWhenUploadFails(self):
+    """Test UploadAllManagedInstallReports() keeps reports it cannot upload."""
+    self.client.PostJsonReport.side_effect = (
+        flight_common.simian_client.SimianServerError)
+
+    flight_common.UploadAllManagedInstallReports(self.client, '1')
+
+    self.assertFalse(self.client.PostReport.called)
+    self.assertEqual(
+        ['ManagedInstallReport-1.plist', 'ManagedInstallReport-2.plist',
+         'other.plist'],
+        self._GetArchives())
+    self.assertFalse(self.mock_fpl.writePlist.called)
+
+  def testUploadAllManagedInstallReportsWhenOldServerUploadFails(self):
+    """Test UploadAllManagedInstallReports() keeps an archive it cannot send."""
+    self.client.PostJsonReport.return_value = ''
+    self.client.PostReport.side_effect = [
+        flight_common.simian_client.SimianServerError, 'OK', 'OK']
+
+    flight_common.UploadAllManagedInstallReports(self.client, '1')
+
+    self.assertEqual(3, self.client.PostReport.call_count)
+    self.assertEqual(
+        ['ManagedInstallReport-1.plist', 'other.plist'], self._GetArchives())
+    self.assertTrue(self.mock_fpl.writePlist.called)
+
+
+if __name__ == '__main__':
+  basetest.main()
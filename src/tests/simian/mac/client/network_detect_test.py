@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""network_detect module tests."""
+
+import threading
+
+import mock
+
+from google.apputils import basetest
+
+# Import and load mock modules before importing network_detect.
+# pylint: disable=g-bad-import-order
+# pylint: disable=g-import-not-at-top
+from tests.simian.mac.client import munkicommon_mock
+munkicommon_mock.LoadMockModules()
+
+from simian.mac.client import network_detect
+
+
+DARWIN_IFCONFIG = (
+    'lo0: flags=8049<UP,LOOPBACK,RUNNING,MULTICAST> mtu 16384\n'
+    '\tinet 127.0.0.1 netmask 0xff000000\n'
+    'en0: flags=8863<UP,BROADCAST,SMART,RUNNING,SIMPLEX,MULTICAST> mtu 1500\n'
+    '\tether 00:11:22:33:44:55\n'
+    '\tinet 192.168.43.20 netmask 0xffffff00 broadcast 192.168.43.255\n'
+    'ppp0: flags=8051<UP,POINTOPOINT,RUNNING,MULTICAST> mtu 1500\n'
+    '\tinet 10.1.1.1 --> 10.1.1.2 netmask 0xff000000\n')
+
+DARWIN_ROUTES = (
+    'Routing tables\n'
+    '\n'
+    'Internet:\n'
+    'Destination        Gateway            Flags        Refs      Use   Netif\n'
+    'default            192.168.43.1       UGSc           10        0     en0\n'
+    '127                127.0.0.1          UCS             0        0'
+    '     lo0\n')
+
+LINUX_IFCONFIG = (
+    'eth0      Link encap:Ethernet  HWaddr 00:11:22:33:44:55\n'
+    '          inet addr:10.0.0.5  Bcast:10.0.0.255  Mask:255.255.255.0\n'
+    '\n'
+    'wlan0     Link encap:Ethernet  HWaddr 00:11:22:33:44:66\n'
+    '          inet addr:192.168.42.7  Bcast:192.168.42.255  '
+    'Mask:255.255.255.0\n')
+
+LINUX_ROUTES = (
+    'default via 192.168.42.129 dev wlan0  proto static\n'
+    '192.168.42.0/24 dev wlan0  proto kernel  scope link  src 192.168.42.7\n')
+
+DNSMASQ_VERSION = (
+    'VERSION.BIND descriptive text "dnsmasq-2.51"\n')
+
+
+class NetworkDetectTest(basetest.TestCase):
+  """Test network_detect module."""
+
+  def setUp(self):
+    super(NetworkDetectTest, self).setUp()
+    self.platform = network_detect.DARWIN
+    self.ifconfig = DARWIN_IFCONFIG
+    self.routes = DARWIN_ROUTES
+    self.ssid = 'corp'
+    self.host = ''
+
+    for name, new in (
+        ('_GetPlatform', lambda: self.platform),
+        ('_IsIosWapPortOpen', mock.Mock(return_value=False)),
+        ('GetHttpResource', mock.Mock(return_value=(-1, 'error')))):
+      patcher = mock.patch.object(network_detect, name, new)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    patcher = mock.patch.object(
+        network_detect.flight_common, 'Exec', side_effect=self._Exec)
+    self.mock_exec = patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def _Exec(self, cmd):
+    """Returns (return code, stdout, stderr) of a stubbed command."""
+    if cmd == network_detect.IFCONFIG:
+      return 0, self.ifconfig, ''
+    elif cmd == network_detect.ROUTE[self.platform]:
+      return 0, self.routes, ''
+    elif cmd[0] == network_detect.HOST:
+      return 0, self.host, ''
+    elif 'airport' in cmd or 'nmcli' in cmd:
+      if self.platform == network_detect.LINUX:
+        return 0, 'Auto %s:wlan0\n' % self.ssid, ''
+      return 0, '%s\n' % self.ssid, ''
+    raise OSError(cmd)
+
+  def testGetInterfacesDarwin(self):
+    """Test _GetInterfaces() parses Darwin ifconfig output."""
+    interfaces = network_detect._GetInterfaces(network_detect.DARWIN)
+
+    self.assertEqual(['lo0', 'en0', 'ppp0'], interfaces.keys())
+    self.assertTrue(interfaces['en0'].startswith('en0: flags='))
+    self.assertTrue('192.168.43.20' in interfaces['en0'])
+    self.assertFalse('10.1.1.1' in interfaces['en0'])
+
+  def testGetInterfacesLinux(self):
+    """Test _GetInterfaces() parses Linux ifconfig output."""
+    self.ifconfig = LINUX_IFCONFIG
+    interfaces = network_detect._GetInterfaces(network_detect.LINUX)
+
+    self.assertEqual(['eth0', 'wlan0'], interfaces.keys())
+    self.assertTrue('10.0.0.5' in interfaces['eth0'])
+    self.assertTrue('192.168.42.7' in interfaces['wlan0'])
+
+  def testGetInterfacesWhenIfconfigFails(self):
+    """Test _GetInterfaces() when ifconfig fails."""
+    self.mock_exec.side_effect = None
+    self.mock_exec.return_value = (1, '', 'error')
+
+    self.assertEqual(
+        {}, network_detect._GetInterfaces(network_detect.DARWIN))
+
+  def testFindNetworkGateway(self):
+    """Test _FindNetworkGateway() on Darwin and Linux routing tables."""
+    self.assertEqual(
+        '192.168.43.1',
+        network_detect._FindNetworkGateway(DARWIN_ROUTES, 'default'))
+    self.assertEqual(
+        '127.0.0.1', network_detect._FindNetworkGateway(DARWIN_ROUTES, '127'))
+    self.assertEqual(
+        '192.168.42.129',
+        network_detect._FindNetworkGateway(LINUX_ROUTES, 'default'))
+    self.assertEqual(
+        'dev wlan0',
+        network_detect._FindNetworkGateway(LINUX_ROUTES, '192.168.42.0/24'))
+    self.assertEqual(
+        None, network_detect._FindNetworkGateway(LINUX_ROUTES, '10.0.0/8'))
+    self.assertEqual(None, network_detect._FindNetworkGateway(None, 'default'))
+
+  def testSnapshotReadsInterfacesAndRoutesOnce(self):
+    """Test NetworkSnapshot runs ifconfig and route once for all checks."""
+    snapshot = network_detect.NetworkSnapshot()
+    snapshot.IsOnWwan()
+    snapshot.IsOnAndroidWap()
+    snapshot.IsOnIosWap()
+    snapshot.IsOnMifi()
+
+    cmds = [c[0][0] for c in self.mock_exec.call_args_list]
+    self.assertEqual(1, cmds.count(network_detect.IFCONFIG))
+    self.assertEqual(1, cmds.count(network_detect.ROUTE[self.platform]))
+    self.assertEqual('192.168.43.1', snapshot.default_gateway)
+
+  def testIsOnWwan(self):
+    """Test IsOnWwan()."""
+    self.assertTrue(network_detect.IsOnWwan())
+
+    self.platform = network_detect.LINUX
+    self.ifconfig = LINUX_IFCONFIG
+    self.routes = LINUX_ROUTES
+    self.assertFalse(network_detect.IsOnWwan())
+
+  def testIsOnBackoffWLAN(self):
+    """Test IsOnBackoffWLAN()."""
+    self.assertFalse(network_detect.IsOnBackoffWLAN())
+
+    self.ssid = 'gogoinflight'
+    self.assertTrue(network_detect.IsOnBackoffWLAN())
+
+    self.platform = network_detect.LINUX
+    self.ifconfig = LINUX_IFCONFIG
+    self.routes = LINUX_ROUTES
+    self.assertTrue(network_detect.IsOnBackoffWLAN())
+
+  def testIsOnAndroidWapDarwin(self):
+    """Test IsOnAndroidWap() on Darwin."""
+    self.assertFalse(network_detect.IsOnAndroidWap())
+
+    self.host = DNSMASQ_VERSION
+    self.assertTrue(network_detect.IsOnAndroidWap())
+
+  def testIsOnAndroidWapLinux(self):
+    """Test IsOnAndroidWap() on Linux."""
+    self.platform = network_detect.LINUX
+    self.ifconfig = LINUX_IFCONFIG
+    self.routes = LINUX_ROUTES
+    self.host = DNSMASQ_VERSION
+    self.assertTrue(network_detect.IsOnAndroidWap())
+
+  def testIsOnAndroidWapWhenGatewayElsewhere(self):
+    """Test IsOnAndroidWap() when the default gateway is not the tether."""
+    self.routes = DARWIN_ROUTES.replace('192.168.43.1 ', '10.0.0.1     ')
+    self.host = DNSMASQ_VERSION
+    self.assertFalse(network_detect.IsOnAndroidWap())
+    self.assertFalse(any(
+        c[0][0][0] == network_detect.HOST
+        for c in self.mock_exec.call_args_list))
+
+  def testIsOnIosWap(self):
+    """Test IsOnIosWap()."""
+    self.assertFalse(network_detect.IsOnIosWap())
+    self.assertFalse(network_detect._IsIosWapPortOpen.called)
+
+    self.routes = DARWIN_ROUTES.replace(
+        '192.168.43.1 ', '172.20.10.1  ') + (
+            '172.20.10/28       link#4             UCS             1        0'
+            '     en0\n')
+    network_detect._IsIosWapPortOpen.return_value = True
+    self.assertTrue(network_detect.IsOnIosWap())
+    network_detect._IsIosWapPortOpen.assert_called_once_with('172.20.10.1')
+
+  def testIsOnMifi(self):
+    """Test IsOnMifi()."""
+    self.assertFalse(network_detect.IsOnMifi())
+    self.assertFalse(network_detect.GetHttpResource.called)
+
+    self.routes = DARWIN_ROUTES.replace('192.168.43.1 ', '192.168.1.1  ')
+    network_detect.GetHttpResource.return_value = (
+        200, '<title>Verizon MiFi</title>')
+    self.assertTrue(network_detect.IsOnMifi())
+    network_detect.GetHttpResource.assert_called_once_with(
+        '192.168.1.1', redir=True, timeout=network_detect.PROBE_TIMEOUT)
+
+  def testIsOnMifiHuawei(self):
+    """Test IsOnMifi() with a Huawei gateway."""
+    self.routes = DARWIN_ROUTES.replace('192.168.43.1 ', '192.168.8.1  ')
+    network_detect.GetHttpResource.return_value = (307, '')
+    self.assertTrue(network_detect.IsOnMifi())
+
+  def testProbeTimeout(self):
+    """Test a probe which does not finish in time yields no result."""
+    done = threading.Event()
+    snapshot = network_detect.NetworkSnapshot()
+    snapshot._StartProbe('slow', lambda: done.wait(10) or True)
+
+    with mock.patch.object(network_detect.logging, 'warning') as mock_warning:
+      self.assertEqual(None, snapshot._GetProbeResult('slow', timeout=0.01))
+    mock_warning.assert_called_once_with(
+        'Network probe %s timed out', 'slow')
+
+    done.set()
+    self.assertTrue(snapshot._GetProbeResult('slow'))
+
+  def testProbeError(self):
+    """Test a probe which raises yields no result."""
+    snapshot = network_detect.NetworkSnapshot()
+    with mock.patch.object(network_detect.logging, 'exception'):
+      snapshot._StartProbe('broken', mock.Mock(
+          side_effect=network_detect.socket.error('connection refused')))
+      self.assertEqual(None, snapshot._GetProbeResult('broken'))
+    self.assertEqual(None, snapshot._GetProbeResult('not_started'))
+
+
+if __name__ == '__main__':
+  basetest.main()
@@ -16,7 +16,9 @@
 #
 """compress module tests."""
 
+import gzip
 import hashlib
+import StringIO
 
 import mock
 import stubout
@@ -26,6 +28,25 @@ from google.apputils import basetest
 from simian.mac.common import compress
 
 
+class GzipTest(basetest.TestCase):
+  """Test the Gzip function."""
+
+  def testGzip(self):
+    """Test Gzip()."""
+    data = 'hello' * 100
+    gzip_data = compress.Gzip(data)
+    self.assertTrue(len(gzip_data) < len(data))
+    self.assertEqual(
+        data, gzip.GzipFile(fileobj=StringIO.StringIO(gzip_data)).read())
+    # output is deterministic.
+    self.assertEqual(gzip_data, compress.Gzip(data))
+
+  def testGunzip(self):
+    """Test Gunzip()."""
+    data = 'hello' * 100
+    self.assertEqual(data, compress.Gunzip(compress.Gzip(data)))
+
+
 class CompressedTextTest(basetest.TestCase):
   """Test the CompressedText object."""
 
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""lru module tests."""
+
+import mock
+
+from google.apputils import app
+from google.apputils import basetest
+from simian.mac.common import lru
+
+
+class LruCacheTest(basetest.TestCase):
+
+  def setUp(self):
+    self.cache = lru.LruCache(max_size=2)
+
+  def testGetSet(self):
+    """Tests Get() and Set()."""
+    self.assertEqual(None, self.cache.Get('foo'))
+    self.assertEqual('default', self.cache.Get('foo', 'default'))
+    self.cache.Set('foo', 'bar')
+    self.assertEqual('bar', self.cache.Get('foo'))
+    self.assertEqual(
+        {'hits': 1, 'misses': 2, 'size': 1, 'max_size': 2},
+        self.cache.GetStats())
+
+  def testEvictsLeastRecentlyUsed(self):
+    """Tests that the least recently used item is evicted at max_size."""
+    self.cache.Set('a', 1)
+    self.cache.Set('b', 2)
+    self.assertEqual(1, self.cache.Get('a'))  # b is now least recently used.
+    self.cache.Set('c', 3)
+    self.assertEqual(2, len(self.cache))
+    self.assertEqual(1, self.cache.Get('a'))
+    self.assertEqual(None, self.cache.Get('b'))
+    self.assertEqual(3, self.cache.Get('c'))
+
+  @mock.patch.object(lru.time, 'time')
+  def testExpiry(self, time_mock):
+    """Tests that items expire after their ttl."""
+    cache = lru.LruCache(ttl=10)
+    time_mock.return_value = 100
+    cache.Set('default_ttl', 1)
+    cache.Set('short_ttl', 2, ttl=5)
+
+    time_mock.return_value = 106
+    self.assertEqual(1, cache.Get('default_ttl'))
+    self.assertEqual(None, cache.Get('short_ttl'))
+
+    time_mock.return_value = 111
+    self.assertEqual(None, cache.Get('default_ttl'))
+
+  def testDeleteAndClear(self):
+    """Tests Delete() and Clear()."""
+    self.cache.Set('a', 1)
+    self.cache.Set('b', 2)
+    self.cache.Delete('a')
+    self.cache.Delete('missing')
+    self.assertEqual(None, self.cache.Get('a'))
+    self.assertEqual(2, self.cache.Get('b'))
+
+    self.cache.Clear()
+    self.assertEqual(0, len(self.cache))
+    self.assertEqual(
+        {'hits': 0, 'misses': 0, 'size': 0, 'max_size': 2},
+        self.cache.GetStats())
+
+
+def main(unused_argv):
+  basetest.main()
+
+
+if __name__ == '__main__':
+  app.run()
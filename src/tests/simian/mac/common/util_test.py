@@ -72,6 +72,14 @@ class DatetimeTest(basetest.TestCase):
         util.EpochExtremeFutureValueError,
         self.dt.utcfromtimestamp, epoch)
 
+  def testFromIsoFormat(self):
+    """Tests fromisoformat()."""
+    dt = datetime.datetime(2016, 1, 2, 3, 4, 5)
+    self.assertEqual(dt, self.dt.fromisoformat(dt.isoformat()))
+    dt = dt.replace(microsecond=1234)
+    self.assertEqual(dt, self.dt.fromisoformat(dt.isoformat()))
+    self.assertRaises(ValueError, self.dt.fromisoformat, '2016-01-02')
+
 
 class UtilModuleTest(basetest.TestCase):
 
@@ -31,6 +31,7 @@ from google.appengine.ext import testbed
 from google.apputils import app
 from google.apputils import resources
 from google.apputils import basetest
+from simian.auth import gaeserver
 from simian.mac import models
 from tests.simian.mac.common import test
 from simian.mac.cron import maintenance as maint
@@ -82,6 +83,149 @@ class AuthSessionCleanupTest(basetest.TestCase):
     self.assertEqual(1, len(sessions))
     self.assertEqual(valid_session_name, sessions[0].key().name())
 
+  def testGetWithExpiresAt(self):
+    """Test get() purges sessions by expires_at."""
+    now = datetime.datetime.utcnow()
+    for i in range(1, 20):
+      models.AuthSession(
+          key_name='t_%d' % i, mtime=now,
+          expires_at=now - datetime.timedelta(hours=i)).put()
+    models.AuthSession(
+        key_name='t_valid', mtime=now,
+        expires_at=now + datetime.timedelta(hours=1)).put()
+    self.testapp.get('/cron/maintenance/authsession_cleanup')
+
+    taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    tasks = taskqueue_stub.get_filtered_tasks()
+    # one task per range, one for sessions without expires_at, and one to
+    # backfill expires_at.
+    self.assertEqual(maint.AUTH_SESSION_PURGE_RANGES + 2, len(tasks))
+    for task in tasks:
+      deferred.run(task.payload)
+
+    sessions = models.AuthSession.all().fetch(None)
+    self.assertEqual(['t_valid'], [s.key().name() for s in sessions])
+
+
+  def testGetBackfillsExpiresAt(self):
+    """Test get() expires sessions stored without expires_at by their age."""
+    now = datetime.datetime.utcnow()
+    models.AuthSession(
+        key_name='t_old', mtime=now - datetime.timedelta(hours=7)).put()
+    models.AuthSession(
+        key_name='t_new', mtime=now - datetime.timedelta(hours=1)).put()
+    models.AuthSession(
+        key_name='t_applesus', mtime=now - datetime.timedelta(hours=7),
+        level=gaeserver.LEVEL_APPLESUS).put()
+    models.AuthSession(
+        key_name='cn_old', mtime=now - datetime.timedelta(minutes=10)).put()
+    models.AuthSession(
+        key_name='unknown', mtime=now - datetime.timedelta(hours=7)).put()
+    self.testapp.get('/cron/maintenance/authsession_cleanup')
+
+    taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    while True:
+      tasks = taskqueue_stub.get_filtered_tasks()
+      if not tasks:
+        break
+      taskqueue_stub.FlushQueue('default')
+      for task in tasks:
+        deferred.run(task.payload)
+
+    sessions = dict(
+        (s.key().name(), s) for s in models.AuthSession.all().fetch(None))
+    # sessions of unknown age are left for the mtime purge.
+    self.assertEqual(['t_applesus', 't_new', 'unknown'], sorted(sessions))
+    self.assertEqual(None, sessions['unknown'].expires_at)
+    self.assertEqual(
+        sessions['t_new'].mtime + datetime.timedelta(
+            seconds=maint.auth_base.AGE_TOKEN_SECONDS),
+        sessions['t_new'].expires_at)
+    self.assertEqual(
+        sessions['t_applesus'].mtime + datetime.timedelta(
+            seconds=maint.auth_base.AGE_APPLESUS_TOKEN_SECONDS),
+        sessions['t_applesus'].expires_at)
+    self.assertTrue(models.KeyValueCache.GetItem(
+        maint.AUTH_SESSION_EXPIRES_AT_BACKFILL_KEY)[0])
+
+  def testGetWhenBackfillRunning(self):
+    """Test get() starts no second expires_at backfill while one runs."""
+    self.testapp.get('/cron/maintenance/authsession_cleanup')
+    self.testapp.get('/cron/maintenance/authsession_cleanup')
+
+    taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    tasks = taskqueue_stub.get_filtered_tasks()
+    self.assertEqual(2 * (maint.AUTH_SESSION_PURGE_RANGES + 1) + 1, len(tasks))
+
+  def testGetWhenBackfillStale(self):
+    """Test get() resumes a backfill which made no progress for too long."""
+    models.KeyValueCache.SetItem(
+        maint.AUTH_SESSION_EXPIRES_AT_BACKFILL_CURSOR_KEY, 'cursor1')
+
+    with mock.patch.object(
+        maint, 'AUTH_SESSION_EXPIRES_AT_BACKFILL_STALE_SECS', -1):
+      with mock.patch.object(maint.deferred, 'defer') as defer_mock:
+        self.testapp.get('/cron/maintenance/authsession_cleanup')
+
+    defer_mock.assert_any_call(
+        maint._BackfillAuthSessionExpiresAt, cursor='cursor1')
+
+class BackfillPackageInfoSummariesTest(basetest.TestCase):
+
+  def setUp(self):
+    super(BackfillPackageInfoSummariesTest, self).setUp()
+    self.testbed = testbed.Testbed()
+
+    self.testbed.activate()
+    self.testbed.setup_env(
+        overwrite=True,
+        USER_EMAIL='user@example.com',
+        USER_ID='123',
+        USER_IS_ADMIN='0',
+        DEFAULT_VERSION_HOSTNAME='example.appspot.com')
+
+    self.testbed.init_all_stubs()
+    self.testapp = webtest.TestApp(gae_app)
+
+  def tearDown(self):
+    super(BackfillPackageInfoSummariesTest, self).tearDown()
+    self.testbed.deactivate()
+
+  def _RunTasks(self):
+    taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    while True:
+      tasks = taskqueue_stub.get_filtered_tasks()
+      if not tasks:
+        break
+      taskqueue_stub.FlushQueue('default')
+      for task in tasks:
+        deferred.run(task.payload)
+
+  @mock.patch.object(maint, 'PKGINFO_SUMMARY_BACKFILL_BATCH_SIZE', 2)
+  def testGet(self):
+    """Test get()."""
+    mtime = datetime.datetime(2016, 1, 1)
+    for i in range(5):
+      p = models.PackageInfo(key_name='pkg%d.dmg' % i, mtime=mtime)
+      p.plist = (
+          '<plist><dict><key>name</key><string>pkg%d</string>'
+          '<key>version</key><string>1.%d</string></dict></plist>' % (i, i))
+      p.munki_name = 'pkg%d-1.%d' % (i, i)
+      models.db.put(p)  # skip PackageInfo.put(), like pre-summary entities.
+
+    self.testapp.get('/cron/maintenance/backfill_pkginfo_summaries')
+    self._RunTasks()
+
+    self.assertTrue(models.PackageInfo.IsPlistSummaryBackfilled())
+    for i, p in enumerate(models.PackageInfo.all()):
+      self.assertEqual(models.PLIST_SUMMARY_VERSION, p.plist_summary_version)
+      self.assertEqual('1.%d' % i, p.version)
+      self.assertEqual(mtime, p.mtime)
+
+    self.testapp.get('/cron/maintenance/backfill_pkginfo_summaries')
+    taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    self.assertEqual([], taskqueue_stub.get_filtered_tasks())
+
 
 class UpdateAverageInstallDurationsTest(test.RequestHandlerTest):
 
@@ -23,6 +23,8 @@ import random
 import mox
 import stubout
 
+from google.appengine.api import memcache
+from google.appengine.ext import db
 from google.appengine.ext import deferred
 from google.appengine.ext import testbed
 
@@ -584,107 +586,86 @@ class ReportsCacheCleanupTest(test.AppengineTest, mox.MoxTestBase):
     rc._GenerateMsuUserSummary()
     self.mox.VerifyAll()
 
-  def testGenerateInstallCounts(self):
-    """Test _GenerateInstallCounts()."""
-    install_counts = {
-        'foo': {
-            'install_count': 2,
-            'applesus': True,
-            'duration_count': 1,
-            'duration_total_seconds': 30,
-            'duration_seconds_avg': 30},
-        'bar': {'install_count': 2, 'install_fail_count': 1, 'applesus': False},
-    }
+  def testGeneratePendingCounts(self):
+    """Test _GeneratePendingCounts()."""
+    pkgs = [test.GenericContainer(munki_name=n) for n in ['foo-1', 'bar-1']]
+    self.stubs.Set(
+        reports_cache.models.PackageInfo, 'all', lambda **kwargs: pkgs)
+    # run each deferred batch synchronously.
+    self.stubs.Set(
+        reports_cache.deferred, 'defer', lambda fn, *a, **kw: fn(*a, **kw))
+    self.stubs.Set(
+        reports_cache.summary_module, 'DEFAULT_COMPUTER_FETCH_LIMIT', 2)
+    models.Computer(
+        key_name='1', active=True, pkgs_to_install=['foo-1', 'bar-1']).put()
+    models.Computer(
+        key_name='2', active=True,
+        pkgs_to_install=['foo-1', 'AppleSUS: x']).put()
+    models.Computer(key_name='3', active=True, pkgs_to_install=[]).put()
+    models.Computer(
+        key_name='4', active=False, pkgs_to_install=['foo-1']).put()
 
-    new_foo = self.mox.CreateMockAnything()
-    new_foo.package = 'foo'
-    new_foo.applesus = True
-    new_foo.duration_seconds = 20
-    new_bar = self.mox.CreateMockAnything()
-    new_bar.package = 'bar'
-    new_bar.applesus = False
-    new_bar.duration_seconds = 10
-    new_bar_success = self.mox.CreateMockAnything()
-    new_bar_success.package = 'bar'
-    new_bar_success.applesus = False
-    new_bar_success.duration_seconds = 10
-    new_bar_success2 = self.mox.CreateMockAnything()
-    new_bar_success2.package = 'bar'
-    new_bar_success2.applesus = False
-    new_bar_success2.duration_seconds = 20
-    new_zzz = self.mox.CreateMockAnything()
-    new_zzz.package = 'zzz'
-    new_zzz.applesus = False
-    new_zzz.duration_seconds = None
-
-    new_installs = [
-        new_foo, new_bar, new_bar_success, new_zzz, new_bar_success2]
-
-    new_install_counts = {
-        'foo': {
-            'install_count': 2,
-            'install_fail_count': 1,
-            'applesus': True,
-            'duration_count': 1,
-            'duration_total_seconds': 30,
-            'duration_seconds_avg': 30,
-         },
-        'bar': {
-            'install_count': 4,
-            'install_fail_count': 2,
-            'applesus': False,
-            'duration_count': 2,
-            'duration_total_seconds': 30,
-            'duration_seconds_avg': 30 / 2,
-         },
-        'zzz': {
-            'install_count': 1,
-            'install_fail_count': 0,
-            'applesus': False,
-            'duration_count': 0,
-            'duration_total_seconds': 0,
-            'duration_seconds_avg': None,
-        },
-    }
-    new_foo.IsSuccess().AndReturn(False)
-    new_bar.IsSuccess().AndReturn(False)
-    new_bar_success.IsSuccess().AndReturn(True)
-    new_zzz.IsSuccess().AndReturn(True)
-    new_bar_success2.IsSuccess().AndReturn(True)
+    reports_cache._GeneratePendingCounts()
 
-    self.mox.StubOutWithMock(reports_cache.models, 'KeyValueCache')
-    self.mox.StubOutWithMock(
-        reports_cache.models.KeyValueCache, 'get_by_key_name')
-    self.mox.StubOutWithMock(reports_cache.models.InstallLog, 'all')
-    self.mox.StubOutWithMock(
-        reports_cache.models.ReportsCache, 'GetInstallCounts')
-    self.mox.StubOutWithMock(
-        reports_cache.models.ReportsCache, 'SetInstallCounts')
-
-    reports_cache.models.ReportsCache.GetInstallCounts().AndReturn(
-        (install_counts, None))
-    mock_query = self.mox.CreateMockAnything()
-    reports_cache.models.InstallLog.all().AndReturn(mock_query)
-    mock_query.order('server_datetime').AndReturn(mock_query)
-    mock_cursor_obj = self.mox.CreateMockAnything()
-    mock_cursor_obj.text_value = 'foocursor'
-    reports_cache.models.KeyValueCache.get_by_key_name(
-        'pkgs_list_cursor').AndReturn(mock_cursor_obj)
-    mock_query.with_cursor(mock_cursor_obj.text_value)
-    mock_query.fetch(1000).AndReturn(new_installs)
-
-    reports_cache.models.ReportsCache.SetInstallCounts(new_install_counts)
-    mock_query.cursor().AndReturn(None)
-    mock_cursor_obj.put().AndReturn(None)
+    counts, _ = models.ReportsCache.GetPendingCounts()
+    self.assertEqual({'foo-1': 2, 'bar-1': 1}, counts)
 
+  def testGenerateInstallCounts(self):
+    """Test _GenerateInstallCounts() backfills shards once."""
     self.mox.StubOutWithMock(reports_cache.deferred, 'defer')
     reports_cache.deferred.defer(
-        reports_cache._GenerateInstallCounts).AndReturn(None)
+        models.InstallCountShard.Backfill, 1, _countdown=mox.IsA(int))
 
     self.mox.ReplayAll()
     reports_cache._GenerateInstallCounts()
+    reports_cache._GenerateInstallCounts()
     self.mox.VerifyAll()
 
+  def testRebuildInstallCounts(self):
+    """Test RebuildInstallCounts() counts into a new generation."""
+    models.InstallLog(package='foo', status='0', duration_seconds=20).put()
+    models.InstallLog(package='foo', status='1').put()
+    models.InstallLog(package='bar', status='0').put()
+    models.InstallCountShard(
+        key_name='foo_0', package='foo', install_count=5).put()
+
+    self.mox.StubOutWithMock(reports_cache.deferred, 'defer')
+    reports_cache.deferred.defer(
+        models.InstallCountShard.Backfill, 1, _countdown=mox.IsA(int))
+    reports_cache.deferred.defer(
+        models.InstallCountShard.Backfill, 1, _transactional=True)
+    reports_cache.deferred.defer(models.InstallCountShard.DeleteGeneration, 0)
+
+    self.mox.ReplayAll()
+    reports_cache.RebuildInstallCounts()
+    models.InstallCountShard.Backfill(1)
+
+    # counts are read from the previous generation until the rebuild is done.
+    counts, _ = models.ReportsCache.GetInstallCounts()
+    self.assertEqual(5, counts['foo']['install_count'])
+
+    # a retry of the counted batch is not counted again.
+    backfill = models.InstallCountBackfill.get_by_key_name('gen_1')
+    db.run_in_transaction(
+        models.InstallCountShard._CountBackfillBatch, backfill.key(), 1, None,
+        'cursor', {'foo': {
+            'applesus': False, 'install_count': 1, 'install_fail_count': 0,
+            'duration_count': 0, 'duration_total_seconds': 0}})
+
+    models.InstallCountShard.Backfill(1)
+    self.mox.VerifyAll()
+
+    memcache.flush_all()
+    counts, _ = models.ReportsCache.GetInstallCounts()
+    self.assertEqual(1, counts['foo']['install_count'])
+    self.assertEqual(1, counts['foo']['install_fail_count'])
+    self.assertEqual(20, counts['foo']['duration_seconds_avg'])
+    self.assertEqual(1, counts['bar']['install_count'])
+    self.assertEqual(None, counts['bar']['duration_seconds_avg'])
+    self.assertEqual(
+        {'active': 1, 'building': None, 'since': None},
+        models.InstallCountShard.GetGenerations())
+
   def testGenerateTrendingInstallsCache(self):
     """Tests _GenerateTrendingInstallsCache."""
     package1_name = 'package1'
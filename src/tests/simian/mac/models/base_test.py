@@ -16,14 +16,18 @@
 #
 """models module tests."""
 
+import datetime
+
 import tests.appenginesdk
 
+import mock
 import mox
 import stubout
 
 from google.apputils import app
 from google.apputils import basetest
 from simian.mac.models import base as models
+from tests.simian.mac.common import test
 
 
 class ModelsModuleTest(mox.MoxTestBase):
@@ -438,6 +442,8 @@ class BaseManifestModificationTest(mox.MoxTestBase):
     self.mox.StubOutWithMock(mod_type_cls, 'DeleteMemcacheWrappedGetAllFilter')
     mod_type_cls.DeleteMemcacheWrappedGetAllFilter(
         (('%s =' % mod_type, target),)).AndReturn(None)
+    self.mox.StubOutWithMock(models.ManifestModificationIndex, 'Invalidate')
+    models.ManifestModificationIndex.Invalidate().AndReturn(None)
 
     self.mox.ReplayAll()
     self.assertTrue(mod_type_invalid not in models.MANIFEST_MOD_MODELS)
@@ -449,6 +455,209 @@ class BaseManifestModificationTest(mox.MoxTestBase):
     self.mox.VerifyAll()
 
 
+class ManifestModificationIndexTest(test.AppengineTest):
+  """ManifestModificationIndex class test."""
+
+  def setUp(self):
+    super(ManifestModificationIndexTest, self).setUp()
+    models.ManifestModificationIndex._local_cache.clear()
+
+  def _GetClientId(self, **kwargs):
+    client_id = {
+        'site': 'NYC', 'os_version': '10.11.6', 'owner': 'foouser',
+        'uuid': 'fooUUID', 'track': 'stable',
+    }
+    client_id.update(kwargs)
+    return client_id
+
+  def testGetModifications(self):
+    """Test GetModifications() with mods of every type."""
+    models.SiteManifestModification(
+        key_name='NYC##SitePkg', site='NYC', value='SitePkg',
+        install_types=['managed_installs']).put()
+    models.OSVersionManifestModification(
+        key_name='10.11.6##OSPkg', os_version='10.11.6', value='OSPkg',
+        install_types=['managed_updates'], manifests=['stable']).put()
+    models.OwnerManifestModification(
+        key_name='foouser##-OwnerPkg', owner='foouser', value='-OwnerPkg',
+        install_types=['managed_installs']).put()
+    models.UuidManifestModification(
+        key_name='fooUUID##UuidPkg', uuid='fooUUID', value='UuidPkg',
+        install_types=['optional_installs']).put()
+    models.TagManifestModification(
+        key_name='footag##TagPkg', tag_key_name='footag', value='TagPkg',
+        install_types=['managed_installs']).put()
+    models.Tag(
+        key_name='footag',
+        keys=[models.db.Key.from_path('Computer', 'fooUUID')]).put()
+    models.GroupManifestModification(
+        key_name='foogroup##GroupPkg', group_key_name='foogroup',
+        value='GroupPkg', install_types=['managed_installs']).put()
+    models.Group(key_name='foogroup', users=['foouser']).put()
+
+    index = models.ManifestModificationIndex.Get('stable')
+    self.assertEqual(
+        [('SitePkg', ['managed_installs']),
+         ('OSPkg', ['managed_updates']),
+         ('-OwnerPkg', ['managed_installs']),
+         ('UuidPkg', ['optional_installs']),
+         ('TagPkg', ['managed_installs']),
+         ('GroupPkg', ['managed_installs'])],
+        index.GetModifications(self._GetClientId()))
+
+    # A client sharing no targets gets no mods.
+    self.assertEqual(
+        [], index.GetModifications(self._GetClientId(
+            site='MTV', os_version='10.10', owner='baruser', uuid='barUUID')))
+
+  def testGetSkipsDisabledAndOtherTrackMods(self):
+    """Test Get() skips disabled mods and mods for other manifests."""
+    models.SiteManifestModification(
+        key_name='NYC##DisabledPkg', site='NYC', value='DisabledPkg',
+        install_types=['managed_installs'], enabled=False).put()
+    models.SiteManifestModification(
+        key_name='NYC##UnstablePkg', site='NYC', value='UnstablePkg',
+        install_types=['managed_installs'], manifests=['unstable']).put()
+
+    index = models.ManifestModificationIndex.Get(
+        'stable', tracks=['stable', 'unstable'])
+    self.assertEqual([], index.GetModifications(self._GetClientId()))
+
+    index = models.ManifestModificationIndex.Get('unstable')
+    self.assertEqual(
+        [('UnstablePkg', ['managed_installs'])],
+        index.GetModifications(self._GetClientId(track='unstable')))
+
+  def testGetRebuildsAfterInvalidate(self):
+    """Test Get() reuses the index until a mod changes."""
+    index = models.ManifestModificationIndex.Get('stable')
+    self.assertTrue(index is models.ManifestModificationIndex.Get('stable'))
+    self.assertEqual([], index.GetModifications(self._GetClientId()))
+
+    mod = models.SiteManifestModification(
+        key_name='NYC##SitePkg', site='NYC', value='SitePkg',
+        install_types=['managed_installs'])
+    mod.put()
+
+    index = models.ManifestModificationIndex.Get('stable')
+    self.assertEqual(
+        [('SitePkg', ['managed_installs'])],
+        index.GetModifications(self._GetClientId()))
+
+    mod.delete()
+    index = models.ManifestModificationIndex.Get('stable')
+    self.assertEqual([], index.GetModifications(self._GetClientId()))
+
+  def testGetFromMemcache(self):
+    """Test Get() loads an index built by another instance from memcache."""
+    models.SiteManifestModification(
+        key_name='NYC##SitePkg', site='NYC', value='SitePkg',
+        install_types=['managed_installs']).put()
+    generation = models.ManifestModificationIndex.Get('stable').generation
+    models.ManifestModificationIndex._local_cache.clear()
+
+    with mock.patch.object(
+        models.ManifestModificationIndex, '_BuildData') as build_data:
+      index = models.ManifestModificationIndex.Get('stable')
+      self.assertFalse(build_data.called)
+
+    self.assertEqual(generation, index.generation)
+    self.assertEqual(
+        [('SitePkg', ['managed_installs'])],
+        index.GetModifications(self._GetClientId()))
+
+
+class LocalCacheTest(test.AppengineTest):
+  """Instance-local MemcacheWrappedGet cache test."""
+
+  def setUp(self):
+    super(LocalCacheTest, self).setUp()
+    models._local_cache.Clear()
+
+  def testMemcacheWrappedGetUsesLocalCache(self):
+    """Tests that repeated gets are served from the local cache."""
+    models.KeyValueCache(key_name='foo', text_value='bar').put()
+
+    self.assertEqual(
+        'bar', models.KeyValueCache.MemcacheWrappedGet('foo', 'text_value'))
+    self.assertEqual(
+        'bar', models.KeyValueCache.MemcacheWrappedGet('foo', 'text_value'))
+
+    stats = models.KeyValueCache.GetLocalCacheStats()
+    self.assertEqual(1, stats['hits'])
+    self.assertEqual(1, stats['misses'])
+    self.assertEqual(1, stats['size'])
+
+  def testMemcacheWrappedSetInvalidatesLocalCache(self):
+    """Tests that MemcacheWrappedSet invalidates locally cached values."""
+    models.KeyValueCache(key_name='foo', text_value='bar').put()
+    self.assertEqual(
+        'bar', models.KeyValueCache.MemcacheWrappedGet('foo', 'text_value'))
+
+    models.KeyValueCache.MemcacheWrappedSet('foo', 'text_value', 'zoo')
+
+    self.assertEqual(
+        'zoo', models.KeyValueCache.MemcacheWrappedGet('foo', 'text_value'))
+
+  def testDeleteMemcacheWrapInvalidatesLocalCache(self):
+    """Tests that DeleteMemcacheWrap invalidates locally cached values."""
+    models.KeyValueCache(key_name='foo', text_value='bar').put()
+    self.assertEqual(
+        'bar', models.KeyValueCache.MemcacheWrappedGet('foo', 'text_value'))
+
+    models.KeyValueCache(key_name='foo', text_value='zoo').put()
+    models.KeyValueCache.DeleteMemcacheWrap('foo', prop_name='text_value')
+
+    self.assertEqual(
+        'zoo', models.KeyValueCache.MemcacheWrappedGet('foo', 'text_value'))
+
+  def testLocalCacheDisabledByDefault(self):
+    """Tests that models must opt in to the local cache."""
+    self.assertFalse(models.BaseModel.MEMCACHE_WRAP_LOCAL_CACHE)
+    models.Tag(key_name='foo').put()
+
+    models.Tag.MemcacheWrappedGet('foo')
+
+    self.assertEqual(0, models.KeyValueCache.GetLocalCacheStats()['size'])
+
+
+class InstallCountShardTest(test.AppengineTest):
+  """InstallCountShard test."""
+
+  DELTA = {
+      'applesus': False, 'install_count': 1, 'install_fail_count': 0,
+      'duration_count': 0, 'duration_total_seconds': 0}
+
+  def testIncrementIsIdempotent(self):
+    """Tests that retrying an applied increment does not count it again."""
+    increment = ('foo_0', 'foo', 0, self.DELTA, 'id1')
+    models.InstallCountShard.ApplyIncrements([increment])
+    models.InstallCountShard.ApplyIncrements([increment])
+
+    shard = models.InstallCountShard.get_by_key_name('foo_0')
+    self.assertEqual(1, shard.install_count)
+    self.assertEqual(['id1'], shard.increment_ids)
+
+  def testIncrementInstallsWhileRebuilding(self):
+    """Tests that installs since a rebuild started count in both generations."""
+    self.assertEqual(1, models.InstallCountShard.StartRebuild())
+    since = models.InstallCountBackfill.get_by_key_name('gen_1').since
+    installs = [
+        models.InstallLog(package='foo', status='0'),
+        models.InstallLog(package='foo', status='0'),
+    ]
+    installs[0].server_datetime = since - datetime.timedelta(seconds=1)
+    installs[1].server_datetime = since
+
+    models.InstallCountShard.IncrementInstalls(installs)
+
+    counts = {}
+    for shard in models.InstallCountShard.all():
+      counts[shard.generation] = (
+          counts.get(shard.generation, 0) + shard.install_count)
+    self.assertEqual({0: 2, 1: 1}, counts)
+
+
 class KeyValueCacheTest(mox.MoxTestBase):
   """Test KeyValueCache class."""
 
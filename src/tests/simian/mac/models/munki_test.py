@@ -56,7 +56,8 @@ class CatalogTest(mox.MoxTestBase, test.AppengineTest):
         name, '2010-09-02-19-30-21-377827')
     models.datetime.datetime.utcnow().AndReturn(utcnow)
     models.deferred.defer(
-        models.Catalog.Generate, name, _name=deferred_name, _countdown=2)
+        models.Catalog.Generate, name, full=False, _name=deferred_name,
+        _countdown=2)
     self.mox.ReplayAll()
     models.Catalog.Generate(name, delay=2)
     self.mox.VerifyAll()
@@ -67,11 +68,13 @@ class CatalogTest(mox.MoxTestBase, test.AppengineTest):
     plist1 = '<dict><key>foo</key><string>bar</string></dict>'
     mock_plist1 = self.mox.CreateMockAnything()
     pkg1 = test.GenericContainer(
-        plist=mock_plist1, name='foo', mtime=datetime.datetime.utcnow())
+        plist=mock_plist1, plist_xml=u'foo xml', name='foo',
+        mtime=datetime.datetime.utcnow())
     plist2 = '<dict><key>foo</key><string>bar</string></dict>'
     mock_plist2 = self.mox.CreateMockAnything()
     pkg2 = test.GenericContainer(
-        plist=mock_plist2, name='bar', mtime=datetime.datetime.utcnow())
+        plist=mock_plist2, plist_xml=u'bar xml', name='bar',
+        mtime=datetime.datetime.utcnow())
 
     self.mox.StubOutWithMock(models.Manifest, 'Generate')
     self.mox.StubOutWithMock(models.PackageInfo, 'all')
@@ -82,11 +85,15 @@ class CatalogTest(mox.MoxTestBase, test.AppengineTest):
     models.PackageInfo.all().AndReturn(mock_model)
     mock_model.filter('catalogs =', name).AndReturn(mock_model)
     mock_model.fetch(None).AndReturn([pkg1, pkg2])
-    pkg1.plist.GetXmlContent(indent_num=1).AndReturn(plist1)
-    pkg2.plist.GetXmlContent(indent_num=1).AndReturn(plist2)
+    pkg1.plist.GetXmlContent(indent_num=2).AndReturn(plist1)
+    pkg2.plist.GetXmlContent(indent_num=2).AndReturn(plist2)
 
     mock_catalog = self.mox.CreateMockAnything()
     models.Catalog.get_or_insert(name).AndReturn(mock_catalog)
+    mock_catalog.SetPlistXml(
+        '%s  <array>\n%s\n%s\n  </array>%s' % (
+            models.plist_lib.PLIST_HEAD, plist1, plist2,
+            models.plist_lib.PLIST_FOOT)).AndReturn(None)
     mock_catalog.put(avoid_mtime_update=True).AndReturn(None)
 
     models.Catalog.DeleteMemcacheWrap(name).AndReturn(None)
@@ -106,9 +113,6 @@ class CatalogTest(mox.MoxTestBase, test.AppengineTest):
         mock.call.Release()])
 
     self.assertEqual(mock_catalog.name, name)
-    xml = '\n'.join([plist1, plist2])
-    expected_plist = models.constants.CATALOG_PLIST_XML % xml
-    self.assertEqual(expected_plist, mock_catalog.plist)
     self.assertEqual(mock_catalog.package_names, ['foo', 'bar'])
 
   def testGenerateWithNoPkgsinfo(self):
@@ -126,6 +130,10 @@ class CatalogTest(mox.MoxTestBase, test.AppengineTest):
 
     mock_catalog = self.mox.CreateMockAnything()
     models.Catalog.get_or_insert(name).AndReturn(mock_catalog)
+    mock_catalog.SetPlistXml(
+        '%s  <array>\n  </array>%s' % (
+            models.plist_lib.PLIST_HEAD,
+            models.plist_lib.PLIST_FOOT)).AndReturn(None)
     mock_catalog.put(avoid_mtime_update=True).AndReturn(None)
 
     models.Catalog.DeleteMemcacheWrap(name).AndReturn(None)
@@ -134,8 +142,6 @@ class CatalogTest(mox.MoxTestBase, test.AppengineTest):
     self.mox.ReplayAll()
     models.Catalog.Generate(name)
     self.assertEqual(mock_catalog.name, name)
-    expected_plist = models.constants.CATALOG_PLIST_XML % '\n'.join([])
-    self.assertEqual(expected_plist, mock_catalog.plist)
     self.assertEqual(mock_catalog.package_names, [])
     self.mox.VerifyAll()
 
@@ -143,13 +149,15 @@ class CatalogTest(mox.MoxTestBase, test.AppengineTest):
     """Tests Generate() where plist.GetXmlDocument() raises plist.Error."""
     name = 'goodname'
     mock_plist1 = self.mox.CreateMockAnything()
-    pkg1 = test.GenericContainer(plist=mock_plist1, name='foo')
+    pkg1 = test.GenericContainer(
+        plist=mock_plist1, plist_xml=u'foo xml', name='foo',
+        mtime=datetime.datetime.utcnow())
     mock_model = self.mox.CreateMockAnything()
     self.mox.StubOutWithMock(models.PackageInfo, 'all')
     models.PackageInfo.all().AndReturn(mock_model)
     mock_model.filter('catalogs =', name).AndReturn(mock_model)
     mock_model.fetch(None).AndReturn([pkg1])
-    mock_plist1.GetXmlContent(indent_num=1).AndRaise(models.plist_lib.Error)
+    mock_plist1.GetXmlContent(indent_num=2).AndRaise(models.plist_lib.Error)
 
     self.mox.ReplayAll()
     self.assertRaises(
@@ -162,23 +170,26 @@ class CatalogTest(mox.MoxTestBase, test.AppengineTest):
     plist1 = '<plist><dict><key>foo</key><string>bar</string></dict></plist>'
     mock_plist1 = self.mox.CreateMockAnything()
     pkg1 = test.GenericContainer(
-        plist=mock_plist1, name='foo', mtime=datetime.datetime.utcnow())
+        plist=mock_plist1, plist_xml=u'foo xml', name='foo',
+        mtime=datetime.datetime.utcnow())
     plist2 = '<plist><dict><key>foo</key><string>bar</string></dict></plist>'
     mock_plist2 = self.mox.CreateMockAnything()
     pkg2 = test.GenericContainer(
-        plist=mock_plist2, name='bar', mtime=datetime.datetime.utcnow())
+        plist=mock_plist2, plist_xml=u'bar xml', name='bar',
+        mtime=datetime.datetime.utcnow())
 
     mock_model = self.mox.CreateMockAnything()
     self.mox.StubOutWithMock(models.PackageInfo, 'all')
     models.PackageInfo.all().AndReturn(mock_model)
     mock_model.filter('catalogs =', name).AndReturn(mock_model)
     mock_model.fetch(None).AndReturn([pkg1, pkg2])
-    mock_plist1.GetXmlContent(indent_num=1).AndReturn(plist1)
-    mock_plist2.GetXmlContent(indent_num=1).AndReturn(plist2)
+    mock_plist1.GetXmlContent(indent_num=2).AndReturn(plist1)
+    mock_plist2.GetXmlContent(indent_num=2).AndReturn(plist2)
 
     mock_catalog = self.mox.CreateMockAnything()
     self.mox.StubOutWithMock(models.Catalog, 'get_or_insert')
     models.Catalog.get_or_insert(name).AndReturn(mock_catalog)
+    mock_catalog.SetPlistXml(mox.IgnoreArg()).AndReturn(None)
     mock_catalog.put(avoid_mtime_update=True).AndRaise(models.db.Error)
 
     self.mox.ReplayAll()
@@ -186,6 +197,40 @@ class CatalogTest(mox.MoxTestBase, test.AppengineTest):
         models.db.Error, models.Catalog.Generate, name)
     self.mox.VerifyAll()
 
+  @mock.patch.object(models.Manifest, 'Generate')
+  def testGenerateIncremental(self, _):
+    """Tests Generate() reuses fragments of unchanged pkginfo plists."""
+    name = 'unstable'
+    for pkg_name in ['foo', 'bar']:
+      p = models.PackageInfo(
+          key_name='%s.dmg' % pkg_name, name=pkg_name, catalogs=[name])
+      p.plist = (
+          '<plist><dict><key>name</key><string>%s</string>'
+          '<key>version</key><string>1.0</string>'
+          '<key>catalogs</key><array><string>%s</string></array>'
+          '</dict></plist>' % (pkg_name, name))
+      p.put()
+
+    models.Catalog.Generate(name)
+    catalog_xml = models.Catalog.get_by_key_name(name).plist_xml
+
+    # The spliced catalog is in the form the plist library serializes it.
+    catalog = models.plist_lib.MunkiPlist(catalog_xml.encode('utf-8'))
+    catalog.Parse()
+    self.assertEqual(catalog_xml, catalog.GetXml())
+    self.assertEqual(
+        ['bar', 'foo'], sorted(pkginfo['name'] for pkginfo in catalog))
+
+    with mock.patch.object(
+        models.plist_lib.ApplePlist, 'GetXmlContent',
+        side_effect=models.plist_lib.Error):
+      models.Catalog.Generate(name)
+      self.assertEqual(
+          catalog_xml, models.Catalog.get_by_key_name(name).plist_xml)
+
+      self.assertRaises(
+          models.plist_lib.Error, models.Catalog.Generate, name, full=True)
+
   def testGenerateLocked(self):
     """Tests Generate() where name is locked."""
     name = 'lockedname'
@@ -382,6 +427,103 @@ class PackageInfoTest(mox.MoxTestBase):
         '<key>catalogs</key><array>%(catalogs)s</array>'
         '<key>description</key><string>%(desc)s</string></dict></plist>' % d)
 
+  def testPlistLazy(self):
+    """Tests plist_lazy is cached per mtime and reflects changes."""
+    p = models.PackageInfo(key_name='foo.dmg')
+    p.plist = self._GetTestPackageInfoPlist({'desc': 'desc1'})
+    p.put()
+
+    p = models.PackageInfo.get_by_key_name('foo.dmg')
+    lazy = p.plist_lazy
+    self.assertTrue(isinstance(lazy, models.plist_lib.LazyPlist))
+    self.assertEqual('fooname', lazy.get('name'))
+    self.assertEqual(['unstable'], lazy['catalogs'])
+    self.assertFalse(hasattr(p, '_plist_obj'))
+    self.assertTrue(
+        models.PackageInfo.get_by_key_name('foo.dmg').plist_lazy is lazy)
+
+    p.plist['description'] = 'desc2'
+    self.assertTrue(p.plist_lazy is p.plist)
+    p.put(avoid_mtime_update=True)
+    p = models.PackageInfo.get_by_key_name('foo.dmg')
+    self.assertFalse(p.plist_lazy is lazy)
+    self.assertEqual('desc2', p.plist_lazy['description'])
+
+  def testPutWithNestedPlistEdit(self):
+    """Tests put() stores in-place edits of nested plist values."""
+    p = models.PackageInfo(key_name='foo.dmg')
+    p.plist = self._GetTestPackageInfoPlist()
+    p.put()
+
+    p = models.PackageInfo.get_by_key_name('foo.dmg')
+    p.plist['catalogs'].append('testing')
+    p.plist.GetContents()['description'] = 'nested'
+    p.put()
+
+    p = models.PackageInfo.get_by_key_name('foo.dmg')
+    self.assertEqual(['unstable', 'testing'], p.plist['catalogs'])
+    self.assertEqual('nested', p.plist['description'])
+
+  def testPutUpdatesPlistSummary(self):
+    """Tests put() updates the plist summary properties."""
+    p = models.PackageInfo(key_name='foo.dmg')
+    p.plist = (
+        '<plist><dict><key>name</key><string>fooname</string>'
+        '<key>display_name</key><string>Foo Name</string>'
+        '<key>version</key><string>1.0</string>'
+        '<key>installer_item_size</key><integer>1024</integer>'
+        '<key>unattended_install</key><true/>'
+        '<key>uninstallable</key><string>not a bool</string>'
+        '<key>force_install_after_date</key>'
+        '<date>2016-01-02T03:04:05Z</date>'
+        '<key>RestartAction</key><string>RequireRestart</string>'
+        '<key>catalogs</key><array><string>unstable</string></array>'
+        '</dict></plist>')
+    p.put()
+
+    p = models.PackageInfo.get_by_key_name('foo.dmg')
+    self.assertEqual(models.PLIST_SUMMARY_VERSION, p.plist_summary_version)
+    self.assertEqual('Foo Name', p.display_name)
+    self.assertEqual('1.0', p.version)
+    self.assertEqual(1024, p.installer_item_size)
+    self.assertTrue(p.unattended_install)
+    self.assertEqual(None, p.unattended_uninstall)
+    self.assertEqual(None, p.uninstallable)  # wrong type.
+    self.assertEqual(
+        datetime.datetime(2016, 1, 2, 3, 4, 5), p.force_install_after_date)
+    self.assertEqual('RequireRestart', p.restart_action)
+
+    self.assertFalse(p.UpdatePlistSummary())
+    p.plist['version'] = '2.0'
+    self.assertTrue(p.UpdatePlistSummary())
+    self.assertEqual('2.0', p.version)
+
+    p.put()
+    self.assertEqual(
+        1, models.PackageInfo.all().filter('version =', '2.0').count())
+
+  def testGetPlistSummaryWhenStale(self):
+    """Tests GetPlistSummary() reads the plist when the summary is stale."""
+    p = models.PackageInfo(key_name='foo.dmg')
+    p.plist = self._GetTestPackageInfoPlist()
+    p.put()
+    p.plist_summary_version = None
+    p.version = None
+    models.db.put(p)
+
+    p = models.PackageInfo.get_by_key_name('foo.dmg')
+    summary = p.GetPlistSummary()
+    self.assertEqual('fooversion', summary['version'])
+    self.assertEqual(None, summary['display_name'])
+    self.assertEqual(models.PLIST_SUMMARY_VERSION, p.plist_summary_version)
+
+  def testIsPlistSummaryBackfilled(self):
+    """Tests IsPlistSummaryBackfilled() and SetPlistSummaryBackfilled()."""
+    self.assertFalse(models.PackageInfo.IsPlistSummaryBackfilled())
+    models.PackageInfo.SetPlistSummaryBackfilled()
+    self.assertTrue(models.PackageInfo.IsPlistSummaryBackfilled())
+    self.assertFalse(models.PackageInfoProposal.IsPlistSummaryBackfilled())
+
   def testGetDescription(self):
     """Tests getting PackageInfo.description property."""
     p = models.PackageInfo()
@@ -833,6 +975,161 @@ class PackageInfoTest(mox.MoxTestBase):
     self.assertTrue('https://foo.com/admin/package/file%20name.dmg' in body)
 
 
+class PackageInfoExportTest(test.AppengineTest):
+  """Test PackageInfoExport class."""
+
+  def _PutPackageInfo(self, filename, version='1.0'):
+    p = models.PackageInfo(key_name=filename, filename=filename)
+    p.plist = (
+        '<plist><dict><key>name</key><string>%s</string>'
+        '<key>version</key><string>%s</string>'
+        '<key>unattended_install</key><true/>'
+        '<key>catalogs</key><array><string>unstable</string></array>'
+        '</dict></plist>' % (filename, version))
+    p.catalogs = ['unstable']
+    p.put()
+    return p
+
+  def _MockQueue(self, key_names=()):
+    queue = mock.MagicMock()
+    queue.lease_tasks.return_value = [
+        mock.Mock(payload=key_name) for key_name in key_names]
+    return mock.patch.object(models.taskqueue, 'Queue', return_value=queue)
+
+  @mock.patch.object(models.deferred, 'defer')
+  def testQueueUpdate(self, defer_mock):
+    """Tests QueueUpdate() queues the package and schedules one Update()."""
+    with self._MockQueue() as queue_mock:
+      models.PackageInfoExport.QueueUpdate('foo.dmg')
+      models.PackageInfoExport.QueueUpdate('bar.dmg')
+
+    queue_mock.assert_called_with(models.PACKAGE_INFO_EXPORT_QUEUE)
+    tasks = [c[0][0] for c in queue_mock.return_value.add.call_args_list]
+    self.assertEqual(['foo.dmg', 'bar.dmg'], [t.payload for t in tasks])
+    self.assertEqual(2, defer_mock.call_count)
+    self.assertEqual(
+        models.PackageInfoExport.Update, defer_mock.call_args[0][0])
+    self.assertTrue(
+        defer_mock.call_args[1]['_name'].startswith('package-info-export-'))
+
+  def testGet(self):
+    """Tests Get() builds and stores the export."""
+    p = self._PutPackageInfo('foo.dmg')
+
+    with self._MockQueue():
+      export = models.PackageInfoExport.Get()
+
+    self.assertTrue(export.is_saved())
+    packages = export.GetPackages()
+    self.assertEqual(['foo.dmg'], packages.keys())
+    self.assertEqual(p.GetExportDict(), packages['foo.dmg'])
+    self.assertEqual('1.0', packages['foo.dmg']['version'])
+    self.assertTrue(packages['foo.dmg']['unattended_install'])
+    self.assertTrue(packages['foo.dmg']['uninstallable'])  # default.
+    self.assertEqual(
+        models.hashlib.sha256(
+            models.compress.Gunzip(export.GetGzip())).hexdigest(),
+        export.etag)
+
+  @mock.patch.object(models, 'PACKAGE_INFO_EXPORT_CHUNK_BYTES', 100)
+  @mock.patch.object(models.deferred, 'defer')
+  def testUpdateWhenExportIsChunked(self, defer_mock):
+    """Tests Update() stores an export too large for one entity in chunks."""
+    for i in xrange(10):
+      self._PutPackageInfo('foo%d.dmg' % i)
+    with self._MockQueue():
+      export = models.PackageInfoExport.Update(rebuild=True)
+    replaced = (export.mtime, export.chunk_count)
+
+    export = models.PackageInfoExport.get_by_key_name(
+        models.PACKAGE_INFO_EXPORT_KEY)
+    self.assertTrue(export.chunk_count > 1)
+    self.assertEqual(10, len(export.GetPackages()))
+
+    self._PutPackageInfo('foo0.dmg', version='2.0')
+    with self._MockQueue(['foo0.dmg']):
+      models.PackageInfoExport.Update()
+
+    export = models.PackageInfoExport.get_by_key_name(
+        models.PACKAGE_INFO_EXPORT_KEY)
+    self.assertEqual('2.0', export.GetPackages()['foo0.dmg']['version'])
+    # the replaced export's chunks are kept for requests still reading it.
+    defer_mock.assert_called_with(
+        models.PackageInfoExportChunk.DeleteChunks, *replaced,
+        _countdown=models.PACKAGE_INFO_EXPORT_CHUNK_EXPIRY_SECS)
+    models.PackageInfoExportChunk.DeleteChunks(*replaced)
+    self.assertEqual(10, len(export.GetPackages()))
+
+  def testUpdate(self):
+    """Tests Update() re-exports only queued packages."""
+    self._PutPackageInfo('foo.dmg')
+    bar = self._PutPackageInfo('bar.dmg')
+    with self._MockQueue():
+      export = models.PackageInfoExport.Update(rebuild=True)
+    etag = export.etag
+
+    # Changes that were not queued are not exported.
+    self._PutPackageInfo('zoo.dmg')
+    self._PutPackageInfo('foo.dmg', version='2.0')
+    bar.delete()
+    with self._MockQueue(['foo.dmg', 'bar.dmg', 'foo.dmg']) as queue_mock:
+      export = models.PackageInfoExport.Update()
+      queue = queue_mock.return_value
+      self.assertEqual(
+          ['foo.dmg', 'bar.dmg', 'foo.dmg'],
+          [t.payload for t in queue.delete_tasks.call_args[0][0]])
+
+    export = models.PackageInfoExport.get_by_key_name(
+        models.PACKAGE_INFO_EXPORT_KEY)
+    packages = export.GetPackages()
+    self.assertEqual(['foo.dmg'], packages.keys())
+    self.assertEqual('2.0', packages['foo.dmg']['version'])
+    self.assertEqual(['bar.dmg'], export.GetDeleted().keys())
+    self.assertNotEqual(etag, export.etag)
+
+  def testUpdateWhenNothingQueued(self):
+    """Tests Update() leaves the export as is when nothing is queued."""
+    self._PutPackageInfo('foo.dmg')
+    with self._MockQueue():
+      export = models.PackageInfoExport.Update(rebuild=True)
+    with self._MockQueue():
+      self.assertEqual(
+          export.mtime, models.PackageInfoExport.Update().mtime)
+
+  def testGetChanges(self):
+    """Tests GetChanges()."""
+    now = datetime.datetime.utcnow()
+    old = now - datetime.timedelta(hours=1)
+    export = models.PackageInfoExport(key_name=models.PACKAGE_INFO_EXPORT_KEY)
+    export._SetPackages(
+        {'old.dmg': {'mtime': old.isoformat()},
+         'new.dmg': {'mtime': now.isoformat()}},
+        {'gone_old.dmg': old.isoformat(), 'gone_new.dmg': now.isoformat()},
+        now)
+
+    changes = export.GetChanges(now - datetime.timedelta(minutes=1))
+    self.assertEqual(['new.dmg'], changes['packages'].keys())
+    self.assertEqual(['gone_new.dmg'], changes['deleted'])
+    self.assertFalse(changes['complete'])
+    self.assertEqual(now.isoformat(), changes['mtime'])
+
+    changes = export.GetChanges(now - datetime.timedelta(days=365))
+    self.assertEqual(
+        ['new.dmg', 'old.dmg'], sorted(changes['packages'].keys()))
+    self.assertEqual([], changes['deleted'])
+    self.assertTrue(changes['complete'])
+
+  def testSetPackagesExpiresDeleted(self):
+    """Tests _SetPackages() drops deleted packages past retention."""
+    now = datetime.datetime.utcnow()
+    expired = now - datetime.timedelta(
+        days=models.PACKAGE_INFO_EXPORT_DELETED_DAYS + 1)
+    export = models.PackageInfoExport()
+    export._SetPackages(
+        {}, {'a.dmg': expired.isoformat(), 'b.dmg': now.isoformat()}, now)
+    self.assertEqual(['b.dmg'], export.GetDeleted().keys())
+
+
 def main(unused_argv):
   basetest.main()
 
@@ -17,8 +17,10 @@
 """Munki common module tests."""
 
 import datetime
+import json
 import logging
 
+import mock
 import mox
 import stubout
 
@@ -363,6 +365,126 @@ class CommonModuleTest(test.RequestHandlerTest):
     common.LogClientConnection(event, client_id, delay=2, ip_address=ip_address)
     self.mox.VerifyAll()
 
+  def _GetClientId(self, uuid):
+    return {
+        'uuid': uuid, 'hostname': 'foohostname', 'serial': 'fooserial',
+        'owner': 'foouser', 'track': 'stable', 'config_track': 'stable',
+        'os_version': '10.6.3', 'client_version': '0.6.0.759.0',
+        'on_corp': True, 'last_notified_datetime': None, 'site': 'NYC',
+        'uptime': 123.0, 'root_disk_free': 456, 'user_disk_free': 789,
+        'runtype': 'auto',
+    }
+
+  @mock.patch.object(common.taskqueue, 'Queue')
+  def testLogClientConnectionWriteBehind(self, queue_mock):
+    """Tests LogClientConnection() with client_connection_write_behind."""
+    models.Settings.SetItem('client_connection_write_behind', True)
+    client_id = self._GetClientId('foo-uuid')
+
+    common.LogClientConnection(
+        'preflight', client_id, ip_address='fooip',
+        report_feedback={'exit': True, 'force_continue': True})
+
+    queue_mock.assert_called_once_with(common.CLIENT_CONNECTION_QUEUE)
+    task = queue_mock.return_value.add.call_args[0][0]
+    self.assertEqual('foo-uuid', task.tag)
+    payload = json.loads(task.payload)
+    self.assertEqual('preflight', payload['event'])
+    self.assertEqual(client_id, payload['client_id'])
+    self.assertEqual('fooip', payload['ip_address'])
+    self.assertEqual({'exit': True}, payload['report_feedback'])
+    self.assertEqual(None, models.Computer.get_by_key_name('foo-uuid'))
+
+  @mock.patch.object(common.deferred, 'defer')
+  @mock.patch.object(common.taskqueue, 'Queue')
+  def testFlushClientConnections(self, queue_mock, defer_mock):
+    """Tests FlushClientConnections() coalesces connections by uuid."""
+    models.Computer(
+        key_name='old-uuid', uuid='old-uuid',
+        preflight_count_since_postflight=1).put()
+    common._QueueClientConnection(
+        'preflight', self._GetClientId('old-uuid'), None, None, 'ip1', None,
+        None)
+    common._QueueClientConnection(
+        'preflight', self._GetClientId('old-uuid'), None, None, 'ip2', None,
+        None)
+    common._QueueClientConnection(
+        'postflight', self._GetClientId('new-uuid'), ['pkg'], [], 'ip3', None,
+        None)
+    tasks = [c[0][0] for c in queue_mock.return_value.add.call_args_list]
+    queue_mock.return_value.lease_tasks.return_value = tasks
+    queue_mock.return_value.fetch_statistics.return_value.tasks = 0
+
+    stats = common.FlushClientConnections()
+
+    self.assertEqual(3, stats['connections'])
+    self.assertEqual(2, stats['computers'])
+    self.assertEqual(0, stats['backlog'])
+    old = models.Computer.get_by_key_name('old-uuid')
+    self.assertEqual(3, old.preflight_count_since_postflight)
+    self.assertEqual('ip2', old.ip_address)
+    new = models.Computer.get_by_key_name('new-uuid')
+    self.assertEqual(['pkg'], new.pkgs_to_install)
+    self.assertEqual(1, len(new.connection_datetimes))
+    deleted = queue_mock.return_value.delete_tasks.call_args[0][0]
+    self.assertEqual(set(tasks), set(deleted))
+    defer_mock.assert_called_once_with(
+        common._SaveFirstConnection, client_id=mock.ANY,
+        computer_key=new.key(), _countdown=300, _queue='first')
+
+  @mock.patch.object(common.taskqueue, 'Queue')
+  def testFlushClientConnectionsSkipsLoggedConnections(self, queue_mock):
+    """Tests FlushClientConnections() when tasks were not deleted."""
+    models.Computer(
+        key_name='old-uuid', uuid='old-uuid',
+        preflight_count_since_postflight=1).put()
+    common._QueueClientConnection(
+        'preflight', self._GetClientId('old-uuid'), None, None, 'ip1', None,
+        None)
+    tasks = [c[0][0] for c in queue_mock.return_value.add.call_args_list]
+    queue_mock.return_value.lease_tasks.return_value = tasks
+    queue_mock.return_value.fetch_statistics.return_value.tasks = 0
+
+    common.FlushClientConnections()
+    common.FlushClientConnections()
+
+    old = models.Computer.get_by_key_name('old-uuid')
+    self.assertEqual(2, old.preflight_count_since_postflight)
+    self.assertEqual(2, queue_mock.return_value.delete_tasks.call_count)
+
+  @mock.patch.object(common, 'CLIENT_CONNECTION_FLUSH_BATCH_SIZE', 1)
+  @mock.patch.object(common.deferred, 'defer')
+  @mock.patch.object(common.taskqueue, 'Queue')
+  def testFlushClientConnectionsWhenBatchFails(self, queue_mock, _):
+    """Tests FlushClientConnections() logs batches after a failed one."""
+    for uuid in ['uuid1', 'uuid2']:
+      common._QueueClientConnection(
+          'preflight', self._GetClientId(uuid), None, None, 'ip', None, None)
+    tasks = [c[0][0] for c in queue_mock.return_value.add.call_args_list]
+    queue_mock.return_value.lease_tasks.return_value = tasks
+    queue_mock.return_value.fetch_statistics.return_value.tasks = 1
+    put = common.db.put
+    batches = []
+
+    def _Put(entities):
+      batches.append([e.key().name() for e in entities])
+      if len(batches) == 1:
+        raise common.db.Timeout
+      return put(entities)
+
+    with mock.patch.object(common.db, 'put', side_effect=_Put):
+      stats = common.FlushClientConnections()
+
+    self.assertEqual(2, len(batches))
+    self.assertEqual(1, stats['computers'])
+    failed, logged = batches[0][0], batches[1][0]
+    self.assertEqual(None, models.Computer.get_by_key_name(failed))
+    self.assertNotEqual(None, models.Computer.get_by_key_name(logged))
+    deleted = queue_mock.return_value.delete_tasks.call_args[0][0]
+    self.assertEqual(1, len(deleted))
+    self.assertEqual(
+        logged, json.loads(deleted[0].payload)['client_id']['uuid'])
+
   def testKeyValueStringToDict(self):
     """Tests the KeyValueStringToDict() function."""
     s = 'key=value::none=None::true=True::false=False'
@@ -682,69 +804,18 @@ class CommonModuleTest(test.RequestHandlerTest):
     install_type_optional_installs = 'optional_installs'
     install_type_managed_updates = 'managed_updates'
 
-    value_one = 'foopkg'
-    site_mod_one = self.mox.CreateMockAnything()
-    site_mod_one.manifests = [manifest]
-    site_mod_one.enabled = True
-    site_mod_one.install_types = [install_type_optional_installs]
-    site_mod_one.value = value_one
-    site_mod_disabled = self.mox.CreateMockAnything()
-    site_mod_disabled.enabled = False
-    site_mods = [site_mod_one, site_mod_disabled]
-    self.mox.StubOutWithMock(
-        common.models.SiteManifestModification, 'MemcacheWrappedGetAllFilter')
-    common.models.SiteManifestModification.MemcacheWrappedGetAllFilter(
-        (('site =', site),)).AndReturn(site_mods)
-
-    os_version_mod_one = self.mox.CreateMockAnything()
-    os_version_mod_one.manifests = [manifest]
-    os_version_mod_one.enabled = True
-    os_version_mod_one.install_types = [install_type_managed_updates]
-    os_version_mod_one.value = 'foo os version pkg'
-    os_version_mods = [os_version_mod_one]
-    self.mox.StubOutWithMock(
-        common.models.OSVersionManifestModification,
-        'MemcacheWrappedGetAllFilter')
-    common.models.OSVersionManifestModification.MemcacheWrappedGetAllFilter(
-        (('os_version =', os_version),)).AndReturn(os_version_mods)
-
-    owner_mod_one = self.mox.CreateMockAnything()
-    owner_mod_one.manifests = [manifest]
-    owner_mod_one.enabled = True
-    owner_mod_one.install_types = [
-        install_type_optional_installs, install_type_managed_updates]
-    owner_mod_one.value = 'foo owner pkg'
-    owner_mods = [owner_mod_one]
-    self.mox.StubOutWithMock(
-        common.models.OwnerManifestModification,
-        'MemcacheWrappedGetAllFilter')
-    common.models.OwnerManifestModification.MemcacheWrappedGetAllFilter(
-        (('owner =', client_id['owner']),)).AndReturn(owner_mods)
-
-    uuid_mod_one = self.mox.CreateMockAnything()
-    uuid_mod_one.enabled = False
-    uuid_mods = [uuid_mod_one]
-    self.mox.StubOutWithMock(
-        common.models.UuidManifestModification,
-        'MemcacheWrappedGetAllFilter')
-    common.models.UuidManifestModification.MemcacheWrappedGetAllFilter(
-        (('uuid =', client_id['uuid']),)).AndReturn(uuid_mods)
-
-    computer_tags = ['footag1', 'footag2']
-    self.mox.StubOutWithMock(common.models.Tag, 'GetAllTagNamesForKey')
-    self.mox.StubOutWithMock(common.models.db.Key, 'from_path')
-    common.models.db.Key.from_path('Computer', client_id['uuid']).AndReturn('k')
-    common.models.Tag.GetAllTagNamesForKey('k').AndReturn(computer_tags)
-    tag_mod_one = self.mox.CreateMockAnything()
-    tag_mod_one.enabled = False
-    tag_mods = [tag_mod_one]
-    self.mox.StubOutWithMock(
-        common.models.TagManifestModification,
-        'MemcacheWrappedGetAllFilter')
-    common.models.TagManifestModification.MemcacheWrappedGetAllFilter(
-        (('tag_key_name =', 'footag1'),)).AndReturn([])
-    common.models.TagManifestModification.MemcacheWrappedGetAllFilter(
-        (('tag_key_name =', 'footag2'),)).AndReturn(tag_mods)
+    site_mod = ('foopkg', [install_type_optional_installs])
+    os_version_mod = ('foo os version pkg', [install_type_managed_updates])
+    owner_mod = (
+        'foo owner pkg',
+        [install_type_optional_installs, install_type_managed_updates])
+
+    mock_index = self.mox.CreateMockAnything()
+    self.mox.StubOutWithMock(common.models.ManifestModificationIndex, 'Get')
+    common.models.ManifestModificationIndex.Get(
+        manifest, tracks=common.common.TRACKS).AndReturn(mock_index)
+    mock_index.GetModifications(client_id).AndReturn(
+        [site_mod, os_version_mod, owner_mod])
 
     mock_plist = self.mox.CreateMockAnything()
     managed_installs = ['FooPkg', blocked_package_name]
@@ -754,21 +825,11 @@ class CommonModuleTest(test.RequestHandlerTest):
     common.plist_module.MunkiManifestPlist(plist_xml).AndReturn(mock_plist)
     mock_plist.Parse().AndReturn(None)
 
-    common.plist_module.UpdateIterable(
-        mock_plist, site_mod_one.install_types[0], site_mod_one.value,
-        default=[], op=common._ModifyList)
-
-    common.plist_module.UpdateIterable(
-        mock_plist, os_version_mod_one.install_types[0],
-        os_version_mod_one.value, default=[], op=common._ModifyList)
-
-    common.plist_module.UpdateIterable(
-        mock_plist, owner_mod_one.install_types[0],
-        owner_mod_one.value, default=[], op=common._ModifyList)
-
-    common.plist_module.UpdateIterable(
-        mock_plist, owner_mod_one.install_types[1],
-        owner_mod_one.value, default=[], op=common._ModifyList)
+    for value, install_types in [site_mod, os_version_mod, owner_mod]:
+      for install_type in install_types:
+        common.plist_module.UpdateIterable(
+            mock_plist, install_type, value, default=[],
+            op=common._ModifyList)
 
     for install_type in common.common.INSTALL_TYPES:
       if install_type == 'managed_installs':
@@ -786,16 +847,119 @@ class CommonModuleTest(test.RequestHandlerTest):
     self.assertTrue(blocked_package_name not in managed_installs)
     self.mox.VerifyAll()
 
+  def testGenerateDynamicManifestWithModificationIndex(self):
+    """Test GenerateDynamicManifest() applying mods from Datastore."""
+    models.ManifestModificationIndex._local_cache.clear()
+    uuid = 'uuidx'
+    client_id = {
+        'site': 'sitex',
+        'os_version': '10.9.5',
+        'owner': 'ownerx',
+        'uuid': uuid,
+        'track': 'stable',
+    }
+    models.SiteManifestModification(
+        key_name='sitex##SitePkg', site='sitex', value='SitePkg',
+        install_types=['managed_installs']).put()
+    models.SiteManifestModification(
+        key_name='sitex##DisabledPkg', site='sitex', value='DisabledPkg',
+        install_types=['managed_installs'], enabled=False).put()
+    models.OwnerManifestModification(
+        key_name='ownerx##UnstablePkg', owner='ownerx', value='UnstablePkg',
+        install_types=['managed_installs'], manifests=['unstable']).put()
+    models.TagManifestModification(
+        key_name='footag##-FooPkg', tag_key_name='footag', value='-FooPkg',
+        install_types=['managed_installs']).put()
+    models.Tag(
+        key_name='footag',
+        keys=[models.db.Key.from_path('Computer', uuid)]).put()
+    models.GroupManifestModification(
+        key_name='foogroup##GroupPkg', group_key_name='foogroup',
+        value='GroupPkg', install_types=['optional_installs']).put()
+    models.Group(key_name='foogroup', users=['ownerx']).put()
+
+    plist = common.plist_module.MunkiManifestPlist()
+    plist.SetContents({'managed_installs': ['FooPkg']})
+
+    xml_out = common.GenerateDynamicManifest(plist.GetXml(), client_id)
+
+    out = common.plist_module.MunkiManifestPlist(xml_out)
+    out.Parse()
+    self.assertEqual(['SitePkg'], out['managed_installs'])
+    self.assertEqual(['GroupPkg'], out['optional_installs'])
+
+  def _PutManifestForFingerprintTests(self):
+    """Stores a stable Manifest and site mod; returns the Manifest entity."""
+    models.ManifestModificationIndex._local_cache.clear()
+    common._rendered_manifest_cache.Clear()
+    models.SiteManifestModification(
+        key_name='sitex##SitePkg', site='sitex', value='SitePkg',
+        install_types=['managed_installs']).put()
+    plist = common.plist_module.MunkiManifestPlist()
+    plist.SetContents({'managed_installs': ['FooPkg']})
+    manifest = models.Manifest(key_name='stable')
+    manifest.plist = plist.GetXml()
+    manifest.put()
+    return manifest
+
+  def testGetManifestFingerprint(self):
+    """Test GetManifestFingerprint()."""
+    manifest = self._PutManifestForFingerprintTests()
+    client_id = {
+        'site': 'sitey', 'os_version': '10.9.5', 'owner': 'ownerx',
+        'uuid': 'uuidx', 'track': 'stable',
+    }
+    other_client_id = {
+        'site': 'sitez', 'os_version': '10.10.1', 'owner': 'ownery',
+        'uuid': 'uuidy', 'track': 'stable',
+    }
+    site_client_id = dict(client_id, site='sitex')
+
+    fingerprint = common.GetManifestFingerprint(manifest, client_id)
+    # attributes which select no mods do not change the fingerprint.
+    self.assertEqual(
+        fingerprint, common.GetManifestFingerprint(manifest, other_client_id))
+    self.assertNotEqual(
+        fingerprint, common.GetManifestFingerprint(manifest, site_client_id))
+    self.assertNotEqual(
+        fingerprint,
+        common.GetManifestFingerprint(
+            manifest, client_id, user_settings={'BlockPackages': ['FooPkg']}))
+
+    models.ManifestModificationIndex.Invalidate()
+    self.assertNotEqual(
+        fingerprint, common.GetManifestFingerprint(manifest, client_id))
+
+  def testGetRenderedManifest(self):
+    """Test GetRenderedManifest() renders once per fingerprint."""
+    manifest = self._PutManifestForFingerprintTests()
+    client_id = {
+        'site': 'sitex', 'os_version': '10.9.5', 'owner': 'ownerx',
+        'uuid': 'uuidx', 'track': 'stable',
+    }
+    other_client_id = dict(client_id, owner='ownery', uuid='uuidy')
+
+    with mock.patch.object(
+        common, 'GenerateDynamicManifest',
+        wraps=common.GenerateDynamicManifest) as generate_mock:
+      xml_out, fingerprint = common.GetRenderedManifest(manifest, client_id)
+      self.assertEqual(
+          (xml_out, fingerprint),
+          common.GetRenderedManifest(manifest, other_client_id))
+      self.assertEqual(1, generate_mock.call_count)
+
+      common._rendered_manifest_cache.Clear()
+      self.assertEqual(
+          (xml_out, fingerprint),
+          common.GetRenderedManifest(manifest, client_id))  # from memcache.
+      self.assertEqual(1, generate_mock.call_count)
+
+    out = common.plist_module.MunkiManifestPlist(xml_out)
+    out.Parse()
+    self.assertEqual(['FooPkg', 'SitePkg'], out['managed_installs'])
+
   def testGenerateDynamicManifestWhenOnlyUserSettingsMods(self):
     """Test GenerateDynamicManifest() when only user_settings mods exist."""
-    self.mox.StubOutWithMock(common.models, 'SiteManifestModification')
-    self.mox.StubOutWithMock(common.models, 'OSVersionManifestModification')
-    self.mox.StubOutWithMock(common.models, 'OwnerManifestModification')
-    self.mox.StubOutWithMock(common.models, 'UuidManifestModification')
-    self.mox.StubOutWithMock(common.models, 'TagManifestModification')
-    self.mox.StubOutWithMock(common.models.db.Key, 'from_path')
-    self.mox.StubOutWithMock(common.models.Tag, 'GetAllTagNamesForKey')
-
     client_id = {
         'site': 'sitex',
         'os_version': 'os_versionx',
@@ -812,18 +976,11 @@ class CommonModuleTest(test.RequestHandlerTest):
 
     plist_xml = '<plist xml>'
 
-    common.models.SiteManifestModification.MemcacheWrappedGetAllFilter(
-        (('site =', client_id['site']),)).AndReturn([])
-    common.models.OSVersionManifestModification.MemcacheWrappedGetAllFilter(
-        (('os_version =', client_id['os_version']),)).AndReturn([])
-    common.models.OwnerManifestModification.MemcacheWrappedGetAllFilter(
-        (('owner =', client_id['owner']),)).AndReturn([])
-    common.models.UuidManifestModification.MemcacheWrappedGetAllFilter(
-        (('uuid =', client_id['uuid']),)).AndReturn([])
-    common.models.db.Key.from_path('Computer', client_id['uuid']).AndReturn('k')
-    common.models.Tag.GetAllTagNamesForKey('k').AndReturn(['tag'])
-    common.models.TagManifestModification.MemcacheWrappedGetAllFilter(
-        (('tag_key_name =', 'tag'),)).AndReturn([])
+    mock_index = self.mox.CreateMockAnything()
+    self.mox.StubOutWithMock(common.models.ManifestModificationIndex, 'Get')
+    common.models.ManifestModificationIndex.Get(
+        client_id['track'], tracks=common.common.TRACKS).AndReturn(mock_index)
+    mock_index.GetModifications(client_id).AndReturn([])
 
     managed_installs = [
         'FooPkg', blocked_package_name, common.FLASH_PLUGIN_NAME]
@@ -864,13 +1021,6 @@ class CommonModuleTest(test.RequestHandlerTest):
 
   def testGenerateDynamicManifestWhenNoMods(self):
     """Test GenerateDynamicManifest() when no manifest mods are available."""
-    self.mox.StubOutWithMock(common.models, 'SiteManifestModification')
-    self.mox.StubOutWithMock(common.models, 'OSVersionManifestModification')
-    self.mox.StubOutWithMock(common.models, 'OwnerManifestModification')
-    self.mox.StubOutWithMock(common.models, 'UuidManifestModification')
-    self.mox.StubOutWithMock(common.models.db.Key, 'from_path')
-    self.mox.StubOutWithMock(common.models.Tag, 'GetAllTagNamesForKey')
-
     client_id = {
         'site': 'sitex',
         'os_version': 'os_versionx',
@@ -882,17 +1032,6 @@ class CommonModuleTest(test.RequestHandlerTest):
     user_settings = None
     plist_xml = '<plist xml>'
 
-    common.models.SiteManifestModification.MemcacheWrappedGetAllFilter(
-        (('site =', client_id['site']),)).AndReturn([])
-    common.models.OSVersionManifestModification.MemcacheWrappedGetAllFilter(
-        (('os_version =', client_id['os_version']),)).AndReturn([])
-    common.models.OwnerManifestModification.MemcacheWrappedGetAllFilter(
-        (('owner =', client_id['owner']),)).AndRaise([])
-    common.models.UuidManifestModification.MemcacheWrappedGetAllFilter(
-        (('uuid =', client_id['uuid']),)).AndRaise([])
-    common.models.db.Key.from_path('Computer', client_id['uuid']).AndReturn('k')
-    common.models.Tag.GetAllTagNamesForKey('k').AndReturn([])
-
     self.mox.ReplayAll()
     self.assertTrue(
         common.GenerateDynamicManifest(
@@ -943,7 +1082,7 @@ class CommonModuleTest(test.RequestHandlerTest):
     self.mox.StubOutWithMock(common.models, 'Computer')
     self.mox.StubOutWithMock(common, 'IsPanicModeNoPackages')
     self.mox.StubOutWithMock(common.models, 'Manifest')
-    self.mox.StubOutWithMock(common, 'GenerateDynamicManifest')
+    self.mox.StubOutWithMock(common, 'GetRenderedManifest')
     self.mox.StubOutWithMock(common.plist_module, 'MunkiManifestPlist')
     self.mox.StubOutWithMock(common.models, 'PackageInfo')
     self.mox.StubOutWithMock(common.plist_module, 'MunkiPackageInfoPlist')
@@ -951,12 +1090,11 @@ class CommonModuleTest(test.RequestHandlerTest):
     # mock manifest creation
     common.models.Computer.get_by_key_name(uuid).AndReturn(computer)
     common.IsPanicModeNoPackages().AndReturn(False)
-    mock_plist = self.mox.CreateMockAnything()
-    common.models.Manifest.MemcacheWrappedGet('track').AndReturn(
-        test.GenericContainer(enabled=True, plist=mock_plist))
-    common.GenerateDynamicManifest(
-        mock_plist, client_id, user_settings=None).AndReturn(
-        'manifest_plist')
+    manifest = test.GenericContainer(enabled=True)
+    common.models.Manifest.MemcacheWrappedGet('track').AndReturn(manifest)
+    common.GetRenderedManifest(
+        manifest, client_id, user_settings=None).AndReturn(
+            ('manifest_plist', 'fingerprint'))
 
     # mock manifest parsing
     mock_manifest_plist = self.mox.CreateMockAnything()
@@ -966,12 +1104,13 @@ class CommonModuleTest(test.RequestHandlerTest):
 
     # mock manifest reading and package map creation
     mock_package_info = self.mox.CreateMockAnything()
+    common.models.PackageInfo.IsPlistSummaryBackfilled().AndReturn(False)
     common.models.PackageInfo.all().AndReturn(mock_package_info)
     iter_return = []
 
     for package_info in package_infos:
       iter_return.append(test.GenericContainer(
-          plist=package_info.plist,
+          plist_lazy=package_info.plist,
           name=package_info.name))
       package_info.plist.get('display_name', None).AndReturn(None)
       package_info.plist.get('name').AndReturn(package_info.name)
@@ -995,6 +1134,45 @@ class CommonModuleTest(test.RequestHandlerTest):
     self.assertEqual(manifest, manifest_expected)
     self.mox.VerifyAll()
 
+  def testGetComputerManifestPackagemapWhenPlistSummaryBackfilled(self):
+    """Test GetComputerManifest() packagemap from a projection query."""
+    uuid = 'uuid'
+    package_infos = [
+        test.GenericContainer(
+            name='fooname1', display_name=None, version='1.0'),
+        test.GenericContainer(
+            name='fooname2', display_name=' Foo Name 2 ', version='2.0'),
+        test.GenericContainer(
+            name='fooname3', display_name='', version=None),
+    ]
+
+    self.mox.StubOutWithMock(common, 'GetComputerManifestAndFingerprint')
+    self.mox.StubOutWithMock(common.plist_module, 'MunkiManifestPlist')
+    self.mox.StubOutWithMock(common.models, 'PackageInfo')
+
+    common.GetComputerManifestAndFingerprint(
+        uuid=uuid, client_id=None).AndReturn(('manifest_plist', 'fp'))
+    mock_manifest_plist = self.mox.CreateMockAnything()
+    common.plist_module.MunkiManifestPlist('manifest_plist').AndReturn(
+        mock_manifest_plist)
+    mock_manifest_plist.Parse().AndReturn(None)
+    common.models.PackageInfo.IsPlistSummaryBackfilled().AndReturn(True)
+    common.models.PackageInfo.all(
+        projection=['name', 'display_name', 'version']).AndReturn(
+            package_infos)
+
+    self.mox.ReplayAll()
+    manifest = common.GetComputerManifest(uuid=uuid, packagemap=True)
+    self.assertEqual(
+        {'plist': mock_manifest_plist,
+         'packagemap': {
+             'fooname1': 'fooname1-1.0',
+             'fooname2': 'Foo Name 2-2.0',
+             'fooname3': 'fooname3-',
+         }},
+        manifest)
+    self.mox.VerifyAll()
+
   def testGetComputerManifestWhenEmptyDynamic(self):
     """Test ComputerInstallsPending()."""
     uuid = 'uuid'
@@ -1027,7 +1205,7 @@ class CommonModuleTest(test.RequestHandlerTest):
     self.mox.StubOutWithMock(common.models, 'Computer')
     self.mox.StubOutWithMock(common, 'IsPanicModeNoPackages')
     self.mox.StubOutWithMock(common.models, 'Manifest')
-    self.mox.StubOutWithMock(common, 'GenerateDynamicManifest')
+    self.mox.StubOutWithMock(common, 'GetRenderedManifest')
     self.mox.StubOutWithMock(common.plist_module, 'MunkiManifestPlist')
     self.mox.StubOutWithMock(common.models, 'PackageInfo')
     self.mox.StubOutWithMock(common.plist_module, 'MunkiPackageInfoPlist')
@@ -1035,11 +1213,11 @@ class CommonModuleTest(test.RequestHandlerTest):
     # mock manifest creation
     common.models.Computer.get_by_key_name(uuid).AndReturn(computer)
     common.IsPanicModeNoPackages().AndReturn(False)
-    mock_plist = self.mox.CreateMockAnything()
-    common.models.Manifest.MemcacheWrappedGet('track').AndReturn(
-        test.GenericContainer(enabled=True, plist=mock_plist))
-    common.GenerateDynamicManifest(
-        mock_plist, client_id, user_settings=None).AndReturn(None)
+    manifest = test.GenericContainer(enabled=True)
+    common.models.Manifest.MemcacheWrappedGet('track').AndReturn(manifest)
+    common.GetRenderedManifest(
+        manifest, client_id, user_settings=None).AndReturn(
+            (None, 'fingerprint'))
 
     self.mox.ReplayAll()
     self.assertRaises(
@@ -65,6 +65,31 @@ class HandlersTest(test.RequestHandlerTest):
     dt = datetime.datetime(2010, 10, 06, 03, 23, 34)  # later date
     self.assertTrue(handlers.IsClientResourceExpired(dt, header_dt_str))
 
+  def testQuoteETag(self):
+    """Tests QuoteETag()."""
+    self.assertEqual('"abc"', handlers.QuoteETag('abc'))
+
+  def testIsETagMatch(self):
+    """Tests IsETagMatch()."""
+    self.assertTrue(handlers.IsETagMatch('abc', '"abc"'))
+    self.assertTrue(handlers.IsETagMatch('abc', '"xyz", W/"abc"'))
+    self.assertTrue(handlers.IsETagMatch('abc', 'abc'))
+    self.assertTrue(handlers.IsETagMatch('abc', '*'))
+    self.assertFalse(handlers.IsETagMatch('abc', '"xyz"'))
+    self.assertFalse(handlers.IsETagMatch('abc', '"abcd"'))
+
+  def testIsGzipAccepted(self):
+    """Tests IsGzipAccepted()."""
+    self.assertTrue(handlers.IsGzipAccepted('gzip'))
+    self.assertTrue(handlers.IsGzipAccepted('deflate, GZIP;q=0.5'))
+    self.assertTrue(handlers.IsGzipAccepted('x-gzip'))
+    self.assertTrue(handlers.IsGzipAccepted('*'))
+    self.assertFalse(handlers.IsGzipAccepted(''))
+    self.assertFalse(handlers.IsGzipAccepted('identity'))
+    self.assertFalse(handlers.IsGzipAccepted('gzip;q=0'))
+    self.assertFalse(handlers.IsGzipAccepted('gzip; q=0.0, *'))
+    self.assertFalse(handlers.IsGzipAccepted('*;q=0'))
+
   def testGetClientIdForRequestWithSession(self):
     """Tests GetClientIdForRequest()."""
     track = 'stable'
@@ -61,6 +61,8 @@ class AppleSUSCatalogsHandlersTest(test.RequestHandlerTest):
     catalog = self.MockModelStatic(
         'AppleSUSCatalog', 'MemcacheWrappedGet', catalog_name)
     catalog.mtime = catalog_date
+    catalog.plist_etag = None
+    catalog.plist_gzip = None
     self.request.headers.get('If-Modified-Since', '').AndReturn(
         header_date_str)
     self.mox.StubOutWithMock(applesus.handlers, 'IsClientResourceExpired')
@@ -96,6 +98,8 @@ class AppleSUSCatalogsHandlersTest(test.RequestHandlerTest):
     catalog = self.MockModelStatic(
         'AppleSUSCatalog', 'MemcacheWrappedGet', catalog_name)
     catalog.mtime = catalog_date
+    catalog.plist_etag = None
+    catalog.plist_gzip = None
     self.request.headers.get('If-Modified-Since', '').AndReturn(
         header_date_str)
     self.mox.StubOutWithMock(applesus.handlers, 'IsClientResourceExpired')
@@ -107,6 +111,32 @@ class AppleSUSCatalogsHandlersTest(test.RequestHandlerTest):
     self.c.get()
     self.mox.VerifyAll()
 
+  def testGetSuccessWhereETagMatches(self):
+    """Tests AppleSUS.get() where If-None-Match matches the catalog ETag."""
+    track = 'stable'
+    client_id = {'track': track, 'os_version': '10.6.6'}
+    session = 'session'
+    catalog_name = '10.6_%s' % track
+
+    self.mox.StubOutWithMock(applesus.handlers, 'GetClientIdForRequest')
+    self.MockDoMunkiAuth(
+        and_return=session, require_level=gaeserver.LEVEL_APPLESUS)
+    applesus.handlers.GetClientIdForRequest(
+        self.request, session=session).AndReturn(client_id)
+
+    catalog = self.MockModelStatic(
+        'AppleSUSCatalog', 'MemcacheWrappedGet', catalog_name)
+    catalog.mtime = datetime.datetime(2011, 01, 01)
+    catalog.plist_etag = 'etag'
+    catalog.plist_gzip = 'gzip'
+    self.request.headers.get('If-None-Match', '').AndReturn('"etag"')
+    self.response.headers['ETag'] = '"etag"'
+    self.response.set_status(304)
+
+    self.mox.ReplayAll()
+    self.c.get()
+    self.mox.VerifyAll()
+
   def testGet404(self):
     """Tests AppleSUS.get() where track is not found."""
     track = 'notfound'
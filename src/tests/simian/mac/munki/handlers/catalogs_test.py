@@ -16,8 +16,10 @@
 #
 """Munki catalogs module tests."""
 
+import gzip
 import httplib
 import logging
+import StringIO
 
 
 import mock
@@ -66,6 +68,56 @@ class CatalogsHandlersTest(basetest.TestCase):
     resp = self.testapp.get('/catalogs/' + name, status=httplib.OK)
     self.assertTrue(resp.body.find('plist') != -1)
 
+  def testGetGzip(self, _):
+    """Tests Catalogs.get() with a client accepting gzip."""
+    name = 'goodname'
+
+    catalog_xml = '<plist><dict></dict></plist>'
+    models.Catalog(key_name=name, _plist=catalog_xml).put()
+
+    resp = self.testapp.get(
+        '/catalogs/' + name, headers={'Accept-Encoding': 'gzip'},
+        status=httplib.OK)
+    self.assertEqual('gzip', resp.headers['Content-Encoding'])
+    self.assertEqual(
+        catalog_xml,
+        gzip.GzipFile(fileobj=StringIO.StringIO(resp.body)).read())
+
+  def testGetGzipRefused(self, _):
+    """Tests Catalogs.get() with a client refusing gzip with q=0."""
+    name = 'goodname'
+
+    catalog_xml = '<plist><dict></dict></plist>'
+    models.Catalog(key_name=name, _plist=catalog_xml).put()
+
+    resp = self.testapp.get(
+        '/catalogs/' + name, headers={'Accept-Encoding': 'gzip;q=0, deflate'},
+        status=httplib.OK)
+    self.assertFalse('Content-Encoding' in resp.headers)
+    self.assertEqual(catalog_xml, resp.body)
+
+  def testGetETagNotModified(self, _):
+    """Tests Catalogs.get() where If-None-Match matches the catalog ETag."""
+    name = 'goodname'
+
+    catalog_xml = '<plist><dict></dict></plist>'
+    models.Catalog(key_name=name, _plist=catalog_xml).put()
+
+    resp = self.testapp.get('/catalogs/' + name, status=httplib.OK)
+    etag = resp.headers['ETag']
+    self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+
+    resp = self.testapp.get(
+        '/catalogs/' + name, headers={'If-None-Match': etag},
+        status=httplib.NOT_MODIFIED)
+    self.assertEqual('', resp.body)
+
+    models.Catalog(key_name=name, _plist='<plist><array/></plist>').put()
+    resp = self.testapp.get(
+        '/catalogs/' + name, headers={'If-None-Match': etag},
+        status=httplib.OK)
+    self.assertNotEqual(etag, resp.headers['ETag'])
+
   def testGet404(self, _):
     """Tests Catalogs.get() where name is not found."""
     name = 'badname'
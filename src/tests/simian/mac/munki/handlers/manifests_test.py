@@ -39,13 +39,16 @@ class HandlersTest(test.RequestHandlerTest):
     plist_xml = 'manifest xml'
 
     self.mox.StubOutWithMock(manifests.handlers, 'GetClientIdForRequest')
-    self.mox.StubOutWithMock(manifests.common, 'GetComputerManifest')
+    self.mox.StubOutWithMock(
+        manifests.common, 'GetComputerManifestAndFingerprint')
 
     self.MockDoAnyAuth(and_return=session)
     manifests.handlers.GetClientIdForRequest(
         self.request, session=session, client_id_str='').AndReturn(client_id)
-    manifests.common.GetComputerManifest(
-        client_id=client_id, packagemap=False).AndReturn(plist_xml)
+    manifests.common.GetComputerManifestAndFingerprint(
+        client_id=client_id).AndReturn((plist_xml, 'fingerprint'))
+    self.response.headers['ETag'] = '"fingerprint"'
+    self.request.headers.get('If-None-Match', '').AndReturn('')
     self.response.headers['Content-Type'] = 'text/xml; charset=utf-8'
     self.response.out.write(plist_xml).AndReturn(None)
 
@@ -53,19 +56,42 @@ class HandlersTest(test.RequestHandlerTest):
     self.c.get()
     self.mox.VerifyAll()
 
+  def testGetNotModified(self):
+    """Tests Manifests.get() when the client has the current manifest."""
+    client_id = {'track': 'track'}
+    session = 'session'
+
+    self.mox.StubOutWithMock(manifests.handlers, 'GetClientIdForRequest')
+    self.mox.StubOutWithMock(
+        manifests.common, 'GetComputerManifestAndFingerprint')
+
+    self.MockDoAnyAuth(and_return=session)
+    manifests.handlers.GetClientIdForRequest(
+        self.request, session=session, client_id_str='').AndReturn(client_id)
+    manifests.common.GetComputerManifestAndFingerprint(
+        client_id=client_id).AndReturn(('manifest xml', 'fingerprint'))
+    self.response.headers['ETag'] = '"fingerprint"'
+    self.request.headers.get('If-None-Match', '').AndReturn('"fingerprint"')
+    self.response.set_status(httplib.NOT_MODIFIED).AndReturn(None)
+
+    self.mox.ReplayAll()
+    self.c.get()
+    self.mox.VerifyAll()
+
   def testGetSuccessWhenManifestNotFoundError(self):
     """Tests Manifests.get()."""
     client_id = {'track': 'track'}
     session = 'session'
 
     self.mox.StubOutWithMock(manifests.handlers, 'GetClientIdForRequest')
-    self.mox.StubOutWithMock(manifests.common, 'GetComputerManifest')
+    self.mox.StubOutWithMock(
+        manifests.common, 'GetComputerManifestAndFingerprint')
 
     self.MockDoAnyAuth(and_return=session)
     manifests.handlers.GetClientIdForRequest(
         self.request, session=session, client_id_str='').AndReturn(client_id)
-    manifests.common.GetComputerManifest(
-        client_id=client_id, packagemap=False).AndRaise(
+    manifests.common.GetComputerManifestAndFingerprint(
+        client_id=client_id).AndRaise(
             manifests.common.ManifestNotFoundError)
     self.response.set_status(httplib.NOT_FOUND).AndReturn(None)
 
@@ -79,13 +105,14 @@ class HandlersTest(test.RequestHandlerTest):
     session = 'session'
 
     self.mox.StubOutWithMock(manifests.handlers, 'GetClientIdForRequest')
-    self.mox.StubOutWithMock(manifests.common, 'GetComputerManifest')
+    self.mox.StubOutWithMock(
+        manifests.common, 'GetComputerManifestAndFingerprint')
 
     self.MockDoAnyAuth(and_return=session)
     manifests.handlers.GetClientIdForRequest(
         self.request, session=session, client_id_str='').AndReturn(client_id)
-    manifests.common.GetComputerManifest(
-        client_id=client_id, packagemap=False).AndRaise(
+    manifests.common.GetComputerManifestAndFingerprint(
+        client_id=client_id).AndRaise(
             manifests.common.ManifestDisabledError)
     self.response.set_status(httplib.SERVICE_UNAVAILABLE).AndReturn(None)
 
@@ -99,13 +126,14 @@ class HandlersTest(test.RequestHandlerTest):
     session = 'session'
 
     self.mox.StubOutWithMock(manifests.handlers, 'GetClientIdForRequest')
-    self.mox.StubOutWithMock(manifests.common, 'GetComputerManifest')
+    self.mox.StubOutWithMock(
+        manifests.common, 'GetComputerManifestAndFingerprint')
 
     self.MockDoAnyAuth(and_return=session)
     manifests.handlers.GetClientIdForRequest(
         self.request, session=session, client_id_str='').AndReturn(client_id)
-    manifests.common.GetComputerManifest(
-        client_id=client_id, packagemap=False).AndRaise(
+    manifests.common.GetComputerManifestAndFingerprint(
+        client_id=client_id).AndRaise(
             manifests.common.Error)
     self.response.set_status(httplib.SERVICE_UNAVAILABLE).AndReturn(None)
 
@@ -51,7 +51,9 @@ class PackagesHandlerTest(PackagesTest):
   def GetTestClassModule(self):
     return pkgs
 
-  def testGetSuccessHelper(self, pkg_modified_since=True, supply_etag='etag'):
+  def testGetSuccessHelper(
+      self, pkg_modified_since=True, supply_etag='etag', range_header=None,
+      if_range=None, use_range=False):
     """Tests Packages.get()."""
     filename = u'good name.dmg'
     filename_quoted = 'good%20name.dmg'
@@ -89,7 +91,11 @@ class PackagesHandlerTest(PackagesTest):
       self.response.headers['Last-Modified'] = pkg_date.strftime(
           pkgs.handlers.HEADER_DATE_FORMAT)
       self.response.headers['X-Download-Size'] = str(pkg_size)
-      self.c.send_blob(blobstore_key).AndReturn(None)
+      self.response.headers['Accept-Ranges'] = 'bytes'
+      self.request.headers.get('Range').AndReturn(range_header)
+      if range_header:
+        self.request.headers.get('If-Range', '').AndReturn(if_range)
+      self.c.send_blob(blobstore_key, use_range=use_range).AndReturn(None)
     else:
       if supply_etag:
         self.response.headers['ETag'] = supply_etag
@@ -148,6 +154,16 @@ class PackagesHandlerTest(PackagesTest):
     """Tests get() where the If-Modified-Since date is older than pkg date."""
     self.testGetSuccessHelper(pkg_modified_since=False, supply_etag='etag')
 
+  def testGetSuccessWithRangeAndMatchingIfRange(self):
+    """Tests Packages.get() resuming a download with a matching If-Range."""
+    self.testGetSuccessHelper(
+        range_header='bytes=100-', if_range='"etag"', use_range=True)
+
+  def testGetSuccessWithRangeAndChangedIfRange(self):
+    """Tests Packages.get() sends the whole package if If-Range differs."""
+    self.testGetSuccessHelper(
+        range_header='bytes=100-', if_range='"oldetag"', use_range=False)
+
   def testGetSuccessWherePackageWasModifiedNoEtag(self):
     """Tests get() where the If-Modified-Since date is older than pkg date."""
     self.testGetSuccessHelper(pkg_modified_since=False, supply_etag=None)
@@ -19,11 +19,13 @@
 import datetime
 import json
 import logging
+import mock
 import mox
 import stubout
 
 from google.apputils import app
 from simian.auth import gaeserver
+from simian.mac.common import compress
 from tests.simian.mac.common import test
 from simian.mac.munki.handlers import reports
 
@@ -397,6 +399,9 @@ class HandlersTest(test.RequestHandlerTest):
 
     self.mox.StubOutWithMock(reports.gae_util, 'BatchDatastoreOp')
     reports.gae_util.BatchDatastoreOp(reports.models.db.put, mox.IsA(list))
+    self.mox.StubOutWithMock(
+        reports.models.InstallCountShard, 'IncrementInstalls')
+    reports.models.InstallCountShard.IncrementInstalls(mox.IsA(list))
 
     self.request.get_all('removals').AndReturn([])
     self.request.get_all('problem_installs').AndReturn([])
@@ -496,6 +501,9 @@ class HandlersTest(test.RequestHandlerTest):
 
     self.mox.StubOutWithMock(reports.gae_util, 'BatchDatastoreOp')
     reports.gae_util.BatchDatastoreOp(reports.models.db.put, mox.IsA(list))
+    self.mox.StubOutWithMock(
+        reports.models.InstallCountShard, 'IncrementInstalls')
+    reports.models.InstallCountShard.IncrementInstalls(mox.IsA(list))
 
     self.request.get_all('removals').AndReturn([])
     self.request.get_all('problem_installs').AndReturn([])
@@ -566,6 +574,301 @@ class HandlersTest(test.RequestHandlerTest):
     self.assertEqual(problem1_err, matched1_err)
     self.mox.VerifyAll()
 
+  def testPostInstallReports(self):
+    """Tests post() with _report_type=install_reports."""
+    uuid = 'foouuid'
+    computer = reports.models.Computer(key_name=uuid)
+    computer.uuid = uuid
+    self.mox.StubOutWithMock(reports.models.Computer, 'get_by_key_name')
+    data = {
+        'version': reports.INSTALL_REPORTS_VERSION,
+        'on_corp': '1',
+        'reports': [
+            {'installs': [{
+                'name': 'FooApp1', 'version': '1.0.0', 'applesus': False,
+                'status': 0, 'duration_seconds': 100,
+                'time': 1312818179.1415989}],
+             'removals': ['removal1'],
+             'problem_installs': ['problem1']},
+            # legacy strings are accepted too.
+            {'installs': ['name=FooApp2|version=2.1.1|status=2']},
+        ],
+    }
+    self.PostSetup(uuid=uuid, report_type='install_reports')
+    self.request.body = compress.Gzip(json.dumps(data))
+    reports.models.Computer.get_by_key_name(uuid).AndReturn(computer)
+
+    self.mox.StubOutWithMock(reports.models, 'InstallLog')
+    self.mox.StubOutWithMock(reports.models, 'ClientLog')
+    mock_install = self.mox.CreateMockAnything()
+    reports.models.InstallLog(
+        uuid=uuid, computer=computer, package='FooApp1-1.0.0',
+        status='0', on_corp=True, applesus=False, unattended=False,
+        duration_seconds=100, mtime=datetime.datetime(2011, 8, 8, 15, 42, 59),
+        dl_kbytes_per_sec=None).AndReturn(mock_install)
+    mock_install.success = mock_install.IsSuccess().AndReturn(True)
+    reports.models.InstallLog(
+        uuid=uuid, computer=computer, package='FooApp2-2.1.1',
+        status='2', on_corp=True, applesus=False, unattended=False,
+        duration_seconds=None, mtime=mox.IsA(datetime.datetime),
+        dl_kbytes_per_sec=None).AndReturn(mock_install)
+    mock_install.success = mock_install.IsSuccess().AndReturn(False)
+    reports.models.ClientLog(
+        uuid=uuid, computer=computer, action='removal',
+        details='removal1').AndReturn('removal_log')
+    reports.models.ClientLog(
+        uuid=uuid, computer=computer, action='install_problem',
+        details='problem1').AndReturn('problem_log')
+
+    self.mox.StubOutWithMock(reports.gae_util, 'BatchDatastoreOp')
+    reports.gae_util.BatchDatastoreOp(
+        reports.models.db.put,
+        [mock_install, mock_install, 'removal_log', 'problem_log'])
+    self.mox.StubOutWithMock(
+        reports.models.InstallCountShard, 'IncrementInstalls')
+    reports.models.InstallCountShard.IncrementInstalls(
+        [mock_install, mock_install])
+    self.response.out.write(
+        reports.JSON_PREFIX + json.dumps({'installs': 2, 'client_logs': 2}))
+
+    self.mox.ReplayAll()
+    self.c.post()
+    self.mox.VerifyAll()
+
+  def testPostInstallReportsWhenUnsupportedVersion(self):
+    """Tests post() with _report_type=install_reports of another version."""
+    uuid = 'foouuid'
+    self.PostSetup(uuid=uuid, report_type='install_reports')
+    self.request.body = json.dumps({'version': 2, 'reports': []})
+    self.response.set_status(reports.httplib.BAD_REQUEST)
+
+    self.mox.ReplayAll()
+    self.c.post()
+    self.mox.VerifyAll()
+
+  def testPostInstallReportWhenWriteBehind(self):
+    """Tests post() queues install_report reports when write-behind is on."""
+    uuid = 'foouuid'
+    self.PostSetup(uuid=uuid, report_type='install_report')
+    self.mox.StubOutWithMock(reports, 'IsReportWriteBehindEnabled')
+    reports.IsReportWriteBehindEnabled().AndReturn(True)
+    self.request.get('on_corp').AndReturn('1')
+    self.request.get_all('installs').AndReturn(['name=FooApp1|status=0'])
+    self.request.get_all('removals').AndReturn([])
+    self.request.get_all('problem_installs').AndReturn([])
+    self.mox.StubOutWithMock(reports, 'QueueReport')
+    reports.QueueReport(uuid, 'install_reports', {
+        'version': reports.INSTALL_REPORTS_VERSION,
+        'on_corp': '1',
+        'reports': [{
+            'installs': ['name=FooApp1|status=0'],
+            'removals': [],
+            'problem_installs': [],
+        }],
+    })
+
+    self.mox.ReplayAll()
+    self.c.post()
+    self.mox.VerifyAll()
+
+  def testPostMsuLogWhenWriteBehindQueueFails(self):
+    """Tests post() ingests msu_log reports directly if queueing fails."""
+    uuid = 'foouuid'
+    self.PostSetup(uuid=uuid, report_type='msu_log')
+    self.mox.StubOutWithMock(reports, 'IsReportWriteBehindEnabled')
+    reports.IsReportWriteBehindEnabled().AndReturn(True)
+    details = {}
+    for k in ['time', 'user', 'source', 'event', 'desc']:
+      details[k] = k
+      self.request.get(k, None).AndReturn(details[k])
+    self.mox.StubOutWithMock(reports, 'QueueReport')
+    reports.QueueReport(uuid, 'msu_log', details).AndRaise(
+        reports.taskqueue.TransientError)
+    self.mox.StubOutWithMock(reports, 'IngestReports')
+    reports.IngestReports([{
+        'uuid': uuid, 'report_type': 'msu_log', 'params': details,
+        'now': mox.IsA(datetime.datetime)}])
+
+    self.mox.ReplayAll()
+    self.c.post()
+    self.mox.VerifyAll()
+
+  @mock.patch.object(reports.taskqueue, 'Queue')
+  def testFlushReports(self, queue_mock):
+    """Tests FlushReports() ingests queued reports grouped by uuid."""
+    reports.QueueReport('uuid1', 'msu_log', {
+        'time': '1312818179', 'user': 'user1', 'source': 'MSU',
+        'event': 'launched', 'desc': None})
+    reports.QueueReport('uuid1', 'msu_log', {
+        'time': '1312818279', 'user': 'user1', 'source': 'MSU',
+        'event': 'launched', 'desc': 'newer'})
+    reports.QueueReport('uuid1', 'install_reports', {
+        'version': reports.INSTALL_REPORTS_VERSION,
+        'reports': [{'removals': ['removal1']}]})
+    reports.QueueReport('uuid2', 'broken_client', {
+        'reason': 'objc', 'details': 'details1'})
+    tasks = [c[0][0] for c in queue_mock.return_value.add.call_args_list]
+    queue_mock.return_value.lease_tasks.return_value = tasks
+    queue_mock.return_value.fetch_statistics.return_value.tasks = 0
+
+    stats = reports.FlushReports()
+
+    self.assertEqual(4, stats['reports'])
+    self.assertEqual(2, stats['computers'])
+    self.assertEqual(0, stats['backlog'])
+    msu_logs = reports.models.ComputerMSULog.all().fetch(10)
+    self.assertEqual(1, len(msu_logs))
+    self.assertEqual('newer', msu_logs[0].desc)
+    client_logs = reports.models.ClientLog.all().fetch(10)
+    self.assertEqual(['removal1'], [l.details for l in client_logs])
+    broken = reports.models.ComputerClientBroken.get_by_key_name('uuid2')
+    self.assertEqual('details1', broken.details)
+    self.assertEqual(1, len(broken.broken_datetimes))
+    deleted = queue_mock.return_value.delete_tasks.call_args[0][0]
+    self.assertEqual(set(tasks), set(deleted))
+
+  @mock.patch.object(reports.taskqueue, 'Queue')
+  def testFlushReportsWhenReportsLeasedAgain(self, queue_mock):
+    """Tests FlushReports() does not ingest a report leased again twice."""
+    reports.QueueReport('uuid1', 'install_reports', {
+        'version': reports.INSTALL_REPORTS_VERSION,
+        'reports': [{
+            'installs': ['name=FooApp1|version=1|status=0'],
+            'removals': ['removal1'],
+        }]})
+    tasks = [
+        reports.taskqueue.Task(payload=c[0][0].payload, method='PULL',
+                               name='task1')
+        for c in queue_mock.return_value.add.call_args_list]
+    queue_mock.return_value.lease_tasks.return_value = tasks
+    queue_mock.return_value.fetch_statistics.return_value.tasks = 0
+
+    with mock.patch.object(
+        reports.models.InstallCountShard, 'IncrementInstalls') as inc_mock:
+      reports.FlushReports()
+      reports.FlushReports()
+
+    self.assertEqual(1, len(reports.models.InstallLog.all().fetch(10)))
+    self.assertEqual(1, len(reports.models.ClientLog.all().fetch(10)))
+    self.assertEqual(1, len(inc_mock.call_args_list[0][0][0]))
+    self.assertEqual([], inc_mock.call_args_list[1][0][0])
+
+  @mock.patch.object(reports.taskqueue, 'Queue')
+  def testFlushReportsWhenBatchFails(self, queue_mock):
+    """Tests FlushReports() ingests computers one at a time if a batch fails."""
+    reports.QueueReport('uuid1', 'install_reports', {
+        'version': reports.INSTALL_REPORTS_VERSION,
+        'reports': [{'installs': [5]}]})
+    reports.QueueReport('uuid2', 'install_reports', {
+        'version': reports.INSTALL_REPORTS_VERSION,
+        'reports': [{'removals': ['removal2']}]})
+    tasks = [c[0][0] for c in queue_mock.return_value.add.call_args_list]
+    queue_mock.return_value.lease_tasks.return_value = tasks
+    queue_mock.return_value.fetch_statistics.return_value.tasks = 1
+
+    with mock.patch.object(reports.logging, 'exception'):
+      stats = reports.FlushReports()
+
+    self.assertEqual(2, stats['reports'])
+    self.assertEqual(0, stats['dropped'])
+    client_logs = reports.models.ClientLog.all().fetch(10)
+    self.assertEqual(['removal2'], [l.details for l in client_logs])
+    queue_mock.return_value.delete_tasks.assert_called_once_with([tasks[1]])
+
+  @mock.patch.object(reports.taskqueue, 'Queue')
+  def testFlushReportsDropsReportsLeasedTooOften(self, queue_mock):
+    """Tests FlushReports() drops reports leased over REPORT_MAX_RETRIES."""
+    reports.QueueReport('uuid1', 'install_reports', {
+        'version': reports.INSTALL_REPORTS_VERSION,
+        'reports': [{'removals': ['removal1']}]})
+    tasks = [c[0][0] for c in queue_mock.return_value.add.call_args_list]
+    tasks.append(reports.taskqueue.Task(payload='{', method='PULL'))
+    queue_mock.return_value.lease_tasks.return_value = tasks
+    queue_mock.return_value.fetch_statistics.return_value.tasks = 0
+
+    with mock.patch.object(
+        reports.taskqueue.Task, 'retry_count', new_callable=mock.PropertyMock,
+        return_value=reports.REPORT_MAX_RETRIES + 1):
+      with mock.patch.object(reports.logging, 'error'):
+        stats = reports.FlushReports()
+
+    self.assertEqual(2, stats['dropped'])
+    self.assertEqual(0, stats['computers'])
+    self.assertEqual([], reports.models.ClientLog.all().fetch(10))
+    queue_mock.return_value.delete_tasks.assert_called_once_with(tasks)
+
+  @mock.patch.object(reports.taskqueue, 'Queue')
+  def testFlushReportsDropsInvalidPayload(self, queue_mock):
+    """Tests FlushReports() drops reports whose payload cannot be decoded."""
+    tasks = [reports.taskqueue.Task(payload='{', method='PULL')]
+    queue_mock.return_value.lease_tasks.return_value = tasks
+    queue_mock.return_value.fetch_statistics.return_value.tasks = 0
+
+    with mock.patch.object(reports.logging, 'error'):
+      stats = reports.FlushReports()
+
+    self.assertEqual(1, stats['dropped'])
+    queue_mock.return_value.delete_tasks.assert_called_once_with(tasks)
+
+  def testDecodeInstallReportsWhenInvalidItems(self):
+    """Tests DecodeInstallReports() with items of unsupported types."""
+    for report in (
+        'report', {'installs': [5]}, {'installs': 'name=Foo'},
+        {'removals': [{'name': 'Foo'}]}, {'problem_installs': [None]}):
+      body = json.dumps({
+          'version': reports.INSTALL_REPORTS_VERSION, 'reports': [report]})
+      self.assertRaises(ValueError, reports.DecodeInstallReports, body)
+
+  def testValidateQueuedReport(self):
+    """Tests ValidateQueuedReport() rejects values too long to be written."""
+    reports.ValidateQueuedReport('uuid1', 'install_reports', {
+        'version': reports.INSTALL_REPORTS_VERSION,
+        'reports': [{'installs': [{'name': 'Foo', 'version': '1'}]}]})
+    self.assertRaises(
+        ValueError, reports.ValidateQueuedReport, 'uuid1', 'install_reports',
+        {'version': reports.INSTALL_REPORTS_VERSION,
+         'reports': [{'installs': [{'name': 'F' * 600, 'version': '1'}]}]})
+    self.assertRaises(
+        ValueError, reports.ValidateQueuedReport, 'uuid1', 'msu_log',
+        {'time': '1312818179', 'user': 'user1', 'source': 'MSU',
+         'event': 'launched', 'desc': 'd' * 600})
+    self.assertRaises(
+        ValueError, reports.ValidateQueuedReport, 'uuid1', 'broken_client',
+        {'reason': 'objc', 'details': 'hostname => %s' % ('h' * 600)})
+
+  def testPostInstallReportsWhenWriteBehindAndInvalid(self):
+    """Tests post() does not queue install_reports which cannot be written."""
+    uuid = 'foouuid'
+    self.PostSetup(uuid=uuid, report_type='install_reports')
+    self.mox.StubOutWithMock(reports, 'IsReportWriteBehindEnabled')
+    reports.IsReportWriteBehindEnabled().AndReturn(True)
+    self.request.body = json.dumps({
+        'version': reports.INSTALL_REPORTS_VERSION,
+        'reports': [{'installs': [{'name': 'F' * 600, 'version': '1'}]}]})
+    self.mox.StubOutWithMock(reports, 'QueueReport')
+    self.response.set_status(reports.httplib.BAD_REQUEST)
+
+    self.mox.ReplayAll()
+    self.c.post()
+    self.mox.VerifyAll()
+
+  def testPostMsuLogWhenWriteBehindAndNoSource(self):
+    """Tests post() queues msu_log reports lacking source, like direct logs."""
+    uuid = 'foouuid'
+    self.PostSetup(uuid=uuid, report_type='msu_log')
+    self.mox.StubOutWithMock(reports, 'IsReportWriteBehindEnabled')
+    reports.IsReportWriteBehindEnabled().AndReturn(True)
+    details = {}
+    for k in ['time', 'user', 'source', 'event', 'desc']:
+      details[k] = None
+      self.request.get(k, None).AndReturn(None)
+    self.mox.StubOutWithMock(reports, 'QueueReport')
+    reports.QueueReport(uuid, 'msu_log', details)
+
+    self.mox.ReplayAll()
+    self.c.post()
+    self.mox.VerifyAll()
+
   def testPostBrokenClient(self):
     """Tests post() with _report_type=broken_client."""
     uuid = 'foouuid'
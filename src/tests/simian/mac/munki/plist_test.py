@@ -19,6 +19,7 @@
 import base64
 import datetime
 import pprint
+import StringIO
 
 import mox
 import stubout
@@ -72,12 +73,37 @@ class PlistModuleTest(mox.MoxTestBase):
   def testEscapeString(self):
     """Test EscapeString()."""
     self.mox.StubOutWithMock(plist.xml.sax.saxutils, 'escape')
-    plist.xml.sax.saxutils.escape('notescaped').AndReturn('escaped')
+    plist.xml.sax.saxutils.escape('not&escaped').AndReturn('escaped')
 
     self.mox.ReplayAll()
-    self.assertEqual('escaped', plist.EscapeString('notescaped'))
+    self.assertEqual('escaped', plist.EscapeString('not&escaped'))
     self.mox.VerifyAll()
 
+  def testEscapeStringWhenNothingToEscape(self):
+    """Test EscapeString() with a str that needs no escaping."""
+    self.mox.StubOutWithMock(plist.xml.sax.saxutils, 'escape')
+
+    self.mox.ReplayAll()
+    self.assertEqual('notescaped', plist.EscapeString('notescaped'))
+    self.mox.VerifyAll()
+
+  def testWriteXml(self):
+    """Test WriteXml() writes the same XML GetXmlStr() returns."""
+    value = {'foo': [1, u'tw\xe9', ('a<b',)], 'bar': {'deep': {}}}
+    out = StringIO.StringIO()
+    plist.WriteXml(value, out, indent_num=2)
+    self.assertEqual(plist.GetXmlStr(value, indent_num=2), out.getvalue())
+
+  def testGetXmlStrWhenDeeplyNested(self):
+    """Test GetXmlStr() beyond the precomputed indent depth."""
+    value = 'x'
+    for _ in xrange(20):
+      value = [value]
+    lines = plist.GetXmlStr(value).splitlines()
+    self.assertEqual(41, len(lines))
+    self.assertEqual(
+        '%s<string>x</string>' % (plist.INDENT_CHAR * 20), lines[20])
+
 
 class ApplePlistTest(mox.MoxTestBase):
 
@@ -185,20 +211,46 @@ class ApplePlistTest(mox.MoxTestBase):
     self.assertEqual({}, self.apl.GetContents())
 
   def PlistTest(self, plist_xml, plist_dict=None, exc=None):
-    """Test invoking Parse().
+    """Test invoking Parse() with each XML parser.
 
     Args:
       plist_xml: str, XML document
       plist_dict: dict, optional, expected dictionary output from Plist
       exc: Exception, optional, expected exception when calling Parse()
     """
-    self.apl.LoadPlist(plist_xml)
-    if exc is not None:
-      self.assertRaises(exc, self.apl.Parse)
-      self.assertFalse(hasattr(self.apl, '_plist'))
-    else:
-      self.apl.Parse()
-      self.assertPlistEquals(plist_dict)
+    for xml_parser in plist.XML_PARSERS:
+      self.apl = plist.ApplePlist()
+      self.apl.LoadPlist(plist_xml)
+      if exc is not None:
+        self.assertRaises(exc, self.apl.Parse, xml_parser=xml_parser)
+        self.assertFalse(hasattr(self.apl, '_plist'))
+      else:
+        self.apl.Parse(xml_parser=xml_parser)
+        self.assertPlistEquals(plist_dict)
+
+  def testParseUnknownXmlParser(self):
+    """Test Parse() with an unknown XML parser."""
+    self.apl.LoadPlist('<plist version="1.0"><dict></dict></plist>')
+    self.assertRaises(ValueError, self.apl.Parse, xml_parser='unknown')
+
+  def testParseFastWhenLegacyParserRequired(self):
+    """Test the fast parser defers elements nested in scalars to legacy."""
+    xml = ('%s<dict><key>foo</key><string>a<true/>b</string></dict>%s' % (
+        plist.PLIST_HEAD, plist.PLIST_FOOT))
+    self.mox.StubOutWithMock(self.apl, '_GetParser')
+    self.apl._GetParser().AndReturn(plist.ApplePlist._GetParser(self.apl))
+
+    self.mox.ReplayAll()
+    self.apl.LoadPlist(xml)
+    self.apl.Parse(xml_parser=plist.XML_PARSER_FAST)
+    self.assertEqual({'foo': 'ab'}, self.apl.GetContents())
+    self.mox.VerifyAll()
+
+  def testParseFirstChunkOfKey(self):
+    """Test both parsers only read the first chunk of key character data."""
+    xml = ('%s<dict><key>a&amp;b</key><string>a&amp;b</string></dict>%s' % (
+        plist.PLIST_HEAD, plist.PLIST_FOOT))
+    self.PlistTest(xml, {'a': 'a&b'})
 
   def testBasicParseChangesLost(self):
     """Test that Parse() will not wipe direct set values."""
@@ -463,6 +515,13 @@ AAAAAAAAfA==""")
     self.apl._plist = {}
     self.assertEqual(plist_xml, self.apl.GetXml())
 
+  def testGetXmlWithOut(self):
+    """Test GetXml() streaming into a file-like object."""
+    self.apl._plist = {'foo': ['bar', 1]}
+    out = StringIO.StringIO()
+    self.assertEqual(None, self.apl.GetXml(out=out))
+    self.assertEqual(self.apl.GetXml(), out.getvalue())
+
   def testGetXmlWithEmptyPlist(self):
     """Test GetXml() with empty plist."""
     self.apl._plist = None
@@ -905,6 +964,51 @@ AAAAAAAAfA==""")
     self.assertFalse(pl.Equal(other, ignore_keys=['bar']))
 
 
+class LazyPlistTest(mox.MoxTestBase):
+
+  def _GetXml(self, content):
+    return '%s%s%s' % (plist.PLIST_HEAD, content, plist.PLIST_FOOT)
+
+  def testIndexed(self):
+    """Test values are only parsed when accessed."""
+    xml = self._GetXml(
+        '<dict><key>foo</key><string>bar</string>'
+        '<key>list</key><array><dict><key>a</key><integer>1</integer></dict>'
+        '<true/></array><key>empty</key><dict/></dict>')
+    lazy = plist.LazyPlist(xml.decode('utf-8'))
+    self.assertEqual(set(['foo', 'list', 'empty']), set(lazy.keys()))
+    self.assertEqual({}, lazy._values)
+    self.assertEqual('bar', lazy.get('foo'))
+    self.assertEqual(['foo'], lazy._values.keys())
+    self.assertEqual([{'a': 1}, True], lazy['list'])
+    self.assertEqual({}, lazy['empty'])
+    self.assertEqual('default', lazy.get('missing', 'default'))
+    self.assertRaises(KeyError, lambda: lazy['missing'])
+    self.assertTrue('foo' in lazy)
+    self.assertFalse('missing' in lazy)
+    self.assertEqual(None, lazy._plist)
+
+  def testNotIndexed(self):
+    """Test plists the index cannot map exactly are parsed fully."""
+    for content in (
+        '<array><string>foo</string></array>',
+        '<dict><key>a&amp;b</key><string>bar</string></dict>',
+        '<dict><key>foo</key><dict><key>a</key></dict></dict>',
+        '<dict><key>foo</key><string>a<true/>b</string></dict>'):
+      xml = self._GetXml(content)
+      lazy = plist.LazyPlist(xml)
+      self.assertEqual(None, lazy._index)
+      apl = plist.ApplePlist(xml)
+      apl.Parse()
+      self.assertEqual(list(apl), list(lazy))
+
+  def testNotIndexedMalformed(self):
+    """Test errors parsing plists that cannot be indexed are raised."""
+    self.assertRaises(
+        plist.MalformedPlistError, plist.LazyPlist,
+        self._GetXml('<dict><foo/></dict>'))
+
+
 class MunkiPlistTest(mox.MoxTestBase):
   """Test MunkiPlist class."""
 